@@ -26,6 +26,10 @@ def make_celery(app):
             with app.app_context():
                 return self.run(*args, **kwargs)
     celery.Task = ContextTask
+
+    # Queries SQL e tempo de banco por task (histogramas em /admin/perf)
+    from app.utils.contador_sql import registrar_instrumentacao_celery
+    registrar_instrumentacao_celery(app)
     return celery
 
 def create_app():
@@ -61,10 +65,26 @@ def create_app():
         login_manager.init_app(app)
         migrate.init_app(app, db)
 
+        # Instrumentação SQL por requisição (queries lentas no log, histogramas em /admin/perf;
+        # headers X-SQL-Queries/Server-Timing e selo na página em modo debug)
+        from app.utils.contador_sql import registrar_contador_requisicao
+        registrar_contador_requisicao(app)
+
         # Self-Healing: Verifica e corrige o esquema do banco de dados na inicialização
         from app.utils.schema_checker import check_db_schema
         check_db_schema(app, db)
 
+        # Registra os listeners ORM que invalidam os caches do WhatsApp
+        # (índice de telefones e regras de automação compiladas) e os que
+        # marcam dias do rollup kpi_diario para recálculo, mantêm o índice da
+        # busca global (busca_indice), atualizam o índice de peças do autocomplete
+        # e invalidam os contadores de pendências do sidebar/BI; mantêm também o
+        # resumo das conversas da central de chat (tabela conversa)
+        from app.services import (  # noqa: F401
+            telefone_index, regras_matcher, kpi_diario_service, busca_service, pecas_index, contadores_pendencias,
+            conversa_service, chat_eventos_service
+        )
+
         # Inicializa Celery
         app.celery = make_celery(app)
 
@@ -76,14 +96,10 @@ def create_app():
         def inject_sidebar_data():
             from flask_login import current_user
             if current_user.is_authenticated and current_user.tipo in ['admin', 'diretor', 'gerente']:
-                from app.models.estoque_models import PedidoCompra
+                # Contadores em cache (ContadoresPendencias): sem query por página renderizada
+                from app.services.contadores_pendencias import ContadoresPendencias
                 try:
-                    if current_user.tipo == 'gerente':
-                        count = PedidoCompra.query.filter_by(status='solicitado').count()
-                    else:
-                        count = PedidoCompra.query.filter(
-                            PedidoCompra.status.in_(['solicitado', 'aguardando_diretoria'])
-                        ).count()
+                    count = ContadoresPendencias.sidebar(current_user)
                 except Exception:
                     count = 0
                 return {'sidebar_pendencias': count}
@@ -0,0 +1,64 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class KpiDiario(db.Model):
+    """
+    Rollup diário dos indicadores por (dia, unidade), mantido por
+    KpiDiarioService.atualizar(). Cada métrica é atribuída ao dia do evento
+    que a origina (abertura da OS, movimentação, criação/conclusão do chamado,
+    solicitação do pedido); médias são guardadas como soma + quantidade.
+    """
+    __tablename__ = 'kpi_diario'
+    __table_args__ = (
+        db.Index('ix_kpi_diario_dia_unidade', 'dia', 'unidade_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False)
+    unidade_id = db.Column(db.Integer, db.ForeignKey('unidades.id'), nullable=True)
+
+    # Ordens de serviço (por data_abertura)
+    os_abertas = db.Column(db.Integer, default=0, nullable=False)
+    os_concluidas = db.Column(db.Integer, default=0, nullable=False)
+    mttr_horas_soma = db.Column(db.Float, default=0, nullable=False)
+    mttr_qtd = db.Column(db.Integer, default=0, nullable=False)
+
+    # Custos
+    custo_pecas = db.Column(db.Numeric(16, 4), default=0, nullable=False)  # consumo, por data_movimentacao
+    custo_servicos = db.Column(db.Numeric(16, 4), default=0, nullable=False)  # chamados, por criado_em
+    custo_servicos_concluidos = db.Column(db.Numeric(16, 4), default=0, nullable=False)  # por data_conclusao
+
+    # Compras (por data_solicitacao)
+    compras_empenhado = db.Column(db.Numeric(16, 4), default=0, nullable=False)
+
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    METRICAS = (
+        'os_abertas', 'os_concluidas', 'mttr_horas_soma', 'mttr_qtd',
+        'custo_pecas', 'custo_servicos', 'custo_servicos_concluidos',
+        'compras_empenhado',
+    )
+
+    def __repr__(self):
+        return f'<KpiDiario {self.dia} unidade={self.unidade_id}>'
+
+
+class KpiDiarioControle(db.Model):
+    """Marca d'água do rollup: último dia fechado já consolidado em kpi_diario."""
+    __tablename__ = 'kpi_diario_controle'
+    id = db.Column(db.Integer, primary_key=True)
+    processado_ate = db.Column(db.Date, nullable=True)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class KpiDiarioSujo(db.Model):
+    """
+    Dias já consolidados que precisam ser recalculados porque um registro de
+    origem foi alterado depois (status da OS, valor do chamado, preço da peça...).
+    Gravado na mesma transação da alteração pelos listeners do KpiDiarioService.
+    """
+    __tablename__ = 'kpi_diario_sujo'
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False, index=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
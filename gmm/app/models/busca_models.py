@@ -0,0 +1,75 @@
+from datetime import datetime
+from sqlalchemy import event
+from app.extensions import db
+
+
+class BuscaIndice(db.Model):
+    """
+    Índice unificado da busca global: um documento por entidade pesquisável
+    (OS, equipamento, peça, fornecedor, terceirizado, usuário), mantido pelos
+    listeners do BuscaService. `texto` guarda os campos pesquisáveis já sem
+    acentos e em minúsculas.
+
+    Sobre esta tabela fica o índice textual do banco: FTS5 (tokenizador
+    trigram) no SQLite e GIN pg_trgm no Postgres; ambos criados junto com ela.
+    """
+    __tablename__ = 'busca_indice'
+    __table_args__ = (
+        db.Index('ix_busca_indice_entidade', 'entidade', 'entidade_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entidade = db.Column(db.String(20), nullable=False)  # os, equipamento, peca, fornecedor, terceirizado, usuario
+    entidade_id = db.Column(db.Integer, nullable=False)
+    titulo = db.Column(db.String(255), nullable=False)
+    subtitulo = db.Column(db.String(255), nullable=True)
+    texto = db.Column(db.Text, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BuscaIndice {self.entidade}:{self.entidade_id}>'
+
+
+# ── índice textual específico do banco ─────────────────────────────────────
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS busca_fts USING fts5("
+    "texto, content='busca_indice', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_ai AFTER INSERT ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(rowid, texto) VALUES (new.id, new.texto); END",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_ad AFTER DELETE ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(busca_fts, rowid, texto) VALUES ('delete', old.id, old.texto); END",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_au AFTER UPDATE ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(busca_fts, rowid, texto) VALUES ('delete', old.id, old.texto); "
+    "INSERT INTO busca_fts(rowid, texto) VALUES (new.id, new.texto); END",
+)
+
+POSTGRES_TRGM = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_busca_indice_texto_trgm ON busca_indice USING gin (texto gin_trgm_ops)",
+)
+
+
+def sqlite_tem_fts_trigram(connection) -> bool:
+    """FTS5 compilado e tokenizador trigram (SQLite >= 3.34)."""
+    versao = connection.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(p) for p in versao.split('.')[:2]) < (3, 34):
+        return False
+    return bool(connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+@event.listens_for(BuscaIndice.__table__, 'after_create')
+def _criar_indice_textual(target, connection, **kw):
+    comandos = ()
+    if connection.dialect.name == 'sqlite' and sqlite_tem_fts_trigram(connection):
+        comandos = SQLITE_FTS
+    elif connection.dialect.name == 'postgresql':
+        comandos = POSTGRES_TRGM
+    for comando in comandos:
+        connection.exec_driver_sql(comando)
+
+
+@event.listens_for(BuscaIndice.__table__, 'before_drop')
+def _remover_indice_textual(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS busca_fts")
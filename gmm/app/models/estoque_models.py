@@ -41,6 +41,9 @@ class Equipamento(db.Model):
 
 class OrdemServico(db.Model):
     __tablename__ = 'ordens_servico'
+    __table_args__ = (
+        db.Index('ix_ordens_servico_status_abertura', 'status', 'data_abertura'),  # backlog crítico
+    )
     id = db.Column(db.Integer, primary_key=True)
     numero_os = db.Column(db.String(20), unique=True, nullable=False)
     tecnico_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
@@ -58,7 +61,7 @@ class OrdemServico(db.Model):
     fotos_antes = db.Column(db.JSON, nullable=True)
     fotos_depois = db.Column(db.JSON, nullable=True)
     
-    data_abertura = db.Column(db.DateTime, default=datetime.utcnow)
+    data_abertura = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     data_conclusao = db.Column(db.DateTime, nullable=True)
     origem_criacao = db.Column(db.String(20), default='web') # web, whatsapp_bot
     
@@ -204,7 +207,7 @@ class PedidoCompra(db.Model):
     fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedores.id'), nullable=True)
     estoque_id = db.Column(db.Integer, db.ForeignKey('estoque.id'), nullable=True)  # nullable para itens livres
     quantidade = db.Column(db.Numeric(10, 3), nullable=False)
-    data_solicitacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_solicitacao = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     data_chegada = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='pendente')
 
@@ -352,7 +355,7 @@ class MovimentacaoEstoque(db.Model):
     tipo_movimentacao = db.Column(db.String(20), nullable=False)
     quantidade = db.Column(db.Numeric(10, 3), nullable=False)
     observacao = db.Column(db.String(255), nullable=True)
-    data_movimentacao = db.Column(db.DateTime, default=datetime.utcnow)
+    data_movimentacao = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     estoque = db.relationship('Estoque', backref='historico')
     usuario = db.relationship('Usuario')
@@ -46,7 +46,7 @@ class ChamadoExterno(db.Model):
 
     prazo_combinado = db.Column(db.DateTime, nullable=False)
     data_inicio = db.Column(db.DateTime)
-    data_conclusao = db.Column(db.DateTime)
+    data_conclusao = db.Column(db.DateTime, index=True)
 
     valor_orcado = db.Column(db.Numeric(10, 2))
     valor_final = db.Column(db.Numeric(10, 2))
@@ -55,7 +55,7 @@ class ChamadoExterno(db.Model):
     feedback = db.Column(db.Text)
 
     criado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
-    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     # Novos campos para WhatsApp
     solicitante_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)  # Quem solicitou o serviço
@@ -76,11 +76,17 @@ class ChamadoExterno(db.Model):
 
 class HistoricoNotificacao(db.Model):
     __tablename__ = 'historico_notificacoes'
+    __table_args__ = (
+        # Histórico de uma conversa, paginado por (criado_em, id)
+        db.Index('ix_historico_telefone_contato_criado_em', 'telefone_contato', 'criado_em'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     chamado_id = db.Column(db.Integer, db.ForeignKey('chamados_externos.id'), nullable=True)
     tipo = db.Column(db.String(20), nullable=False) # criacao, lembrete, cobranca, resposta_auto
     remetente = db.Column(db.String(20), nullable=True) # Para inbound
     destinatario = db.Column(db.String(20), nullable=True) # Pode ser null se inbound? Ou usamos para o 'sistema'
+    # Telefone normalizado do contato (remetente no inbound, destinatário no outbound), preenchido no insert
+    telefone_contato = db.Column(db.String(20), nullable=True)
     mensagem = db.Column(db.Text, nullable=False)
     status_envio = db.Column(db.String(20), default='pendente') # pendente, enviado, falhou
     resposta_api = db.Column(db.Text) # JSON log
@@ -92,7 +98,7 @@ class HistoricoNotificacao(db.Model):
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Campos para webhook/MegaAPI
-    megaapi_id = db.Column(db.String(100), nullable=True)
+    megaapi_id = db.Column(db.String(100), nullable=True, unique=True, index=True)  # dedup de retries do webhook
     tipo_conteudo = db.Column(db.String(20), nullable=True)  # text, image, audio, document, interactive
     status_leitura = db.Column(db.String(20), default='nao_lida')  # nao_lida, lida
     mimetype = db.Column(db.String(100), nullable=True)
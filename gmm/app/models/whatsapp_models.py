@@ -72,6 +72,25 @@ class EstadoConversa(db.Model):
         self.chamado_id = None
         self.ordem_servico_id = None
 
+class Conversa(db.Model):
+    """
+    Resumo de cada conversa da central de chat (um registro por telefone
+    normalizado): prévia e horário da última mensagem, não lidas e nome do
+    contato. Mantido pelo ConversaService na mesma transação que grava o
+    HistoricoNotificacao.
+    """
+    __tablename__ = 'conversa'
+    id = db.Column(db.Integer, primary_key=True)
+    telefone = db.Column(db.String(20), nullable=False, unique=True)
+    nome_contato = db.Column(db.String(150), nullable=True)
+    nome_origem = db.Column(db.String(20), nullable=True)  # terceirizado, fornecedor, usuario, push_name
+    ultima_mensagem_id = db.Column(db.Integer, nullable=True)
+    ultima_msg_em = db.Column(db.DateTime, nullable=True, index=True)
+    ultima_direcao = db.Column(db.String(10), nullable=True)
+    ultima_preview = db.Column(db.String(120), nullable=True)
+    nao_lidas = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ConfiguracaoWhatsApp(db.Model):
     __tablename__ = 'whatsapp_configuracao'
     id = db.Column(db.Integer, primary_key=True)
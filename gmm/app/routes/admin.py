@@ -1034,4 +1034,20 @@ def exportar_movimentacoes_csv():
         output.getvalue(),
         mimetype="text/csv",
         headers={"Content-disposition": f"attachment; filename=movimentacoes_{datetime.now().strftime('%Y%m%d')}.csv"}
-    )
\ No newline at end of file
+    )
+
+@bp.route('/perf', methods=['GET'])
+@login_required
+def perf():
+    """Queries SQL e tempo de banco por endpoint/task (histogramas da instrumentação SQL)."""
+    from app.utils.contador_sql import AgregadorPerf
+    return render_template('admin/perf.html', resumo=AgregadorPerf.resumo())
+
+
+@bp.route('/perf/limpar', methods=['POST'])
+@login_required
+def perf_limpar():
+    from app.utils.contador_sql import AgregadorPerf
+    AgregadorPerf.limpar()
+    flash('Métricas de SQL zeradas.', 'success')
+    return redirect(url_for('admin.perf'))
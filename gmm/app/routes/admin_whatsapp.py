@@ -1,8 +1,7 @@
 import logging
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request, render_template, abort
+from flask import Blueprint, jsonify, request, render_template, abort, Response, stream_with_context
 from flask_login import login_required, current_user
-from sqlalchemy import or_
 from app.extensions import db
 from app.models.whatsapp_models import RegrasAutomacao
 from app.models.terceirizados_models import HistoricoNotificacao
@@ -288,11 +287,16 @@ def dashboard():
     
     # Rate Limit
     pode_enviar, restantes = RateLimiter.check_limit()
+    _taxa, capacidade, _reserva, _ignorar = RateLimiter.parametros()
     
     # Mensagens pendentes
     pendentes = HistoricoNotificacao.query.filter_by(
         status_envio='pendente'
     ).count()
+
+    # Fila de despacho outbound (profundidade, espera, vazão)
+    from app.services.fila_envio import FilaEnvio
+    fila_envio = FilaEnvio.metricas()
     
     return render_template('admin/whatsapp_dashboard.html',
         config=config,
@@ -301,7 +305,9 @@ def dashboard():
         taxa_entrega=round(taxa_entrega, 1),
         cb_state=cb_state,
         rate_limit_disponivel=restantes,
-        mensagens_pendentes=pendentes
+        rate_limit_capacidade=int(capacidade),
+        mensagens_pendentes=pendentes,
+        fila_envio=fila_envio
     )
 
 @bp.route('/api/whatsapp/metricas-grafico')
@@ -351,6 +357,29 @@ def metricas_grafico():
         'entregues': entregues
     })
 
+@bp.route('/api/whatsapp/ingestao')
+@login_required
+def metricas_ingestao():
+    """Backlog e latência por etapa da fila de ingestão do webhook, e hits do dedup"""
+    if current_user.tipo != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    from app.services.fila_ingestao import FilaIngestao
+    from app.services.deduplicador_webhook import DeduplicadorWebhook
+    metricas = FilaIngestao.metricas()
+    metricas['dedup'] = DeduplicadorWebhook.metricas()
+    return jsonify(metricas)
+
+@bp.route('/api/whatsapp/fila-envio')
+@login_required
+def metricas_fila_envio():
+    """Profundidade por faixa, espera (p50/p95/p99) e vazão da fila de despacho outbound"""
+    if current_user.tipo != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    from app.services.fila_envio import FilaEnvio
+    return jsonify(FilaEnvio.metricas())
+
 @bp.route('/api/whatsapp/historico-recente')
 @login_required
 def historico_recente():
@@ -470,126 +499,16 @@ def chat_central():
 @bp.route('/admin/chat/conversas')
 @login_required
 def listar_conversas():
-    """Lista todas as conversas com última mensagem e contagem de não lidas"""
+    """Lista todas as conversas com última mensagem e contagem de não lidas (tabela conversa)"""
     if current_user.tipo not in ['admin', 'gerente']:
         return jsonify({'error': 'Unauthorized'}), 403
 
     filtro = request.args.get('filtro', 'todas')
 
-    from app.models.terceirizados_models import Terceirizado
-    from sqlalchemy import func, or_, literal_column
-
-    # SQLAlchemy 2.x: colunas sem .label() recebem prefixo da tabela no UNION subquery.
-    # Solução: usar .label() explícito em TODAS as colunas.
-    subq_inbound = db.session.query(
-        HistoricoNotificacao.remetente.label('telefone'),
-        HistoricoNotificacao.criado_em.label('criado_em'),
-        HistoricoNotificacao.direcao.label('direcao'),
-        HistoricoNotificacao.status_leitura.label('status_leitura'),
-        HistoricoNotificacao.tipo_conteudo.label('tipo_conteudo'),
-        HistoricoNotificacao.mensagem.label('mensagem'),
-        HistoricoNotificacao.tipo.label('tipo')
-    ).filter(
-        HistoricoNotificacao.direcao == 'inbound',
-        HistoricoNotificacao.remetente.isnot(None),
-        HistoricoNotificacao.remetente != '',
-        HistoricoNotificacao.remetente != 'sistema'
-    )
-
-    subq_outbound = db.session.query(
-        HistoricoNotificacao.destinatario.label('telefone'),
-        HistoricoNotificacao.criado_em.label('criado_em'),
-        HistoricoNotificacao.direcao.label('direcao'),
-        HistoricoNotificacao.status_leitura.label('status_leitura'),
-        HistoricoNotificacao.tipo_conteudo.label('tipo_conteudo'),
-        HistoricoNotificacao.mensagem.label('mensagem'),
-        HistoricoNotificacao.tipo.label('tipo')
-    ).filter(
-        HistoricoNotificacao.direcao == 'outbound',
-        HistoricoNotificacao.destinatario.isnot(None),
-        HistoricoNotificacao.destinatario != '',
-        HistoricoNotificacao.destinatario != 'sistema'
-    )
-
-    # Unir inbound e outbound
-    union_query = subq_inbound.union_all(subq_outbound).subquery()
-
-    # Agrupar por telefone
-    nao_lidas_expr = func.count(
-        db.case(
-            (db.and_(
-                union_query.c.direcao == 'inbound',
-                or_(
-                    union_query.c.status_leitura == None,
-                    union_query.c.status_leitura == 'nao_lida'
-                )
-            ), 1)
-        )
-    )
-
-    query = db.session.query(
-        union_query.c.telefone,
-        func.max(union_query.c.criado_em).label('ultima_msg_em'),
-        nao_lidas_expr.label('nao_lidas')
-    ).group_by(union_query.c.telefone)
-
-    # Aplicar filtros
-    if filtro == 'nao_lidas':
-        query = query.having(nao_lidas_expr > 0)
-    elif filtro == 'ativas':
-        limite_24h = datetime.utcnow() - timedelta(hours=24)
-        query = query.having(func.max(union_query.c.criado_em) >= limite_24h)
-
-    conversas_raw = query.order_by(func.max(union_query.c.criado_em).desc()).limit(50).all()
-
-    # Buscar preview da última mensagem e nome do contato para cada conversa
-    from app.models.estoque_models import Fornecedor
-    from app.models.models import Usuario
+    from app.services.conversa_service import ConversaService
 
     conversas = []
-    for conv in conversas_raw:
-        telefone = conv.telefone
-        if not telefone:
-            continue
-
-        # Buscar última mensagem (inbound OU outbound), excluindo mensagens deletadas
-        ultima = HistoricoNotificacao.query.filter(
-            or_(
-                HistoricoNotificacao.remetente == telefone,
-                HistoricoNotificacao.destinatario == telefone
-            ),
-            HistoricoNotificacao.excluido_em.is_(None)
-        ).order_by(HistoricoNotificacao.criado_em.desc()).first()
-
-        if not ultima:
-            continue
-
-        # Tentar encontrar nome do contato (Terceirizado, Fornecedor ou Usuario)
-        nome = None
-        terceirizado = Terceirizado.query.filter_by(telefone=telefone).first()
-        if terceirizado:
-            nome = terceirizado.nome
-        else:
-            fornecedor = Fornecedor.query.filter_by(telefone=telefone).first()
-            if not fornecedor:
-                fornecedor = Fornecedor.query.filter_by(whatsapp=telefone).first()
-            if fornecedor:
-                nome = fornecedor.nome
-            else:
-                usuario = Usuario.query.filter_by(telefone=telefone).first()
-                if usuario:
-                    nome = usuario.nome
-
-        # Se não encontrou em nenhuma tabela, usar pushName salvo na última mensagem inbound
-        if not nome:
-            msg_com_nome = HistoricoNotificacao.query.filter(
-                HistoricoNotificacao.remetente == telefone,
-                HistoricoNotificacao.direcao == 'inbound',
-                HistoricoNotificacao.caption.isnot(None)
-            ).order_by(HistoricoNotificacao.criado_em.desc()).first()
-            if msg_com_nome:
-                nome = msg_com_nome.caption
-
+    for conv in ConversaService.listar(filtro):
         # Calcular tempo relativo (usando hora local Brasil UTC-3)
         ultima_msg_local = utc_to_local(conv.ultima_msg_em)
         tempo_diff = datetime.utcnow() - conv.ultima_msg_em
@@ -604,29 +523,12 @@ def listar_conversas():
         else:
             tempo_str = ultima_msg_local.strftime('%d/%m')
 
-        # Preview da mensagem
-        tipo_conteudo = ultima.tipo_conteudo or 'text'
-        if tipo_conteudo == 'text':
-            preview = ultima.mensagem[:50] + '...' if len(ultima.mensagem or '') > 50 else (ultima.mensagem or '')
-        elif tipo_conteudo == 'audio':
-            preview = '🎤 Áudio'
-        elif tipo_conteudo == 'image':
-            preview = '📷 Imagem'
-        elif tipo_conteudo == 'document':
-            preview = '📄 Documento'
-        else:
-            preview = ultima.tipo or tipo_conteudo
-
-        # Indicar direção na preview
-        if ultima.direcao == 'outbound':
-            preview = '↗ ' + preview
-
         conversas.append({
-            'telefone': telefone,
-            'nome': nome or telefone,
+            'telefone': conv.telefone,
+            'nome': conv.nome_contato or conv.telefone,
             'ultima_msg_tempo': tempo_str,
-            'ultima_msg_preview': preview,
-            'nao_lidas': int(conv.nao_lidas)
+            'ultima_msg_preview': conv.ultima_preview or '',
+            'nao_lidas': conv.nao_lidas or 0
         })
 
     return jsonify(conversas)
@@ -634,47 +536,30 @@ def listar_conversas():
 @bp.route('/admin/chat/mensagens/<telefone>')
 @login_required
 def listar_mensagens(telefone):
-    """Lista todas as mensagens de uma conversa específica"""
+    """
+    Mensagens de uma conversa, paginadas por cursor: sem parâmetros traz as 50
+    mais recentes; ?antes=<cursor> as anteriores e ?depois=<cursor> as novas.
+    """
     if current_user.tipo not in ['admin', 'gerente']:
         return jsonify({'error': 'Unauthorized'}), 403
 
-    # Normalizar telefone e gerar variantes para retrocompatibilidade com registros antigos
-    from app.services.whatsapp_service import WhatsAppService
+    from app.services.conversa_service import ConversaService
     try:
-        telefone_norm = WhatsAppService.normalizar_telefone(telefone)
-    except Exception:
-        telefone_norm = telefone
-
-    # Gerar variante sem prefixo 55 (para mensagens antigas)
-    telefone_sem55 = telefone_norm[2:] if telefone_norm.startswith('55') and len(telefone_norm) > 11 else telefone_norm
-
-    # Buscar mensagens por ambos os formatos (retrocompatibilidade)
-    mensagens = db.session.query(HistoricoNotificacao).filter(
-        or_(
-            HistoricoNotificacao.remetente == telefone_norm,
-            HistoricoNotificacao.destinatario == telefone_norm,
-            HistoricoNotificacao.remetente == telefone_sem55,
-            HistoricoNotificacao.destinatario == telefone_sem55,
-            HistoricoNotificacao.remetente == telefone,
-            HistoricoNotificacao.destinatario == telefone,
-        ),
-        HistoricoNotificacao.excluido_em.is_(None)
-    ).order_by(HistoricoNotificacao.criado_em.asc()).all()
+        mensagens, tem_anteriores = ConversaService.mensagens(
+            telefone,
+            antes=request.args.get('antes'),
+            depois=request.args.get('depois'),
+            limite=request.args.get('limite', type=int),
+        )
+    except ValueError:
+        return jsonify({'error': 'Cursor inválido'}), 400
 
     resultado = []
     for msg in mensagens:
-        # Determinar direção correta
-        if msg.direcao:
-            direcao = msg.direcao
-        elif msg.destinatario == telefone:
-            direcao = 'outbound'
-        else:
-            direcao = 'inbound'
-
         criado_local = utc_to_local(msg.criado_em)
         resultado.append({
             'id': msg.id,
-            'direcao': direcao,
+            'direcao': msg.direcao or 'outbound',
             'mensagem': msg.mensagem,
             'tipo_conteudo': msg.tipo_conteudo or 'text',
             'url_midia_local': msg.url_midia_local,
@@ -687,7 +572,14 @@ def listar_mensagens(telefone):
             'excluido_em': msg.excluido_em.isoformat() if msg.excluido_em else None
         })
 
-    return jsonify(resultado)
+    # `antes`: cursor para carregar as anteriores (None se não houver);
+    # `depois`: cursor para o polling de mensagens novas
+    depois = request.args.get('depois')
+    return jsonify({
+        'mensagens': resultado,
+        'antes': ConversaService.cursor(mensagens[0]) if tem_anteriores else None,
+        'depois': ConversaService.cursor(mensagens[-1]) if mensagens else depois,
+    })
 
 @bp.route('/admin/chat/enviar', methods=['POST'])
 @login_required
@@ -743,6 +635,22 @@ def enviar_mensagem_chat():
             'error': resposta.get('error', 'Erro ao enviar')
         }), 500
 
+@bp.route('/admin/chat/eventos')
+@login_required
+def eventos_chat():
+    """Push (SSE) de mensagens novas, status e leituras; a tela busca só o delta."""
+    if current_user.tipo not in ['admin', 'gerente']:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    from app.services.chat_eventos_service import ChatEventosService
+    # A conexão fica aberta por minutos: devolve a conexão do banco ao pool já
+    db.session.close()
+    return Response(
+        stream_with_context(ChatEventosService.stream(lambda evento: evento.get('telefone'))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 @bp.route('/admin/chat/marcar-lida/<telefone>', methods=['POST'])
 @login_required
 def marcar_como_lida(telefone):
@@ -750,18 +658,9 @@ def marcar_como_lida(telefone):
     if current_user.tipo not in ['admin', 'gerente']:
         return jsonify({'error': 'Unauthorized'}), 403
 
-    # Atualizar status de leitura de mensagens inbound não lidas
-    HistoricoNotificacao.query.filter_by(
-        remetente=telefone,
-        direcao='inbound'
-    ).filter(
-        or_(
-            HistoricoNotificacao.status_leitura == None,
-            HistoricoNotificacao.status_leitura == 'nao_lida'
-        )
-    ).update({
-        'status_leitura': 'lida'
-    })
+    # Atualizar status de leitura de mensagens inbound não lidas (e zerar o contador da conversa)
+    from app.services.conversa_service import ConversaService
+    ConversaService.marcar_lida(telefone)
 
     db.session.commit()
 
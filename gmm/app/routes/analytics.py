@@ -2,8 +2,11 @@ from flask import Blueprint, render_template, jsonify, request, send_file, abort
 from flask_login import login_required, current_user
 from functools import wraps
 from app.services.analytics_service import AnalyticsService, BIService
+from app.services.kpi_diario_service import KpiDiarioService
+from app.services.lead_time_service import LeadTimeService
+from app.utils.serie_temporal import RESOLUCOES, MAX_PONTOS, EixoTemporal
 from app.models.models import Unidade, Usuario
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import csv
 import io
 
@@ -22,7 +25,7 @@ def role_required(*roles):
 bp = Blueprint('analytics', __name__, url_prefix='/analytics')
 
 # ── v4.0: Importações para analytics de compras ────────────────────────────
-from app.models.estoque_models import PedidoCompra, Fornecedor, OrcamentoUnidade, AprovacaoPedido
+from app.models.estoque_models import PedidoCompra, Fornecedor, OrcamentoUnidade
 
 @bp.route('/dashboard')
 @login_required
@@ -59,11 +62,15 @@ def compras_bi():
 @login_required
 def api_compras_budget():
     """Budget Tracking: orçado vs empenhado vs realizado por unidade no mês."""
-    from sqlalchemy import func, extract
+    from sqlalchemy import func
     from app.extensions import db
 
     ano = request.args.get('ano', datetime.utcnow().year, type=int)
     mes = request.args.get('mes', datetime.utcnow().month, type=int)
+    if not 1 <= mes <= 12:
+        return jsonify({'error': 'mes deve estar entre 1 e 12'}), 400
+    if not 2000 <= ano <= 2100:
+        return jsonify({'error': 'ano deve estar entre 2000 e 2100'}), 400
 
     # Orçado por unidade
     orcados = db.session.query(
@@ -71,19 +78,14 @@ def api_compras_budget():
         func.sum(OrcamentoUnidade.valor_orcado).label('orcado')
     ).filter_by(ano=ano, mes=mes).group_by(OrcamentoUnidade.unidade_id).all()
 
-    # Empenhado = pedidos aprovados/faturados no mês
-    empenhados = db.session.query(
-        PedidoCompra.unidade_destino_id,
-        func.sum(PedidoCompra.valor_total_estimado).label('empenhado')
-    ).filter(
-        PedidoCompra.status.in_(['aprovado', 'faturado', 'recebido']),
-        extract('year', PedidoCompra.data_solicitacao) == ano,
-        extract('month', PedidoCompra.data_solicitacao) == mes
-    ).group_by(PedidoCompra.unidade_destino_id).all()
+    # Empenhado = pedidos aprovados/faturados no mês (rollup diário + dia corrente)
+    inicio_mes = date(ano, mes, 1)
+    fim_mes = date(ano + mes // 12, mes % 12 + 1, 1) - timedelta(days=1)
+    empenhados = KpiDiarioService.serie(inicio_mes, fim_mes, fontes=('compras',), agrupar=('unidade_id',))
 
     unidades_map = {u.id: u.nome for u in Unidade.query.all()}
     orcado_map = {r.unidade_id: float(r.orcado or 0) for r in orcados}
-    emp_map = {r.unidade_destino_id: float(r.empenhado or 0) for r in empenhados}
+    emp_map = {r['unidade_id']: r['compras_empenhado'] for r in empenhados if r['compras_empenhado']}
 
     all_ids = set(orcado_map) | set(emp_map)
     result = []
@@ -99,33 +101,21 @@ def api_compras_budget():
 @bp.route('/api/compras/leadtime')
 @login_required
 def api_compras_leadtime():
-    """Lead time médio: Solicitação → Aprovação → Recebimento."""
-    from sqlalchemy import func
-    from app.extensions import db
-
+    """
+    Lead time Solicitação → Aprovação → Recebimento: média e p50/p90/p99 no
+    geral e por tier, fornecedor e unidade (LeadTimeService, em cache até o
+    próximo commit que receba/finalize um pedido ou registre uma aprovação).
+    """
     dias = request.args.get('dias', 90, type=int)
-    desde = datetime.utcnow() - timedelta(days=dias)
-
-    pedidos = PedidoCompra.query.filter(
-        PedidoCompra.data_solicitacao >= desde,
-        PedidoCompra.status.in_(['recebido', 'faturado'])
-    ).all()
-
-    lt_aprovacao = []
-    lt_recebimento = []
-    for p in pedidos:
-        aprovacao = AprovacaoPedido.query.filter_by(pedido_id=p.id, acao='aprovado').order_by(
-            AprovacaoPedido.created_at).first()
-        if aprovacao:
-            lt_aprovacao.append((aprovacao.created_at - p.data_solicitacao).total_seconds() / 3600)
-        if p.data_recebimento and p.data_solicitacao:
-            lt_recebimento.append((p.data_recebimento - p.data_solicitacao).total_seconds() / 3600)
+    unidade_id = request.args.get('unidade_id', type=int)
+    lead_time = LeadTimeService.calcular(dias, unidade_id=unidade_id)
 
-    avg = lambda lst: round(sum(lst) / len(lst), 1) if lst else 0
+    geral = lead_time['geral']
     return jsonify({
-        'media_horas_aprovacao': avg(lt_aprovacao),
-        'media_horas_recebimento': avg(lt_recebimento),
-        'total_pedidos': len(pedidos)
+        'media_horas_aprovacao': geral['aprovacao']['media'],
+        'media_horas_recebimento': geral['recebimento']['media'],
+        'total_pedidos': geral['total_pedidos'],
+        **lead_time
     })
 
 
@@ -208,8 +198,30 @@ def api_kpi_geral():
 def api_charts_custos():
     unidade_id = request.args.get('unidade_id', type=int)
     days = request.args.get('days', default=30, type=int)
-    
-    data = AnalyticsService.get_cost_evolution(unidade_id, days)
+    resolucao = request.args.get('resolucao', default='dia')
+    por_unidade = request.args.get('por_unidade', default='').lower() in ('1', 'true', 'sim')
+    try:
+        inicio = datetime.strptime(request.args['inicio'], '%Y-%m-%d').date() if request.args.get('inicio') else None
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else None
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+    if resolucao not in RESOLUCOES:
+        return jsonify({'error': f"resolucao deve ser uma de: {', '.join(RESOLUCOES)}"}), 400
+
+    hoje = datetime.utcnow().date()
+    fim = fim or hoje
+    try:
+        inicio = inicio or hoje - timedelta(days=days)
+    except OverflowError:
+        return jsonify({'error': 'days fora do intervalo permitido'}), 400
+    if inicio > fim:
+        return jsonify({'error': 'inicio deve ser anterior ou igual a fim'}), 400
+    if EixoTemporal(inicio, fim, resolucao).tamanho > MAX_PONTOS[resolucao]:
+        return jsonify({'error': f"Período longo demais para resolucao={resolucao} "
+                                 f"(máximo de {MAX_PONTOS[resolucao]} pontos)"}), 400
+
+    data = AnalyticsService.get_cost_evolution(unidade_id, days, resolucao=resolucao, inicio=inicio, fim=fim,
+                                               por_unidade=por_unidade)
     return jsonify(data)
 
 @bp.route('/api/tecnicos/performance')
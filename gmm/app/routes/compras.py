@@ -7,6 +7,7 @@ from app.models.estoque_models import (
     CotacaoCompra, ConfiguracaoCompras
 )
 from app.extensions import db
+from app.services.perfis_carga import PerfisCarga
 from datetime import datetime
 import logging
 import os
@@ -125,15 +126,7 @@ def novo():
 @login_required
 def detalhes(id):
     """View order details, quotes and communication history"""
-    pedido = PedidoCompra.query.get_or_404(id)
-    quotes = CatalogoFornecedor.query.filter_by(estoque_id=pedido.estoque_id).order_by(CatalogoFornecedor.preco_atual).all()
-    from app.models.models import Unidade
-    unidades = Unidade.query.filter_by(ativa=True).order_by(Unidade.nome).all()
-    fornecedores_cadastrados = Fornecedor.query.filter_by(ativo=True).order_by(Fornecedor.nome).all()
-
-    return render_template('compras/detalhes_melhorado.html',
-                           pedido=pedido, quotes=quotes, unidades=unidades,
-                           fornecedores_cadastrados=fornecedores_cadastrados)
+    return render_template('compras/detalhes_melhorado.html', **PerfisCarga.pedido_detalhe(id))
 
 @bp.route('/<int:id>/alterar_unidade', methods=['POST'])
 @login_required
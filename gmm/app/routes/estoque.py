@@ -2,7 +2,10 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required
 from app.models.estoque_models import Estoque, EstoqueSaldo, MovimentacaoEstoque
 from app.services.estoque_service import EstoqueService
+from app.services.pecas_index import PecasIndex
+from app.models.models import Unidade
 from app.extensions import db
+from datetime import datetime, timedelta
 
 bp = Blueprint('estoque', __name__, url_prefix='/estoque')
 
@@ -13,8 +16,12 @@ def dashboard():
     # 1. Obter saldos totais
     itens = Estoque.query.order_by(Estoque.nome).all()
     
-    # 2. Curva ABC
-    dados_abc, total_valor = EstoqueService.gerar_curva_abc()
+    # 2. Curva ABC (opcionalmente por unidade e/ou últimos N dias)
+    unidade_id = request.args.get('unidade_id', type=int)
+    dias = request.args.get('dias', type=int)
+    # Janela em dias inteiros: mantém a mesma chave de cache ao longo do dia
+    inicio = datetime.combine(datetime.utcnow().date() - timedelta(days=dias), datetime.min.time()) if dias else None
+    dados_abc, total_valor = EstoqueService.gerar_curva_abc(unidade_id=unidade_id, inicio=inicio)
     
     # 3. Alertas de estoque crítico
     criticos = Estoque.query.filter(Estoque.quantidade_atual <= Estoque.quantidade_minima).all()
@@ -27,7 +34,10 @@ def dashboard():
                          dados_abc=dados_abc, 
                          total_valor=total_valor,
                          criticos=criticos,
-                         recentes=recentes)
+                         recentes=recentes,
+                         unidades=Unidade.query.filter_by(ativa=True).order_by(Unidade.nome).all(),
+                         filtro_unidade_id=unidade_id,
+                         filtro_dias=dias)
 
 @bp.route('/movimentacoes')
 @login_required
@@ -42,9 +52,8 @@ def movimentacoes():
 def api_pecas():
     """API simples para busca de peças no frontend"""
     q = request.args.get('q', '')
-    query = Estoque.query
-    if q:
-        query = query.filter(Estoque.nome.ilike(f'%{q}%'))
-    
-    pecas = query.limit(10).all()
-    return jsonify([{'id': p.id, 'nome': p.nome, 'codigo': p.codigo, 'qtd': float(p.quantidade_atual)} for p in pecas])
+    unidade_id = request.args.get('unidade_id', type=int)
+    pecas = PecasIndex.buscar(q, unidade_id=unidade_id)
+    return jsonify([{'id': p['id'], 'nome': p['nome'], 'codigo': p['codigo'], 'qtd': p['saldo'],
+                     'saldos': p['saldos'], **({'qtd_unidade': p['saldo_unidade']} if unidade_id else {})}
+                    for p in pecas])
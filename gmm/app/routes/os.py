@@ -6,10 +6,12 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 from app.extensions import db
 from app.models.models import Unidade, Usuario
-from app.models.estoque_models import OrdemServico, Estoque, CategoriaEstoque, Equipamento, AnexosOS, PedidoCompra, EstoqueSaldo, MovimentacaoEstoque, Fornecedor
+from app.models.estoque_models import OrdemServico, Estoque, Equipamento, AnexosOS, PedidoCompra, EstoqueSaldo, MovimentacaoEstoque, Fornecedor
 from app.models.terceirizados_models import Terceirizado, ChamadoExterno
 from app.services.os_service import OSService
 from app.services.estoque_service import EstoqueService
+from app.services.pecas_index import PecasIndex
+from app.services.perfis_carga import PerfisCarga
 from app.services.email_service import EmailService
 from app.models.terceirizados_models import HistoricoNotificacao
 
@@ -80,41 +82,9 @@ def nova_os():
 @bp.route('/<int:id>', methods=['GET'])
 @login_required
 def detalhes(id):
-    os_obj = OrdemServico.query.get_or_404(id)
-    categorias = CategoriaEstoque.query.all()
-    
-    # Carregar todas as peças para o modal de solicitação
-    todas_pecas = Estoque.query.order_by(Estoque.nome).all()
-    
-    # Filtra terceirizados: Globais (abrangencia_global=True) OU que atendam a Unidade da OS
-    terceirizados = Terceirizado.query.filter(
-        (Terceirizado.abrangencia_global == True) | 
-        (Terceirizado.unidades.any(id=os_obj.unidade_id))
-    ).filter_by(ativo=True).order_by(Terceirizado.nome).all()
-
-    # [Novo] Carrega usuários para o select de notificação na transferência
-    usuarios = Usuario.query.filter_by(ativo=True).order_by(Usuario.nome).all()
-
-    # Etapa 3 — solicitações pendentes vinculadas a esta OS
-    from app.models.estoque_models import PedidoCompra, SolicitacaoTransferencia
-    pedidos_pendentes = PedidoCompra.query.filter(
-        PedidoCompra.os_id == id,
-        PedidoCompra.status.notin_(['concluido', 'cancelado', 'recusado'])
-    ).order_by(PedidoCompra.data_solicitacao.desc()).all()
-
-    transferencias_pendentes = SolicitacaoTransferencia.query.filter(
-        SolicitacaoTransferencia.os_id == id,
-        SolicitacaoTransferencia.status.notin_(['concluida', 'rejeitada'])
-    ).order_by(SolicitacaoTransferencia.data_solicitacao.desc()).all()
-
-    return render_template('os_detalhes.html',
-                         os=os_obj,
-                         categorias=categorias,
-                         todas_pecas=todas_pecas,
-                         terceirizados=terceirizados,
-                         usuarios=usuarios,
-                         pedidos_pendentes=pedidos_pendentes,
-                         transferencias_pendentes=transferencias_pendentes)
+    # Perfil de carga: OS + técnico/unidade/equipamento, movimentações → peça e
+    # chamados → prestador em queries fixas (sem lazy load por linha no template)
+    return render_template('os_detalhes.html', **PerfisCarga.os_detalhe(id))
 
 @bp.route('/<int:id>/iniciar', methods=['POST'])
 @login_required
@@ -401,8 +371,11 @@ def disponibilidade_estoque(id):
 def buscar_pecas():
     termo = request.args.get('q', '')
     if len(termo) < 2: return jsonify([])
-    pecas = Estoque.query.filter(Estoque.nome.ilike(f'%{termo}%')).limit(10).all()
-    return jsonify([{'id': p.id, 'nome': p.nome, 'unidade': p.unidade_medida, 'saldo': float(p.quantidade_atual)} for p in pecas])
+    # Índice em memória (sem SQL por tecla); saldo_unidade = unidade da OS ou do técnico
+    unidade_id = request.args.get('unidade_id', type=int) or current_user.unidade_padrao_id
+    pecas = PecasIndex.buscar(termo, unidade_id=unidade_id)
+    return jsonify([{'id': p['id'], 'codigo': p['codigo'], 'nome': p['nome'], 'unidade': p['unidade_medida'],
+                     'saldo': p['saldo'], 'saldo_unidade': p.get('saldo_unidade'), 'saldos': p['saldos']} for p in pecas])
 
 
 @bp.route('/api/pecas/<int:peca_id>/disponibilidade')
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime
 from app.extensions import db
@@ -411,12 +411,16 @@ def api_obter_mensagens(id):
     """
     Retorna histórico completo de mensagens de um chamado específico.
     Usado pela Central de Mensagens para carregar o chat.
+    Com ?apos=<id> retorna só as mensagens posteriores (delta após um evento).
     """
     # Verifica se o chamado existe
     chamado = ChamadoExterno.query.get_or_404(id)
 
-    mensagens = HistoricoNotificacao.query.filter_by(chamado_id=id)\
-        .order_by(HistoricoNotificacao.criado_em.asc()).all()
+    query = HistoricoNotificacao.query.filter_by(chamado_id=id)
+    apos = request.args.get('apos', type=int)
+    if apos:
+        query = query.filter(HistoricoNotificacao.id > apos)
+    mensagens = query.order_by(HistoricoNotificacao.criado_em.asc(), HistoricoNotificacao.id.asc()).all()
 
     resultado = []
     for m in mensagens:
@@ -451,6 +455,23 @@ def api_obter_mensagens(id):
     return jsonify(resultado)
 
 
+@bp.route('/api/eventos', methods=['GET'])
+@login_required
+def api_eventos():
+    """
+    Push (SSE) dos eventos das mensagens ligadas a chamados.
+    Usado pela Central de Mensagens no lugar do polling de 5 segundos.
+    """
+    from app.services.chat_eventos_service import ChatEventosService
+    # A conexão fica aberta por minutos: devolve a conexão do banco ao pool já
+    db.session.close()
+    return Response(
+        stream_with_context(ChatEventosService.stream(lambda evento: evento.get('chamado_id'))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @bp.route('/api/chamados/<int:id>/finalizar', methods=['POST'])
 @login_required
 def api_finalizar_chamado(id):
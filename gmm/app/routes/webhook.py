@@ -1,11 +1,15 @@
 import hmac
+import time
 import hashlib
 import logging
 from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy.exc import IntegrityError
 from app.extensions import db
 from app.models.terceirizados_models import HistoricoNotificacao
-from app.models.estoque_models import ComunicacaoFornecedor, Fornecedor
+from app.models.estoque_models import ComunicacaoFornecedor
+from app.services.fila_ingestao import FilaIngestao
+from app.services.deduplicador_webhook import DeduplicadorWebhook
 
 bp = Blueprint('webhook', __name__)
 logger = logging.getLogger(__name__)
@@ -17,12 +21,9 @@ def vincular_notificacao_chamado(notif, remetente):
     Isso faz a mensagem aparecer na Central de Mensagens (/terceirizados/central-mensagens).
     """
     try:
-        from app.models.terceirizados_models import Terceirizado, ChamadoExterno
-        termo = remetente[-8:]
-        terceirizado = Terceirizado.query.filter(
-            Terceirizado.telefone.like(f'%{termo}'),
-            Terceirizado.ativo == True
-        ).first()
+        from app.models.terceirizados_models import ChamadoExterno
+        from app.services.telefone_index import TelefoneIndex
+        terceirizado = TelefoneIndex.buscar_terceirizado(remetente)
         if not terceirizado:
             return
         chamado = ChamadoExterno.query.filter(
@@ -44,30 +45,13 @@ def vincular_whatsapp_fornecedor(remetente, texto):
     Busca o fornecedor pelo telefone e vincula a comunicacao pendente mais recente.
     """
     try:
-        from app.services.whatsapp_service import WhatsAppService
-        try:
-            telefone_normalizado = WhatsAppService.normalizar_telefone(remetente)
-        except Exception:
-            telefone_normalizado = None
+        from app.services.telefone_index import TelefoneIndex
 
-        # Buscar fornecedor pelo telefone ou whatsapp (ultimos 10 digitos)
-        digitos = remetente[-10:] if remetente else None
-        if not digitos:
+        # Buscar fornecedor pelo telefone ou whatsapp (índice em memória)
+        if not remetente:
             return
 
-        filtros = [
-            Fornecedor.telefone.contains(digitos),
-            Fornecedor.whatsapp.contains(digitos),
-        ]
-        if telefone_normalizado:
-            digitos_norm = telefone_normalizado[-10:]
-            filtros.append(Fornecedor.telefone.contains(digitos_norm))
-            filtros.append(Fornecedor.whatsapp.contains(digitos_norm))
-
-        fornecedor = Fornecedor.query.filter(
-            db.or_(*filtros),
-            Fornecedor.ativo == True
-        ).first()
+        fornecedor = TelefoneIndex.buscar_fornecedor_exato(remetente)
 
         if not fornecedor:
             logger.debug(f"Nenhum fornecedor encontrado para telefone {remetente}")
@@ -397,12 +381,177 @@ def extrair_dados_megaapi(payload):
     return resultado
 
 
+def motivo_ignorar_inbound(dados):
+    """Retorna o motivo para ignorar o evento (sem gravar nada), ou None se for processável."""
+    tipo = dados['tipo']
+    if tipo == 'text':
+        return None if dados['texto'] else 'empty_text'
+    if tipo == 'interactive':
+        return None if dados['interactive_id'] else 'no_interactive_response'
+    if tipo in ('image', 'audio', 'document'):
+        return None
+    return f'unknown_type_{tipo}'
+
+
+def registrar_mensagem_inbound(dados, remetente):
+    """
+    Persiste o HistoricoNotificacao do evento e faz os vínculos (chamado / fornecedor).
+    Usado pelo webhook no modo síncrono e pelos workers da fila de ingestão.
+    Retorna None se o megaapi_id já existir no banco (retry que escapou do dedup).
+    """
+    tipo = dados['tipo']
+    megaapi_id = dados['msg_id'] or None  # vazio não pode colidir no índice único
+
+    if tipo == 'text':
+        texto = dados['texto']
+        notif = HistoricoNotificacao(
+            tipo='resposta_auto',
+            direcao='inbound',
+            remetente=remetente,
+            destinatario='sistema',
+            status_envio='recebido',
+            mensagem=texto,
+            mensagem_hash=hashlib.sha256(texto.encode()).hexdigest(),
+            megaapi_id=megaapi_id,
+            tipo_conteudo='text',
+            status_leitura='nao_lida',
+            caption=dados.get('push_name'),  # nome do remetente (pushName do MegaAPI)
+        )
+    elif tipo == 'interactive':
+        notif = HistoricoNotificacao(
+            tipo='resposta_interativa',
+            direcao='inbound',
+            remetente=remetente,
+            destinatario='sistema',
+            status_envio='recebido',
+            mensagem=dados['interactive_id'],
+            caption=dados['interactive_title'],
+            megaapi_id=megaapi_id,
+            tipo_conteudo='interactive',
+            status_leitura='nao_lida',
+        )
+    else:
+        notif = HistoricoNotificacao(
+            tipo='midia_recebida',
+            direcao='inbound',
+            remetente=remetente,
+            destinatario='sistema',
+            status_envio='recebido',
+            mensagem=dados['caption'] or f'[{tipo.upper()}]',
+            megaapi_id=megaapi_id,
+            tipo_conteudo=tipo,
+            mimetype=dados['mimetype'],
+            caption=dados['caption'],
+            status_leitura='nao_lida',
+        )
+
+    db.session.add(notif)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        DeduplicadorWebhook.registrar_duplicata_banco(megaapi_id)
+        return None
+
+    if tipo != 'interactive':
+        # Vincular ao chamado ativo (para aparecer na Central de Mensagens de Terceirizados)
+        vincular_notificacao_chamado(notif, remetente)
+
+    if tipo == 'text':
+        # Vincular ao historico de comunicacoes de compras (se for fornecedor)
+        vincular_whatsapp_fornecedor(remetente, dados['texto'])
+
+    return notif
+
+
+def _rotear_texto_sincrono(remetente, texto):
+    """Roteia e responde dentro do próprio request (garantia de entrega independente do Celery)."""
+    try:
+        from app.services.roteamento_service import RoteamentoService
+        from app.services.whatsapp_service import WhatsAppService
+        resultado = RoteamentoService.processar(remetente, texto)
+        if resultado:
+            acao = resultado.get('acao')
+            if acao == 'responder' and resultado.get('resposta'):
+                WhatsAppService.enviar_mensagem(
+                    telefone=remetente,
+                    texto=resultado['resposta']
+                )
+            elif acao == 'enviar_mensagem' and resultado.get('mensagem'):
+                WhatsAppService.enviar_mensagem(
+                    telefone=resultado.get('telefone', remetente),
+                    texto=resultado['mensagem']
+                )
+            elif acao == 'encaminhar':
+                WhatsAppService.enviar_mensagem(
+                    telefone=remetente,
+                    texto="✅ Mensagem recebida. Em breve um atendente responderá."
+                )
+            # Encaminha para usuários do perfil — só quando ação é 'encaminhar'
+            if acao == 'encaminhar' and resultado.get('encaminhar_para'):
+                _encaminhar_para_perfil(resultado['encaminhar_para'], remetente, texto)
+            logger.info(f"Roteamento sincrono concluido: acao={acao} para {remetente}")
+    except Exception as e:
+        logger.error(f"Erro no roteamento sincrono: {e}", exc_info=True)
+
+
+def processar_interativo_inbound(notif):
+    """Processa a resposta de lista/botão já persistida."""
+    try:
+        from app.services.roteamento_service import RoteamentoService
+        resultado = RoteamentoService.processar_resposta_interativa(notif)
+        if resultado and resultado.get('acao') == 'enviar_mensagem':
+            from app.services.whatsapp_service import WhatsAppService
+            WhatsAppService.enviar_mensagem(resultado['telefone'], resultado['mensagem'], prioridade=1)
+    except Exception as e:
+        logger.error(f"Erro ao processar interativo: {e}")
+
+
+def baixar_midia_inbound(notif, url_midia, tipo):
+    """Baixa a mídia recebida: tenta Celery, cai para síncrono se indisponível."""
+    if not url_midia:
+        logger.warning(f"Mensagem de mídia sem URL — tipo={tipo}, msg_id={notif.megaapi_id}")
+        return
+
+    celery_ok = False
+    try:
+        from app.tasks.whatsapp_tasks import baixar_midia_task
+        baixar_midia_task.delay(notif.id, url_midia, tipo)
+        celery_ok = True
+    except Exception as e:
+        logger.warning(f"Celery indisponivel para download de midia: {e}")
+
+    if not celery_ok:
+        # Fallback síncrono — baixa direto no request
+        try:
+            from app.services.media_downloader_service import MediaDownloaderService
+            bearer_token = current_app.config.get('MEGA_API_TOKEN')
+            if bearer_token:
+                filepath = MediaDownloaderService.download(url_midia, tipo, bearer_token)
+                notif.url_midia_local = filepath
+                db.session.commit()
+                logger.info(f"Mídia baixada de forma síncrona: {filepath}")
+                # Transcrição síncrona de áudio
+                if tipo == 'audio':
+                    try:
+                        from app.tasks.whatsapp_tasks import transcrever_audio_task
+                        transcrever_audio_task.delay(notif.id)
+                    except Exception:
+                        pass
+            else:
+                logger.error("MEGA_API_TOKEN não configurado — não é possível baixar mídia")
+        except Exception as e2:
+            logger.error(f"Erro no download síncrono de mídia: {e2}", exc_info=True)
+
+
 @bp.route('/webhook/whatsapp', methods=['POST', 'GET'])
 def webhook_whatsapp():
     """
     Receives POSTs from MegaAPI.
     GET retorna 200 para verificacao de URL pela MegaAPI.
     """
+    recebido_em = time.time()
+
     # Log toda requisicao para debug
     logger.info(f"=== WEBHOOK CHAMADO === method={request.method}, headers={str(dict(request.headers))[:200] if request.headers else 'N/A'}")
 
@@ -455,156 +604,48 @@ def webhook_whatsapp():
         logger.error(f"Erro ao parsear payload: {e}", exc_info=True)
         return jsonify({'error': 'Invalid payload'}), 400
 
-    # Processar baseado no tipo
-    try:
-        if tipo == 'text':
-            texto = dados['texto']
-            if not texto:
-                return jsonify({'status': 'ignored', 'reason': 'empty_text'}), 200
-
-            notif = HistoricoNotificacao(
-                tipo='resposta_auto',
-                direcao='inbound',
-                remetente=remetente,
-                destinatario='sistema',
-                status_envio='recebido',
-                mensagem=texto,
-                mensagem_hash=hashlib.sha256(texto.encode()).hexdigest(),
-                megaapi_id=dados['msg_id'],
-                tipo_conteudo='text',
-                status_leitura='nao_lida',
-                caption=dados.get('push_name'),  # nome do remetente (pushName do MegaAPI)
-            )
-            db.session.add(notif)
-            db.session.commit()
-
-            # Vincular ao chamado ativo (para aparecer na Central de Mensagens de Terceirizados)
-            vincular_notificacao_chamado(notif, remetente)
-
-            # Vincular ao historico de comunicacoes de compras (se for fornecedor)
-            vincular_whatsapp_fornecedor(remetente, texto)
-
-            # Processar de forma síncrona (garantia de entrega independente do Celery)
+    motivo = motivo_ignorar_inbound(dados)
+    if motivo:
+        if motivo.startswith('unknown_type'):
+            logger.warning(f"Tipo de mensagem desconhecido: {tipo}")
+        return jsonify({'status': 'ignored', 'reason': motivo}), 200
+
+    # Retries da MegaAPI: descartados antes de qualquer escrita
+    if DeduplicadorWebhook.ja_processado(dados['msg_id']):
+        logger.info(f"Webhook duplicado ignorado: msg_id={dados['msg_id']}")
+        return jsonify({'status': 'ignored', 'reason': 'duplicate'}), 200
+
+    # Modo assíncrono: grava na fila durável e responde já; workers persistem e roteiam
+    if FilaIngestao.habilitada():
+        enfileirado, info = FilaIngestao.publicar(dados, remetente, recebido_em)
+        if enfileirado:
+            FilaIngestao.registrar_latencia('ack', (time.time() - recebido_em) * 1000)
             try:
-                from app.services.roteamento_service import RoteamentoService
-                from app.services.whatsapp_service import WhatsAppService
-                resultado = RoteamentoService.processar(remetente, texto)
-                if resultado:
-                    acao = resultado.get('acao')
-                    if acao == 'responder' and resultado.get('resposta'):
-                        WhatsAppService.enviar_mensagem(
-                            telefone=remetente,
-                            texto=resultado['resposta']
-                        )
-                    elif acao == 'enviar_mensagem' and resultado.get('mensagem'):
-                        WhatsAppService.enviar_mensagem(
-                            telefone=resultado.get('telefone', remetente),
-                            texto=resultado['mensagem']
-                        )
-                    elif acao == 'encaminhar':
-                        WhatsAppService.enviar_mensagem(
-                            telefone=remetente,
-                            texto="✅ Mensagem recebida. Em breve um atendente responderá."
-                        )
-                    # Encaminha para usuários do perfil — só quando ação é 'encaminhar'
-                    if acao == 'encaminhar' and resultado.get('encaminhar_para'):
-                        _encaminhar_para_perfil(resultado['encaminhar_para'], remetente, texto)
-                    logger.info(f"Roteamento sincrono concluido: acao={acao} para {remetente}")
+                from app.tasks.whatsapp_tasks import consumir_fila_inbound
+                consumir_fila_inbound.delay()
             except Exception as e:
-                logger.error(f"Erro no roteamento sincrono: {e}", exc_info=True)
+                # O beat drena a fila periodicamente; o evento não se perde
+                logger.warning(f"Não foi possível acionar o consumidor da fila: {e}")
+            return jsonify({'status': 'queued', 'id': info}), 200
+        FilaIngestao.incrementar('fallback_sincrono')
 
+    # Processar baseado no tipo
+    try:
+        notif = registrar_mensagem_inbound(dados, remetente)
+        if notif is None:
+            return jsonify({'status': 'ignored', 'reason': 'duplicate'}), 200
 
+        if tipo == 'text':
+            _rotear_texto_sincrono(remetente, dados['texto'])
         elif tipo == 'interactive':
-            interactive_id = dados['interactive_id']
-            if not interactive_id:
-                return jsonify({'status': 'ignored', 'reason': 'no_interactive_response'}), 200
-
-            notif = HistoricoNotificacao(
-                tipo='resposta_interativa',
-                direcao='inbound',
-                remetente=remetente,
-                destinatario='sistema',
-                status_envio='recebido',
-                mensagem=interactive_id,
-                caption=dados['interactive_title'],
-                megaapi_id=dados['msg_id'],
-                tipo_conteudo='interactive',
-                status_leitura='nao_lida',
-            )
-            db.session.add(notif)
-            db.session.commit()
-
-            # Processar resposta interativa
-            try:
-                from app.services.roteamento_service import RoteamentoService
-                resultado = RoteamentoService.processar_resposta_interativa(notif)
-                if resultado and resultado.get('acao') == 'enviar_mensagem':
-                    from app.services.whatsapp_service import WhatsAppService
-                    WhatsAppService.enviar_mensagem(resultado['telefone'], resultado['mensagem'], prioridade=1)
-            except Exception as e:
-                logger.error(f"Erro ao processar interativo: {e}")
-
-        elif tipo in ('image', 'audio', 'document'):
-            notif = HistoricoNotificacao(
-                tipo='midia_recebida',
-                direcao='inbound',
-                remetente=remetente,
-                destinatario='sistema',
-                status_envio='recebido',
-                mensagem=dados['caption'] or f'[{tipo.upper()}]',
-                megaapi_id=dados['msg_id'],
-                tipo_conteudo=tipo,
-                mimetype=dados['mimetype'],
-                caption=dados['caption'],
-                status_leitura='nao_lida',
-            )
-            db.session.add(notif)
-            db.session.commit()
-
-            # Vincular ao chamado ativo (para Central de Mensagens)
-            vincular_notificacao_chamado(notif, remetente)
-
-            # Baixar mídia: tenta Celery, cai para síncrono se indisponível
-            if dados['url_midia']:
-                celery_ok = False
-                try:
-                    from app.tasks.whatsapp_tasks import baixar_midia_task
-                    baixar_midia_task.delay(notif.id, dados['url_midia'], tipo)
-                    celery_ok = True
-                except Exception as e:
-                    logger.warning(f"Celery indisponivel para download de midia: {e}")
-
-                if not celery_ok:
-                    # Fallback síncrono — baixa direto no request
-                    try:
-                        from app.services.media_downloader_service import MediaDownloaderService
-                        bearer_token = current_app.config.get('MEGA_API_TOKEN')
-                        if bearer_token:
-                            filepath = MediaDownloaderService.download(dados['url_midia'], tipo, bearer_token)
-                            notif.url_midia_local = filepath
-                            db.session.commit()
-                            logger.info(f"Mídia baixada de forma síncrona: {filepath}")
-                            # Transcrição síncrona de áudio
-                            if tipo == 'audio':
-                                try:
-                                    from app.tasks.whatsapp_tasks import transcrever_audio_task
-                                    transcrever_audio_task.delay(notif.id)
-                                except Exception:
-                                    pass
-                        else:
-                            logger.error("MEGA_API_TOKEN não configurado — não é possível baixar mídia")
-                    except Exception as e2:
-                        logger.error(f"Erro no download síncrono de mídia: {e2}", exc_info=True)
-            else:
-                logger.warning(f"Mensagem de mídia sem URL — tipo={tipo}, msg_id={dados['msg_id']}")
-
+            processar_interativo_inbound(notif)
         else:
-            logger.warning(f"Tipo de mensagem desconhecido: {tipo}")
-            return jsonify({'status': 'ignored', 'reason': f'unknown_type_{tipo}'}), 200
+            baixar_midia_inbound(notif, dados['url_midia'], tipo)
 
     except Exception as e:
         logger.error(f"Erro ao processar webhook: {e}", exc_info=True)
         db.session.rollback()
+        DeduplicadorWebhook.liberar(dados['msg_id'])
         return jsonify({'error': 'Processing failed', 'details': str(e)}), 500
 
     return jsonify({'success': True, 'processed_at': datetime.utcnow().isoformat()})
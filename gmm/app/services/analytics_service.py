@@ -1,72 +1,41 @@
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
-from decimal import Decimal
 from app.extensions import db
 from app.models.models import Usuario, Unidade, RegistroPonto
 from app.models.estoque_models import OrdemServico, MovimentacaoEstoque, Estoque, EstoqueSaldo
-from app.models.terceirizados_models import ChamadoExterno
+from app.services.kpi_diario_service import KpiDiarioService
+from app.utils.serie_temporal import EixoTemporal, SeriesTemporais
+from app.utils.sql_tempo import horas_entre
 
 class AnalyticsService:
     @staticmethod
     def get_kpi_geral(unidade_id=None, days=30):
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Filtros base
-        os_filter = [OrdemServico.data_abertura >= start_date]
-        mov_filter = [MovimentacaoEstoque.data_movimentacao >= start_date, MovimentacaoEstoque.tipo_movimentacao == 'consumo']
-        chamado_filter = [ChamadoExterno.criado_em >= start_date]
-        
+        """
+        KPIs gerais do período (em dias inteiros): histórico lido do rollup
+        kpi_diario, apenas o dia corrente agregado ao vivo. O backlog crítico é
+        um retrato do momento e continua sendo contado direto nas OS.
+        """
+        inicio = (datetime.utcnow() - timedelta(days=days)).date()
+        totais = KpiDiarioService.totais(inicio, unidade_id=unidade_id, fontes=('os', 'pecas', 'servicos'))
+
+        # OS abertas há mais de 7 dias (independe do período)
+        backlog_query = db.session.query(func.count(OrdemServico.id)).filter(
+            OrdemServico.status == 'aberta',
+            OrdemServico.data_abertura <= datetime.utcnow() - timedelta(days=7)
+        )
         if unidade_id:
-            os_filter.append(OrdemServico.unidade_id == unidade_id)
-            mov_filter.append(MovimentacaoEstoque.unidade_id == unidade_id)
-            # Chamados externos podem estar vinculados a uma OS que tem unidade
-            chamado_filter.append(OrdemServico.unidade_id == unidade_id)
-
-        # 1. MTTR (Mean Time To Repair)
-        # Média de (data_conclusao - data_abertura) para OS concluídas
-        mttr_query = db.session.query(
-            func.avg(OrdemServico.data_conclusao - OrdemServico.data_abertura)
-        ).filter(
-            OrdemServico.status == 'concluida',
-            OrdemServico.data_conclusao.isnot(None),
-            *os_filter
-        ).scalar()
-        
-        mttr_hours = 0
-        if mttr_query:
-            mttr_hours = mttr_query.total_seconds() / 3600
+            backlog_query = backlog_query.filter(OrdemServico.unidade_id == unidade_id)
+        backlog_critico = backlog_query.scalar()
 
-        # 2. Custos (Peças + Serviços)
-        # Peças: sum(mov.quantidade * estoque.valor_unitario)
-        custo_pecas = db.session.query(
-            func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
-        ).join(Estoque).filter(*mov_filter).scalar() or Decimal('0.00')
-
-        # Serviços: sum(chamado.valor_final)
-        custo_servicos = db.session.query(
-            func.sum(ChamadoExterno.valor_final)
-        ).join(OrdemServico, ChamadoExterno.os_id == OrdemServico.id).filter(*chamado_filter).scalar() or Decimal('0.00')
-
-        total_custo = custo_pecas + custo_servicos
-
-        # 3. Backlog e Eficiência
-        total_os = OrdemServico.query.filter(*os_filter).count()
-        concluidas = OrdemServico.query.filter(OrdemServico.status == 'concluida', *os_filter).count()
-        taxa_conclusao = (concluidas / total_os * 100) if total_os > 0 else 0
-        
-        # OS abertas há mais de 7 dias
-        sete_dias_atras = datetime.utcnow() - timedelta(days=7)
-        backlog_critico = OrdemServico.query.filter(
-            OrdemServico.status == 'aberta',
-            OrdemServico.data_abertura <= sete_dias_atras,
-            *([OrdemServico.unidade_id == unidade_id] if unidade_id else [])
-        ).count()
+        total_os = int(totais['os_abertas'])
+        mttr = totais['mttr_horas_soma'] / totais['mttr_qtd'] if totais['mttr_qtd'] else 0
+        taxa_conclusao = (totais['os_concluidas'] / total_os * 100) if total_os > 0 else 0
 
         return {
-            'mttr': round(mttr_hours, 1),
-            'custo_total': float(total_custo),
-            'custo_pecas': float(custo_pecas),
-            'custo_servicos': float(custo_servicos),
+            'mttr': round(mttr, 1),
+            'custo_total': round(totais['custo_pecas'] + totais['custo_servicos'], 2),
+            'custo_pecas': round(totais['custo_pecas'], 2),
+            'custo_servicos': round(totais['custo_servicos'], 2),
             'total_os': total_os,
             'taxa_conclusao': round(taxa_conclusao, 1),
             'backlog_critico': backlog_critico
@@ -74,60 +43,62 @@ class AnalyticsService:
 
     @staticmethod
     def get_performance_tecnicos(start_date, end_date, unidade_id=None):
+        """
+        Horas de ponto, horas em OS, custo de peças e OS concluídas por técnico.
+        Número fixo de consultas (uma por métrica, agrupada por técnico).
+        """
         # Query base para usuários que são técnicos
         tecnicos_query = Usuario.query.filter(Usuario.tipo == 'tecnico')
         if unidade_id:
             tecnicos_query = tecnicos_query.filter(Usuario.unidade_padrao_id == unidade_id)
-        
-        tecnicos = tecnicos_query.all()
-        result = []
 
-        for t in tecnicos:
-            # 1. Horas totais de Ponto (Check-in até Check-out)
-            # Para SQLite, precisamos usar julianday. Para Postgres, a subtração direta funciona.
-            # Verificamos o dialeto se necessário, mas aqui usaremos uma abordagem segura.
-            registros = RegistroPonto.query.filter(
-                RegistroPonto.usuario_id == t.id,
-                RegistroPonto.data_hora_entrada >= start_date,
-                RegistroPonto.data_hora_entrada <= end_date,
-                RegistroPonto.data_hora_saida.isnot(None)
-            ).all()
-            
-            total_horas_ponto = 0
-            for r in registros:
-                diff = r.data_hora_saida - r.data_hora_entrada
-                total_horas_ponto += diff.total_seconds() / 3600
-
-            # 2. Horas totais em OS
-            ordens = OrdemServico.query.filter(
-                OrdemServico.tecnico_id == t.id,
+        tecnicos = tecnicos_query.all()
+        if not tecnicos:
+            return []
+        ids = [t.id for t in tecnicos]
+
+        # 1. Horas totais de Ponto (Check-in até Check-out)
+        horas_ponto = dict(db.session.query(
+            RegistroPonto.usuario_id,
+            func.sum(horas_entre(RegistroPonto.data_hora_entrada, RegistroPonto.data_hora_saida))
+        ).filter(
+            RegistroPonto.usuario_id.in_(ids),
+            RegistroPonto.data_hora_entrada >= start_date,
+            RegistroPonto.data_hora_entrada <= end_date,
+            RegistroPonto.data_hora_saida.isnot(None)
+        ).group_by(RegistroPonto.usuario_id).all())
+
+        # 2. Horas totais em OS e quantidade de OS concluídas
+        ordens = {
+            tecnico_id: (horas, quantidade)
+            for tecnico_id, horas, quantidade in db.session.query(
+                OrdemServico.tecnico_id,
+                func.sum(horas_entre(OrdemServico.data_abertura, OrdemServico.data_conclusao)),
+                func.count(OrdemServico.id)
+            ).filter(
+                OrdemServico.tecnico_id.in_(ids),
                 OrdemServico.status == 'concluida',
                 OrdemServico.data_conclusao >= start_date,
                 OrdemServico.data_conclusao <= end_date
-            ).all()
-
-            total_horas_os = 0
-            for o in ordens:
-                if o.data_conclusao and o.data_abertura:
-                    diff = o.data_conclusao - o.data_abertura
-                    total_horas_os += diff.total_seconds() / 3600
+            ).group_by(OrdemServico.tecnico_id).all()
+        }
 
-            # 3. Consumo de Peças por técnico
-            custo_pecas = db.session.query(
-                func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
-            ).join(Estoque).filter(
-                MovimentacaoEstoque.usuario_id == t.id,
-                MovimentacaoEstoque.tipo_movimentacao == 'consumo',
-                MovimentacaoEstoque.data_movimentacao >= start_date,
-                MovimentacaoEstoque.data_movimentacao <= end_date
-            ).scalar() or 0
+        # 3. Consumo de Peças por técnico
+        custos = dict(db.session.query(
+            MovimentacaoEstoque.usuario_id,
+            func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
+        ).join(Estoque).filter(
+            MovimentacaoEstoque.usuario_id.in_(ids),
+            MovimentacaoEstoque.tipo_movimentacao == 'consumo',
+            MovimentacaoEstoque.data_movimentacao >= start_date,
+            MovimentacaoEstoque.data_movimentacao <= end_date
+        ).group_by(MovimentacaoEstoque.usuario_id).all())
 
-            os_concluidas = OrdemServico.query.filter(
-                OrdemServico.tecnico_id == t.id,
-                OrdemServico.status == 'concluida',
-                OrdemServico.data_conclusao >= start_date,
-                OrdemServico.data_conclusao <= end_date
-            ).count()
+        result = []
+        for t in tecnicos:
+            total_horas_ponto = float(horas_ponto.get(t.id) or 0)
+            total_horas_os, os_concluidas = ordens.get(t.id, (0, 0))
+            total_horas_os = float(total_horas_os or 0)
 
             ociosidade = 0
             if total_horas_ponto > 0:
@@ -139,10 +110,10 @@ class AnalyticsService:
                 'horas_ponto': round(total_horas_ponto, 1),
                 'horas_os': round(total_horas_os, 1),
                 'ociosidade_percentual': round(ociosidade, 1),
-                'custo_pecas': float(custo_pecas),
+                'custo_pecas': float(custos.get(t.id) or 0),
                 'os_concluidas': os_concluidas
             })
-            
+
         return result
 
     @staticmethod
@@ -197,78 +168,62 @@ class AnalyticsService:
         }
 
     @staticmethod
-    def get_cost_evolution(unidade_id=None, days=30):
-        # Retorna dados agrupados por dia para o gráfico
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Peças
-        pecas_evo = db.session.query(
-            func.date(MovimentacaoEstoque.data_movimentacao).label('dia'),
-            func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
-        ).join(Estoque).filter(
-            MovimentacaoEstoque.tipo_movimentacao == 'consumo',
-            MovimentacaoEstoque.data_movimentacao >= start_date
-        )
-        if unidade_id:
-            pecas_evo = pecas_evo.filter(MovimentacaoEstoque.unidade_id == unidade_id)
-        
-        pecas_data = pecas_evo.group_by('dia').all()
-
-        # Serviços
-        servicos_evo = db.session.query(
-            func.date(ChamadoExterno.data_conclusao).label('dia'),
-            func.sum(ChamadoExterno.valor_final)
-        ).join(OrdemServico, ChamadoExterno.os_id == OrdemServico.id).filter(
-            ChamadoExterno.status == 'concluido',
-            ChamadoExterno.data_conclusao >= start_date
-        )
-        if unidade_id:
-            servicos_evo = servicos_evo.filter(OrdemServico.unidade_id == unidade_id)
-        
-        servicos_data = servicos_evo.group_by('dia').all()
-
-        # Merge data
-        all_days = {}
-        for d, v in pecas_data:
-            all_days[d] = {'pecas': float(v), 'servicos': 0}
-        for d, v in servicos_data:
-            if d in all_days:
-                all_days[d]['servicos'] = float(v)
-            else:
-                all_days[d] = {'pecas': 0, 'servicos': float(v)}
-        
-        # Sort and format
-        sorted_days = sorted(all_days.keys())
-        labels = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m') for d in sorted_days]
-        dataset_pecas = [all_days[d]['pecas'] for d in sorted_days]
-        dataset_servicos = [all_days[d]['servicos'] for d in sorted_days]
-
-        return {
-            'labels': labels,
-            'pecas': dataset_pecas,
-            'servicos': dataset_servicos
+    def get_cost_evolution(unidade_id=None, days=30, resolucao='dia', inicio=None, fim=None, por_unidade=False):
+        """
+        Série densa de custos (peças e serviços concluídos) para o gráfico: um ponto
+        por dia/semana/mês do período, com zero onde não houve custo. `inicio`/`fim`
+        (date) substituem `days`; com `por_unidade`, inclui uma série por unidade.
+        """
+        hoje = datetime.utcnow().date()
+        fim = fim or hoje
+        inicio = inicio or (datetime.utcnow() - timedelta(days=days)).date()
+        eixo = EixoTemporal(inicio, fim, resolucao)
+
+        # Rollup diário (+ dia corrente ao vivo) a partir do início do primeiro balde
+        linhas = KpiDiarioService.serie(eixo.inicio, fim, unidade_id=unidade_id,
+                                        fontes=('pecas', 'servicos_concluidos'),
+                                        agrupar=('dia', 'unidade_id') if por_unidade else ('dia',))
+        series = SeriesTemporais(eixo)
+        for linha in linhas:
+            series.somar('pecas', linha['dia'], linha['custo_pecas'])
+            series.somar('servicos', linha['dia'], linha['custo_servicos_concluidos'])
+            if por_unidade:
+                series.somar(('pecas', linha['unidade_id']), linha['dia'], linha['custo_pecas'])
+                series.somar(('servicos', linha['unidade_id']), linha['dia'], linha['custo_servicos_concluidos'])
+
+        resultado = {
+            'labels': eixo.rotulos(),
+            'resolucao': resolucao,
+            'pecas': series.lista('pecas'),
+            'servicos': series.lista('servicos')
         }
+        if por_unidade:
+            unidades = sorted({chave[1] for chave in series.chaves() if isinstance(chave, tuple)},
+                              key=lambda uid: (uid is None, uid))
+            resultado['unidades'] = [{
+                'unidade_id': uid,
+                'pecas': series.lista(('pecas', uid)),
+                'servicos': series.lista(('servicos', uid))
+            } for uid in unidades]
+        return resultado
 
 
 class BIService:
-    """Gera cards de ação contextuais com base no perfil do utilizador (RBAC)."""
+    """
+    Gera cards de ação contextuais com base no perfil do utilizador (RBAC).
+    Os números vêm dos contadores em cache (ContadoresPendencias).
+    """
 
     @staticmethod
     def get_contextual_data(user):
         from flask import url_for
-        from app.models.estoque_models import PedidoCompra, OrdemServico, Estoque
+        from app.services.contadores_pendencias import ContadoresPendencias
 
         pendencias = []
 
         # Diretor / Admin / Gerente → pedidos aguardando aprovação
         if user.tipo in ['admin', 'diretor', 'gerente']:
-            if user.tipo == 'gerente':
-                q = PedidoCompra.query.filter_by(status='solicitado')
-            else:
-                q = PedidoCompra.query.filter(
-                    PedidoCompra.status.in_(['solicitado', 'aguardando_diretoria'])
-                )
-            qtd = q.count()
+            qtd = ContadoresPendencias.pedidos_para_aprovar(user.tipo)
             if qtd > 0:
                 pendencias.append({
                     'label': 'Pedidos para Aprovar',
@@ -280,7 +235,7 @@ class BIService:
 
         # Admin / Comprador → fila de pedidos aprovados aguardando processamento
         if user.tipo in ['admin', 'comprador']:
-            qtd = PedidoCompra.query.filter_by(status='aprovado').count()
+            qtd = ContadoresPendencias.fila_compras()
             if qtd > 0:
                 pendencias.append({
                     'label': 'Fila de Compras',
@@ -292,10 +247,10 @@ class BIService:
 
         # Admin / Gerente → OS abertas (com filtro de unidade para gerentes)
         if user.tipo in ['admin', 'gerente']:
-            q = OrdemServico.query.filter_by(status='aberta')
             if user.tipo == 'gerente' and user.unidade_padrao_id:
-                q = q.filter_by(unidade_id=user.unidade_padrao_id)
-            qtd = q.count()
+                qtd = ContadoresPendencias.os_abertas(user.unidade_padrao_id)
+            else:
+                qtd = ContadoresPendencias.os_abertas()
             if qtd > 0:
                 pendencias.append({
                     'label': 'OS Pendentes',
@@ -307,9 +262,7 @@ class BIService:
 
         # Admin / Gerente / Comprador → itens em ruptura de stock
         if user.tipo in ['admin', 'gerente', 'comprador']:
-            qtd = Estoque.query.filter(
-                Estoque.quantidade_atual <= Estoque.quantidade_minima
-            ).count()
+            qtd = ContadoresPendencias.itens_ruptura()
             if qtd > 0:
                 pendencias.append({
                     'label': 'Itens em Ruptura',
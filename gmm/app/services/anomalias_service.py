@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from app.extensions import db
+from app.models.models import Unidade
+from app.models.estoque_models import Equipamento, OrdemServico
+from app.utils.estatisticas import z_robustos, tendencia_relativa
+from app.utils.sql_tempo import horas_entre
+
+
+class AnomaliasService:
+    """
+    Detector de anomalias do parque de equipamentos ativos, em duas consultas
+    qualquer que seja o número de equipamentos:
+
+    1. resumo agrupado por equipamento: última OS concluída e corretivas na janela;
+    2. intervalos entre falhas (LAG sobre as corretivas de cada equipamento).
+
+    Sobre esse resumo, numa passada:
+    - sem_manutencao: nenhuma OS concluída há mais de DIAS_SEM_MANUTENCAO dias;
+    - taxa_falhas: corretivas por 30 dias de operação com z-score robusto
+      (mediana/MAD) >= Z_LIMITE dentro da categoria do equipamento (ou do
+      parque todo, se a categoria tiver menos de MIN_GRUPO equipamentos);
+    - mtbf_em_queda: intervalos entre falhas encurtando ao longo da janela
+      (tendência linear <= TENDENCIA_LIMITE da média).
+    """
+
+    JANELA_DIAS = 365
+    DIAS_SEM_MANUTENCAO = 30
+    Z_LIMITE = 3.5
+    MIN_GRUPO = 5
+    MIN_CORRETIVAS = 3
+    MIN_INTERVALOS = 4
+    TENDENCIA_LIMITE = -0.5
+
+    @staticmethod
+    def _resumo(desde):
+        ordens = db.session.query(
+            OrdemServico.equipamento_id.label('equipamento_id'),
+            func.max(case((OrdemServico.status == 'concluida', OrdemServico.data_conclusao))).label('ultima'),
+            func.sum(case(
+                ((OrdemServico.tipo_manutencao == 'corretiva') & (OrdemServico.data_abertura >= desde), 1),
+                else_=0,
+            )).label('corretivas'),
+        ).filter(OrdemServico.equipamento_id.isnot(None)).group_by(OrdemServico.equipamento_id).subquery()
+
+        return db.session.query(
+            Equipamento.id, Equipamento.nome, Equipamento.categoria, Unidade.nome, Equipamento.created_at,
+            ordens.c.ultima, ordens.c.corretivas,
+        ).outerjoin(ordens, ordens.c.equipamento_id == Equipamento.id)\
+         .outerjoin(Unidade, Unidade.id == Equipamento.unidade_id)\
+         .filter(Equipamento.ativo == True).all()
+
+    @staticmethod
+    def _intervalos(desde) -> dict:
+        """equipamento_id -> intervalos entre corretivas consecutivas (horas), em ordem cronológica."""
+        anterior = func.lag(OrdemServico.data_abertura).over(
+            partition_by=OrdemServico.equipamento_id,
+            order_by=(OrdemServico.data_abertura, OrdemServico.id),
+        )
+        falhas = db.session.query(
+            OrdemServico.id.label('id'),
+            OrdemServico.equipamento_id.label('equipamento_id'),
+            OrdemServico.data_abertura.label('aberta_em'),
+            anterior.label('anterior'),
+        ).filter(
+            OrdemServico.equipamento_id.isnot(None),
+            OrdemServico.tipo_manutencao == 'corretiva',
+            OrdemServico.data_abertura >= desde,
+        ).subquery()
+
+        intervalos = {}
+        for equipamento_id, horas in db.session.query(
+            falhas.c.equipamento_id, horas_entre(falhas.c.anterior, falhas.c.aberta_em)
+        ).filter(falhas.c.anterior.isnot(None)).order_by(falhas.c.equipamento_id, falhas.c.aberta_em, falhas.c.id):
+            intervalos.setdefault(equipamento_id, []).append(float(horas))
+        return intervalos
+
+    @classmethod
+    def detectar(cls, agora=None) -> dict:
+        """
+        Anomalias dos equipamentos ativos. Chaves: analisados, sem_manutencao,
+        taxa_falhas e mtbf_em_queda (listas de dicts com id, nome, categoria,
+        unidade e as métricas do critério).
+        """
+        agora = agora or datetime.utcnow()
+        desde = agora - timedelta(days=cls.JANELA_DIAS)
+        limite_manutencao = agora - timedelta(days=cls.DIAS_SEM_MANUTENCAO)
+        intervalos = cls._intervalos(desde)
+
+        equipamentos, taxas_por_categoria = [], {}  # (base, corretivas, taxa) e categoria -> índices
+        sem_manutencao, mtbf_em_queda = [], []
+        for id_, nome, categoria, unidade, criado_em, ultima, corretivas in cls._resumo(desde):
+            base = {'id': id_, 'nome': nome, 'categoria': categoria, 'unidade': unidade or 'Sem unidade'}
+
+            if ultima is None or ultima < limite_manutencao:
+                sem_manutencao.append({**base, 'dias': (agora - ultima).days if ultima else None})
+
+            # Corretivas por 30 dias de operação na janela (mínimo de 30 dias de exposição)
+            inicio = max(desde, criado_em) if criado_em else desde
+            exposicao = max(30.0, (agora - inicio).total_seconds() / 86400)
+            corretivas = int(corretivas or 0)
+            equipamentos.append((base, corretivas, corretivas * 30 / exposicao))
+            taxas_por_categoria.setdefault(categoria, []).append(len(equipamentos) - 1)
+
+            serie = intervalos.get(id_, [])
+            if len(serie) >= cls.MIN_INTERVALOS:
+                tendencia = tendencia_relativa(serie)
+                if tendencia <= cls.TENDENCIA_LIMITE:
+                    mtbf_em_queda.append({
+                        **base,
+                        'mtbf_dias': round(sum(serie) / len(serie) / 24, 1),
+                        'ultimo_intervalo_dias': round(serie[-1] / 24, 1),
+                        'tendencia': round(tendencia, 2),
+                    })
+
+        # z por categoria; categorias pequenas demais para ter referência própria usam o parque todo
+        z = [0.0] * len(equipamentos)
+        z_parque = z_robustos([taxa for _, _, taxa in equipamentos]) if len(equipamentos) >= cls.MIN_GRUPO else z
+        for indices in taxas_por_categoria.values():
+            if len(indices) >= cls.MIN_GRUPO:
+                for i, z_i in zip(indices, z_robustos([equipamentos[i][2] for i in indices])):
+                    z[i] = z_i
+            else:
+                for i in indices:
+                    z[i] = z_parque[i]
+
+        taxa_falhas = [
+            {**base, 'corretivas': corretivas, 'taxa_30d': round(taxa, 2), 'z': round(z_i, 1)}
+            for (base, corretivas, taxa), z_i in zip(equipamentos, z)
+            if z_i >= cls.Z_LIMITE and corretivas >= cls.MIN_CORRETIVAS
+        ]
+
+        sem_manutencao.sort(key=lambda a: (a['dias'] is not None, -(a['dias'] or 0)))
+        taxa_falhas.sort(key=lambda a: -a['z'])
+        mtbf_em_queda.sort(key=lambda a: a['tendencia'])
+        return {
+            'analisados': len(equipamentos),
+            'sem_manutencao': sem_manutencao,
+            'taxa_falhas': taxa_falhas,
+            'mtbf_em_queda': mtbf_em_queda,
+        }
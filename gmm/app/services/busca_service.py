@@ -0,0 +1,284 @@
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam, event, inspect, select, text
+from app.extensions import db
+from app.models.busca_models import BuscaIndice, sqlite_tem_fts_trigram
+from app.models.models import Usuario, Unidade
+from app.models.estoque_models import OrdemServico, Equipamento, Estoque, Fornecedor
+from app.models.terceirizados_models import Terceirizado
+from app.utils.texto import sem_acentos
+
+logger = logging.getLogger(__name__)
+
+
+def _cortar(valor, tamanho=255):
+    valor = valor or ''
+    return valor if len(valor) <= tamanho else valor[:tamanho - 3] + '...'
+
+
+# ── documentos por entidade ────────────────────────────────────────────────
+# Cada função recebe o registro (objeto ORM ou linha) e os nomes relacionados
+# já resolvidos, e devolve (titulo, subtitulo, campos pesquisáveis).
+
+def _doc_os(os_, equipamento=None):
+    return (
+        f'OS #{os_.numero_os} - {equipamento or "Geral"}',
+        f'{(os_.descricao_problema or "")[:50]}...',
+        (os_.numero_os, os_.descricao_problema, os_.descricao_solucao, equipamento),
+    )
+
+
+def _doc_equipamento(e, unidade=None):
+    return (e.nome, f'Categoria: {e.categoria} | Unidade: {unidade or "-"}', (e.nome, e.categoria))
+
+
+def _doc_peca(p, _relacionado=None):
+    # O saldo é lido ao vivo na consulta (muda a cada movimentação, fora do ORM)
+    return (f'{p.nome} ({p.codigo})', None, (p.nome, p.codigo))
+
+
+def _doc_fornecedor(f, _relacionado=None):
+    return (f.nome, f'Fornecedor | {f.email}', (f.nome, f.email))
+
+
+def _doc_terceirizado(t, _relacionado=None):
+    especialidades = t.especialidades[:30] if t.especialidades else 'Geral'
+    return (t.nome_empresa or t.nome, f'Terceirizado | {especialidades}', (t.nome, t.nome_empresa, t.especialidades))
+
+
+def _doc_usuario(u, _relacionado=None):
+    return (u.nome, f'{(u.tipo or "").capitalize()} | {u.email}', (u.nome,))
+
+
+class BuscaService:
+    """
+    Busca global sobre o índice unificado `busca_indice`.
+
+    Uma única consulta devolve os resultados de todas as entidades, ordenados
+    por relevância e limitados por categoria (ROW_NUMBER por entidade). O
+    casamento é por substring sem acentos, como o ILIKE anterior:
+      - SQLite: FTS5 com tokenizador trigram (termos com 3+ caracteres) e bm25;
+      - Postgres: LIKE apoiado no índice GIN pg_trgm, ranqueado por
+        similarity() + ts_rank();
+      - demais casos: LIKE simples na tabela de índice.
+    """
+
+    # entidade -> (modelo, função do documento, campos que alteram o documento,
+    #              (modelo relacionado, coluna de chave no registro)) | None)
+    ENTIDADES = {
+        'os': (OrdemServico, _doc_os, ('numero_os', 'descricao_problema', 'descricao_solucao', 'equipamento_id'),
+               (Equipamento, 'equipamento_id')),
+        'equipamento': (Equipamento, _doc_equipamento, ('nome', 'categoria', 'unidade_id'), (Unidade, 'unidade_id')),
+        'peca': (Estoque, _doc_peca, ('nome', 'codigo'), None),
+        'fornecedor': (Fornecedor, _doc_fornecedor, ('nome', 'email'), None),
+        'terceirizado': (Terceirizado, _doc_terceirizado, ('nome', 'nome_empresa', 'especialidades'), None),
+        'usuario': (Usuario, _doc_usuario, ('nome', 'tipo', 'email'), None),
+    }
+
+    # Resultados por categoria (mesmos limites da busca anterior)
+    LIMITES = {'os': 5, 'equipamento': 5, 'peca': 5, 'fornecedor': 3, 'terceirizado': 3, 'usuario': 3}
+
+    TAMANHO_MINIMO_TRIGRAMA = 3
+    # Documentos mais recentes ranqueados por entidade (termos muito comuns casam com quase tudo)
+    MAX_CANDIDATOS = 200
+    _modo_por_url = {}
+
+    @classmethod
+    def documento(cls, entidade, registro, relacionado=None) -> dict:
+        _modelo, montar, _campos, _rel = cls.ENTIDADES[entidade]
+        titulo, subtitulo, campos = montar(registro, relacionado)
+        return {
+            'entidade': entidade,
+            'entidade_id': registro.id,
+            'titulo': _cortar(titulo),
+            'subtitulo': _cortar(subtitulo) if subtitulo else None,
+            'texto': sem_acentos(' '.join(str(c) for c in campos if c)),
+            'atualizado_em': datetime.utcnow(),
+        }
+
+    @classmethod
+    def reindexar(cls, connection=None, lote=5000) -> int:
+        """Reconstrói o índice inteiro a partir das tabelas de origem (carga inicial / reparo)."""
+        connection = connection or db.session.connection()
+        tabela = BuscaIndice.__table__
+        connection.execute(tabela.delete())
+        total = 0
+        for entidade, (modelo, _montar, _campos, relacionado) in cls.ENTIDADES.items():
+            nomes = {}
+            if relacionado:
+                rel_modelo = relacionado[0]
+                nomes = dict(connection.execute(select(rel_modelo.id, rel_modelo.nome)).all())
+            resultado = connection.execute(select(modelo.__table__)).yield_per(lote)
+            for linhas in resultado.partitions():
+                documentos = [
+                    cls.documento(entidade, r, nomes.get(getattr(r, relacionado[1])) if relacionado else None)
+                    for r in linhas
+                ]
+                connection.execute(tabela.insert(), documentos)
+                total += len(documentos)
+        logger.info("busca_indice reconstruído: %s documentos", total)
+        return total
+
+    # ── consulta ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _modo(cls):
+        engine = db.engine
+        modo = cls._modo_por_url.get(str(engine.url))
+        if modo is None:
+            if engine.dialect.name == 'postgresql':
+                modo = 'postgres'
+            elif engine.dialect.name == 'sqlite':
+                with engine.connect() as conexao:
+                    modo = 'fts5' if sqlite_tem_fts_trigram(conexao) else 'like'
+            else:
+                modo = 'like'
+            cls._modo_por_url[str(engine.url)] = modo
+        return modo
+
+    @staticmethod
+    def _escapar_like(termo):
+        return '%' + termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    @classmethod
+    def _candidatos(cls, modo, termos, consulta, params):
+        """
+        SQL que devolve (id, score) dos documentos de uma entidade (:entidade_N)
+        que contêm todos os termos; maior score = melhor. O template é repetido
+        por entidade e só os documentos mais recentes (maior id) são ranqueados.
+        """
+        longos = [t for t in termos if len(t) >= cls.TAMANHO_MINIMO_TRIGRAMA]
+        likes = []
+        for n, termo in enumerate(termos if modo != 'fts5' or not longos else
+                                  [t for t in termos if t not in longos]):
+            params[f'termo_{n}'] = cls._escapar_like(termo)
+            likes.append(f"b.texto LIKE :termo_{n} ESCAPE '\\'")
+
+        if modo == 'fts5' and longos:
+            # rank = bm25() do FTS5 (menor é melhor), calculado só para as linhas devolvidas.
+            # O "+" em b.entidade impede o planner de trocar o FTS pelo índice de entidade.
+            params['fts'] = ' AND '.join('"{}"'.format(t.replace('"', '""')) for t in longos)
+            filtro = ''.join(f' AND {l}' for l in likes)
+            return ("SELECT busca_fts.rowid AS id, -busca_fts.rank AS score FROM busca_fts "
+                    "JOIN busca_indice b ON b.id = busca_fts.rowid "
+                    f"WHERE busca_fts MATCH :fts AND +b.entidade = :{{entidade}}{filtro} "
+                    "ORDER BY busca_fts.rowid DESC LIMIT :max_candidatos")
+
+        params['consulta'] = consulta
+        if modo == 'postgres':
+            score = ("similarity(b.texto, :consulta) + "
+                     "ts_rank(to_tsvector('simple', b.texto), plainto_tsquery('simple', :consulta))")
+        else:
+            score = "-instr(b.texto, :consulta)"
+        return (f"SELECT b.id AS id, {score} AS score FROM busca_indice b "
+                f"WHERE b.entidade = :{{entidade}} AND {' AND '.join(likes)} "
+                "ORDER BY b.id DESC LIMIT :max_candidatos")
+
+    @classmethod
+    def buscar(cls, q: str) -> list:
+        """
+        Resultados ranqueados de todas as entidades numa única consulta.
+        Cada item: entidade, entidade_id, titulo, subtitulo (+ saldo e
+        unidade_medida ao vivo para peças).
+        """
+        consulta = ' '.join(sem_acentos(q).split())
+        termos = list(dict.fromkeys(consulta.split()))
+        if not termos:
+            return []
+
+        params = {'max_candidatos': cls.MAX_CANDIDATOS}
+        modelo = cls._candidatos(cls._modo(), termos, consulta, params)
+        ramos = []
+        for n, entidade in enumerate(cls.LIMITES):
+            params[f'entidade_{n}'] = entidade
+            ramos.append(f"SELECT * FROM ({modelo.format(entidade=f'entidade_{n}')}) c{n}")
+        if consulta.isdigit():
+            # Número digitado: a OS com esse id vem primeiro
+            params['os_id'] = int(consulta)
+            ramos.append("SELECT b.id AS id, 1000000 AS score FROM busca_indice b "
+                         "WHERE b.entidade = 'os' AND b.entidade_id = :os_id")
+        candidatos = ' UNION ALL '.join(ramos)
+
+        limites = ' '.join(f"WHEN '{entidade}' THEN {limite}" for entidade, limite in cls.LIMITES.items())
+        sql = f"""
+            WITH candidatos AS (
+                SELECT id, MAX(score) AS score FROM ({candidatos}) c GROUP BY id
+            ), ranqueados AS (
+                SELECT b.entidade, b.entidade_id, b.titulo, b.subtitulo, c.score,
+                       ROW_NUMBER() OVER (PARTITION BY b.entidade ORDER BY c.score DESC, b.id) AS posicao
+                FROM candidatos c JOIN busca_indice b ON b.id = c.id
+            )
+            SELECT r.entidade, r.entidade_id, r.titulo, r.subtitulo,
+                   e.quantidade_atual AS saldo, e.unidade_medida
+            FROM ranqueados r
+            LEFT JOIN estoque e ON r.entidade = 'peca' AND e.id = r.entidade_id
+            WHERE r.posicao <= CASE r.entidade {limites} ELSE 0 END
+            ORDER BY r.score DESC, r.entidade, r.posicao
+        """
+        return [dict(linha._mapping) for linha in db.session.execute(text(sql), params)]
+
+
+# ── sincronização via eventos do ORM ───────────────────────────────────────
+
+def _sincronizar(entidade):
+    modelo, _montar, campos, relacionado = BuscaService.ENTIDADES[entidade]
+    tabela = BuscaIndice.__table__
+
+    def _remover(connection, target):
+        connection.execute(tabela.delete().where(
+            tabela.c.entidade == entidade, tabela.c.entidade_id == target.id))
+
+    def _gravar(mapper, connection, target):
+        nome_relacionado = None
+        if relacionado:
+            rel_modelo, chave = relacionado
+            valor = getattr(target, chave)
+            if valor is not None:
+                nome_relacionado = connection.execute(
+                    select(rel_modelo.nome).where(rel_modelo.id == valor)).scalar()
+        _remover(connection, target)
+        connection.execute(tabela.insert(), [BuscaService.documento(entidade, target, nome_relacionado)])
+
+    def _ao_atualizar(mapper, connection, target):
+        estado = inspect(target)
+        if any(estado.attrs[c].history.has_changes() for c in campos):
+            _gravar(mapper, connection, target)
+
+    event.listen(modelo, 'after_insert', _gravar)
+    event.listen(modelo, 'after_update', _ao_atualizar)
+    event.listen(modelo, 'after_delete', lambda mapper, connection, target: _remover(connection, target))
+
+
+def _sincronizar_dependentes(entidade):
+    """
+    Documentos que embutem o nome de outro registro (OS -> equipamento,
+    equipamento -> unidade) são reescritos na mesma transação quando esse
+    nome muda.
+    """
+    modelo, _montar, _campos, (rel_modelo, chave) = BuscaService.ENTIDADES[entidade]
+    tabela = BuscaIndice.__table__
+    origem = modelo.__table__
+
+    def _ao_renomear(mapper, connection, target):
+        if not inspect(target).attrs.nome.history.has_changes():
+            return
+        documentos = []
+        for r in connection.execute(select(origem).where(origem.c[chave] == target.id)):
+            documento = BuscaService.documento(entidade, r, target.nome)
+            del documento['entidade']
+            documento['b_id'] = documento.pop('entidade_id')
+            documentos.append(documento)
+        if documentos:
+            # UPDATE mantém o id do documento (ordem de recência usada na busca)
+            connection.execute(
+                tabela.update().where(tabela.c.entidade == entidade, tabela.c.entidade_id == bindparam('b_id')),
+                documentos,
+            )
+
+    event.listen(rel_modelo, 'after_update', _ao_renomear)
+
+
+for _entidade, (_modelo, _montar, _campos, _relacionado) in BuscaService.ENTIDADES.items():
+    _sincronizar(_entidade)
+    if _relacionado:
+        _sincronizar_dependentes(_entidade)
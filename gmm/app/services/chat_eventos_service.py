@@ -0,0 +1,195 @@
+import json
+import os
+import queue
+import threading
+import time
+import logging
+import redis
+from flask import has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.models.terceirizados_models import HistoricoNotificacao
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class ChatEventosService:
+    """
+    Canal de push das telas de chat (central de chat e Central de Mensagens).
+
+    Toda gravação de HistoricoNotificacao confirmada (webhook, envio, tasks do
+    Celery) publica um evento pequeno no canal Redis CANAL, depois do commit:
+    'mensagem' (nova), 'status' (status_envio: entregue/lido/falhou), 'leitura'
+    (status_leitura) e 'atualizada' (mídia baixada, transcrição, exclusão).
+    O evento só identifica a conversa; o navegador busca o delta.
+
+    Cada processo web mantém uma única assinatura do canal (thread daemon) e
+    repassa os eventos às filas das conexões SSE abertas, em vez de uma
+    conexão Redis por navegador.
+    """
+
+    CANAL = 'gmm:chat:eventos'
+    HEARTBEAT = 15          # segundos entre comentários de keep-alive
+    DURACAO_MAXIMA = 300    # o navegador reconecta sozinho (EventSource)
+    RETRY_MS = 3000
+    TAMANHO_FILA = 200
+
+    # Colunas que geram evento em updates, e o tipo correspondente
+    CAMPOS_EVENTO = (
+        ('status_envio', 'status'),
+        ('status_leitura', 'leitura'),
+        ('url_midia_local', 'atualizada'),
+        ('mensagem_transcrita', 'atualizada'),
+        ('excluido_em', 'atualizada'),
+    )
+
+    _lock = threading.Lock()
+    _filas = set()
+    _ouvinte = None
+    _ouvinte_pid = None
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @staticmethod
+    def evento(tipo, msg) -> dict:
+        return {
+            'tipo': tipo,
+            'id': msg.id,
+            'telefone': msg.telefone_contato,
+            'chamado_id': msg.chamado_id,
+            'direcao': msg.direcao,
+            'status': msg.status_envio,
+            'excluido': msg.excluido_em is not None,
+        }
+
+    @staticmethod
+    def acumular(sessao, evento):
+        """Guarda o evento na sessão; é publicado no commit e descartado no rollback."""
+        sessao.info.setdefault('eventos_chat', []).append(evento)
+
+    @classmethod
+    def publicar(cls, eventos):
+        if not eventos or not has_app_context():
+            return
+        try:
+            cliente = cls._get_redis()
+            for evento in eventos:
+                cliente.publish(cls.CANAL, json.dumps(evento))
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: eventos do chat não publicados (telas seguem no polling).")
+
+    # ── fan-out no processo web ─────────────────────────────────────────────
+
+    @classmethod
+    def _distribuir(cls, dados):
+        with cls._lock:
+            filas = list(cls._filas)
+        for fila in filas:
+            try:
+                fila.put_nowait(dados)
+            except queue.Full:
+                pass  # conexão lenta: perde o evento, o polling de segurança cobre
+
+    @classmethod
+    def _ouvir(cls, cliente):
+        while True:
+            try:
+                assinatura = cliente.pubsub(ignore_subscribe_messages=True)
+                assinatura.subscribe(cls.CANAL)
+                while True:
+                    # get_message com timeout próprio: o socket_timeout curto do pool não derruba a assinatura
+                    mensagem = assinatura.get_message(timeout=cls.HEARTBEAT)
+                    if mensagem is not None:
+                        dados = mensagem['data']
+                        cls._distribuir(dados.decode() if isinstance(dados, bytes) else dados)
+            except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+                logger.warning("Redis Unavailable: assinatura dos eventos do chat, tentando de novo.")
+                time.sleep(5)
+
+    @classmethod
+    def _garantir_ouvinte(cls):
+        # Após um fork a thread não existe no processo filho: recria
+        if cls._ouvinte is not None and cls._ouvinte_pid == os.getpid() and cls._ouvinte.is_alive():
+            return
+        with cls._lock:
+            if cls._ouvinte is not None and cls._ouvinte_pid == os.getpid() and cls._ouvinte.is_alive():
+                return
+            if cls._ouvinte_pid != os.getpid():
+                cls._filas = set()
+            cls._ouvinte = threading.Thread(target=cls._ouvir, args=(cls._get_redis(),),
+                                            name='chat-eventos', daemon=True)
+            cls._ouvinte_pid = os.getpid()
+            cls._ouvinte.start()
+
+    @classmethod
+    def disponivel(cls) -> bool:
+        try:
+            cls._get_redis().ping()
+            return True
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: push do chat desligado, telas seguem no polling.")
+            return False
+
+    @classmethod
+    def stream(cls, filtro=None):
+        """
+        Gerador SSE. `filtro(evento)` decide o que a conexão recebe (permissão
+        ou conversa); sem filtro recebe tudo. Sem Redis envia só o evento
+        'indisponivel' e encerra: o navegador continua no polling.
+        """
+        if not cls.disponivel():
+            yield "event: indisponivel\ndata: {}\n\n"
+            return
+        cls._garantir_ouvinte()
+        fila = queue.Queue(maxsize=cls.TAMANHO_FILA)
+        with cls._lock:
+            cls._filas.add(fila)
+        try:
+            yield f"retry: {cls.RETRY_MS}\n\n"
+            fim = time.monotonic() + cls.DURACAO_MAXIMA
+            while time.monotonic() < fim:
+                try:
+                    dados = fila.get(timeout=cls.HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                evento = json.loads(dados)
+                if filtro is None or filtro(evento):
+                    yield f"event: {evento['tipo']}\ndata: {dados}\n\n"
+        finally:
+            with cls._lock:
+                cls._filas.discard(fila)
+
+
+# ── eventos do ORM: acumulados na sessão e publicados após o commit ─────────
+
+def _acumular(target, tipo):
+    sessao = inspect(target).session
+    if sessao is not None:
+        ChatEventosService.acumular(sessao, ChatEventosService.evento(tipo, target))
+
+
+@event.listens_for(HistoricoNotificacao, 'after_insert')
+def _mensagem_nova(mapper, connection, target):
+    _acumular(target, 'mensagem')
+
+
+@event.listens_for(HistoricoNotificacao, 'after_update')
+def _mensagem_alterada(mapper, connection, target):
+    estado = inspect(target)
+    tipos = {tipo for campo, tipo in ChatEventosService.CAMPOS_EVENTO if estado.attrs[campo].history.has_changes()}
+    for tipo in sorted(tipos):
+        _acumular(target, tipo)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publicar_eventos(session):
+    ChatEventosService.publicar(session.info.pop('eventos_chat', None))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_eventos(session):
+    session.info.pop('eventos_chat', None)
@@ -1,6 +1,7 @@
 import time
 import redis
 from flask import current_app
+from app.utils.redis_client import get_redis
 
 class CircuitBreaker:
     """
@@ -14,9 +15,22 @@ class CircuitBreaker:
     THRESHOLD = 5
     TIMEOUT = 600 # 10 minutes in seconds
 
+    # KEYS: failures, state, opened_at | ARGV: failures TTL, threshold, now, opened_at TTL
+    _LUA_FAILURE = """
+    local failures = redis.call('INCR', KEYS[1])
+    if failures == 1 then
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+    end
+    if failures >= tonumber(ARGV[2]) then
+        redis.call('SET', KEYS[2], 'OPEN')
+        redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[4])
+    end
+    return failures
+    """
+
     @staticmethod
     def _get_redis():
-        return redis.from_url(current_app.config.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+        return get_redis()
 
     @staticmethod
     def get_state() -> str:
@@ -46,10 +60,10 @@ class CircuitBreaker:
     def record_success():
         """Resets failures and returns state to CLOSED"""
         try:
-            r = CircuitBreaker._get_redis()
-            r.set('whatsapp:cb:state', 'CLOSED')
-            r.delete('whatsapp:cb:failures')
-            r.delete('whatsapp:cb:opened_at')
+            pipe = CircuitBreaker._get_redis().pipeline()
+            pipe.set('whatsapp:cb:state', 'CLOSED')
+            pipe.delete('whatsapp:cb:failures', 'whatsapp:cb:opened_at')
+            pipe.execute()
         except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
              current_app.logger.warning("Redis Unavailable: could not record success in CircuitBreaker.")
 
@@ -58,16 +72,14 @@ class CircuitBreaker:
         """Increments failure count and opens circuit if threshold reached"""
         try:
             r = CircuitBreaker._get_redis()
-            failures = r.incr('whatsapp:cb:failures')
-            
-            # Set expiry for failure counter if first failure
-            if failures == 1:
-                r.expire('whatsapp:cb:failures', 300) # 5 minutes TTL
-                
+            # Single round trip: increment, TTL on first failure and OPEN transition are atomic
+            failures = r.eval(
+                CircuitBreaker._LUA_FAILURE, 3,
+                'whatsapp:cb:failures', 'whatsapp:cb:state', 'whatsapp:cb:opened_at',
+                300, CircuitBreaker.THRESHOLD, time.time(), CircuitBreaker.TIMEOUT + 60
+            )
+
             if failures >= CircuitBreaker.THRESHOLD:
-                r.set('whatsapp:cb:state', 'OPEN')
-                r.set('whatsapp:cb:opened_at', time.time())
-                r.expire('whatsapp:cb:opened_at', CircuitBreaker.TIMEOUT + 60) # Buffer
                 # Log critical event
                 current_app.logger.critical("WhatsApp Circuit Breaker is now OPEN (Threshold reached).")
         except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
@@ -0,0 +1,116 @@
+import json
+import logging
+import redis
+from sqlalchemy import func
+from app.extensions import db
+from app.models.estoque_models import PedidoCompra, OrdemServico, Estoque, MovimentacaoEstoque
+from app.utils.cache_local import CacheVersionado, invalidar_apos_commit
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class ContadoresPendencias:
+    """
+    Contadores de pendências do sidebar e dos cards do BI (pedidos por status,
+    OS abertas por unidade, itens em ruptura), sem queries por página.
+
+    Os números ficam em memória em cada worker (CacheVersionado) e num
+    snapshot compartilhado no Redis, gravado sob a versão atual do cache: o
+    primeiro worker a recalcular grava, os demais só leem. Commits que mudam o
+    status de pedidos/OS ou o saldo das peças incrementam a versão (eventos do
+    ORM); o TTL curto cobre alterações feitas fora do ORM.
+    """
+
+    CHAVE_SNAPSHOT = 'gmm:pendencias:v{versao}'
+    TTL = 60
+    STATUS_PEDIDOS = ('solicitado', 'aguardando_diretoria', 'aprovado')
+
+    _cache = None
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @classmethod
+    def _calcular(cls) -> dict:
+        pedidos = dict(
+            db.session.query(PedidoCompra.status, func.count(PedidoCompra.id))
+            .filter(PedidoCompra.status.in_(cls.STATUS_PEDIDOS))
+            .group_by(PedidoCompra.status).all()
+        )
+        os_abertas = dict(
+            db.session.query(OrdemServico.unidade_id, func.count(OrdemServico.id))
+            .filter(OrdemServico.status == 'aberta')
+            .group_by(OrdemServico.unidade_id).all()
+        )
+        ruptura = db.session.query(func.count(Estoque.id)).filter(
+            Estoque.quantidade_atual <= Estoque.quantidade_minima
+        ).scalar()
+        return {
+            'pedidos': {status: pedidos.get(status, 0) for status in cls.STATUS_PEDIDOS},
+            # Chaves em texto para o snapshot JSON ('None' = OS sem unidade)
+            'os_abertas': {str(unidade_id): qtd for unidade_id, qtd in os_abertas.items()},
+            'ruptura': ruptura or 0,
+        }
+
+    @classmethod
+    def _carregar(cls) -> dict:
+        """Snapshot do Redis para a versão atual; recalcula e grava se não houver."""
+        try:
+            cliente = cls._get_redis()
+            chave = cls.CHAVE_SNAPSHOT.format(versao=int(cliente.get(cls._cache.chave_versao) or 0))
+            snapshot = cliente.get(chave)
+            if snapshot:
+                return json.loads(snapshot)
+            contadores = cls._calcular()
+            cliente.set(chave, json.dumps(contadores), ex=cls.TTL)
+            return contadores
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: contadores de pendências calculados apenas neste processo.")
+            return cls._calcular()
+
+    @classmethod
+    def obter(cls) -> dict:
+        return cls._cache.obter()
+
+    # ── contadores por perfil ───────────────────────────────────────────────
+
+    @classmethod
+    def pedidos_para_aprovar(cls, tipo) -> int:
+        """Gerente aprova os 'solicitado'; admin/diretor também os que aguardam a diretoria."""
+        pedidos = cls.obter()['pedidos']
+        if tipo == 'gerente':
+            return pedidos['solicitado']
+        return pedidos['solicitado'] + pedidos['aguardando_diretoria']
+
+    @classmethod
+    def fila_compras(cls) -> int:
+        return cls.obter()['pedidos']['aprovado']
+
+    @classmethod
+    def os_abertas(cls, unidade_id=None) -> int:
+        por_unidade = cls.obter()['os_abertas']
+        if unidade_id is None:
+            return sum(por_unidade.values())
+        return por_unidade.get(str(unidade_id), 0)
+
+    @classmethod
+    def itens_ruptura(cls) -> int:
+        return cls.obter()['ruptura']
+
+    @classmethod
+    def sidebar(cls, user) -> int:
+        """Badge de pendências do menu (admin/diretor/gerente)."""
+        if user.tipo not in ['admin', 'diretor', 'gerente']:
+            return 0
+        return cls.pedidos_para_aprovar(user.tipo)
+
+
+ContadoresPendencias._cache = CacheVersionado(
+    'pendencias', lambda: ContadoresPendencias._carregar(), ttl=ContadoresPendencias.TTL)
+invalidar_apos_commit(ContadoresPendencias._cache, PedidoCompra, campos=('status',))
+invalidar_apos_commit(ContadoresPendencias._cache, OrdemServico, campos=('status', 'unidade_id'))
+invalidar_apos_commit(ContadoresPendencias._cache, Estoque, campos=('quantidade_atual', 'quantidade_minima'))
+# A movimentação altera Estoque.quantidade_atual via Core (atualizar_saldo_estoque), sem evento do ORM
+invalidar_apos_commit(ContadoresPendencias._cache, MovimentacaoEstoque)
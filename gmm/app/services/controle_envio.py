@@ -0,0 +1,83 @@
+import time
+import logging
+import redis
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class ControleEnvio:
+    """
+    Checagem de envio outbound em um único round trip ao Redis.
+
+    Um script Lua lê o estado do Circuit Breaker (com a transição OPEN → HALF_OPEN)
+    e consome atomicamente um token do Rate Limiter (token bucket), substituindo
+    as chamadas separadas get_state + check_limit. Também informa se o circuito
+    está "limpo" (CLOSED e sem falhas), caso em que o record_success após um
+    envio bem-sucedido pode ser pulado.
+    """
+
+    # KEYS: estado, falhas, aberto_em, balde do rate limit
+    # ARGV: agora, timeout do circuito, taxa/s, capacidade, reserva da faixa, ignorar_limite (0/1), custo
+    _LUA = RateLimiter.LUA_BALDE + """
+    local estado = redis.call('GET', KEYS[1]) or 'CLOSED'
+    local falhas = tonumber(redis.call('GET', KEYS[2]) or '0')
+
+    if estado == 'OPEN' then
+        local aberto_em = tonumber(redis.call('GET', KEYS[3]) or '0')
+        if tonumber(ARGV[1]) - aberto_em >= tonumber(ARGV[2]) then
+            redis.call('SET', KEYS[1], 'HALF_OPEN')
+            estado = 'HALF_OPEN'
+        else
+            return {estado, 0, 0, falhas, 0}
+        end
+    end
+
+    local balde = consumir_balde(KEYS[4], tonumber(ARGV[1]), tonumber(ARGV[3]), tonumber(ARGV[4]),
+                                 tonumber(ARGV[5]), tonumber(ARGV[7]), tonumber(ARGV[6]))
+    return {estado, balde[1], balde[2], falhas, balde[3]}
+    """
+
+    _script = None
+    _script_cliente = None
+
+    @classmethod
+    def _get_script(cls, r):
+        # Script registrado uma vez por cliente (EVALSHA, com fallback automático para EVAL)
+        if cls._script is None or cls._script_cliente is not r:
+            cls._script = r.register_script(cls._LUA)
+            cls._script_cliente = r
+        return cls._script
+
+    @classmethod
+    def autorizar(cls, prioridade: int = 0, ignorar_limite: bool = False, token_reservado: bool = False) -> dict:
+        """
+        Verifica circuito e limite, consumindo o token se o envio for permitido.
+        prioridade: faixa do token bucket (urgente >= 2 consome mas não é barrado).
+        ignorar_limite: envios interativos, tratados como urgentes.
+        token_reservado: o despachante da FilaEnvio já consumiu o token; só o circuito é checado.
+
+        Returns: {'estado', 'permitido', 'restantes', 'espera', 'limpo'} — espera em segundos
+        """
+        taxa, capacidade, reserva, ignorar = RateLimiter.parametros(prioridade, ignorar_limite or token_reservado)
+        custo = 0 if token_reservado else 1
+        try:
+            r = CircuitBreaker._get_redis()
+            estado, permitido, restantes, falhas, espera_ms = cls._get_script(r)(
+                keys=['whatsapp:cb:state', 'whatsapp:cb:failures', 'whatsapp:cb:opened_at', RateLimiter.CHAVE],
+                args=[time.time(), CircuitBreaker.TIMEOUT, taxa, capacidade, reserva, ignorar, custo],
+            )
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: envio liberado sem Circuit Breaker/Rate Limiter.")
+            return {'estado': 'CLOSED', 'permitido': True, 'restantes': int(capacidade), 'espera': 0.0,
+                    'limpo': True}
+
+        estado = estado.decode() if isinstance(estado, bytes) else estado
+        return {
+            'estado': estado,
+            'permitido': bool(permitido),
+            'restantes': int(restantes),
+            'espera': espera_ms / 1000,
+            'limpo': estado == 'CLOSED' and not falhas,
+        }
@@ -0,0 +1,366 @@
+import logging
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import event, inspect, select, update, delete, func, case, literal, or_
+from app.extensions import db
+from app.models.models import Usuario
+from app.models.estoque_models import Fornecedor
+from app.models.terceirizados_models import Terceirizado, HistoricoNotificacao
+from app.models.whatsapp_models import Conversa
+from app.services.whatsapp_service import WhatsAppService
+from app.services.chat_eventos_service import ChatEventosService
+
+logger = logging.getLogger(__name__)
+
+_IGNORADOS = ('', 'sistema')
+
+
+def _variantes(telefone):
+    """Telefone normalizado e sem o 55 (registros antigos gravados sem DDI)."""
+    if telefone.startswith('55') and len(telefone) > 11:
+        return (telefone, telefone[2:])
+    return (telefone,)
+
+
+class ConversaService:
+    """
+    Mantém a tabela `conversa` (resumo por telefone normalizado) usada pela
+    barra lateral da central de chat.
+
+    Cada HistoricoNotificacao inserido atualiza o resumo da conversa na mesma
+    transação (evento after_insert, upsert pelo telefone): prévia, horário e
+    direção da última mensagem, contador de não lidas e, na criação, o nome
+    do contato (Terceirizado, Fornecedor, Usuario ou pushName). Exclusões e
+    leituras recalculam o resumo daquele telefone. A listagem vira uma
+    consulta indexada por ultima_msg_em.
+
+    O telefone do contato de cada mensagem fica em
+    HistoricoNotificacao.telefone_contato (preenchido antes do insert), e o
+    histórico de uma conversa é paginado por cursor (criado_em, id).
+    """
+
+    LIMITE_LISTA = 50
+    LIMITE_MENSAGENS = 50
+    MAX_MENSAGENS = 200
+    TAMANHO_PREVIA = 50
+
+    # ── regras do resumo ────────────────────────────────────────────────────
+
+    @staticmethod
+    def telefone_da_mensagem(direcao, remetente, destinatario):
+        """Telefone do contato (remetente no inbound, destinatário no outbound), normalizado."""
+        bruto = remetente if direcao == 'inbound' else destinatario
+        if not bruto or bruto in _IGNORADOS:
+            return None
+        telefone = WhatsAppService.normalizar_telefone(bruto)
+        return telefone or None
+
+    @classmethod
+    def previa(cls, tipo_conteudo, mensagem, tipo, direcao) -> str:
+        tipo_conteudo = tipo_conteudo or 'text'
+        if tipo_conteudo == 'text':
+            mensagem = mensagem or ''
+            previa = mensagem[:cls.TAMANHO_PREVIA] + '...' if len(mensagem) > cls.TAMANHO_PREVIA else mensagem
+        elif tipo_conteudo == 'audio':
+            previa = '🎤 Áudio'
+        elif tipo_conteudo == 'image':
+            previa = '📷 Imagem'
+        elif tipo_conteudo == 'document':
+            previa = '📄 Documento'
+        else:
+            previa = tipo or tipo_conteudo
+
+        # Indicar direção na prévia
+        if direcao == 'outbound':
+            previa = '↗ ' + previa
+        return previa
+
+    @staticmethod
+    def _nao_lida(direcao, status_leitura):
+        return direcao == 'inbound' and status_leitura in (None, 'nao_lida')
+
+    @staticmethod
+    def _resolver_nome(connection, telefone):
+        """(nome, origem) do contato cadastrado com esse telefone, ou (None, None)."""
+        variantes = _variantes(telefone)
+        for origem, consulta in (
+            ('terceirizado', select(Terceirizado.nome).where(Terceirizado.telefone.in_(variantes))),
+            ('fornecedor', select(Fornecedor.nome).where(Fornecedor.telefone.in_(variantes))),
+            ('fornecedor', select(Fornecedor.nome).where(Fornecedor.whatsapp.in_(variantes))),
+            ('usuario', select(Usuario.nome).where(Usuario.telefone.in_(variantes))),
+        ):
+            nome = connection.execute(consulta.limit(1)).scalar()
+            if nome:
+                return nome, origem
+        return None, None
+
+    @staticmethod
+    def _upsert(connection, valores, atualizacao):
+        """INSERT ... ON CONFLICT (telefone) DO UPDATE; `atualizacao(excluded)` dá as colunas do UPDATE."""
+        tabela = Conversa.__table__
+        dialeto = connection.dialect.name
+        if dialeto in ('postgresql', 'sqlite'):
+            if dialeto == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            comando = insert(tabela).values(**valores)
+            connection.execute(comando.on_conflict_do_update(
+                index_elements=['telefone'], set_=atualizacao(comando.excluded)))
+            return
+        # Demais bancos: UPDATE e, se não havia a conversa, INSERT
+        existente = connection.execute(
+            select(tabela.c.id).where(tabela.c.telefone == valores['telefone'])).scalar()
+        if existente is None:
+            connection.execute(tabela.insert().values(**valores))
+        else:
+            # Os valores novos entram como literais no lugar da pseudo-tabela `excluded`
+            excluded = SimpleNamespace(**{k: literal(v, tabela.c[k].type) for k, v in valores.items()})
+            connection.execute(update(tabela).where(tabela.c.id == existente).values(**atualizacao(excluded)))
+
+    @classmethod
+    def registrar_mensagem(cls, connection, msg):
+        """Atualiza o resumo da conversa com uma mensagem recém-inserida (mesma transação)."""
+        telefone = msg.telefone_contato
+        if telefone is None:
+            return
+        tabela = Conversa.__table__
+        atual = connection.execute(
+            select(tabela.c.nome_contato, tabela.c.nome_origem).where(tabela.c.telefone == telefone)).first()
+
+        if atual is None:
+            nome, origem = cls._resolver_nome(connection, telefone)
+        else:
+            nome, origem = atual.nome_contato, atual.nome_origem
+        # pushName (caption das mensagens de texto recebidas) só vale para quem não está cadastrado
+        push_name = msg.caption if msg.direcao == 'inbound' and msg.tipo_conteudo == 'text' else None
+        if origem in (None, 'push_name') and push_name:
+            nome, origem = push_name[:150], 'push_name'
+
+        criado_em = msg.criado_em or datetime.utcnow()
+        valores = {
+            'telefone': telefone,
+            'nome_contato': nome,
+            'nome_origem': origem,
+            'ultima_mensagem_id': msg.id,
+            'ultima_msg_em': criado_em,
+            'ultima_direcao': msg.direcao,
+            'ultima_preview': cls.previa(msg.tipo_conteudo, msg.mensagem, msg.tipo, msg.direcao)[:120],
+            'nao_lidas': 1 if cls._nao_lida(msg.direcao, msg.status_leitura) else 0,
+            'atualizado_em': datetime.utcnow(),
+        }
+
+        def _atualizacao(excluded):
+            # Mensagem fora de ordem (mais antiga que a última) não troca a prévia
+            mais_nova = or_(tabela.c.ultima_msg_em.is_(None), excluded.ultima_msg_em >= tabela.c.ultima_msg_em)
+            colunas = {
+                coluna: case((mais_nova, getattr(excluded, coluna)), else_=getattr(tabela.c, coluna))
+                for coluna in ('ultima_mensagem_id', 'ultima_msg_em', 'ultima_direcao', 'ultima_preview')
+            }
+            colunas.update(
+                nome_contato=excluded.nome_contato,
+                nome_origem=excluded.nome_origem,
+                nao_lidas=tabela.c.nao_lidas + excluded.nao_lidas,
+                atualizado_em=excluded.atualizado_em,
+            )
+            return colunas
+
+        cls._upsert(connection, valores, _atualizacao)
+
+    @classmethod
+    def recalcular(cls, connection, telefone):
+        """Refaz o resumo de um telefone a partir do histórico (exclusão, leitura, reconstrução)."""
+        h = HistoricoNotificacao.__table__
+        tabela = Conversa.__table__
+        ultima = connection.execute(
+            select(h.c.id, h.c.criado_em, h.c.direcao, h.c.tipo_conteudo, h.c.mensagem, h.c.tipo)
+            .where(h.c.telefone_contato == telefone, h.c.excluido_em.is_(None))
+            .order_by(h.c.criado_em.desc(), h.c.id.desc()).limit(1)
+        ).first()
+        if ultima is None:
+            connection.execute(delete(tabela).where(tabela.c.telefone == telefone))
+            return
+
+        nao_lidas = connection.execute(
+            select(func.count(h.c.id)).where(
+                h.c.telefone_contato == telefone, h.c.direcao == 'inbound',
+                or_(h.c.status_leitura.is_(None), h.c.status_leitura == 'nao_lida'))
+        ).scalar()
+        nome, origem = cls._resolver_nome(connection, telefone)
+        if nome is None:
+            nome = connection.execute(
+                select(h.c.caption).where(
+                    h.c.telefone_contato == telefone, h.c.direcao == 'inbound', h.c.tipo_conteudo == 'text',
+                    h.c.caption.isnot(None), h.c.caption != '')
+                .order_by(h.c.criado_em.desc()).limit(1)
+            ).scalar()
+            origem = 'push_name' if nome else None
+
+        valores = {
+            'telefone': telefone,
+            'nome_contato': nome[:150] if nome else None,
+            'nome_origem': origem,
+            'ultima_mensagem_id': ultima.id,
+            'ultima_msg_em': ultima.criado_em,
+            'ultima_direcao': ultima.direcao,
+            'ultima_preview': cls.previa(ultima.tipo_conteudo, ultima.mensagem, ultima.tipo, ultima.direcao)[:120],
+            'nao_lidas': nao_lidas,
+            'atualizado_em': datetime.utcnow(),
+        }
+        cls._upsert(connection, valores,
+                    lambda excluded: {c: getattr(excluded, c) for c in valores if c != 'telefone'})
+
+    @classmethod
+    def reconstruir(cls, connection=None) -> int:
+        """Recria a tabela inteira a partir do histórico (carga inicial / reparo)."""
+        connection = connection or db.session.connection()
+        h = HistoricoNotificacao.__table__
+        telefones = connection.execute(
+            select(h.c.telefone_contato).where(h.c.telefone_contato.isnot(None)).distinct()
+        ).scalars().all()
+
+        connection.execute(delete(Conversa.__table__))
+        for telefone in sorted(telefones):
+            cls.recalcular(connection, telefone)
+        logger.info("conversa reconstruída: %s telefones", len(telefones))
+        return len(telefones)
+
+    # ── consultas da central de chat ────────────────────────────────────────
+
+    @classmethod
+    def listar(cls, filtro='todas', limite=None) -> list:
+        """Conversas mais recentes primeiro (filtro: todas, nao_lidas, ativas)."""
+        query = Conversa.query
+        if filtro == 'nao_lidas':
+            query = query.filter(Conversa.nao_lidas > 0)
+        elif filtro == 'ativas':
+            query = query.filter(Conversa.ultima_msg_em >= datetime.utcnow() - timedelta(hours=24))
+        return query.order_by(Conversa.ultima_msg_em.desc()).limit(limite or cls.LIMITE_LISTA).all()
+
+    @staticmethod
+    def cursor(msg) -> str:
+        """Posição de uma mensagem no histórico: '<criado_em ISO>_<id>'."""
+        return f"{msg.criado_em.isoformat()}_{msg.id}"
+
+    @staticmethod
+    def _ler_cursor(cursor):
+        """(criado_em, id) de um cursor; ValueError se malformado."""
+        criado_em, _, msg_id = cursor.rpartition('_')
+        return datetime.fromisoformat(criado_em), int(msg_id)
+
+    @classmethod
+    def mensagens(cls, telefone, antes=None, depois=None, limite=None):
+        """
+        Página do histórico de uma conversa, em ordem cronológica, pelo índice
+        (telefone_contato, criado_em). Sem cursor: as `limite` mais recentes;
+        `antes`: as anteriores a esse cursor (rolagem para cima); `depois`: as
+        novas desde esse cursor (polling). Retorna (mensagens, tem_anteriores).
+        Cursor inválido levanta ValueError.
+        """
+        limite = min(limite or cls.LIMITE_MENSAGENS, cls.MAX_MENSAGENS)
+        telefone_norm = WhatsAppService.normalizar_telefone(telefone) or telefone
+        query = HistoricoNotificacao.query.filter(
+            HistoricoNotificacao.telefone_contato == telefone_norm,
+            HistoricoNotificacao.excluido_em.is_(None),
+        )
+        criado_em, id_ = HistoricoNotificacao.criado_em, HistoricoNotificacao.id
+
+        if depois:
+            c_em, c_id = cls._ler_cursor(depois)
+            # criado_em >= c primeiro, para o banco usar o intervalo do índice
+            query = query.filter(criado_em >= c_em, or_(criado_em > c_em, id_ > c_id))
+            pagina = query.order_by(criado_em.asc(), id_.asc()).limit(limite).all()
+            return pagina, None
+
+        if antes:
+            c_em, c_id = cls._ler_cursor(antes)
+            query = query.filter(criado_em <= c_em, or_(criado_em < c_em, id_ < c_id))
+        # Uma linha a mais só para saber se ainda há mensagens anteriores
+        pagina = query.order_by(criado_em.desc(), id_.desc()).limit(limite + 1).all()
+        tem_anteriores = len(pagina) > limite
+        return list(reversed(pagina[:limite])), tem_anteriores
+
+    @classmethod
+    def marcar_lida(cls, telefone):
+        """Marca as mensagens recebidas do telefone como lidas e zera o contador (sem commit)."""
+        telefone_norm = WhatsAppService.normalizar_telefone(telefone) or telefone
+        HistoricoNotificacao.query.filter(
+            HistoricoNotificacao.telefone_contato == telefone_norm,
+            HistoricoNotificacao.direcao == 'inbound',
+            or_(
+                HistoricoNotificacao.status_leitura == None,
+                HistoricoNotificacao.status_leitura == 'nao_lida'
+            )
+        ).update({'status_leitura': 'lida'}, synchronize_session=False)
+        Conversa.query.filter_by(telefone=telefone_norm).update({'nao_lidas': 0}, synchronize_session=False)
+        # UPDATE em massa não passa pelos eventos do ORM: avisa as outras telas abertas
+        ChatEventosService.acumular(db.session(), {
+            'tipo': 'leitura', 'id': None, 'telefone': telefone_norm, 'chamado_id': None,
+            'direcao': 'inbound', 'status': None, 'excluido': False,
+        })
+
+
+# ── manutenção via eventos do ORM ──────────────────────────────────────────
+
+@event.listens_for(HistoricoNotificacao, 'before_insert')
+@event.listens_for(HistoricoNotificacao, 'before_update')
+def _preencher_telefone_contato(mapper, connection, target):
+    target.telefone_contato = ConversaService.telefone_da_mensagem(
+        target.direcao, target.remetente, target.destinatario)
+
+
+@event.listens_for(HistoricoNotificacao, 'after_insert')
+def _registrar_na_conversa(mapper, connection, target):
+    ConversaService.registrar_mensagem(connection, target)
+
+
+@event.listens_for(HistoricoNotificacao, 'after_update')
+def _recalcular_conversa(mapper, connection, target):
+    estado = inspect(target)
+    if not any(estado.attrs[c].history.has_changes() for c in ('excluido_em', 'status_leitura', 'mensagem')):
+        return
+    if target.telefone_contato:
+        ConversaService.recalcular(connection, target.telefone_contato)
+
+
+@event.listens_for(HistoricoNotificacao, 'after_delete')
+def _remover_da_conversa(mapper, connection, target):
+    if target.telefone_contato:
+        ConversaService.recalcular(connection, target.telefone_contato)
+
+
+def _renomear_contatos(campos_telefone):
+    """Cadastro de contato alterado: refaz o nome das conversas dos telefones envolvidos."""
+    def _renomear(mapper, connection, target):
+        estado = inspect(target)
+        telefones = set()
+        for campo in campos_telefone:
+            historico = estado.attrs[campo].history
+            for valor in list(historico.deleted or ()) + [getattr(target, campo)]:
+                if valor:
+                    telefones.add(WhatsAppService.normalizar_telefone(valor))
+        tabela = Conversa.__table__
+        for telefone in telefones - {''}:
+            nome, origem = ConversaService._resolver_nome(connection, telefone)
+            if nome is not None:
+                connection.execute(update(tabela).where(tabela.c.telefone == telefone)
+                                   .values(nome_contato=nome[:150], nome_origem=origem))
+            else:
+                # Sem cadastro: volta ao pushName na próxima mensagem recebida (ou ao telefone)
+                connection.execute(update(tabela).where(
+                    tabela.c.telefone == telefone, tabela.c.nome_origem != 'push_name'
+                ).values(nome_contato=None, nome_origem=None))
+
+    def _ao_atualizar(mapper, connection, target):
+        estado = inspect(target)
+        if any(estado.attrs[c].history.has_changes() for c in ('nome',) + campos_telefone):
+            _renomear(mapper, connection, target)
+
+    return _renomear, _ao_atualizar
+
+
+for _modelo, _campos in ((Terceirizado, ('telefone',)), (Fornecedor, ('telefone', 'whatsapp')), (Usuario, ('telefone',))):
+    _renomear, _ao_atualizar = _renomear_contatos(_campos)
+    event.listen(_modelo, 'after_insert', _renomear)
+    event.listen(_modelo, 'after_update', _ao_atualizar)
+    event.listen(_modelo, 'after_delete', _renomear)
@@ -0,0 +1,108 @@
+import logging
+import threading
+from collections import OrderedDict
+import redis
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class DeduplicadorWebhook:
+    """
+    Descarta retries da MegaAPI antes de qualquer escrita no banco.
+
+    Camadas, da mais barata para a mais cara:
+    1. LRU em memória (ids vistos por este processo);
+    2. SET NX com TTL no Redis (ids vistos por qualquer worker);
+    3. índice único em historico_notificacoes.megaapi_id (última linha de defesa,
+       tratada em registrar_mensagem_inbound).
+    """
+
+    PREFIXO = 'whatsapp:dedup:'
+    CHAVE_METRICAS = 'whatsapp:dedup:metricas'
+    TTL = 86400            # retries da MegaAPI acontecem em minutos; 24h cobre com folga
+    CAPACIDADE_LRU = 10000
+
+    _lock = threading.Lock()
+    _lru = OrderedDict()
+    _contadores = {'hit_lru': 0, 'hit_redis': 0, 'hit_banco': 0, 'miss': 0}
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @classmethod
+    def _contar(cls, contador: str):
+        with cls._lock:
+            cls._contadores[contador] += 1
+        try:
+            cls._get_redis().hincrby(cls.CHAVE_METRICAS, contador, 1)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def _lembrar(cls, msg_id: str):
+        with cls._lock:
+            cls._lru[msg_id] = True
+            cls._lru.move_to_end(msg_id)
+            while len(cls._lru) > cls.CAPACIDADE_LRU:
+                cls._lru.popitem(last=False)
+
+    @classmethod
+    def ja_processado(cls, msg_id: str) -> bool:
+        """Reserva o msg_id e retorna True se ele já tiver sido recebido (duplicata)."""
+        if not msg_id:
+            return False
+
+        with cls._lock:
+            visto = msg_id in cls._lru
+            if visto:
+                cls._lru.move_to_end(msg_id)
+        if visto:
+            cls._contar('hit_lru')
+            return True
+
+        try:
+            novo = cls._get_redis().set(cls.PREFIXO + msg_id, 1, nx=True, ex=cls.TTL)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            # Sem Redis: segue com LRU local + índice único no banco
+            logger.warning("Redis Unavailable: deduplicação do webhook apenas local.")
+            novo = True
+
+        cls._lembrar(msg_id)
+        if not novo:
+            cls._contar('hit_redis')
+            return True
+
+        cls._contar('miss')
+        return False
+
+    @classmethod
+    def registrar_duplicata_banco(cls, msg_id: str):
+        logger.info(f"Duplicata barrada pelo índice único: megaapi_id={msg_id}")
+        cls._contar('hit_banco')
+
+    @classmethod
+    def liberar(cls, msg_id: str):
+        """Desfaz a reserva quando o processamento falhou, para o retry da MegaAPI ser aceito."""
+        if not msg_id:
+            return
+        with cls._lock:
+            cls._lru.pop(msg_id, None)
+        try:
+            cls._get_redis().delete(cls.PREFIXO + msg_id)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def metricas(cls) -> dict:
+        """Contadores de hit/miss deste processo e o total global (todos os workers)."""
+        with cls._lock:
+            processo = dict(cls._contadores)
+            processo['lru_tamanho'] = len(cls._lru)
+        try:
+            bruto = cls._get_redis().hgetall(cls.CHAVE_METRICAS)
+            global_ = {k.decode(): int(v) for k, v in bruto.items()}
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            global_ = None
+        return {'processo': processo, 'global': global_}
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from app.extensions import db
 from app.models.whatsapp_models import EstadoConversa
 from app.models.terceirizados_models import ChamadoExterno
+from app.services.estado_store import EstadoStore
 
 class EstadoService:
     """
@@ -12,17 +13,28 @@ class EstadoService:
     @staticmethod
     def criar_estado(telefone: str, chamado_id: int, estado_inicial: str):
         """Creates a new conversation state."""
-        # Clean existing state
-        EstadoConversa.query.filter_by(telefone=telefone).delete()
-        
         estado = EstadoConversa(
             telefone=telefone,
             chamado_id=chamado_id,
             estado_atual=estado_inicial,
             contexto=json.dumps({}), # Empty context initially
-            # expira_em handled by cleanup task logic (updated_at)
+            # expiração: TTL do EstadoStore (24h sem gravação)
         )
-        db.session.add(estado)
+        # Replaces any existing state for this phone
+        EstadoStore.salvar(estado)
+        db.session.commit()
+        return estado
+
+    @staticmethod
+    def criar_ou_atualizar_estado(telefone: str, contexto: dict, estado_atual: str = None):
+        """Merges `contexto` into the phone's active state, creating it if needed."""
+        estado = EstadoStore.obter(telefone) or EstadoConversa(telefone=telefone, estado_atual='inicio')
+        ctx = estado.get_contexto()
+        ctx.update(contexto)
+        estado.set_contexto(ctx)
+        if estado_atual:
+            estado.estado_atual = estado_atual
+        EstadoStore.salvar(estado)
         db.session.commit()
         return estado
     
@@ -30,13 +42,13 @@ class EstadoService:
     def atualizar_estado(estado: EstadoConversa, novo_estado: str, contexto_update: dict = None):
         """Updates the state and context."""
         estado.estado_atual = novo_estado
-        estado.updated_at = datetime.utcnow()
         
         if contexto_update:
             ctx = estado.get_contexto()
             ctx.update(contexto_update)
             estado.set_contexto(ctx)
         
+        EstadoStore.salvar(estado)
         db.session.commit()
     
     @staticmethod
@@ -67,7 +79,7 @@ class EstadoService:
                     chamado.status = 'recusado' # Or back to 'aberto' depending on logic
                 
                 # Close conversation
-                db.session.delete(estado)
+                EstadoStore.remover(estado)
                 db.session.commit()
                 
                 return {
@@ -0,0 +1,250 @@
+import json
+import logging
+from datetime import datetime, timedelta
+import redis
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models.whatsapp_models import EstadoConversa
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class EstadoStore:
+    """
+    Estado das conversas do bot (fluxos de menu, confirmação, avaliação...),
+    um por telefone, com backend configurável (ESTADO_CONVERSA_BACKEND).
+
+    - 'redis' (padrão): um hash por telefone com TTL nativo de 24h renovado a
+      cada gravação; leitura e escrita são um round-trip só. Com
+      ESTADO_CONVERSA_AUDITORIA cada gravação também entra numa lista Redis,
+      gravada em lote na tabela whatsapp_estados_conversa pela task
+      gravar_auditoria_estados (write-behind; encerramentos viram uma linha
+      com estado_atual='encerrado'). As linhas de auditoria são apagadas
+      por limpar_expirados após ESTADO_CONVERSA_RETENCAO_DIAS.
+    - 'sql': a tabela whatsapp_estados_conversa, como antes.
+
+    No backend Redis as gravações ficam pendentes na sessão e só vão ao Redis
+    depois do commit do chamador (descartadas no rollback), para o estado do
+    fluxo não divergir das linhas de negócio gravadas na mesma transação.
+
+    Os estados circulam como EstadoConversa (transientes no backend Redis),
+    para os fluxos do RoteamentoService seguirem usando get_contexto/
+    set_contexto; quem altera um estado chama salvar() e quem encerra chama
+    remover(). Sem Redis, o backend Redis lê e grava na tabela.
+    """
+
+    PREFIXO = 'gmm:estado:'
+    CHAVE_AUDITORIA = 'gmm:estado:auditoria'
+    TTL = 86400  # 24h de inatividade encerram o fluxo
+    ENCERRADO = 'encerrado'
+    CAMPOS_INT = ('chamado_id', 'usuario_id', 'ordem_servico_id')
+    CAMPOS_TEXTO = ('estado_atual', 'contexto', 'usuario_tipo')
+    LOTE_AUDITORIA = 500
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @staticmethod
+    def backend() -> str:
+        return current_app.config.get('ESTADO_CONVERSA_BACKEND', 'redis')
+
+    @staticmethod
+    def _auditoria() -> bool:
+        return bool(current_app.config.get('ESTADO_CONVERSA_AUDITORIA', True))
+
+    @staticmethod
+    def _retencao_dias() -> int:
+        return int(current_app.config.get('ESTADO_CONVERSA_RETENCAO_DIAS', 30))
+
+    # ── serialização ────────────────────────────────────────────────────────
+
+    @classmethod
+    def _para_hash(cls, estado) -> dict:
+        dados = {campo: getattr(estado, campo) or '' for campo in cls.CAMPOS_TEXTO}
+        dados.update({campo: '' if getattr(estado, campo) is None else str(getattr(estado, campo))
+                      for campo in cls.CAMPOS_INT})
+        dados['updated_at'] = estado.updated_at.isoformat()
+        return dados
+
+    @classmethod
+    def _de_hash(cls, telefone, dados) -> EstadoConversa:
+        dados = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                 for k, v in dados.items()}
+        estado = EstadoConversa(telefone=telefone, updated_at=datetime.fromisoformat(dados['updated_at']))
+        for campo in cls.CAMPOS_TEXTO:
+            setattr(estado, campo, dados.get(campo) or None)
+        for campo in cls.CAMPOS_INT:
+            setattr(estado, campo, int(dados[campo]) if dados.get(campo) else None)
+        return estado
+
+    @classmethod
+    def _linha_auditoria(cls, telefone, dados) -> str:
+        return json.dumps({'telefone': telefone, **dados})
+
+    # ── backend SQL (também o fallback sem Redis) ───────────────────────────
+
+    @classmethod
+    def _obter_sql(cls, telefone):
+        estado = EstadoConversa.query.filter_by(telefone=telefone).order_by(
+            EstadoConversa.updated_at.desc()
+        ).first()
+        if estado is None or estado.estado_atual == cls.ENCERRADO or estado.updated_at is None:
+            return None
+        if (datetime.utcnow() - estado.updated_at).total_seconds() >= cls.TTL:
+            return None
+        return estado
+
+    @staticmethod
+    def _salvar_sql(estado):
+        if inspect(estado).transient:
+            db.session.add(estado)
+
+    @staticmethod
+    def _remover_sql(telefone):
+        EstadoConversa.query.filter_by(telefone=telefone).delete(synchronize_session=False)
+
+    # ── gravações pendentes até o commit (backend Redis) ────────────────────
+
+    @staticmethod
+    def _pendentes() -> list:
+        """(telefone, hash | None) na ordem das chamadas; None encerra o fluxo."""
+        sessao = db.session()
+        if not sessao.in_transaction():
+            sessao.begin()  # sem transação, rollback() não dispara evento e a pendência vazaria
+        return sessao.info.setdefault('estados_pendentes', [])
+
+    @classmethod
+    def _pendente(cls, telefone):
+        """Última gravação pendente do telefone nesta sessão: (True, hash | None) ou (False, None)."""
+        for tel, dados in reversed(db.session.info.get('estados_pendentes', ())):
+            if tel == telefone:
+                return True, dados
+        return False, None
+
+    @classmethod
+    def _linha_sql(cls, telefone, dados) -> dict:
+        if dados is None:
+            return {'telefone': telefone, 'estado_atual': cls.ENCERRADO, 'updated_at': datetime.utcnow()}
+        estado = cls._de_hash(telefone, dados)
+        return {'telefone': telefone, 'updated_at': estado.updated_at,
+                **{campo: getattr(estado, campo) for campo in cls.CAMPOS_TEXTO + cls.CAMPOS_INT}}
+
+    @classmethod
+    def aplicar(cls, pendentes):
+        """Grava no Redis, num pipeline só, as mudanças confirmadas pelo commit do chamador."""
+        if not pendentes or not has_app_context():
+            return
+        try:
+            pipe = cls._get_redis().pipeline()
+            for telefone, dados in pendentes:
+                chave = cls.PREFIXO + telefone
+                pipe.delete(chave)
+                if dados is not None:
+                    pipe.hset(chave, mapping=dados)
+                    pipe.expire(chave, cls.TTL)
+                if cls._auditoria():
+                    pipe.rpush(cls.CHAVE_AUDITORIA, cls._linha_auditoria(telefone, dados or {
+                        'estado_atual': cls.ENCERRADO, 'updated_at': datetime.utcnow().isoformat()}))
+            pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: estados da conversa gravados no banco.")
+            # A transação do chamador já foi confirmada: linhas novas numa transação
+            # própria (a leitura pega a mais recente; encerramento vira linha 'encerrado')
+            with db.engine.begin() as conexao:
+                conexao.execute(EstadoConversa.__table__.insert(),
+                                [cls._linha_sql(telefone, dados) for telefone, dados in pendentes])
+
+    # ── API ─────────────────────────────────────────────────────────────────
+
+    @classmethod
+    def obter(cls, telefone):
+        """Estado ativo do telefone (atualizado nas últimas 24h) ou None."""
+        if not telefone:
+            return None
+        if cls.backend() == 'sql':
+            return cls._obter_sql(telefone)
+        achou, dados = cls._pendente(telefone)
+        if achou:
+            return cls._de_hash(telefone, dados) if dados else None
+        try:
+            dados = cls._get_redis().hgetall(cls.PREFIXO + telefone)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: estado da conversa lido do banco.")
+            return cls._obter_sql(telefone)
+        return cls._de_hash(telefone, dados) if dados else None
+
+    @classmethod
+    def salvar(cls, estado):
+        """Grava o estado (novo ou alterado) e renova o TTL quando o chamador fizer commit."""
+        estado.updated_at = datetime.utcnow()
+        if cls.backend() == 'sql':
+            cls._salvar_sql(estado)
+            return
+        cls._pendentes().append((estado.telefone, cls._para_hash(estado)))
+
+    @classmethod
+    def remover(cls, telefone):
+        """Encerra o fluxo do telefone (aceita o telefone ou o próprio estado) no commit do chamador."""
+        if isinstance(telefone, EstadoConversa):
+            telefone = telefone.telefone
+        if not telefone:
+            return
+        if cls.backend() == 'sql':
+            cls._remover_sql(telefone)
+            return
+        cls._pendentes().append((telefone, None))
+
+    @classmethod
+    def gravar_auditoria(cls) -> int:
+        """Move as gravações acumuladas no Redis para a tabela (write-behind). Retorna o total gravado."""
+        total = 0
+        while True:
+            try:
+                pipe = cls._get_redis().pipeline()
+                pipe.lrange(cls.CHAVE_AUDITORIA, 0, cls.LOTE_AUDITORIA - 1)
+                pipe.ltrim(cls.CHAVE_AUDITORIA, cls.LOTE_AUDITORIA, -1)
+                linhas, _ = pipe.execute()
+            except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+                logger.warning("Redis Unavailable: auditoria dos estados adiada.")
+                return total
+            if not linhas:
+                return total
+            for linha in linhas:
+                dados = json.loads(linha)
+                db.session.add(cls._de_hash(dados['telefone'], dados))
+            db.session.commit()
+            total += len(linhas)
+            if len(linhas) < cls.LOTE_AUDITORIA:
+                return total
+
+    @classmethod
+    def limpar_expirados(cls) -> int:
+        """
+        Backend SQL: apaga estados parados há mais de 24h. Backend Redis (o TTL
+        expira os estados): apaga as linhas de auditoria mais antigas que a retenção.
+        """
+        if cls.backend() == 'sql':
+            limite = datetime.utcnow() - timedelta(seconds=cls.TTL)
+        else:
+            limite = datetime.utcnow() - timedelta(days=cls._retencao_dias())
+        removidos = EstadoConversa.query.filter(EstadoConversa.updated_at < limite).delete()
+        db.session.commit()
+        return removidos
+
+
+# ── gravações do backend Redis: aplicadas após o commit, descartadas no rollback ──
+
+@event.listens_for(Session, 'after_commit')
+def _aplicar_estados(session):
+    EstadoStore.aplicar(session.info.pop('estados_pendentes', None))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_estados(session, transacao_anterior):
+    # soft: também descarta quando o rollback vem antes de qualquer SQL; savepoints não contam
+    if not transacao_anterior.nested:
+        session.info.pop('estados_pendentes', None)
@@ -1,8 +1,15 @@
+import json
+import logging
+import sqlite3
+import redis
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta
 from app.extensions import db
 from app.models.estoque_models import Estoque, MovimentacaoEstoque, OrdemServico, EstoqueSaldo, SolicitacaoTransferencia
 from app.models.models import Usuario
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
 
 class EstoqueService:
     @staticmethod
@@ -339,52 +346,128 @@ class EstoqueService:
         
         return os_obj
 
+    # Limites da curva ABC (percentual acumulado do valor consumido)
+    ABC_LIMITE_A = 80
+    ABC_LIMITE_B = 95
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
     @staticmethod
-    def gerar_curva_abc():
+    def _janela_disponivel():
+        """Window functions exigem SQLite >= 3.25; Postgres/MySQL 8 sempre têm."""
+        if db.engine.dialect.name != 'sqlite':
+            return True
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+
+    @classmethod
+    def _classe_abc(cls, percentual_acumulado):
+        if percentual_acumulado <= cls.ABC_LIMITE_A:
+            return 'A'
+        if percentual_acumulado <= cls.ABC_LIMITE_B:
+            return 'B'
+        return 'C'
+
+    @classmethod
+    def _consultar_curva_abc(cls, unidade_id=None, inicio=None, fim=None):
+        from sqlalchemy import func, case, cast, Float
+
+        # Consumo valorado por item, num único GROUP BY já junto ao cadastro
+        filtros = [
+            MovimentacaoEstoque.tipo_movimentacao == 'consumo',
+            Estoque.valor_unitario.isnot(None),
+            Estoque.valor_unitario != 0,
+        ]
+        if unidade_id:
+            filtros.append(MovimentacaoEstoque.unidade_id == unidade_id)
+        if inicio:
+            filtros.append(MovimentacaoEstoque.data_movimentacao >= inicio)
+        if fim:
+            filtros.append(MovimentacaoEstoque.data_movimentacao < fim)
+        qtd = func.sum(MovimentacaoEstoque.quantidade)
+        consumo = db.session.query(
+            Estoque.id, Estoque.nome, Estoque.codigo,
+            qtd.label('qtd_consumo'),
+            (qtd * Estoque.valor_unitario).label('valor_consumo'),
+        ).join(MovimentacaoEstoque, MovimentacaoEstoque.estoque_id == Estoque.id).filter(*filtros).group_by(
+            Estoque.id, Estoque.nome, Estoque.codigo, Estoque.valor_unitario
+        )
+
+        if not cls._janela_disponivel():
+            # Fallback: mesma consulta agrupada, acumulado calculado em Python
+            linhas = sorted(consumo.all(), key=lambda r: (-float(r.valor_consumo), r.id))
+            total = sum(float(r.valor_consumo) for r in linhas)
+            acumulado = 0.0
+            dados_abc = []
+            for r in linhas:
+                acumulado += float(r.valor_consumo)
+                percentual = acumulado / total * 100 if total > 0 else 0
+                dados_abc.append({
+                    'id': r.id, 'nome': r.nome, 'codigo': r.codigo,
+                    'valor_consumo': float(r.valor_consumo), 'qtd_consumo': float(r.qtd_consumo),
+                    'percentual_acumulado': round(percentual, 2), 'classe': cls._classe_abc(percentual),
+                })
+            return dados_abc, total
+
+        consumo = consumo.subquery()
+        ordem = (consumo.c.valor_consumo.desc(), consumo.c.id)
+        janela = db.session.query(
+            consumo,
+            func.sum(consumo.c.valor_consumo).over(order_by=ordem, rows=(None, 0)).label('acumulado'),
+            func.sum(consumo.c.valor_consumo).over().label('total'),
+        ).subquery()
+        percentual = case(
+            (janela.c.total > 0, cast(janela.c.acumulado, Float) * 100 / cast(janela.c.total, Float)),
+            else_=0.0
+        )
+        linhas = db.session.query(
+            janela.c.id, janela.c.nome, janela.c.codigo, janela.c.qtd_consumo, janela.c.valor_consumo,
+            janela.c.total,
+            percentual.label('percentual_acumulado'),
+            case(
+                (percentual <= cls.ABC_LIMITE_A, 'A'),
+                (percentual <= cls.ABC_LIMITE_B, 'B'),
+                else_='C'
+            ).label('classe'),
+        ).order_by(janela.c.valor_consumo.desc(), janela.c.id).all()
+
+        dados_abc = [{
+            'id': r.id, 'nome': r.nome, 'codigo': r.codigo,
+            'valor_consumo': float(r.valor_consumo), 'qtd_consumo': float(r.qtd_consumo),
+            'percentual_acumulado': round(float(r.percentual_acumulado), 2), 'classe': r.classe,
+        } for r in linhas]
+        return dados_abc, float(linhas[0].total) if linhas else 0.0
+
+    @classmethod
+    def gerar_curva_abc(cls, unidade_id=None, inicio=None, fim=None):
         """
         Calcula a curva ABC baseada no consumo (quantidade * valor unitário).
         RF-011: Visão global e balanceamento.
+
+        Opcionalmente restrita a uma unidade e/ou a uma janela [inicio, fim) de
+        data_movimentacao. Valor, acumulado e classe saem de uma única consulta
+        (window functions); o resultado fica em cache no Redis até o fim do dia.
         """
-        from sqlalchemy import func
-        
-        # 1. Obter consumo por item (Apenas tipo 'consumo')
-        consumo_query = db.session.query(
-            MovimentacaoEstoque.estoque_id,
-            func.sum(MovimentacaoEstoque.quantidade).label('total_qtd')
-        ).filter(
-            MovimentacaoEstoque.tipo_movimentacao == 'consumo'
-        ).group_by(MovimentacaoEstoque.estoque_id).all()
-        
-        dados_abc = []
-        total_geral_valor = Decimal('0.00')
-        
-        for estoque_id, qtd in consumo_query:
-            item = Estoque.query.get(estoque_id)
-            if item and item.valor_unitario:
-                valor_total = qtd * item.valor_unitario
-                dados_abc.append({
-                    'id': item.id,
-                    'nome': item.nome,
-                    'codigo': item.codigo,
-                    'valor_consumo': valor_total,
-                    'qtd_consumo': qtd
-                })
-                total_geral_valor += valor_total
-        
-        # 2. Ordenar por valor decrescente
-        dados_abc.sort(key=lambda x: x['valor_consumo'], reverse=True)
-        
-        # 3. Classificar e calcular acumulado
-        acumulado = Decimal('0.00')
-        for d in dados_abc:
-            acumulado += d['valor_consumo']
-            percentual_acumulado = (acumulado / total_geral_valor * 100) if total_geral_valor > 0 else 0
-            
-            if percentual_acumulado <= 80:
-                d['classe'] = 'A'
-            elif percentual_acumulado <= 95:
-                d['classe'] = 'B'
-            else:
-                d['classe'] = 'C'
-        
+        hoje = datetime.utcnow().date()
+        chave = 'gmm:curva_abc:{}:{}:{}:{}'.format(
+            hoje.isoformat(), unidade_id or 'todas',
+            inicio.isoformat() if inicio else '-', fim.isoformat() if fim else '-',
+        )
+        try:
+            em_cache = cls._get_redis().get(chave)
+            if em_cache:
+                dados = json.loads(em_cache)
+                return dados['itens'], dados['total']
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: curva ABC calculada sem cache.")
+
+        dados_abc, total_geral_valor = cls._consultar_curva_abc(unidade_id, inicio, fim)
+
+        fim_do_dia = datetime.combine(hoje + timedelta(days=1), datetime.min.time())
+        ttl = max(60, int((fim_do_dia - datetime.utcnow()).total_seconds()))
+        try:
+            cls._get_redis().setex(chave, ttl, json.dumps({'itens': dados_abc, 'total': total_geral_valor}))
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
         return dados_abc, total_geral_valor
@@ -0,0 +1,239 @@
+import json
+import time
+import uuid
+import logging
+from datetime import timezone
+import redis
+from app.utils.redis_client import get_redis
+from app.utils.estatisticas import percentil
+from app.services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class FilaEnvio:
+    """
+    Fila de despacho outbound (sorted set no Redis) para notificações barradas pelo Rate Limiter.
+
+    Substitui o reagendamento individual de cada task (countdown), que acordava
+    milhares de tasks no mesmo instante. Um único despachante (despachar_fila_outbound)
+    retira as notificações na ordem (prioridade, criado_em) e só dispara a task
+    de envio quando o token bucket libera, já com o token consumido.
+
+    Justiça entre destinatários: a ordem dentro da faixa usa um "tempo virtual" por
+    destinatário (start-time fair queueing) — a n-ésima mensagem pendente de um
+    mesmo número entra n intervalos de envio depois, e um destinatário com centenas
+    de mensagens não segura os demais.
+
+    Entrega ao menos uma vez: proximo() move o item para o conjunto "em voo"
+    (com a pontuação original) em vez de removê-lo; registrar_despacho() o
+    confirma depois do apply_async. Itens em voo há mais que o TTL do lock
+    pertencem a um despachante que morreu e voltam para a fila
+    (recuperar_em_voo, no início de cada despacho).
+    """
+
+    CHAVE_FILA = 'whatsapp:outbound:fila'
+    CHAVE_DADOS = 'whatsapp:outbound:dados'
+    CHAVE_TEMPO_VIRTUAL = 'whatsapp:outbound:tempo_virtual'
+    CHAVE_LOCK = 'whatsapp:outbound:despachante'
+    CHAVE_METRICAS = 'whatsapp:outbound:metricas'
+    CHAVE_ESPERAS = 'whatsapp:outbound:esperas'
+    CHAVE_DESPACHOS = 'whatsapp:outbound:despachados'  # sufixo: minuto
+    CHAVE_EM_VOO = 'whatsapp:outbound:em_voo'                  # zset: notificacao_id -> retirado em
+    CHAVE_EM_VOO_PONTUACAO = 'whatsapp:outbound:em_voo:pontuacao'  # hash: notificacao_id -> pontuação
+
+    FAIXA = 1e10               # deslocamento por faixa de prioridade (> qualquer epoch em segundos)
+    AMOSTRAS_ESPERA = 500
+    DURACAO_DESPACHO = 55      # segundos por execução; o beat religa a cada minuto
+    TTL_LOCK = 70
+
+    # KEYS: fila, dados, tempo_virtual
+    # ARGV: notificacao_id, destinatario, criado_em, intervalo, deslocamento da faixa, dados json
+    _LUA_ENFILEIRAR = """
+    if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+        return 0
+    end
+    local ultimo = tonumber(redis.call('HGET', KEYS[3], ARGV[2]) or '0')
+    local inicio = math.max(tonumber(ARGV[3]), ultimo)
+    redis.call('HSET', KEYS[3], ARGV[2], tostring(inicio + tonumber(ARGV[4])))
+    redis.call('EXPIRE', KEYS[3], 86400)
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[5]) + inicio, ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[6])
+    return 1
+    """
+
+    # KEYS: fila, em_voo, em_voo_pontuacao | ARGV: agora
+    _LUA_RETIRAR = """
+    local item = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #item == 0 then
+        return nil
+    end
+    redis.call('ZREM', KEYS[1], item[1])
+    redis.call('ZADD', KEYS[2], ARGV[1], item[1])
+    redis.call('HSET', KEYS[3], item[1], item[2])
+    return item
+    """
+
+    # KEYS: fila, em_voo, em_voo_pontuacao | ARGV: retirados até (epoch)
+    _LUA_RECUPERAR = """
+    local orfaos = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, membro in ipairs(orfaos) do
+        local pontuacao = redis.call('HGET', KEYS[3], membro)
+        if pontuacao then
+            redis.call('ZADD', KEYS[1], pontuacao, membro)
+        end
+        redis.call('ZREM', KEYS[2], membro)
+        redis.call('HDEL', KEYS[3], membro)
+    end
+    return #orfaos
+    """
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @classmethod
+    def _faixa(cls, prioridade: int) -> float:
+        # Prioridade maior = pontuação menor (sai primeiro); 2+ é tudo urgente
+        return (2 - min(max(prioridade or 0, 0), 2)) * cls.FAIXA
+
+    @classmethod
+    def enfileirar(cls, notificacao) -> bool:
+        """
+        Coloca uma HistoricoNotificacao na fila de despacho.
+        Returns: False se o Redis estiver indisponível (o chamador reagenda por conta própria).
+        """
+        prioridade = notificacao.prioridade or 0
+        # criado_em é UTC ingênuo (datetime.utcnow)
+        criado_em = (notificacao.criado_em.replace(tzinfo=timezone.utc).timestamp()
+                     if notificacao.criado_em else time.time())
+        intervalo = 1 / RateLimiter.parametros(prioridade)[0]
+        dados = json.dumps({'prioridade': prioridade, 'enfileirado_em': time.time()})
+        try:
+            cls._get_redis().eval(
+                cls._LUA_ENFILEIRAR, 3, cls.CHAVE_FILA, cls.CHAVE_DADOS, cls.CHAVE_TEMPO_VIRTUAL,
+                notificacao.id, notificacao.destinatario or '', criado_em, intervalo,
+                cls._faixa(prioridade), dados,
+            )
+            return True
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: fila de despacho outbound indisponível.")
+            return False
+
+    @classmethod
+    def adquirir_despachante(cls):
+        """Garante um único despachante ativo. Returns: token do lock ou None."""
+        token = uuid.uuid4().hex
+        if cls._get_redis().set(cls.CHAVE_LOCK, token, nx=True, ex=cls.TTL_LOCK):
+            return token
+        return None
+
+    @classmethod
+    def liberar_despachante(cls, token: str):
+        try:
+            r = cls._get_redis()
+            atual = r.get(cls.CHAVE_LOCK)
+            if atual is not None and atual.decode() == token:
+                r.delete(cls.CHAVE_LOCK)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def despachante_ativo(cls) -> bool:
+        try:
+            return bool(cls._get_redis().exists(cls.CHAVE_LOCK))
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return False
+
+    @classmethod
+    def proximo(cls):
+        """
+        Retira o próximo da fila para o conjunto em voo.
+        Returns: (notificacao_id, pontuacao, dados) ou None.
+        """
+        r = cls._get_redis()
+        retirado = r.eval(cls._LUA_RETIRAR, 3, cls.CHAVE_FILA, cls.CHAVE_EM_VOO, cls.CHAVE_EM_VOO_PONTUACAO,
+                          time.time())
+        if not retirado:
+            return None
+        membro, pontuacao = retirado
+        membro = membro.decode() if isinstance(membro, bytes) else membro
+        bruto = r.hget(cls.CHAVE_DADOS, membro)
+        dados = json.loads(bruto) if bruto else {'prioridade': 0, 'enfileirado_em': time.time()}
+        return int(membro), float(pontuacao), dados
+
+    @classmethod
+    def devolver(cls, notificacao_id: int, pontuacao: float):
+        """Recoloca na mesma posição (token ainda não disponível)."""
+        membro = str(notificacao_id)
+        pipe = cls._get_redis().pipeline()
+        pipe.zadd(cls.CHAVE_FILA, {membro: pontuacao})
+        pipe.zrem(cls.CHAVE_EM_VOO, membro)
+        pipe.hdel(cls.CHAVE_EM_VOO_PONTUACAO, membro)
+        pipe.execute()
+
+    @classmethod
+    def recuperar_em_voo(cls) -> int:
+        """Devolve à fila os itens em voo há mais que TTL_LOCK (despachante interrompido)."""
+        try:
+            recuperados = cls._get_redis().eval(
+                cls._LUA_RECUPERAR, 3, cls.CHAVE_FILA, cls.CHAVE_EM_VOO, cls.CHAVE_EM_VOO_PONTUACAO,
+                time.time() - cls.TTL_LOCK,
+            )
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return 0
+        if recuperados:
+            logger.warning(f"FilaEnvio: {recuperados} notificação(ões) em voo devolvidas à fila")
+        return recuperados
+
+    @classmethod
+    def registrar_despacho(cls, notificacao_id: int, dados: dict):
+        """Confirma o item em voo (task já publicada) e registra as métricas."""
+        espera_ms = (time.time() - dados['enfileirado_em']) * 1000
+        minuto = int(time.time() / 60)
+        membro = str(notificacao_id)
+        try:
+            pipe = cls._get_redis().pipeline()
+            pipe.zrem(cls.CHAVE_EM_VOO, membro)
+            pipe.hdel(cls.CHAVE_EM_VOO_PONTUACAO, membro)
+            pipe.hdel(cls.CHAVE_DADOS, membro)
+            pipe.hincrby(cls.CHAVE_METRICAS, 'despachados', 1)
+            pipe.lpush(cls.CHAVE_ESPERAS, round(espera_ms, 1))
+            pipe.ltrim(cls.CHAVE_ESPERAS, 0, cls.AMOSTRAS_ESPERA - 1)
+            pipe.incr(f'{cls.CHAVE_DESPACHOS}:{minuto}')
+            pipe.expire(f'{cls.CHAVE_DESPACHOS}:{minuto}', 900)
+            pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def metricas(cls) -> dict:
+        """Profundidade por faixa, espera na fila (p50/p95/p99) e vazão dos últimos minutos."""
+        try:
+            r = cls._get_redis()
+            faixas = {}
+            for nome, prioridade in (('urgente', 2), ('alta', 1), ('normal', 0)):
+                inicio = cls._faixa(prioridade)
+                faixas[nome] = r.zcount(cls.CHAVE_FILA, inicio, f'({inicio + cls.FAIXA}')
+
+            esperas = sorted(float(x) for x in r.lrange(cls.CHAVE_ESPERAS, 0, -1))
+
+            # Vazão: média dos últimos 5 minutos completos
+            minuto_atual = int(time.time() / 60)
+            chaves = [f'{cls.CHAVE_DESPACHOS}:{m}' for m in range(minuto_atual - 5, minuto_atual)]
+            despachos = [int(v) for v in r.mget(chaves) if v]
+
+            return {
+                'disponivel': True,
+                'profundidade': sum(faixas.values()),
+                'faixas': faixas,
+                'em_voo': r.zcard(cls.CHAVE_EM_VOO),
+                'despachante_ativo': bool(r.exists(cls.CHAVE_LOCK)),
+                'espera_p50_ms': percentil(esperas, 50),
+                'espera_p95_ms': percentil(esperas, 95),
+                'espera_p99_ms': percentil(esperas, 99),
+                'vazao_por_minuto': round(sum(despachos) / 5, 1),
+                'limite_por_minuto': RateLimiter.limite_por_minuto(),
+            }
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return {'disponivel': False}
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import socket
+import logging
+import redis
+from flask import current_app
+from app.utils.redis_client import get_redis
+from app.utils.estatisticas import percentil
+
+logger = logging.getLogger(__name__)
+
+
+class FilaIngestao:
+    """
+    Fila durável (Redis Stream) entre o webhook da MegaAPI e os workers de roteamento.
+
+    O webhook grava o evento já extraído e responde imediatamente; o Celery
+    (consumir_fila_inbound) lê em lote via consumer group, persiste e roteia.
+    Entradas de um worker que morreu no meio do processamento ficam pendentes
+    e são reivindicadas após OCIOSIDADE_REIVINDICAR_MS; o evento reivindicado
+    traz 'reentrega' e, se a mensagem já estava gravada mas não roteada
+    (marca CHAVE_ROTEADO ausente), é roteado a partir do registro existente.
+    """
+
+    STREAM = 'whatsapp:inbound:stream'
+    GRUPO = 'gmm-inbound'
+    CHAVE_METRICAS = 'whatsapp:inbound:metricas'
+    CHAVE_LATENCIAS = 'whatsapp:inbound:latencias'
+    CHAVE_ROTEADO = 'whatsapp:inbound:roteado:{megaapi_id}'
+    TTL_ROTEADO = 86400
+    ETAPAS = ('ack', 'fila', 'persistencia', 'roteamento')
+    AMOSTRAS_LATENCIA = 500            # amostras recentes guardadas por etapa
+    OCIOSIDADE_REIVINDICAR_MS = 60000  # entrega sem ACK há 1 min volta para a fila
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @staticmethod
+    def habilitada() -> bool:
+        return bool(current_app.config.get('WHATSAPP_INGESTAO_ASSINCRONA', False))
+
+    @staticmethod
+    def _consumidor() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def _garantir_grupo(cls, r):
+        try:
+            r.xgroup_create(cls.STREAM, cls.GRUPO, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @classmethod
+    def publicar(cls, dados: dict, remetente: str, recebido_em: float):
+        """
+        Enfileira um evento inbound.
+        Returns: (True, entrada_id) ou (False, motivo) — motivo 'fila_cheia' ou 'redis_indisponivel'.
+        Quando não enfileira, o chamador processa de forma síncrona (back-pressure natural).
+        """
+        limite = current_app.config.get('WHATSAPP_INGESTAO_MAX_PENDENTES', 5000)
+        try:
+            r = cls._get_redis()
+            if r.xlen(cls.STREAM) >= limite:
+                r.hincrby(cls.CHAVE_METRICAS, 'fila_cheia', 1)
+                logger.warning(f"Fila de ingestão cheia (>= {limite}) — processando de forma síncrona")
+                return False, 'fila_cheia'
+
+            evento = json.dumps({
+                'dados': dados,
+                'remetente': remetente,
+                'recebido_em': recebido_em,
+                'enfileirado_em': time.time(),
+            })
+            entrada_id = r.xadd(cls.STREAM, {'evento': evento})
+            return True, entrada_id.decode() if isinstance(entrada_id, bytes) else entrada_id
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError) as e:
+            logger.warning(f"Redis Unavailable: fila de ingestão desativada para este evento ({e})")
+            return False, 'redis_indisponivel'
+
+    @classmethod
+    def ler_lote(cls, quantidade: int = 50) -> list:
+        """
+        Lê até `quantidade` eventos para este worker: primeiro reivindica entregas
+        órfãs, depois lê novos. Returns: [(entrada_id, evento_dict)]; eventos
+        reivindicados vêm com evento['reentrega'] = True.
+        """
+        r = cls._get_redis()
+        cls._garantir_grupo(r)
+        consumidor = cls._consumidor()
+
+        entradas = []
+        try:
+            resposta = r.xautoclaim(cls.STREAM, cls.GRUPO, consumidor,
+                                    min_idle_time=cls.OCIOSIDADE_REIVINDICAR_MS,
+                                    start_id='0-0', count=quantidade)
+            entradas.extend(resposta[1])
+        except redis.exceptions.ResponseError:
+            pass  # Redis < 6.2 sem XAUTOCLAIM: órfãs ficam até intervenção manual
+        reivindicadas = len(entradas)
+
+        if len(entradas) < quantidade:
+            for _stream, novas in r.xreadgroup(cls.GRUPO, consumidor, {cls.STREAM: '>'},
+                                               count=quantidade - len(entradas)) or []:
+                entradas.extend(novas)
+
+        lote = []
+        for posicao, (entrada_id, campos) in enumerate(entradas):
+            if not campos:
+                continue  # entrada removida enquanto pendente
+            entrada_id = entrada_id.decode() if isinstance(entrada_id, bytes) else entrada_id
+            evento = json.loads(campos.get(b'evento') or campos.get('evento'))
+            if posicao < reivindicadas:
+                evento['reentrega'] = True
+            lote.append((entrada_id, evento))
+        return lote
+
+    @classmethod
+    def marcar_roteado(cls, megaapi_id: str):
+        """Registra que a mensagem foi roteada (consultado quando o evento é reentregue)."""
+        try:
+            cls._get_redis().set(cls.CHAVE_ROTEADO.format(megaapi_id=megaapi_id), 1, ex=cls.TTL_ROTEADO)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def ja_roteado(cls, megaapi_id: str) -> bool:
+        try:
+            return bool(cls._get_redis().exists(cls.CHAVE_ROTEADO.format(megaapi_id=megaapi_id)))
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return False
+
+    @classmethod
+    def confirmar(cls, entrada_id: str):
+        """ACK + remoção: o tamanho do stream passa a ser o backlog real."""
+        pipe = cls._get_redis().pipeline()
+        pipe.xack(cls.STREAM, cls.GRUPO, entrada_id)
+        pipe.xdel(cls.STREAM, entrada_id)
+        pipe.execute()
+
+    @classmethod
+    def registrar_latencia(cls, etapa: str, ms: float):
+        try:
+            pipe = cls._get_redis().pipeline()
+            pipe.hincrby(cls.CHAVE_METRICAS, f'{etapa}:n', 1)
+            pipe.hincrbyfloat(cls.CHAVE_METRICAS, f'{etapa}:soma_ms', ms)
+            chave = f'{cls.CHAVE_LATENCIAS}:{etapa}'
+            pipe.lpush(chave, round(ms, 2))
+            pipe.ltrim(chave, 0, cls.AMOSTRAS_LATENCIA - 1)
+            pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def incrementar(cls, contador: str):
+        try:
+            cls._get_redis().hincrby(cls.CHAVE_METRICAS, contador, 1)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            pass
+
+    @classmethod
+    def metricas(cls) -> dict:
+        """Backlog, entregas sem ACK e latência (média/p50/p95/p99) por etapa."""
+        try:
+            r = cls._get_redis()
+            contadores = {k.decode(): v.decode() for k, v in r.hgetall(cls.CHAVE_METRICAS).items()}
+
+            etapas = {}
+            for etapa in cls.ETAPAS:
+                amostras = sorted(float(x) for x in r.lrange(f'{cls.CHAVE_LATENCIAS}:{etapa}', 0, -1))
+                total = int(contadores.get(f'{etapa}:n', 0))
+                soma = float(contadores.get(f'{etapa}:soma_ms', 0))
+                etapas[etapa] = {
+                    'total': total,
+                    'media_ms': round(soma / total, 1) if total else 0,
+                    'p50_ms': percentil(amostras, 50),
+                    'p95_ms': percentil(amostras, 95),
+                    'p99_ms': percentil(amostras, 99),
+                }
+
+            try:
+                em_processamento = r.xpending(cls.STREAM, cls.GRUPO)['pending']
+            except redis.exceptions.ResponseError:
+                em_processamento = 0  # grupo ainda não criado
+
+            return {
+                'disponivel': True,
+                'habilitada': cls.habilitada(),
+                'backlog': r.xlen(cls.STREAM),
+                'em_processamento': em_processamento,
+                'fila_cheia': int(contadores.get('fila_cheia', 0)),
+                'fallback_sincrono': int(contadores.get('fallback_sincrono', 0)),
+                'erros': int(contadores.get('erros', 0)),
+                'etapas': etapas,
+            }
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return {'disponivel': False, 'habilitada': cls.habilitada()}
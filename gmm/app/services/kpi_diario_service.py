@@ -0,0 +1,329 @@
+import logging
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, and_, case, select, event, inspect
+from app.extensions import db
+from app.models.analytics_models import KpiDiario, KpiDiarioControle, KpiDiarioSujo
+from app.models.estoque_models import OrdemServico, MovimentacaoEstoque, Estoque, PedidoCompra
+from app.models.terceirizados_models import ChamadoExterno
+from app.utils.sql_tempo import horas_entre
+
+logger = logging.getLogger(__name__)
+
+
+def _como_dia(valor):
+    """func.date() devolve date no Postgres e texto 'AAAA-MM-DD' no SQLite."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    return valor
+
+
+def _periodo(coluna, inicio, fim):
+    filtros = [coluna >= inicio]
+    if fim is not None:
+        filtros.append(coluna < fim)
+    return filtros
+
+
+class KpiDiarioService:
+    """
+    Rollup diário de KPIs (tabela kpi_diario) por (dia, unidade).
+
+    Os dias até a marca d'água (`processado_ate`) são lidos do rollup; o que vem
+    depois dela (normalmente só o dia corrente) é agregado ao vivo nas tabelas de
+    origem pelas mesmas consultas usadas na consolidação. Assim um período de
+    365 dias lê ~365 x unidades linhas em vez de todas as OS/movimentações.
+    """
+
+    # Fontes agregáveis: nome -> métricas que ela produz
+    FONTES = {
+        'os': ('os_abertas', 'os_concluidas', 'mttr_horas_soma', 'mttr_qtd'),
+        'pecas': ('custo_pecas',),
+        'servicos': ('custo_servicos',),
+        'servicos_concluidos': ('custo_servicos_concluidos',),
+        'compras': ('compras_empenhado',),
+    }
+
+    # ── consultas de origem (agrupadas por dia e unidade) ──────────────────
+
+    @staticmethod
+    def _consulta_os(inicio, fim, unidade_id):
+        dia = func.date(OrdemServico.data_abertura)
+        concluida = OrdemServico.status == 'concluida'
+        com_reparo = and_(concluida, OrdemServico.data_conclusao.isnot(None))
+        query = db.session.query(
+            dia, OrdemServico.unidade_id,
+            func.count(OrdemServico.id),
+            func.count(case((concluida, 1))),
+            func.sum(case((com_reparo, horas_entre(OrdemServico.data_abertura, OrdemServico.data_conclusao)))),
+            func.count(case((com_reparo, 1))),
+        ).filter(*_periodo(OrdemServico.data_abertura, inicio, fim))
+        if unidade_id:
+            query = query.filter(OrdemServico.unidade_id == unidade_id)
+        return query.group_by(dia, OrdemServico.unidade_id)
+
+    @staticmethod
+    def _consulta_pecas(inicio, fim, unidade_id):
+        dia = func.date(MovimentacaoEstoque.data_movimentacao)
+        query = db.session.query(
+            dia, MovimentacaoEstoque.unidade_id,
+            func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario),
+        ).join(Estoque).filter(
+            MovimentacaoEstoque.tipo_movimentacao == 'consumo',
+            *_periodo(MovimentacaoEstoque.data_movimentacao, inicio, fim)
+        )
+        if unidade_id:
+            query = query.filter(MovimentacaoEstoque.unidade_id == unidade_id)
+        return query.group_by(dia, MovimentacaoEstoque.unidade_id)
+
+    @staticmethod
+    def _consulta_chamados(coluna, inicio, fim, unidade_id, *filtros):
+        # Chamados externos entram pela unidade da OS vinculada
+        dia = func.date(coluna)
+        query = db.session.query(
+            dia, OrdemServico.unidade_id,
+            func.sum(ChamadoExterno.valor_final),
+        ).join(OrdemServico, ChamadoExterno.os_id == OrdemServico.id).filter(
+            *filtros, *_periodo(coluna, inicio, fim)
+        )
+        if unidade_id:
+            query = query.filter(OrdemServico.unidade_id == unidade_id)
+        return query.group_by(dia, OrdemServico.unidade_id)
+
+    @classmethod
+    def _consulta_servicos(cls, inicio, fim, unidade_id):
+        return cls._consulta_chamados(ChamadoExterno.criado_em, inicio, fim, unidade_id)
+
+    @classmethod
+    def _consulta_servicos_concluidos(cls, inicio, fim, unidade_id):
+        return cls._consulta_chamados(ChamadoExterno.data_conclusao, inicio, fim, unidade_id,
+                                      ChamadoExterno.status == 'concluido')
+
+    @staticmethod
+    def _consulta_compras(inicio, fim, unidade_id):
+        dia = func.date(PedidoCompra.data_solicitacao)
+        empenhado = PedidoCompra.status.in_(['aprovado', 'faturado', 'recebido'])
+        query = db.session.query(
+            dia, PedidoCompra.unidade_destino_id,
+            func.sum(case((empenhado, PedidoCompra.valor_total_estimado))),
+        ).filter(*_periodo(PedidoCompra.data_solicitacao, inicio, fim))
+        if unidade_id:
+            query = query.filter(PedidoCompra.unidade_destino_id == unidade_id)
+        return query.group_by(dia, PedidoCompra.unidade_destino_id)
+
+    @staticmethod
+    def _linha_vazia(dia, unidade_id):
+        linha = dict.fromkeys(KpiDiario.METRICAS, 0)
+        linha.update(dia=dia, unidade_id=unidade_id)
+        return linha
+
+    @classmethod
+    def agregar(cls, inicio: datetime, fim: datetime = None, unidade_id=None, fontes=None) -> list:
+        """
+        Agrega as tabelas de origem em [inicio, fim) por (dia, unidade).
+        Retorna uma lista de dicts com `dia`, `unidade_id` e as métricas de KpiDiario.
+        """
+        linhas = {}
+        for fonte in fontes or cls.FONTES:
+            campos = cls.FONTES[fonte]
+            consulta = getattr(cls, f'_consulta_{fonte}')(inicio, fim, unidade_id)
+            for dia, unidade, *valores in consulta.all():
+                dia = _como_dia(dia)
+                linha = linhas.get((dia, unidade))
+                if linha is None:
+                    linha = linhas[(dia, unidade)] = cls._linha_vazia(dia, unidade)
+                for campo, valor in zip(campos, valores):
+                    linha[campo] = valor or 0
+        return list(linhas.values())
+
+    # ── leitura ─────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def processado_ate():
+        controle = KpiDiarioControle.query.first()
+        return controle.processado_ate if controle else None
+
+    @classmethod
+    def serie(cls, inicio: date, fim: date = None, unidade_id=None, fontes=None,
+              agrupar=('dia', 'unidade_id')) -> list:
+        """
+        Métricas de `inicio` a `fim` (inclusive; sem `fim`, até agora), somadas por
+        `agrupar` (subconjunto de 'dia'/'unidade_id'; vazio = um total só).
+        Dias consolidados vêm de kpi_diario, somados no banco; os posteriores à
+        marca d'água são agregados ao vivo.
+        """
+        campos = [c for fonte in (fontes or cls.FONTES) for c in cls.FONTES[fonte]]
+        processado_ate = cls.processado_ate()
+        grupos = {}
+
+        def _acumular(chave, valores):
+            linha = grupos.get(chave)
+            if linha is None:
+                linha = grupos[chave] = dict(zip(agrupar, chave), **dict.fromkeys(campos, 0))
+            for campo, valor in zip(campos, valores):
+                linha[campo] += float(valor or 0)
+
+        if processado_ate and inicio <= processado_ate:
+            ate = min(fim, processado_ate) if fim else processado_ate
+            colunas = [getattr(KpiDiario, c) for c in agrupar]
+            query = db.session.query(*colunas, *(func.sum(getattr(KpiDiario, c)) for c in campos)).filter(
+                KpiDiario.dia >= inicio, KpiDiario.dia <= ate
+            )
+            if unidade_id:
+                query = query.filter(KpiDiario.unidade_id == unidade_id)
+            for linha in query.group_by(*colunas).all():
+                _acumular(tuple(linha[:len(agrupar)]), linha[len(agrupar):])
+
+        vivo_desde = max(inicio, processado_ate + timedelta(days=1)) if processado_ate else inicio
+        if fim is None or vivo_desde <= fim:
+            for linha in cls.agregar(
+                datetime.combine(vivo_desde, time.min),
+                datetime.combine(fim + timedelta(days=1), time.min) if fim else None,
+                unidade_id, fontes,
+            ):
+                _acumular(tuple(linha[c] for c in agrupar), [linha[c] for c in campos])
+        return list(grupos.values())
+
+    @classmethod
+    def totais(cls, inicio: date, fim: date = None, unidade_id=None, fontes=None) -> dict:
+        """Soma de cada métrica das `fontes` no período (zeros se não houver dados)."""
+        linhas = cls.serie(inicio, fim, unidade_id, fontes, agrupar=())
+        if linhas:
+            return linhas[0]
+        return dict.fromkeys((c for fonte in (fontes or cls.FONTES) for c in cls.FONTES[fonte]), 0.0)
+
+    # ── consolidação ────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _primeiro_dia():
+        minimos = db.session.query(
+            db.session.query(func.min(OrdemServico.data_abertura)).scalar_subquery(),
+            db.session.query(func.min(MovimentacaoEstoque.data_movimentacao)).scalar_subquery(),
+            db.session.query(func.min(ChamadoExterno.criado_em)).scalar_subquery(),
+            db.session.query(func.min(ChamadoExterno.data_conclusao)).scalar_subquery(),
+            db.session.query(func.min(PedidoCompra.data_solicitacao)).scalar_subquery(),
+        ).one()
+        datas = [_como_dia(m) for m in minimos if m is not None]
+        return min(datas) if datas else None
+
+    @staticmethod
+    def _intervalos(dias):
+        """Agrupa dias em intervalos contíguos [(inicio, fim), ...] (fim inclusive)."""
+        intervalos = []
+        for dia in sorted(dias):
+            if intervalos and dia == intervalos[-1][1] + timedelta(days=1):
+                intervalos[-1][1] = dia
+            else:
+                intervalos.append([dia, dia])
+        return intervalos
+
+    @classmethod
+    def atualizar(cls, hoje: date = None) -> dict:
+        """
+        Consolida em kpi_diario os dias fechados ainda não processados (da marca
+        d'água até ontem), os dias marcados como sujos e sempre o dia anterior,
+        que pode receber commits de transações que cruzaram a meia-noite.
+        """
+        hoje = hoje or datetime.utcnow().date()
+        ontem = hoje - timedelta(days=1)
+
+        # Serializa execuções concorrentes (no SQLite o FOR UPDATE é ignorado)
+        controle = KpiDiarioControle.query.with_for_update().first()
+        if controle is None:
+            controle = KpiDiarioControle()
+            db.session.add(controle)
+
+        dias = {ontem}
+        inicio = controle.processado_ate + timedelta(days=1) if controle.processado_ate else cls._primeiro_dia()
+        if inicio:
+            dias.update(inicio + timedelta(days=n) for n in range((ontem - inicio).days + 1))
+
+        # Marcas gravadas depois desta leitura ficam para a próxima execução
+        ultima_marca = db.session.query(func.max(KpiDiarioSujo.id)).scalar()
+        if ultima_marca is not None:
+            dias.update(d for (d,) in db.session.query(KpiDiarioSujo.dia).filter(
+                KpiDiarioSujo.id <= ultima_marca, KpiDiarioSujo.dia <= ontem
+            ).distinct())
+
+        total_linhas = 0
+        for primeiro, ultimo in cls._intervalos(dias):
+            KpiDiario.query.filter(KpiDiario.dia >= primeiro, KpiDiario.dia <= ultimo).delete(
+                synchronize_session=False)
+            linhas = cls.agregar(datetime.combine(primeiro, time.min),
+                                 datetime.combine(ultimo + timedelta(days=1), time.min))
+            if linhas:
+                db.session.execute(KpiDiario.__table__.insert(), linhas)
+            total_linhas += len(linhas)
+
+        if ultima_marca is not None:
+            KpiDiarioSujo.query.filter(KpiDiarioSujo.id <= ultima_marca).delete(synchronize_session=False)
+        controle.processado_ate = ontem
+        db.session.commit()
+
+        logger.info("kpi_diario: %s dia(s) recalculado(s), %s linha(s)", len(dias), total_linhas)
+        return {'dias': len(dias), 'linhas': total_linhas, 'processado_ate': ontem.isoformat()}
+
+
+# ── marcação de dias sujos ─────────────────────────────────────────────────
+# Alterações em registros de dias já consolidados gravam o dia em kpi_diario_sujo
+# na mesma transação. O dia corrente não é marcado: ainda não foi consolidado.
+
+def _marcar_dias_sujos(modelo, colunas_data, campos, relacionados=None, relacionados_na_insercao=True):
+    def _registrar(connection, target, apenas_alterados):
+        estado = inspect(target)
+        if apenas_alterados and not any(estado.attrs[c].history.has_changes() for c in campos):
+            return
+        dias = set()
+        for coluna in colunas_data:
+            historico = estado.attrs[coluna].history
+            for valor in (*historico.deleted, getattr(target, coluna)):
+                if valor:
+                    dias.add(_como_dia(valor))
+        if relacionados and (apenas_alterados or relacionados_na_insercao):
+            dias |= relacionados(connection, target, estado)
+        hoje = datetime.utcnow().date()
+        dias = sorted(d for d in dias if d < hoje)
+        if dias:
+            connection.execute(KpiDiarioSujo.__table__.insert(), [{'dia': d, 'criado_em': datetime.utcnow()}
+                                                                   for d in dias])
+
+    event.listen(modelo, 'after_insert', lambda mapper, connection, target: _registrar(connection, target, False))
+    event.listen(modelo, 'after_delete', lambda mapper, connection, target: _registrar(connection, target, False))
+    event.listen(modelo, 'after_update', lambda mapper, connection, target: _registrar(connection, target, True))
+
+
+def _dias_distintos(connection, coluna, *filtros):
+    return {_como_dia(d) for (d,) in connection.execute(
+        select(func.date(coluna)).where(coluna.isnot(None), *filtros).distinct()
+    )}
+
+
+def _dias_chamados_da_os(connection, target, estado):
+    # Custos de serviço seguem a unidade da OS: trocar a unidade afeta os dias dos chamados
+    if not estado.attrs['unidade_id'].history.has_changes():
+        return set()
+    tabela = ChamadoExterno.__table__
+    return (_dias_distintos(connection, tabela.c.criado_em, tabela.c.os_id == target.id)
+            | _dias_distintos(connection, tabela.c.data_conclusao, tabela.c.os_id == target.id))
+
+
+def _dias_consumo_da_peca(connection, target, estado):
+    # O custo de peças usa o valor_unitario vigente; mudou o preço, mudam os dias de consumo
+    if not estado.attrs['valor_unitario'].history.has_changes():
+        return set()
+    tabela = MovimentacaoEstoque.__table__
+    return _dias_distintos(connection, tabela.c.data_movimentacao,
+                           tabela.c.estoque_id == target.id, tabela.c.tipo_movimentacao == 'consumo')
+
+
+_marcar_dias_sujos(OrdemServico, ('data_abertura',),
+                   ('data_abertura', 'data_conclusao', 'status', 'unidade_id'), _dias_chamados_da_os,
+                   relacionados_na_insercao=False)
+_marcar_dias_sujos(MovimentacaoEstoque, ('data_movimentacao',),
+                   ('data_movimentacao', 'quantidade', 'tipo_movimentacao', 'unidade_id', 'estoque_id'))
+_marcar_dias_sujos(ChamadoExterno, ('criado_em', 'data_conclusao'),
+                   ('criado_em', 'data_conclusao', 'valor_final', 'status', 'os_id'))
+_marcar_dias_sujos(PedidoCompra, ('data_solicitacao',),
+                   ('data_solicitacao', 'status', 'valor_total_estimado', 'unidade_destino_id'))
+_marcar_dias_sujos(Estoque, (), ('valor_unitario',), _dias_consumo_da_peca, relacionados_na_insercao=False)
@@ -0,0 +1,160 @@
+import json
+import logging
+from datetime import datetime, timedelta
+import redis
+from sqlalchemy import func
+from app.extensions import db
+from app.models.models import Unidade
+from app.models.estoque_models import PedidoCompra, AprovacaoPedido, Fornecedor
+from app.utils.cache_local import CacheVersionado, invalidar_apos_commit
+from app.utils.estatisticas import percentil
+from app.utils.redis_client import get_redis
+from app.utils.sql_tempo import horas_entre
+
+logger = logging.getLogger(__name__)
+
+
+class LeadTimeService:
+    """
+    Lead time de compras (Solicitação → Aprovação → Recebimento) dos pedidos
+    finalizados, com média e percentis p50/p90/p99 por etapa, no geral e por
+    tier de aprovação, fornecedor e unidade de destino.
+
+    A primeira aprovação de cada pedido vem de uma subquery agrupada
+    (MIN(created_at) por pedido_id) juntada uma única vez aos pedidos da
+    janela: uma consulta, qualquer que seja o número de pedidos. O resultado,
+    por dia, janela (dias) e unidade, fica em memória em cada worker
+    (CacheVersionado) e num snapshot no Redis gravado sob a versão atual do
+    cache; commits que recebem/finalizam pedidos ou registram aprovações
+    incrementam a versão.
+    """
+
+    CHAVE_SNAPSHOT = 'gmm:leadtime:v{versao}:{dia}:{dias}:{unidade}'
+    STATUS_FINALIZADOS = ('recebido', 'faturado')
+    PERCENTIS = (50, 90, 99)
+
+    _cache = None
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @classmethod
+    def _consultar(cls, desde, unidade_id=None):
+        primeira_aprovacao = db.session.query(
+            AprovacaoPedido.pedido_id.label('pedido_id'),
+            func.min(AprovacaoPedido.created_at).label('aprovado_em'),
+        ).filter(AprovacaoPedido.acao == 'aprovado').group_by(AprovacaoPedido.pedido_id).subquery()
+
+        query = db.session.query(
+            PedidoCompra.tier_aprovacao,
+            PedidoCompra.fornecedor_id, Fornecedor.nome,
+            PedidoCompra.unidade_destino_id, Unidade.nome,
+            horas_entre(PedidoCompra.data_solicitacao, primeira_aprovacao.c.aprovado_em),
+            horas_entre(PedidoCompra.data_solicitacao, PedidoCompra.data_recebimento),
+        ).outerjoin(primeira_aprovacao, primeira_aprovacao.c.pedido_id == PedidoCompra.id)\
+         .outerjoin(Fornecedor, Fornecedor.id == PedidoCompra.fornecedor_id)\
+         .outerjoin(Unidade, Unidade.id == PedidoCompra.unidade_destino_id)\
+         .filter(PedidoCompra.status.in_(cls.STATUS_FINALIZADOS), PedidoCompra.data_solicitacao >= desde)
+        if unidade_id:
+            query = query.filter(PedidoCompra.unidade_destino_id == unidade_id)
+        return query.all()
+
+    @classmethod
+    def _estatisticas(cls, amostras) -> dict:
+        amostras = sorted(amostras)
+        resultado = {
+            'qtd': len(amostras),
+            'media': round(sum(amostras) / len(amostras), 1) if amostras else 0,
+        }
+        for p in cls.PERCENTIS:
+            resultado[f'p{p}'] = percentil(amostras, p)
+        return resultado
+
+    @classmethod
+    def _grupo(cls, amostras_aprovacao, amostras_recebimento, total) -> dict:
+        return {
+            'total_pedidos': total,
+            'aprovacao': cls._estatisticas(amostras_aprovacao),
+            'recebimento': cls._estatisticas(amostras_recebimento),
+        }
+
+    @classmethod
+    def _agregar(cls, linhas) -> dict:
+        # dimensão -> chave -> [nome, total, horas de aprovação, horas de recebimento]
+        grupos = {'tier': {}, 'fornecedor': {}, 'unidade': {}}
+        geral = [0, [], []]
+        for tier, fornecedor_id, fornecedor, unidade_id, unidade, h_aprovacao, h_recebimento in linhas:
+            chaves = {
+                'tier': (tier, f'Tier {tier}' if tier else 'Sem tier'),
+                'fornecedor': (fornecedor_id, fornecedor or 'Sem fornecedor'),
+                'unidade': (unidade_id, unidade or 'Sem unidade'),
+            }
+            for acumulado in [geral] + [
+                grupos[dimensao].setdefault(chave, [0, [], [], nome])
+                for dimensao, (chave, nome) in chaves.items()
+            ]:
+                acumulado[0] += 1
+                if h_aprovacao is not None:
+                    acumulado[1].append(float(h_aprovacao))
+                if h_recebimento is not None:
+                    acumulado[2].append(float(h_recebimento))
+
+        resultado = {'geral': cls._grupo(geral[1], geral[2], geral[0])}
+        for dimensao, por_chave in grupos.items():
+            resultado[f'por_{dimensao}'] = sorted((
+                {'id': chave, 'nome': nome, **cls._grupo(aprovacao, recebimento, total)}
+                for chave, (total, aprovacao, recebimento, nome) in por_chave.items()
+            ), key=lambda g: (-g['total_pedidos'], g['nome']))
+        return resultado
+
+    @classmethod
+    def calcular(cls, dias=90, unidade_id=None) -> dict:
+        """
+        Lead times dos pedidos finalizados solicitados nos últimos `dias` dias
+        (horas). Chaves: geral, por_tier, por_fornecedor e por_unidade, cada
+        grupo com total_pedidos e estatísticas de 'aprovacao' e 'recebimento'
+        (qtd, media, p50, p90, p99).
+        """
+        hoje = datetime.utcnow().date()
+        por_janela = cls._cache.obter()
+        chave = (hoje, dias, unidade_id)
+        if chave not in por_janela:
+            por_janela[chave] = cls._carregar(hoje, dias, unidade_id)
+        return por_janela[chave]
+
+    @classmethod
+    def _carregar(cls, hoje, dias, unidade_id) -> dict:
+        """Snapshot do Redis para a versão atual; recalcula e grava se não houver."""
+        try:
+            cliente = cls._get_redis()
+            chave = cls.CHAVE_SNAPSHOT.format(versao=int(cliente.get(cls._cache.chave_versao) or 0),
+                                              dia=hoje.isoformat(), dias=dias, unidade=unidade_id or 'todas')
+            em_cache = cliente.get(chave)
+            if em_cache:
+                return json.loads(em_cache)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: lead time calculado apenas neste processo.")
+            cliente = None
+
+        desde = datetime.combine(hoje - timedelta(days=dias), datetime.min.time())
+        resultado = cls._agregar(cls._consultar(desde, unidade_id))
+        resultado['dias'] = dias
+
+        if cliente is not None:
+            fim_do_dia = datetime.combine(hoje + timedelta(days=1), datetime.min.time())
+            ttl = max(60, int((fim_do_dia - datetime.utcnow()).total_seconds()))
+            try:
+                cliente.setex(chave, ttl, json.dumps(resultado))
+            except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+                pass
+        return resultado
+
+
+LeadTimeService._cache = CacheVersionado('lead_time', dict, ttl=600)
+invalidar_apos_commit(LeadTimeService._cache, PedidoCompra,
+                      campos=('status', 'data_recebimento', 'data_solicitacao', 'tier_aprovacao',
+                              'fornecedor_id', 'unidade_destino_id'))
+invalidar_apos_commit(LeadTimeService._cache, AprovacaoPedido, campos=('acao', 'created_at'))
+invalidar_apos_commit(LeadTimeService._cache, Fornecedor, campos=('nome',))
+invalidar_apos_commit(LeadTimeService._cache, Unidade, campos=('nome',))
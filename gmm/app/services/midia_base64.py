@@ -0,0 +1,168 @@
+import io
+import os
+import json
+import base64
+import logging
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+BLOCO = 3 * 16384  # múltiplo de 3: o base64 concatenado dos blocos é igual ao do arquivo inteiro
+
+
+def tamanho_base64(tamanho: int) -> int:
+    return 4 * ((tamanho + 2) // 3)
+
+
+class CorpoMidiaBase64:
+    """
+    Corpo JSON do endpoint mediaBase64 gerado sob demanda (file-like).
+
+    O base64 do arquivo é produzido bloco a bloco enquanto o requests/urllib3 lê o
+    corpo, então o pico de memória não depende do tamanho da mídia. Expõe __len__
+    (Content-Length, sem chunked) e tell/seek(0), usados pelo urllib3 para
+    reenviar o corpo nos retries.
+    """
+
+    def __init__(self, campos: dict, mime_type: str, caminho: str, pre_codificado=None):
+        # {"messageData": {<campos>, "base64": "data:<mime>;base64,<arquivo>"}}, com o
+        # base64 como última chave: o prefixo sai dos campos serializados, sem procurar
+        # marcador em texto do usuário (legenda, nome do arquivo)
+        outros = json.dumps({k: v for k, v in campos.items() if k != 'base64'})
+        abertura = json.dumps(f'data:{mime_type};base64,')[:-1]  # sem a aspa de fechamento
+        separador = ', ' if len(outros) > 2 else ''
+        self._prefixo = ('{"messageData": ' + outros[:-1] + separador + '"base64": ' + abertura).encode()
+        self._sufixo = b'"}}'
+        self._caminho = caminho
+        self._pre_codificado = memoryview(pre_codificado) if pre_codificado is not None else None
+        self.tamanho_base64 = (len(pre_codificado) if pre_codificado is not None
+                               else tamanho_base64(os.path.getsize(caminho)))
+        self._tamanho = len(self._prefixo) + self.tamanho_base64 + len(self._sufixo)
+        self._arquivo = None
+        self.seek(0)
+
+    def __len__(self):
+        return self._tamanho
+
+    def __iter__(self):
+        while True:
+            parte = self.read(BLOCO)
+            if not parte:
+                return
+            yield parte
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def seek(self, posicao: int, whence: int = io.SEEK_SET) -> int:
+        if posicao != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('CorpoMidiaBase64 só volta ao início')
+        self.close()
+        self._posicao = 0
+        self._posicao_b64 = 0
+        self._pendente = bytearray()
+        return 0
+
+    def close(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+    def _ler_base64(self, n: int) -> bytes:
+        if self._pre_codificado is not None:
+            parte = self._pre_codificado[self._posicao_b64:self._posicao_b64 + n]
+            self._posicao_b64 += len(parte)
+            return bytes(parte)
+
+        if self._arquivo is None and self._posicao_b64 == 0:
+            self._arquivo = open(self._caminho, 'rb')
+        while len(self._pendente) < n and self._arquivo is not None:
+            bloco = self._arquivo.read(BLOCO)
+            if not bloco:
+                self.close()
+                break
+            self._pendente += base64.b64encode(bloco)
+        parte = bytes(self._pendente[:n])
+        del self._pendente[:n]
+        self._posicao_b64 += len(parte)
+        return parte
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self._tamanho - self._posicao
+
+        partes = []
+        while n > 0 and self._posicao < self._tamanho:
+            inicio_b64 = len(self._prefixo)
+            fim_b64 = inicio_b64 + self.tamanho_base64
+            if self._posicao < inicio_b64:
+                parte = self._prefixo[self._posicao:self._posicao + n]
+            elif self._posicao < fim_b64:
+                parte = self._ler_base64(min(n, fim_b64 - self._posicao))
+                if not parte:
+                    raise IOError(f'Arquivo de mídia alterado durante o envio: {self._caminho}')
+            else:
+                inicio = self._posicao - fim_b64
+                parte = self._sufixo[inicio:inicio + n]
+            partes.append(parte)
+            self._posicao += len(parte)
+            n -= len(parte)
+        return b''.join(partes)
+
+
+class CacheMidiaBase64:
+    """
+    Base64 já codificado dos arquivos enviados recentemente (LRU por processo).
+
+    O mesmo PDF/imagem enviado a vários destinatários (enviar_lote, briefings) é
+    codificado uma vez. A chave inclui mtime e tamanho, então um arquivo
+    sobrescrito no mesmo caminho é recodificado. Arquivos maiores que 1/4 do
+    orçamento (WHATSAPP_MIDIA_CACHE_MB) não entram: vão direto do disco.
+    """
+
+    _lock = threading.Lock()
+    _itens = OrderedDict()
+    _bytes_total = 0
+
+    @staticmethod
+    def _codificar(caminho: str, tamanho: int) -> bytearray:
+        codificado = bytearray(tamanho_base64(tamanho))
+        posicao = 0
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(BLOCO), b''):
+                parte = base64.b64encode(bloco)
+                codificado[posicao:posicao + len(parte)] = parte
+                posicao += len(parte)
+        return codificado
+
+    @classmethod
+    def obter(cls, caminho: str):
+        """Returns: base64 do arquivo (bytearray) ou None se ele não couber no cache."""
+        orcamento = current_app.config.get('WHATSAPP_MIDIA_CACHE_MB', 64) * 1024 * 1024
+        info = os.stat(caminho)
+        if tamanho_base64(info.st_size) > orcamento // 4:
+            return None
+
+        chave = (os.path.abspath(caminho), info.st_mtime_ns, info.st_size)
+        with cls._lock:
+            codificado = cls._itens.get(chave)
+            if codificado is not None:
+                cls._itens.move_to_end(chave)
+                return codificado
+
+            # Codificado sob o lock: envios paralelos do mesmo arquivo esperam e reaproveitam
+            codificado = cls._codificar(caminho, info.st_size)
+            cls._itens[chave] = codificado
+            cls._bytes_total += len(codificado)
+            while cls._bytes_total > orcamento:
+                _chave, antigo = cls._itens.popitem(last=False)
+                cls._bytes_total -= len(antigo)
+            return codificado
+
+    @classmethod
+    def limpar(cls):
+        with cls._lock:
+            cls._itens.clear()
+            cls._bytes_total = 0
@@ -0,0 +1,308 @@
+import heapq
+import logging
+import threading
+import time
+import redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models.estoque_models import Estoque, EstoqueSaldo, MovimentacaoEstoque
+from app.utils.redis_client import get_redis
+from app.utils.texto import sem_acentos
+
+logger = logging.getLogger(__name__)
+
+# Incrementa a versão e registra os ids alterados com essa versão, atomicamente
+_PUBLICAR_ALTERACOES = """
+local versao = redis.call('INCR', KEYS[1])
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[2], versao, ARGV[i])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', versao - tonumber(ARGV[1]))
+return versao
+"""
+
+
+def _ngramas(texto) -> set:
+    """Bigramas e trigramas de cada palavra (bigramas atendem os termos de 2 letras)."""
+    return {palavra[i:i + n] for palavra in texto.split() for n in (2, 3) for i in range(len(palavra) - n + 1)}
+
+
+def _ngramas_consulta(termos) -> set:
+    """Trigramas dos termos com 3+ letras; bigramas para os de 2; termos de 1 letra não filtram."""
+    return {t[i:i + min(len(t), 3)] for t in termos if len(t) >= 2 for i in range(len(t) - min(len(t), 3) + 1)}
+
+
+class PecasIndex:
+    """
+    Índice em memória das peças (código + nome, sem acentos) para o
+    autocomplete, com o saldo global e o saldo por unidade (EstoqueSaldo).
+
+    Carregado uma vez por worker. Cada commit que altera peças, saldos ou
+    movimentações registra os ids afetados: o próprio worker os relê na
+    próxima busca e os demais os recebem por um log de alterações no Redis
+    (versão + sorted set id -> versão), checado no máximo a cada
+    INTERVALO_VERIFICACAO segundos. Só as peças alteradas são relidas; a
+    recarga completa acontece no TTL ou quando o worker fica mais de
+    JANELA_ALTERACOES versões atrás.
+    """
+
+    CHAVE_VERSAO = 'gmm:pecas_index:versao'
+    CHAVE_ALTERACOES = 'gmm:pecas_index:alteracoes'
+    INTERVALO_VERIFICACAO = 5  # segundos entre checagens da versão no Redis
+    JANELA_ALTERACOES = 5000   # versões mantidas no log de alterações
+    TTL = 3600
+    LIMITE = 10
+
+    _lock = threading.RLock()
+    _pecas = None       # id -> documento da peça
+    _ngramas = {}       # bigrama/trigrama -> ids
+    _pendentes = set()  # ids alterados ainda não relidos
+    _versao = None
+    _carregado_em = 0.0
+    _verificado_em = 0.0
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    # ── carga ───────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _ler(ids=None) -> dict:
+        """Lê peças e saldos (todas ou só `ids`) em duas queries."""
+        consulta = db.session.query(
+            Estoque.id, Estoque.codigo, Estoque.nome, Estoque.unidade_medida, Estoque.quantidade_atual)
+        saldos = db.session.query(EstoqueSaldo.estoque_id, EstoqueSaldo.unidade_id, EstoqueSaldo.quantidade)
+        if ids is not None:
+            consulta = consulta.filter(Estoque.id.in_(ids))
+            saldos = saldos.filter(EstoqueSaldo.estoque_id.in_(ids))
+
+        pecas = {}
+        for pid, codigo, nome, unidade_medida, quantidade in consulta:
+            pecas[pid] = {
+                'id': pid,
+                'codigo': codigo,
+                'nome': nome,
+                'unidade_medida': unidade_medida,
+                'saldo': float(quantidade or 0),
+                'saldos': {},
+                'chave_codigo': sem_acentos(codigo),
+                'chave_nome': sem_acentos(nome),
+            }
+            peca = pecas[pid]
+            peca['chave'] = f"{peca['chave_codigo']} {peca['chave_nome']}"
+            peca['ordem'] = (len(peca['chave_nome']), peca['chave_nome'], pid)
+
+        for estoque_id, unidade_id, quantidade in saldos:
+            if estoque_id in pecas:
+                pecas[estoque_id]['saldos'][unidade_id] = float(quantidade or 0)
+        return pecas
+
+    @classmethod
+    def _indexar(cls, peca):
+        cls._pecas[peca['id']] = peca
+        for ngrama in _ngramas(peca['chave']):
+            cls._ngramas.setdefault(ngrama, set()).add(peca['id'])
+
+    @classmethod
+    def _desindexar(cls, pid):
+        peca = cls._pecas.pop(pid, None)
+        if peca is None:
+            return
+        for ngrama in _ngramas(peca['chave']):
+            ids = cls._ngramas.get(ngrama)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del cls._ngramas[ngrama]
+
+    @classmethod
+    def _carregar(cls, versao):
+        cls._pecas, cls._ngramas = {}, {}
+        for peca in cls._ler().values():
+            cls._indexar(peca)
+        cls._pendentes = set()
+        cls._versao = versao
+        cls._carregado_em = cls._verificado_em = time.monotonic()
+        logger.info(f"Índice de peças carregado: {len(cls._pecas)} itens (versão {versao})")
+
+    @classmethod
+    def _aplicar(cls, ids):
+        """Relê apenas as peças alteradas (removidas somem do índice)."""
+        atuais = cls._ler(ids)
+        for pid in ids:
+            cls._desindexar(pid)
+            if pid in atuais:
+                cls._indexar(atuais[pid])
+
+    @classmethod
+    def _sincronizar(cls):
+        agora = time.monotonic()
+        if cls._pecas is None or agora - cls._carregado_em >= cls.TTL:
+            cls._carregar(cls._ler_versao())
+            return
+
+        if agora - cls._verificado_em >= cls.INTERVALO_VERIFICACAO:
+            cls._verificado_em = agora
+            try:
+                cliente = cls._get_redis()
+                versao = int(cliente.get(cls.CHAVE_VERSAO) or 0)
+                if cls._versao is not None and versao != cls._versao:
+                    if versao < cls._versao or versao - cls._versao > cls.JANELA_ALTERACOES:
+                        cls._carregar(versao)  # Redis reiniciado ou worker muito atrasado
+                        return
+                    alterados = cliente.zrangebyscore(cls.CHAVE_ALTERACOES, f'({cls._versao}', versao)
+                    cls._pendentes.update(int(pid) for pid in alterados)
+                cls._versao = versao
+            except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+                pass  # sem Redis: alterações locais continuam valendo; as remotas chegam no TTL
+
+        if cls._pendentes:
+            pendentes, cls._pendentes = cls._pendentes, set()
+            cls._aplicar(pendentes)
+
+    @classmethod
+    def _ler_versao(cls):
+        try:
+            return int(cls._get_redis().get(cls.CHAVE_VERSAO) or 0)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return None
+
+    # ── consulta ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _relevancia(peca, consulta, primeiro):
+        codigo = peca['chave_codigo']
+        if codigo == consulta:
+            nivel = 0
+        elif codigo.startswith(primeiro):
+            nivel = 1
+        elif peca['chave_nome'].startswith(consulta):
+            nivel = 2
+        elif ' ' + primeiro in peca['chave']:  # início de alguma palavra do nome
+            nivel = 3
+        else:
+            nivel = 4
+        return (nivel, peca['ordem'])
+
+    @classmethod
+    def buscar(cls, termo, unidade_id=None, limite=None) -> list:
+        """
+        Sugestões ranqueadas (código exato, prefixo do código, prefixo do nome,
+        prefixo de palavra, substring), sem SQL quando nada mudou.
+        Cada item traz saldo global, saldos por unidade e, se `unidade_id`
+        for informado, `saldo_unidade`.
+        """
+        limite = limite or cls.LIMITE
+        consulta = ' '.join(sem_acentos(termo).split())
+        termos = consulta.split()
+
+        with cls._lock:
+            cls._sincronizar()
+            if not termos:
+                escolhidas = [cls._pecas[pid] for pid in heapq.nsmallest(limite, cls._pecas)]
+            else:
+                candidatos = None
+                for ngrama in sorted(_ngramas_consulta(termos), key=lambda n: len(cls._ngramas.get(n, ()))):
+                    ids = cls._ngramas.get(ngrama, set())
+                    candidatos = ids.copy() if candidatos is None else candidatos & ids
+                    if not candidatos:
+                        break
+                if candidatos is None:  # só termos de 1 letra
+                    candidatos = cls._pecas.keys()
+                pecas = cls._pecas
+                encontradas = (
+                    pecas[pid] for pid in candidatos if all(t in pecas[pid]['chave'] for t in termos)
+                )
+                escolhidas = heapq.nsmallest(
+                    limite, encontradas, key=lambda p: cls._relevancia(p, consulta, termos[0]))
+
+            resultado = []
+            for peca in escolhidas:
+                item = {
+                    'id': peca['id'],
+                    'codigo': peca['codigo'],
+                    'nome': peca['nome'],
+                    'unidade_medida': peca['unidade_medida'],
+                    'saldo': peca['saldo'],
+                    'saldos': dict(peca['saldos']),
+                }
+                if unidade_id is not None:
+                    item['saldo_unidade'] = peca['saldos'].get(unidade_id, 0.0)
+                resultado.append(item)
+            return resultado
+
+    # ── alterações ──────────────────────────────────────────────────────────
+
+    @classmethod
+    def registrar_alteracoes(cls, ids):
+        """Marca peças para releitura neste worker e publica os ids para os demais."""
+        ids = set(ids)
+        if not ids:
+            return
+        with cls._lock:
+            if cls._pecas is not None:
+                cls._pendentes.update(ids)
+        try:
+            publicar = cls._get_redis().register_script(_PUBLICAR_ALTERACOES)
+            versao = publicar(keys=[cls.CHAVE_VERSAO, cls.CHAVE_ALTERACOES], args=[cls.JANELA_ALTERACOES, *sorted(ids)])
+            with cls._lock:
+                # Versão publicada por este worker logo após a que ele já conhece: nada a reler do log
+                if cls._versao is not None and int(versao) == cls._versao + 1:
+                    cls._versao = int(versao)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: alterações do índice de peças aplicadas apenas localmente.")
+        except RuntimeError:
+            # Fora de app context (scripts de manutenção): basta a marcação local
+            pass
+
+    @classmethod
+    def limpar_local(cls):
+        """Descarta o índice deste processo (recarregado na próxima busca)."""
+        with cls._lock:
+            cls._pecas = None
+            cls._ngramas = {}
+            cls._pendentes = set()
+
+
+# ── marcação via eventos do ORM ────────────────────────────────────────────
+
+def _marcar_peca(campos, chave='id'):
+    def _marcar(mapper, connection, target):
+        sessao = inspect(target).session
+        pid = getattr(target, chave)
+        if sessao is not None and pid is not None:
+            sessao.info.setdefault('pecas_alteradas', set()).add(pid)
+
+    def _ao_atualizar(mapper, connection, target):
+        estado = inspect(target)
+        if any(estado.attrs[c].history.has_changes() for c in campos):
+            _marcar(mapper, connection, target)
+
+    return _marcar, _ao_atualizar
+
+
+for _modelo, _campos, _chave in (
+    (Estoque, ('codigo', 'nome', 'unidade_medida', 'quantidade_atual'), 'id'),
+    (EstoqueSaldo, ('quantidade', 'unidade_id'), 'estoque_id'),
+):
+    _marcar, _ao_atualizar = _marcar_peca(_campos, _chave)
+    event.listen(_modelo, 'after_insert', _marcar)
+    event.listen(_modelo, 'after_delete', _marcar)
+    event.listen(_modelo, 'after_update', _ao_atualizar)
+
+# A movimentação altera Estoque.quantidade_atual via Core (atualizar_saldo_estoque), sem evento do ORM
+event.listen(MovimentacaoEstoque, 'after_insert', _marcar_peca((), 'estoque_id')[0])
+
+
+@event.listens_for(Session, 'after_commit')
+def _publicar_pecas_alteradas(session):
+    ids = session.info.pop('pecas_alteradas', None)
+    if ids:
+        PecasIndex.registrar_alteracoes(ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_pecas_alteradas(session):
+    session.info.pop('pecas_alteradas', None)
@@ -0,0 +1,147 @@
+from sqlalchemy.orm import joinedload, selectinload
+from app.models.models import Usuario, Unidade
+from app.models.estoque_models import (
+    OrdemServico, Equipamento, MovimentacaoEstoque, PedidoCompra, SolicitacaoTransferencia,
+    CatalogoFornecedor, ComunicacaoFornecedor, Fornecedor
+)
+from app.models.terceirizados_models import Terceirizado, ChamadoExterno
+
+
+def _os_detalhe():
+    return (
+        joinedload(OrdemServico.tecnico),
+        joinedload(OrdemServico.unidade),
+        joinedload(OrdemServico.equipamento_rel),
+        selectinload(OrdemServico.movimentacoes).joinedload(MovimentacaoEstoque.estoque),
+        selectinload(OrdemServico.chamados_externos).joinedload(ChamadoExterno.terceirizado),
+    )
+
+
+def _equipamento_dossie():
+    return (joinedload(Equipamento.unidade),)
+
+
+def _pedido_detalhe():
+    return (
+        joinedload(PedidoCompra.peca),
+        joinedload(PedidoCompra.fornecedor),
+        joinedload(PedidoCompra.solicitante),
+        joinedload(PedidoCompra.aprovador),
+        joinedload(PedidoCompra.unidade_destino),
+        selectinload(PedidoCompra.cotacoes),
+        selectinload(PedidoCompra.comunicacoes).joinedload(ComunicacaoFornecedor.fornecedor),
+    )
+
+
+class PerfisCarga:
+    """
+    Perfis nomeados de eager loading das telas de detalhe.
+
+    Cada perfil declara o grafo de relacionamentos que o template percorre
+    (joinedload para muitos-para-um, selectinload para coleções), de modo que a
+    página roda num número fixo de queries, independente de quantas
+    movimentações, chamados ou cotações o registro tenha. Ao mudar um template,
+    ajuste o perfil correspondente: os testes de orçamento de queries renderizam
+    as páginas reais (rota + template) e acusam lazy loads novos.
+    """
+
+    PERFIS = {
+        'os_detalhe': _os_detalhe,
+        'equipamento_dossie': _equipamento_dossie,
+        'pedido_detalhe': _pedido_detalhe,
+    }
+
+    @classmethod
+    def opcoes(cls, nome) -> tuple:
+        """Opções de carregamento do perfil (para usar em query.options(*...))."""
+        return cls.PERFIS[nome]()
+
+    @classmethod
+    def os_detalhe(cls, id) -> dict:
+        """Contexto do template os_detalhes.html."""
+        os_obj = OrdemServico.query.options(*cls.opcoes('os_detalhe')).filter_by(id=id).first_or_404()
+
+        # Filtra terceirizados: Globais (abrangencia_global=True) OU que atendam a Unidade da OS
+        terceirizados = Terceirizado.query.filter(
+            (Terceirizado.abrangencia_global == True) |
+            (Terceirizado.unidades.any(id=os_obj.unidade_id))
+        ).filter_by(ativo=True).order_by(Terceirizado.nome).all()
+
+        # Usuários para o select de notificação na transferência
+        usuarios = Usuario.query.filter_by(ativo=True).order_by(Usuario.nome).all()
+
+        # Solicitações pendentes vinculadas a esta OS
+        pedidos_pendentes = PedidoCompra.query.options(joinedload(PedidoCompra.peca)).filter(
+            PedidoCompra.os_id == id,
+            PedidoCompra.status.notin_(['concluido', 'cancelado', 'recusado'])
+        ).order_by(PedidoCompra.data_solicitacao.desc()).all()
+
+        transferencias_pendentes = SolicitacaoTransferencia.query.options(
+            joinedload(SolicitacaoTransferencia.peca),
+            joinedload(SolicitacaoTransferencia.origem),
+            joinedload(SolicitacaoTransferencia.destino),
+        ).filter(
+            SolicitacaoTransferencia.os_id == id,
+            SolicitacaoTransferencia.status.notin_(['concluida', 'rejeitada'])
+        ).order_by(SolicitacaoTransferencia.data_solicitacao.desc()).all()
+
+        return {
+            'os': os_obj,
+            'terceirizados': terceirizados,
+            'usuarios': usuarios,
+            'pedidos_pendentes': pedidos_pendentes,
+            'transferencias_pendentes': transferencias_pendentes,
+        }
+
+    @classmethod
+    def equipamento_dossie(cls, id) -> dict:
+        """Contexto do template equipamento_detalhe.html (dossiê, RF-004)."""
+        equipamento = Equipamento.query.options(*cls.opcoes('equipamento_dossie')).filter_by(id=id).first_or_404()
+
+        # 1. Histórico de Manutenções
+        historico_os = OrdemServico.query.filter_by(equipamento_id=id)\
+            .order_by(OrdemServico.data_abertura.desc()).all()
+
+        # 2. Peças Trocadas (Via Movimentações ligadas às OSs do equipamento)
+        pecas_trocadas = MovimentacaoEstoque.query.options(joinedload(MovimentacaoEstoque.estoque))\
+            .join(OrdemServico)\
+            .filter(OrdemServico.equipamento_id == id, MovimentacaoEstoque.tipo_movimentacao == 'consumo')\
+            .order_by(MovimentacaoEstoque.data_movimentacao.desc()).all()
+
+        # 3. KPIs Locais
+        total_custo_pecas = sum([m.quantidade * (m.estoque.valor_unitario or 0) for m in pecas_trocadas])
+
+        # MTBF Simplificado (Tempo total / Qtd falhas corretivas)
+        corretivas = [os for os in historico_os if os.tipo_manutencao == 'corretiva']
+        mtbf = "N/A"
+        if len(corretivas) > 1:
+            # Pega a data da primeira e da última OS corretiva
+            delta = corretivas[0].data_abertura - corretivas[-1].data_abertura
+            mtbf = f"{delta.days // (len(corretivas) - 1)} dias"
+
+        return {
+            'eq': equipamento,
+            'historico_os': historico_os,
+            'pecas': pecas_trocadas,
+            'kpis': {
+                'custo_total': total_custo_pecas,
+                'qtd_os': len(historico_os),
+                'mtbf': mtbf,
+            },
+        }
+
+    @classmethod
+    def pedido_detalhe(cls, id) -> dict:
+        """Contexto do template compras/detalhes_melhorado.html."""
+        pedido = PedidoCompra.query.options(*cls.opcoes('pedido_detalhe')).filter_by(id=id).first_or_404()
+        quotes = CatalogoFornecedor.query.options(joinedload(CatalogoFornecedor.fornecedor))\
+            .filter_by(estoque_id=pedido.estoque_id).order_by(CatalogoFornecedor.preco_atual).all()
+        unidades = Unidade.query.filter_by(ativa=True).order_by(Unidade.nome).all()
+        fornecedores_cadastrados = Fornecedor.query.filter_by(ativo=True).order_by(Fornecedor.nome).all()
+
+        return {
+            'pedido': pedido,
+            'quotes': quotes,
+            'unidades': unidades,
+            'fornecedores_cadastrados': fornecedores_cadastrados,
+        }
@@ -1,52 +1,132 @@
+import math
 import time
 import redis
 from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from app.models.whatsapp_models import ConfiguracaoWhatsApp
+from app.utils.redis_client import get_redis
+from app.utils.cache_local import CacheVersionado, invalidar_apos_commit
 
 class RateLimiter:
     """
-    Fixed window counter for rate limiting.
-    Limit: 60 requests per minute.
+    Token bucket atômico (script Lua no Redis) para o envio outbound.
+
+    A taxa vem de ConfiguracaoWhatsApp.rate_limit (msg/min). O balde comporta
+    RAJADA_SEGUNDOS de envios, então nenhuma janela de 60s passa muito do limite
+    (a janela fixa por minuto permitia o dobro na virada do minuto).
+    Checagem e consumo acontecem no mesmo script, sem corrida entre workers.
+
+    Faixas de prioridade: a faixa normal (0) precisa deixar RESERVA_FAIXA do
+    balde livre para a alta (1); urgente (>= 2) consome mas nunca é barrada.
+    """
+    LIMIT = 60                 # padrão sem ConfiguracaoWhatsApp ativa
+    CHAVE = 'whatsapp:ratelimit:balde'
+    RAJADA_SEGUNDOS = 10       # capacidade do balde, em segundos de taxa
+    RESERVA_FAIXA = {0: 0.25, 1: 0.0}
+
+    # Função Lua compartilhada com o ControleEnvio.
+    # Retorna {permitido, tokens restantes (piso), espera em ms} — Lua → Redis trunca floats.
+    LUA_BALDE = """
+    local function consumir_balde(chave, agora, taxa, capacidade, reserva, custo, ignorar)
+        local balde = redis.call('HMGET', chave, 'tokens', 'ts')
+        local tokens = tonumber(balde[1])
+        local ts = tonumber(balde[2])
+        if tokens == nil or ts == nil then
+            tokens = capacidade
+            ts = agora
+        end
+        tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * taxa)
+
+        local permitido = 1
+        local espera_ms = 0
+        if ignorar ~= 1 and tokens - custo < reserva then
+            permitido = 0
+            espera_ms = math.ceil((reserva + custo - tokens) / taxa * 1000)
+        else
+            -- urgentes podem deixar o balde negativo: as faixas abaixo esperam a dívida
+            tokens = math.max(tokens - custo, -capacidade)
+        end
+
+        redis.call('HSET', chave, 'tokens', tostring(tokens), 'ts', tostring(agora))
+        redis.call('EXPIRE', chave, math.ceil(2 * capacidade / taxa) + 60)
+        return {permitido, math.floor(math.max(tokens, 0)), espera_ms}
+    end
     """
-    LIMIT = 60
-    
+
+    # KEYS: balde — ARGV: agora, taxa/s, capacidade, reserva, custo, ignorar (0/1)
+    _LUA = LUA_BALDE + """
+    return consumir_balde(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]),
+                          tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6]))
+    """
+
+    _script = None
+    _script_cliente = None
+
     @staticmethod
     def _get_redis():
-        return redis.from_url(current_app.config.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+        return get_redis()
+
+    @classmethod
+    def _get_script(cls, r):
+        if cls._script is None or cls._script_cliente is not r:
+            cls._script = r.register_script(cls._LUA)
+            cls._script_cliente = r
+        return cls._script
 
     @staticmethod
-    def check_limit():
+    def _carregar_limite() -> int:
+        try:
+            config = ConfiguracaoWhatsApp.query.filter_by(ativo=True).first()
+        except SQLAlchemyError:
+            return RateLimiter.LIMIT
+        return config.rate_limit if config and config.rate_limit else RateLimiter.LIMIT
+
+    @classmethod
+    def limite_por_minuto(cls) -> int:
+        return cls._cache_limite.obter()
+
+    @classmethod
+    def parametros(cls, prioridade: int = 0, ignorar_limite: bool = False) -> list:
+        """Argumentos do balde para a faixa: [taxa/s, capacidade, reserva, ignorar]."""
+        limite = max(1, cls.limite_por_minuto())
+        capacidade = max(1.0, limite * cls.RAJADA_SEGUNDOS / 60)
+        # A reserva nunca pode impedir a faixa de consumir com o balde cheio
+        reserva = min(capacidade * cls.RESERVA_FAIXA.get(prioridade, 0.0), capacidade - 1)
+        ignorar = 1 if ignorar_limite or prioridade >= 2 else 0
+        return [limite / 60, capacidade, reserva, ignorar]
+
+    @classmethod
+    def consumir(cls, prioridade: int = 0, custo: int = 1):
         """
-        Check if the request can proceed within the current minute window.
-        Returns: (can_send, remaining_requests)
+        Checa e consome `custo` tokens numa única operação atômica.
+        Returns: (can_send, remaining_tokens, wait_seconds)
         """
+        taxa, capacidade, reserva, ignorar = cls.parametros(prioridade)
         try:
-            r = RateLimiter._get_redis()
-            # Key based on current minute timestamp
-            current_minute = int(time.time() / 60)
-            key = f"whatsapp:ratelimit:minute:{current_minute}"
-            
-            count = r.get(key)
-            if count is None:
-                return True, RateLimiter.LIMIT
-                
-            count = int(count)
-            if count >= RateLimiter.LIMIT:
-                return False, 0
-                
-            return True, RateLimiter.LIMIT - count
+            permitido, restantes, espera_ms = cls._get_script(cls._get_redis())(
+                keys=[cls.CHAVE],
+                args=[time.time(), taxa, capacidade, reserva, custo, ignorar],
+            )
         except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
             current_app.logger.warning("Redis Unavailable: RateLimiter allowing traffic by default.")
-            return True, RateLimiter.LIMIT
+            return True, int(capacidade), 0.0
+        return bool(permitido), int(restantes), espera_ms / 1000
+
+    @classmethod
+    def check_limit(cls, prioridade: int = 0):
+        """
+        Consulta sem consumir (painel).
+        Returns: (can_send, remaining_tokens)
+        """
+        pode_enviar, restantes, _espera = cls.consumir(prioridade, custo=0)
+        return pode_enviar, restantes
 
     @staticmethod
-    def increment():
-        """Increments the current minute counter"""
-        try:
-            r = RateLimiter._get_redis()
-            current_minute = int(time.time() / 60)
-            key = f"whatsapp:ratelimit:minute:{current_minute}"
-            
-            r.incr(key)
-            r.expire(key, 60) # Only needed for 1 minute
-        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
-             current_app.logger.warning("Redis Unavailable: RateLimiter could not increment counter.")
+    def espera_para_countdown(espera: float) -> float:
+        """Countdown do Celery para a espera do balde (nunca zero, para não girar em falso)."""
+        return max(0.1, math.ceil(espera * 10) / 10)
+
+
+RateLimiter._cache_limite = CacheVersionado('whatsapp_rate_limit', lambda: RateLimiter._carregar_limite())
+
+invalidar_apos_commit(RateLimiter._cache_limite, ConfiguracaoWhatsApp, campos=('rate_limit', 'ativo'))
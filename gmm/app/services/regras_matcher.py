@@ -0,0 +1,153 @@
+import re
+import logging
+from collections import deque, namedtuple
+from app.models.whatsapp_models import RegrasAutomacao
+from app.utils.cache_local import CacheVersionado, invalidar_apos_commit
+
+logger = logging.getLogger(__name__)
+
+# Cópia desacoplada da sessão com os campos usados pelo roteamento
+RegraCompilada = namedtuple('RegraCompilada', [
+    'id', 'palavra_chave', 'tipo_correspondencia', 'acao', 'resposta_texto',
+    'tipo_resposta', 'resposta_estruturada', 'encaminhar_para_perfil',
+    'funcao_sistema', 'prioridade', 'notificar_usuario_id',
+])
+
+
+class AhoCorasick:
+    """Autômato de Aho–Corasick: encontra todos os padrões de um texto numa única passada."""
+
+    def __init__(self, padroes):
+        # padroes: iterável de (padrao, valor)
+        self._goto = [{}]
+        self._falha = [0]
+        self._saida = [[]]
+
+        for padrao, valor in padroes:
+            no = 0
+            for ch in padrao:
+                proximo = self._goto[no].get(ch)
+                if proximo is None:
+                    proximo = len(self._goto)
+                    self._goto[no][ch] = proximo
+                    self._goto.append({})
+                    self._falha.append(0)
+                    self._saida.append([])
+                no = proximo
+            self._saida[no].append(valor)
+
+        # BFS: links de falha e saídas herdadas dos sufixos
+        fila = deque(self._goto[0].values())
+        while fila:
+            no = fila.popleft()
+            for ch, filho in self._goto[no].items():
+                fila.append(filho)
+                if no:
+                    f = self._falha[no]
+                    while f and ch not in self._goto[f]:
+                        f = self._falha[f]
+                    self._falha[filho] = self._goto[f].get(ch, 0)
+                self._saida[filho] = self._saida[filho] + self._saida[self._falha[filho]]
+
+    def buscar(self, texto: str) -> set:
+        """Retorna o conjunto de valores cujos padrões ocorrem em `texto`."""
+        encontrados = set()
+        goto, falha, saida = self._goto, self._falha, self._saida
+        no = 0
+        for ch in texto:
+            while no and ch not in goto[no]:
+                no = falha[no]
+            no = goto[no].get(ch, 0)
+            if saida[no]:
+                encontrados.update(saida[no])
+        return encontrados
+
+
+class _MatcherPublico:
+    """Regras de um público compiladas: hash (exata), Aho–Corasick (contem) e regex."""
+
+    def __init__(self, regras):
+        self.regras = regras  # já em ordem de prioridade
+        self.exatas = {}
+        self.regex = []
+        contem = []
+
+        for ordem, r in enumerate(regras):
+            if not r.palavra_chave:
+                continue
+            tipo = r.tipo_correspondencia
+            if tipo in ('exata', 'exato'):   # aceita ambas as grafias
+                self.exatas.setdefault(r.palavra_chave.upper(), []).append(ordem)
+            elif tipo == 'contem':
+                contem.append((r.palavra_chave.upper(), ordem))
+            elif tipo == 'regex':
+                try:
+                    self.regex.append((re.compile(r.palavra_chave, re.IGNORECASE), ordem))
+                except re.error as e:
+                    logger.warning(f"Regra {r.id}: regex inválida ignorada ({e})")
+
+        self.contem = AhoCorasick(contem) if contem else None
+
+    def correspondentes(self, texto: str) -> list:
+        texto_up = texto.upper()
+        ordens = set(self.exatas.get(texto.strip().upper(), ()))
+        if self.contem:
+            ordens |= self.contem.buscar(texto_up)
+        for padrao, ordem in self.regex:
+            if padrao.search(texto):
+                ordens.add(ordem)
+        return [self.regras[o] for o in sorted(ordens)]
+
+
+class RegrasMatcher:
+    """
+    Conjunto de RegrasAutomacao ativas compilado uma vez por worker.
+
+    Cada público (desconhecidos, terceirizados, usuarios) tem seu próprio matcher,
+    preservando a ordem de prioridade. O casamento não consulta o banco; o conjunto
+    é recompilado quando um commit altera alguma regra (CRUD em admin_whatsapp).
+    """
+
+    PUBLICOS = ('desconhecidos', 'terceirizados', 'usuarios')
+
+    @staticmethod
+    def _compilar() -> dict:
+        regras = RegrasAutomacao.query.filter_by(ativo=True).order_by(
+            RegrasAutomacao.prioridade.desc(), RegrasAutomacao.id
+        ).all()
+
+        por_publico = {p: [] for p in RegrasMatcher.PUBLICOS}
+        for r in regras:
+            compilada = RegraCompilada(
+                id=r.id,
+                palavra_chave=r.palavra_chave,
+                tipo_correspondencia=r.tipo_correspondencia,
+                acao=r.acao,
+                resposta_texto=r.resposta_texto,
+                tipo_resposta=r.tipo_resposta,
+                resposta_estruturada=r.resposta_estruturada,
+                encaminhar_para_perfil=r.encaminhar_para_perfil,
+                funcao_sistema=r.funcao_sistema,
+                prioridade=r.prioridade,
+                notificar_usuario_id=r.notificar_usuario_id,
+            )
+            for publico in RegrasMatcher.PUBLICOS:
+                if getattr(r, f'para_{publico}'):
+                    por_publico[publico].append(compilada)
+
+        return {p: _MatcherPublico(lista) for p, lista in por_publico.items()}
+
+    @classmethod
+    def correspondentes(cls, texto: str, publico: str) -> list:
+        """Regras do público que casam com o texto, em ordem de prioridade."""
+        if not texto:
+            return []
+        return cls._cache.obter()[publico].correspondentes(texto)
+
+    @classmethod
+    def invalidar(cls):
+        cls._cache.invalidar()
+
+
+RegrasMatcher._cache = CacheVersionado('regras_automacao', lambda: RegrasMatcher._compilar(), ttl=600)
+invalidar_apos_commit(RegrasMatcher._cache, RegrasAutomacao)
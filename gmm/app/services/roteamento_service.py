@@ -1,12 +1,14 @@
-import re
 import json
 import logging
 from datetime import datetime, timedelta
 from app.models.terceirizados_models import Terceirizado, ChamadoExterno
-from app.models.whatsapp_models import EstadoConversa, RegrasAutomacao, ConfiguracaoWhatsApp
+from app.models.whatsapp_models import EstadoConversa, ConfiguracaoWhatsApp
 from app.services.comando_parser import ComandoParser
 from app.services.comando_executores import ComandoExecutores
 from app.services.estado_service import EstadoService
+from app.services.estado_store import EstadoStore
+from app.services.telefone_index import TelefoneIndex
+from app.services.regras_matcher import RegrasMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -30,43 +32,29 @@ class RoteamentoService:
 
         PRD v2.0: Expandido para reconhecer usuarios internos.
         """
-        from app.models.models import Usuario
-
         # 1. Identify Sender - PRD v2.0: Busca em Terceirizado E Usuario
-        # Usa LIKE nos últimos 8 dígitos para ignorar formatação (com/sem 55, com máscara, etc.)
-        termo_busca = remetente[-8:]
-        terceirizado = Terceirizado.query.filter(
-            Terceirizado.telefone.like(f'%{termo_busca}'),
-            Terceirizado.ativo == True
-        ).first()
+        # Índice em memória pelos últimos 8 dígitos (ignora formatação, com/sem 55, máscara, etc.)
+        terceirizado = TelefoneIndex.buscar_terceirizado(remetente)
         usuario = None
         if not terceirizado:
-            usuario = Usuario.query.filter(
-                Usuario.telefone.like(f'%{termo_busca}'),
-                Usuario.ativo == True
-            ).first()
+            usuario = TelefoneIndex.buscar_usuario(remetente)
 
         if not terceirizado and not usuario:
             # Telefone não cadastrado — verificando regras de automação
             logger.info(f"Telefone não cadastrado: {remetente} — percorrendo regras")
             
-            # Busca regras ativas que se aplicam a desconhecidos
-            regras = RegrasAutomacao.query.filter_by(ativo=True, para_desconhecidos=True).order_by(
-                RegrasAutomacao.prioridade.desc()
-            ).all()
-
-            for r in regras:
-                if RoteamentoService._match_regra(r, texto):
-                    logger.info(f"Regra '{r.palavra_chave}' disparada para não-cadastrado {remetente}")
-                    RoteamentoService._notificar_usuario_regra(r, remetente, texto)
+            # Regras ativas que se aplicam a desconhecidos, já em ordem de prioridade
+            for r in RegrasMatcher.correspondentes(texto, 'desconhecidos'):
+                logger.info(f"Regra '{r.palavra_chave}' disparada para não-cadastrado {remetente}")
+                RoteamentoService._notificar_usuario_regra(r, remetente, texto)
                     
-                    if r.acao == 'executar_funcao' and r.funcao_sistema:
-                        return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, None, remetente=remetente)
+                if r.acao == 'executar_funcao' and r.funcao_sistema:
+                    return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, None, remetente=remetente)
                     
-                    if r.resposta_texto:
-                        return {'acao': 'enviar_mensagem', 'telefone': remetente, 'mensagem': r.resposta_texto}
+                if r.resposta_texto:
+                    return {'acao': 'enviar_mensagem', 'telefone': remetente, 'mensagem': r.resposta_texto}
                     
-                    return {'acao': 'ignorar'}
+                return {'acao': 'ignorar'}
 
             return {'acao': 'ignorar'}
 
@@ -87,12 +75,10 @@ class RoteamentoService:
         from app.services.whatsapp_service import WhatsAppService
 
         # 1. Check Active Conversation State
-        estado = EstadoConversa.query.filter_by(telefone=remetente).order_by(
-            EstadoConversa.updated_at.desc()
-        ).first()
+        estado = EstadoStore.obter(remetente)
 
-        # Determine if state is still valid (e.g., < 24h)
-        if estado and (datetime.utcnow() - estado.updated_at).total_seconds() < 86400:
+        # Estado só existe enquanto válido (< 24h desde a última gravação)
+        if estado:
             ctx = estado.get_contexto()
 
             # PRD: Processar confirmação de OS
@@ -129,32 +115,24 @@ class RoteamentoService:
                 return {'acao': 'responder', 'resposta': resultado_estado['resposta']}
 
         # 2. Automation Rules (Priority)
-        regras = RegrasAutomacao.query.filter(
-            RegrasAutomacao.ativo == True,
-            RegrasAutomacao.para_terceirizados == True # Adicionado filtro para terceirizados
-        ).order_by(
-            RegrasAutomacao.prioridade.desc()
-        ).all()
-        
-        for r in regras:
-            if RoteamentoService._match_regra(r, texto):
-                # Notifica usuário específico se configurado
-                RoteamentoService._notificar_usuario_regra(r, remetente, texto, entidade=terceirizado)
+        for r in RegrasMatcher.correspondentes(texto, 'terceirizados'):
+            # Notifica usuário específico se configurado
+            RoteamentoService._notificar_usuario_regra(r, remetente, texto, entidade=terceirizado)
                 
-                # Executa a função do sistema se configurado
-                if r.acao == 'executar_funcao' and r.funcao_sistema:
-                    return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, terceirizado)
+            # Executa a função do sistema se configurado
+            if r.acao == 'executar_funcao' and r.funcao_sistema:
+                return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, terceirizado)
                 
-                if r.resposta_texto or r.resposta_estruturada:
-                    return {
-                        'acao': r.acao,
-                        'resposta': r.resposta_texto,
-                        'mensagem': r.resposta_texto,
-                        'tipo_resposta': getattr(r, 'tipo_resposta', 'texto') or 'texto',
-                        'resposta_estruturada': r.resposta_estruturada,
-                        'encaminhar_para': r.encaminhar_para_perfil,
-                        'funcao': r.funcao_sistema
-                    }
+            if r.resposta_texto or r.resposta_estruturada:
+                return {
+                    'acao': r.acao,
+                    'resposta': r.resposta_texto,
+                    'mensagem': r.resposta_texto,
+                    'tipo_resposta': getattr(r, 'tipo_resposta', 'texto') or 'texto',
+                    'resposta_estruturada': r.resposta_estruturada,
+                    'encaminhar_para': r.encaminhar_para_perfil,
+                    'funcao': r.funcao_sistema
+                }
 
         # 3. Parse comandos estruturados legados (apenas se nenhuma regra disparou)
         comando = ComandoParser.parse(texto)
@@ -198,7 +176,7 @@ class RoteamentoService:
                     'fluxo': 'confirmar_os_nlp',
                     'dados': entidades
                 })
-                db.session.add(estado)
+                EstadoStore.salvar(estado)
                 db.session.commit()
 
                 return {'acao': 'responder', 'resposta': res_texto}
@@ -231,11 +209,9 @@ class RoteamentoService:
         from app.extensions import db
 
         # 1. Verifica estado ativo
-        estado = EstadoConversa.query.filter_by(telefone=remetente).order_by(
-            EstadoConversa.updated_at.desc()
-        ).first()
+        estado = EstadoStore.obter(remetente)
 
-        if estado and (datetime.utcnow() - estado.updated_at).total_seconds() < 86400:
+        if estado:
             ctx = estado.get_contexto()
 
             # Processar avaliação do solicitante
@@ -255,25 +231,20 @@ class RoteamentoService:
                 return RoteamentoService._processar_comando_admin(usuario, texto)
 
         # 2. Automation Rules — base de dados tem prioridade absoluta
-        regras = RegrasAutomacao.query.filter_by(ativo=True, para_usuarios=True).order_by(
-            RegrasAutomacao.prioridade.desc()
-        ).all()
-
-        for r in regras:
-            if RoteamentoService._match_regra(r, texto):
-                RoteamentoService._notificar_usuario_regra(r, remetente, texto, entidade=usuario)
-                if r.acao == 'executar_funcao' and r.funcao_sistema:
-                    return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, usuario, is_usuario=True)
-                if r.resposta_texto or r.resposta_estruturada:
-                    return {
-                        'acao': r.acao,
-                        'resposta': r.resposta_texto,
-                        'mensagem': r.resposta_texto,
-                        'tipo_resposta': getattr(r, 'tipo_resposta', 'texto') or 'texto',
-                        'resposta_estruturada': r.resposta_estruturada,
-                        'encaminhar_para': r.encaminhar_para_perfil,
-                        'funcao': r.funcao_sistema
-                    }
+        for r in RegrasMatcher.correspondentes(texto, 'usuarios'):
+            RoteamentoService._notificar_usuario_regra(r, remetente, texto, entidade=usuario)
+            if r.acao == 'executar_funcao' and r.funcao_sistema:
+                return RoteamentoService._executar_funcao_sistema(r.funcao_sistema, usuario, is_usuario=True)
+            if r.resposta_texto or r.resposta_estruturada:
+                return {
+                    'acao': r.acao,
+                    'resposta': r.resposta_texto,
+                    'mensagem': r.resposta_texto,
+                    'tipo_resposta': getattr(r, 'tipo_resposta', 'texto') or 'texto',
+                    'resposta_estruturada': r.resposta_estruturada,
+                    'encaminhar_para': r.encaminhar_para_perfil,
+                    'funcao': r.funcao_sistema
+                }
 
         # 3. Comportamento dinâmico lido da configuração
         config = ConfiguracaoWhatsApp.query.filter_by(ativo=True).first()
@@ -305,7 +276,7 @@ class RoteamentoService:
         from app.extensions import db
 
         # Limpa estados antigos
-        EstadoConversa.query.filter_by(telefone=usuario.telefone).delete()
+        EstadoStore.remover(usuario.telefone)
 
         if usuario.tipo == 'admin':
             mensagem = f"""📊 *Menu Administrativo*
@@ -354,7 +325,7 @@ Digite o número da opção desejada."""
             'fluxo': 'menu_usuario',
             'tipo': usuario.tipo
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         return {'acao': 'responder', 'resposta': mensagem}
@@ -374,7 +345,7 @@ Digite o número da opção desejada."""
             return {'acao': 'responder', 'resposta': "⚠️ Por favor, digite apenas o número da opção."}
 
         # Limpa estado após processar
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         # Menu Admin
@@ -696,7 +667,7 @@ Digite MENU para voltar."""
         chamado = ChamadoExterno.query.get(chamado_id)
 
         if not chamado:
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
             return {'acao': 'responder', 'resposta': "❌ Chamado não encontrado."}
 
@@ -706,7 +677,7 @@ Digite MENU para voltar."""
         if texto_lower in ['sim', 's', 'aceito', 'ok', 'confirmo']:
             chamado.status = 'aceito'
             chamado.data_inicio = datetime.utcnow()
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
 
             # NOTIFICA SOLICITANTE
@@ -728,7 +699,7 @@ Para atualizar o status, envie:
         # Recusa
         elif texto_lower in ['nao', 'não', 'n', 'recuso', 'não posso']:
             chamado.status = 'recusado'
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
 
             # NOTIFICA SOLICITANTE
@@ -780,7 +751,7 @@ Obrigado!
             'etapa': 'aguardando_codigo',
             'chamado_id': chamado_ativo.id
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         mensagem = f"""📦 *SOLICITAÇÃO DE PEÇA*
@@ -822,6 +793,7 @@ _Exemplo: ROL001 ou Rolamento 6205_
             ctx['etapa'] = 'aguardando_quantidade'
             estado.set_contexto(ctx)
             estado.estado_atual = 'solicitacao_peca_quantidade'
+            EstadoStore.salvar(estado)
             db.session.commit()
 
             return {
@@ -867,7 +839,7 @@ Para criar pedido de compra, use:
                 justificativa=f'Solicitado por {terceirizado.nome} via WhatsApp - Chamado #{chamado.numero_chamado if chamado else "N/A"}'
             )
             db.session.add(pedido)
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
 
             # NOTIFICA RESPONSÁVEL PELO ESTOQUE
@@ -909,7 +881,7 @@ Você receberá confirmação quando estiver disponível para retirada.
             'etapa': 'aguardando_foto',
             'chamado_id': chamado.id
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         mensagem = f"""📸 *CONCLUSÃO DE OS*
@@ -941,6 +913,7 @@ _Aguardando foto..._
             ctx['foto_path'] = None
             estado.set_contexto(ctx)
             estado.estado_atual = 'conclusao_aguardando_comentario'
+            EstadoStore.salvar(estado)
             db.session.commit()
 
             return {
@@ -953,6 +926,7 @@ _Aguardando foto..._
         ctx['etapa'] = 'aguardando_comentario'
         estado.set_contexto(ctx)
         estado.estado_atual = 'conclusao_aguardando_comentario'
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         return {
@@ -970,7 +944,7 @@ _Aguardando foto..._
         chamado = ChamadoExterno.query.get(chamado_id)
 
         if not chamado:
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
             return {'acao': 'responder', 'resposta': "❌ Chamado não encontrado."}
 
@@ -981,7 +955,7 @@ _Aguardando foto..._
         chamado.status = 'concluido'
         chamado.data_conclusao = datetime.utcnow()
 
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         # NOTIFICA SOLICITANTE
@@ -1006,7 +980,7 @@ _Aguardando foto..._
             'fluxo': 'avaliacao',
             'chamado_id': chamado.id
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         mensagem = f"""⭐ *AVALIAÇÃO DO ATENDIMENTO*
@@ -1043,7 +1017,7 @@ Digite apenas o número (1 a 5):
         if chamado:
             chamado.avaliacao = nota
 
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         estrelas = '⭐' * nota
@@ -1089,7 +1063,7 @@ Sua opinião nos ajuda a melhorar nossos serviços.
                     media = sum(c.avaliacao for c in chamados_avaliados) / len(chamados_avaliados)
                     terceirizado.avaliacao_media = round(media, 2)
 
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         estrelas = '⭐' * nota
@@ -1124,7 +1098,7 @@ Sua opinião nos ajuda a melhorar nossos serviços.
             'chamado_id': chamado_id,
             'etapa': 'aguardando_data'
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         mensagem = """📅 *AGENDAMENTO DE VISITA*
@@ -1161,7 +1135,7 @@ _Exemplo: 15/01/2026 14:30_
             chamado.data_inicio = data_visita
             chamado.status = 'agendado'
 
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         # NOTIFICA SOLICITANTE
@@ -1389,7 +1363,7 @@ Para avaliar, responda com nota de 1 a 5.
             'fluxo': 'avaliacao_solicitante',
             'chamado_id': chamado.id
         })
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
     @staticmethod
@@ -1436,26 +1410,6 @@ Você receberá um lembrete 1 dia antes.
             return [p.strip().upper() for p in config.palavras_saudacao.split(',') if p.strip()]
         return RoteamentoService._PALAVRAS_SAUDACAO_PADRAO
 
-    @staticmethod
-    def _match_regra(regra: RegrasAutomacao, texto: str) -> bool:
-        """Checks if text matches the rule pattern."""
-        if not regra.palavra_chave:
-            return False
-
-        if regra.tipo_correspondencia in ('exata', 'exato'):   # aceita ambas as grafias
-            return texto.strip().upper() == regra.palavra_chave.upper()
-
-        elif regra.tipo_correspondencia == 'contem':
-            return regra.palavra_chave.upper() in texto.upper()
-
-        elif regra.tipo_correspondencia == 'regex':
-            try:
-                return re.search(regra.palavra_chave, texto, re.IGNORECASE) is not None
-            except:
-                return False
-
-        return False
-
     @staticmethod
     def _notificar_usuario_regra(regra, remetente: str, texto: str, entidade=None):
         """
@@ -1627,7 +1581,7 @@ Você receberá um lembrete 1 dia antes.
 
         elif resposta_id == 'voltar_menu':
             from app.extensions import db
-            EstadoConversa.query.filter_by(telefone=telefone).delete()
+            EstadoStore.remover(telefone)
             db.session.commit()
             if is_usuario:
                 return RoteamentoService._exibir_menu_usuario(entidade)
@@ -1701,7 +1655,7 @@ Você receberá um lembrete 1 dia antes.
             usuario_id=terceirizado.id
         )
         estado.set_contexto({'fluxo': 'abrir_os', 'etapa': 'aguardando_equipamento'})
-        db.session.add(estado)
+        EstadoStore.salvar(estado)
         db.session.commit()
 
         mensagem = "🛠️ *Abertura de OS*\n\nQual equipamento apresenta o problema?\n\n_Digite o nome ou código do equipamento_"
@@ -1803,11 +1757,9 @@ Você receberá um lembrete 1 dia antes.
         from app.models.models import Unidade, Usuario
         from app.extensions import db
 
-        estado = EstadoConversa.query.filter_by(
-            telefone=terceirizado.telefone
-        ).filter(EstadoConversa.contexto.like('%confirmar_os_nlp%')).order_by(EstadoConversa.updated_at.desc()).first()
+        estado = EstadoStore.obter(terceirizado.telefone)
 
-        if not estado:
+        if not estado or estado.get_contexto().get('fluxo') != 'confirmar_os_nlp':
             return "Não há solicitação de OS pendente."
 
         contexto = estado.get_contexto()
@@ -1818,7 +1770,7 @@ Você receberá um lembrete 1 dia antes.
         cancelamentos = ['nao', 'não', 'n', 'no', 'cancelar']
 
         if texto_lower in cancelamentos:
-            db.session.delete(estado)
+            EstadoStore.remover(estado)
             db.session.commit()
             return "❌ Solicitação de OS cancelada."
 
@@ -1868,7 +1820,7 @@ Você receberá um lembrete 1 dia antes.
             pass
 
         db.session.add(nova_os)
-        db.session.delete(estado)
+        EstadoStore.remover(estado)
         db.session.commit()
 
         return f"""✅ *OS CRIADA COM SUCESSO*
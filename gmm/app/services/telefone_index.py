@@ -0,0 +1,141 @@
+import re
+from app.extensions import db
+from app.models.models import Usuario
+from app.models.terceirizados_models import Terceirizado
+from app.models.estoque_models import Fornecedor
+from app.services.whatsapp_service import WhatsAppService
+from app.utils.cache_local import CacheVersionado, invalidar_apos_commit
+
+
+class TelefoneIndex:
+    """
+    Índice em memória telefone → identidade (Terceirizado, Usuario, Fornecedor).
+
+    A chave é o sufixo de 8 dígitos do telefone (mesma regra do antigo
+    LIKE '%<últimos 8 dígitos>'), o que ignora DDI, DDD e máscara.
+    O índice é carregado uma vez por worker (ver CacheVersionado) e invalidado
+    quando um commit altera telefone/ativo das entidades.
+    """
+
+    TIPOS = ('terceirizado', 'usuario', 'fornecedor')
+
+    @staticmethod
+    def chave(telefone) -> str:
+        """Retorna o sufixo de 8 dígitos usado como chave, ou None se o telefone for curto."""
+        digitos = re.sub(r'[^0-9]', '', str(telefone or ''))
+        if len(digitos) < 8:
+            return None
+        return digitos[-8:]
+
+    @classmethod
+    def _carregar(cls) -> dict:
+        """Monta o índice com uma query por tabela (somente registros ativos)."""
+        indice = {}
+
+        def _adicionar(tipo, entidade_id, telefone):
+            chave = cls.chave(telefone)
+            if not chave:
+                return
+            ids = indice.setdefault(chave, {}).setdefault(tipo, [])
+            if entidade_id not in ids:
+                ids.append(entidade_id)
+
+        for tid, tel in db.session.query(Terceirizado.id, Terceirizado.telefone).filter(
+            Terceirizado.ativo == True
+        ).order_by(Terceirizado.id):
+            _adicionar('terceirizado', tid, tel)
+
+        for uid, tel in db.session.query(Usuario.id, Usuario.telefone).filter(
+            Usuario.ativo == True,
+            Usuario.telefone.isnot(None)
+        ).order_by(Usuario.id):
+            _adicionar('usuario', uid, tel)
+
+        for fid, tel, wpp in db.session.query(Fornecedor.id, Fornecedor.telefone, Fornecedor.whatsapp).filter(
+            Fornecedor.ativo == True
+        ).order_by(Fornecedor.id):
+            _adicionar('fornecedor', fid, wpp)
+            _adicionar('fornecedor', fid, tel)
+
+        return indice
+
+    @classmethod
+    def resolver(cls, telefone) -> dict:
+        """
+        Resolve o telefone para ids de entidades ativas, sem SQL no caminho quente.
+        Returns: {'terceirizado': id|None, 'usuario': id|None, 'fornecedor': id|None}
+        """
+        resultado = dict.fromkeys(cls.TIPOS)
+        chave = cls.chave(telefone)
+        if not chave:
+            return resultado
+        entrada = cls._cache.obter().get(chave)
+        if entrada:
+            for tipo, ids in entrada.items():
+                resultado[tipo] = ids[0]
+        return resultado
+
+    @classmethod
+    def buscar_terceirizado(cls, telefone):
+        tid = cls.resolver(telefone)['terceirizado']
+        return db.session.get(Terceirizado, tid) if tid else None
+
+    @classmethod
+    def buscar_usuario(cls, telefone):
+        uid = cls.resolver(telefone)['usuario']
+        return db.session.get(Usuario, uid) if uid else None
+
+    @classmethod
+    def _exato(cls, tipo, modelo, telefone, campos):
+        """
+        Registro de `modelo` com algum dos `campos` de telefone, normalizado,
+        idêntico ao informado; None se nenhum casar ou se mais de um casar.
+        O sufixo do índice só restringe os candidatos.
+        """
+        chave = cls.chave(telefone)
+        ids = cls._cache.obter().get(chave, {}).get(tipo, []) if chave else []
+        if not ids:
+            return None
+        normalizado = WhatsAppService.normalizar_telefone(telefone)
+        candidatos = [
+            r for r in modelo.query.filter(modelo.id.in_(ids)).all()
+            if any(getattr(r, c) and WhatsAppService.normalizar_telefone(getattr(r, c)) == normalizado
+                   for c in campos)
+        ]
+        return candidatos[0] if len(candidatos) == 1 else None
+
+    @classmethod
+    def buscar_usuario_exato(cls, telefone):
+        """
+        Usuario com o telefone normalizado idêntico ao informado, para decisões de
+        autorização: o sufixo de 8 dígitos admite colisões entre números diferentes.
+        Retorna None se nenhum usuário casar ou se mais de um casar (ambíguo).
+        """
+        return cls._exato('usuario', Usuario, telefone, ('telefone',))
+
+    @classmethod
+    def buscar_fornecedor(cls, telefone):
+        fid = cls.resolver(telefone)['fornecedor']
+        return db.session.get(Fornecedor, fid) if fid else None
+
+    @classmethod
+    def buscar_fornecedor_exato(cls, telefone):
+        """
+        Fornecedor com whatsapp ou telefone normalizado idêntico ao informado,
+        para vincular respostas: fornecedores que diferem só no DDD colidem no
+        sufixo. Retorna None se nenhum casar ou se mais de um casar (ambíguo).
+        """
+        return cls._exato('fornecedor', Fornecedor, telefone, ('whatsapp', 'telefone'))
+
+    @classmethod
+    def invalidar(cls):
+        """Descarta o índice local e incrementa a versão global (outros workers recarregam)."""
+        cls._cache.invalidar()
+
+
+TelefoneIndex._cache = CacheVersionado('telefone_index', lambda: TelefoneIndex._carregar(), ttl=600)
+
+# Invalida o índice quando um commit altera telefone/ativo das entidades indexadas
+invalidar_apos_commit(TelefoneIndex._cache, Terceirizado, campos=('telefone', 'ativo'))
+invalidar_apos_commit(TelefoneIndex._cache, Usuario, campos=('telefone', 'ativo'))
+invalidar_apos_commit(TelefoneIndex._cache, Fornecedor, campos=('telefone', 'whatsapp', 'ativo'))
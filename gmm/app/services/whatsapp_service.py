@@ -1,9 +1,16 @@
-import requests
+import os
 import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app
 from app.services.circuit_breaker import CircuitBreaker
+from app.services.controle_envio import ControleEnvio
 from app.services.rate_limiter import RateLimiter
+from app.services.midia_base64 import CorpoMidiaBase64, CacheMidiaBase64
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +22,16 @@ class WhatsAppService:
         POST {MEGA_API_URL}/rest/sendMessage/{MEGA_API_ID}/{tipo}
         Headers: Authorization: Bearer {MEGA_API_TOKEN}
         Body: {"messageData": {"to": "5511999999999@s.whatsapp.net", ...}}
+
+    As requisições usam uma sessão HTTP keep-alive por processo (pool configurável
+    por WHATSAPP_HTTP_*), evitando um handshake TCP/TLS a cada mensagem.
     """
 
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+    _credenciais = None  # (app, url, instance_key, bearer_token)
+
     @staticmethod
     def normalizar_telefone(telefone: str) -> str:
         """
@@ -39,8 +54,8 @@ class WhatsAppService:
         """Valida formato: 55 + 10 ou 11 dígitos (fixo ou celular)"""
         return bool(re.match(r'^55\d{10,11}$', str(telefone)))
 
-    @staticmethod
-    def _get_credentials():
+    @classmethod
+    def _get_credentials(cls):
         """
         Retorna (url_base, instance_key, bearer_token) da MegaAPI.
 
@@ -49,12 +64,69 @@ class WhatsAppService:
           Corresponde a MEGA_API_KEY no .env
         - bearer_token: token de autenticação no header Authorization
           Corresponde a MEGA_API_TOKEN no .env (valor diferente da instance_key)
+
+        Lidas uma vez por aplicação Flask (a config não muda em runtime).
         """
-        url = current_app.config.get('MEGA_API_URL')
-        instance_key = current_app.config.get('MEGA_API_KEY')
-        bearer_token = current_app.config.get('MEGA_API_TOKEN')
+        app = current_app._get_current_object()
+        cache = cls._credenciais
+        if cache is None or cache[0] is not app:
+            cache = (
+                app,
+                app.config.get('MEGA_API_URL'),
+                app.config.get('MEGA_API_KEY'),
+                app.config.get('MEGA_API_TOKEN'),
+            )
+            cls._credenciais = cache
 
-        return url, instance_key, bearer_token
+        return cache[1:]
+
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        """
+        Sessão HTTP compartilhada pelo processo (e por threads de enviar_lote).
+        Recriada após fork, já que workers prefork do Celery não podem herdar sockets.
+        """
+        pid = os.getpid()
+        if cls._session is not None and cls._session_pid == pid:
+            return cls._session
+
+        with cls._session_lock:
+            if cls._session is None or cls._session_pid != pid:
+                config = current_app.config
+                tentativas = config.get('WHATSAPP_HTTP_RETRIES', 2)
+                # Só repete o que a MegaAPI garantidamente não processou: falha de conexão,
+                # 429 e 503. Read timeout não é repetido para não duplicar mensagens.
+                retry = Retry(
+                    total=tentativas,
+                    connect=tentativas,
+                    read=0,
+                    status=tentativas,
+                    status_forcelist=(429, 503),
+                    allowed_methods=frozenset(['GET', 'POST']),
+                    backoff_factor=0.5,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=config.get('WHATSAPP_HTTP_POOL_SIZE', 20),
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls._session = session
+                cls._session_pid = pid
+        return cls._session
+
+    @classmethod
+    def _timeout(cls, leitura: int = None):
+        """Timeout (conexão, leitura) para as chamadas à MegaAPI."""
+        config = current_app.config
+        return (
+            config.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', 5),
+            leitura or config.get('WHATSAPP_HTTP_TIMEOUT', 15),
+        )
 
     @staticmethod
     def _format_phone(telefone: str) -> str:
@@ -64,18 +136,20 @@ class WhatsAppService:
 
     @classmethod
     def enviar_mensagem(cls, telefone: str, texto: str, prioridade: int = 0, notificacao_id: int = None,
-                       arquivo_path: str = None, tipo_midia: str = 'text', caption: str = None):
+                       arquivo_path: str = None, tipo_midia: str = 'text', caption: str = None,
+                       token_reservado: bool = False):
         """
         Envia mensagem via MegaAPI com resiliência e suporte a multimídia.
 
         Args:
             telefone: Número no formato 5511999999999
             texto: Texto da mensagem
-            prioridade: 0=Normal, 1=Alta, 2=Urgente (ignora rate limit)
+            prioridade: 0=Normal, 1=Alta (usa a reserva do balde), 2=Urgente (ignora rate limit)
             notificacao_id: ID da notificação para tracking
             arquivo_path: Caminho do arquivo de mídia (opcional)
             tipo_midia: Tipo de mídia: 'text', 'image', 'audio', 'document'
             caption: Legenda para mídia (opcional)
+            token_reservado: token do Rate Limiter já consumido pelo despachante da FilaEnvio
         """
         # 1. Normalização e Validação
         telefone = cls.normalizar_telefone(telefone)
@@ -83,8 +157,11 @@ class WhatsAppService:
             logger.warning(f"Telefone inválido após normalização: {telefone}")
             return False, {"error": "Telefone inválido"}
 
-        # 2. Circuit Breaker
-        if not CircuitBreaker.should_attempt():
+        # 2. Circuit Breaker + token do Rate Limit num único round trip ao Redis
+        #    (faixa pela prioridade; urgente >= 2 consome, mas não é barrado)
+        controle = ControleEnvio.autorizar(prioridade=prioridade, token_reservado=token_reservado)
+
+        if controle['estado'] == 'OPEN':
             from app.services.sms_service import SMSService
             logger.warning(f"WhatsApp Indisponível (Circuit OPEN). Tentando SMS para {telefone}")
             sucesso_sms, res_sms = SMSService.enviar_sms(telefone, texto)
@@ -92,21 +169,20 @@ class WhatsAppService:
                 return True, {"status": "enviado_via_sms", "details": res_sms}
             return False, {"error": "Circuit breaker OPEN and SMS fallback failed", "code": "CIRCUIT_OPEN_NO_FALLBACK"}
 
-        # 3. Rate Limit (ignorar se prioridade urgente >= 2)
-        if prioridade < 2:
-            pode_enviar, restantes = RateLimiter.check_limit()
-            if not pode_enviar:
-                logger.info(f"Rate limit reached. Enqueueing notification {notificacao_id} for later.")
-                if notificacao_id:
-                    from app.tasks.whatsapp_tasks import enviar_whatsapp_task
-                    enviar_whatsapp_task.apply_async(args=[notificacao_id], countdown=60)
-                return True, {"status": "enfileirado"}
+        # 3. Rate Limit: a notificação vai para a fila de despacho, drenada no ritmo do balde
+        if not controle['permitido']:
+            countdown = RateLimiter.espera_para_countdown(controle['espera'])
+            logger.info(f"Rate limit reached. Enqueueing notification {notificacao_id} for dispatch.")
+            if notificacao_id:
+                cls._enfileirar_despacho(notificacao_id, countdown)
+            return True, {"status": "enfileirado", "espera": countdown}
 
         # 4. Enviar
         recipient = cls._format_phone(telefone)
 
         if arquivo_path and tipo_midia != 'text':
-            return cls._send_media(recipient, arquivo_path, tipo_midia, caption or texto)
+            return cls._send_media(recipient, arquivo_path, tipo_midia, caption or texto,
+                                   circuito_limpo=controle['limpo'])
         else:
             payload = {
                 "messageData": {
@@ -114,7 +190,41 @@ class WhatsAppService:
                     "text": texto
                 }
             }
-            return cls._send_request("text", payload)
+            return cls._send_request("text", payload, circuito_limpo=controle['limpo'])
+
+    @classmethod
+    def enviar_lote(cls, mensagens: list) -> list:
+        """
+        Envia várias mensagens em paralelo por um pool limitado de threads
+        (WHATSAPP_LOTE_MAX_THREADS), reaproveitando as conexões da sessão HTTP.
+
+        Args:
+            mensagens: lista de dicts com os argumentos de enviar_mensagem
+                       (telefone, texto, prioridade, notificacao_id, ...)
+
+        Returns:
+            list: (sucesso, resposta) de cada mensagem, na mesma ordem da entrada
+        """
+        if not mensagens:
+            return []
+
+        app = current_app._get_current_object()
+        max_threads = min(app.config.get('WHATSAPP_LOTE_MAX_THREADS', 8), len(mensagens))
+
+        def _enviar(mensagem):
+            with app.app_context():
+                try:
+                    return cls.enviar_mensagem(**mensagem)
+                except Exception as e:
+                    logger.error(f"Erro no envio em lote para {mensagem.get('telefone')}: {e}")
+                    return False, {"error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='whatsapp-lote') as pool:
+            resultados = list(pool.map(_enviar, mensagens))
+
+        enviados = sum(1 for sucesso, _ in resultados if sucesso)
+        logger.info(f"Envio em lote concluído: {enviados}/{len(mensagens)} mensagens")
+        return resultados
 
     @classmethod
     def send_list_message(cls, phone: str, header: str, body: str, sections: list, button_text: str = "Ver Opções"):
@@ -131,7 +241,8 @@ class WhatsAppService:
         phone = cls.normalizar_telefone(phone)
         if not cls.validar_telefone(phone):
             return False, {"error": "Telefone inválido"}
-        if not CircuitBreaker.should_attempt():
+        controle = ControleEnvio.autorizar(ignorar_limite=True)
+        if controle['estado'] == 'OPEN':
             return False, {"error": "Circuit breaker OPEN"}
 
         recipient = cls._format_phone(phone)
@@ -146,7 +257,7 @@ class WhatsAppService:
             }
         }
 
-        return cls._send_request("listMessage", payload)
+        return cls._send_request("listMessage", payload, circuito_limpo=controle['limpo'])
 
     @classmethod
     def send_buttons_message(cls, phone: str, body: str, buttons: list):
@@ -163,7 +274,8 @@ class WhatsAppService:
             return False, {"error": "Telefone inválido"}
         if len(buttons) > 3:
             return False, {"error": "Máximo de 3 botões permitido"}
-        if not CircuitBreaker.should_attempt():
+        controle = ControleEnvio.autorizar(ignorar_limite=True)
+        if controle['estado'] == 'OPEN':
             return False, {"error": "Circuit breaker OPEN"}
 
         recipient = cls._format_phone(phone)
@@ -176,7 +288,7 @@ class WhatsAppService:
             }
         }
 
-        return cls._send_request("buttonMessage", payload)
+        return cls._send_request("buttonMessage", payload, circuito_limpo=controle['limpo'])
 
     @classmethod
     def enviar_imagem_url(cls, phone: str, url_publica: str, caption: str = None):
@@ -192,7 +304,8 @@ class WhatsAppService:
         phone = cls.normalizar_telefone(phone)
         if not cls.validar_telefone(phone):
             return False, {"error": "Telefone inválido"}
-        if not CircuitBreaker.should_attempt():
+        controle = ControleEnvio.autorizar(ignorar_limite=True)
+        if controle['estado'] == 'OPEN':
             return False, {"error": "Circuit breaker OPEN"}
 
         recipient = cls._format_phone(phone)
@@ -214,7 +327,7 @@ class WhatsAppService:
         }
 
         logger.info(f"[WhatsApp URL] Enviando imagem via URL para {recipient}: {url_publica}")
-        return cls._send_request("mediaUrl", payload)
+        return cls._send_request("mediaUrl", payload, circuito_limpo=controle['limpo'])
 
     @classmethod
     def enviar_documento(cls, phone: str, document_url: str, filename: str, caption: str = None):
@@ -230,7 +343,8 @@ class WhatsAppService:
         phone = cls.normalizar_telefone(phone)
         if not cls.validar_telefone(phone):
             return False, {"error": "Telefone inválido"}
-        if not CircuitBreaker.should_attempt():
+        controle = ControleEnvio.autorizar(ignorar_limite=True)
+        if controle['estado'] == 'OPEN':
             return False, {"error": "Circuit breaker OPEN"}
 
         recipient = cls._format_phone(phone)
@@ -245,7 +359,7 @@ class WhatsAppService:
             }
         }
 
-        return cls._send_request("mediaUrl", payload)
+        return cls._send_request("mediaUrl", payload, circuito_limpo=controle['limpo'])
 
     # Mapeamento explícito de extensões para MIME (fallback para mimetypes.guess_type)
     _MIME_MAP = {
@@ -261,11 +375,30 @@ class WhatsAppService:
         'mp3': 'audio/mpeg',
     }
 
+    @staticmethod
+    def _enfileirar_despacho(notificacao_id: int, countdown: float):
+        from app.extensions import db
+        from app.models.terceirizados_models import HistoricoNotificacao
+        from app.services.fila_envio import FilaEnvio
+        from app.tasks.whatsapp_tasks import enviar_whatsapp_task, despachar_fila_outbound
+
+        notificacao = db.session.get(HistoricoNotificacao, notificacao_id)
+        if notificacao and FilaEnvio.enfileirar(notificacao):
+            if not FilaEnvio.despachante_ativo():
+                despachar_fila_outbound.delay()
+        else:
+            # Sem Redis para a fila: reagenda a própria task para quando o balde liberar
+            enviar_whatsapp_task.apply_async(args=[notificacao_id], countdown=countdown)
+
     @classmethod
-    def _send_media(cls, recipient: str, arquivo_path: str, tipo_midia: str, caption: str = None):
-        """Envia mídia via base64 (MegaAPI endpoint mediaBase64)."""
-        import os
-        import base64
+    def _send_media(cls, recipient: str, arquivo_path: str, tipo_midia: str, caption: str = None,
+                    circuito_limpo: bool = False):
+        """
+        Envia mídia via base64 (MegaAPI endpoint mediaBase64).
+
+        O corpo JSON é gerado em streaming (CorpoMidiaBase64); arquivos repetidos
+        reaproveitam o base64 do CacheMidiaBase64.
+        """
         import mimetypes
 
         if not os.path.exists(arquivo_path):
@@ -281,39 +414,41 @@ class WhatsAppService:
             if not mime_type:
                 mime_type = 'application/octet-stream'
 
-            with open(arquivo_path, 'rb') as f:
-                file_data = base64.b64encode(f.read()).decode('utf-8')
-
-            base64_str = f"data:{mime_type};base64,{file_data}"
             filename = os.path.basename(arquivo_path)
-
-            payload = {
-                "messageData": {
+            corpo = CorpoMidiaBase64(
+                {
                     "to": recipient,
-                    "base64": base64_str,
                     "fileName": filename,
                     "type": tipo_midia,
                     "caption": caption or "",
                     "mimeType": mime_type
-                }
-            }
+                },
+                mime_type,
+                arquivo_path,
+                pre_codificado=CacheMidiaBase64.obter(arquivo_path),
+            )
 
-            logger.info(f"[WhatsApp Media] Enviando {tipo_midia} '{filename}' ({len(file_data)//1024}KB b64) para {recipient}")
-            return cls._send_request("mediaBase64", payload, timeout=60)
+            logger.info(f"[WhatsApp Media] Enviando {tipo_midia} '{filename}' ({corpo.tamanho_base64//1024}KB b64) para {recipient}")
+            try:
+                return cls._send_request("mediaBase64", corpo, timeout=60, circuito_limpo=circuito_limpo)
+            finally:
+                corpo.close()
 
         except Exception as e:
             logger.error(f"[WhatsApp Media] Erro ao preparar mídia '{arquivo_path}': {e}")
             return False, {"error": str(e)}
 
     @classmethod
-    def _send_request(cls, endpoint_type: str, payload: dict, timeout: int = 15):
+    def _send_request(cls, endpoint_type: str, payload: dict, timeout: int = None, circuito_limpo: bool = False):
         """
         Método interno para enviar requisição à MegaAPI.
 
         Args:
             endpoint_type: Tipo de endpoint (text, mediaBase64, listMessage, buttonMessage, etc.)
-            payload: Payload completo da requisição
-            timeout: Timeout em segundos (padrão 15s; use 60s para mídia grande)
+            payload: Payload completo da requisição (dict, ou corpo JSON já serializado/file-like)
+            timeout: Timeout de leitura em segundos (padrão WHATSAPP_HTTP_TIMEOUT; use 60s para mídia grande)
+            circuito_limpo: circuito já estava CLOSED e sem falhas na checagem (ControleEnvio);
+                            nesse caso o sucesso não precisa ser gravado no Redis
 
         Returns:
             tuple: (sucesso: bool, resposta: dict)
@@ -333,17 +468,20 @@ class WhatsAppService:
             "Content-Type": "application/json"
         }
 
+        timeout = cls._timeout(timeout)
+
         try:
-            response = requests.post(
+            corpo = {'json': payload} if isinstance(payload, dict) else {'data': payload}
+            response = cls._get_session().post(
                 endpoint,
-                json=payload,
                 headers=headers,
-                timeout=timeout
+                timeout=timeout,
+                **corpo
             )
 
             if response.status_code in [200, 201]:
-                CircuitBreaker.record_success()
-                RateLimiter.increment()
+                if not circuito_limpo:
+                    CircuitBreaker.record_success()
                 return True, response.json()
             else:
                 CircuitBreaker.record_failure()
@@ -352,8 +490,8 @@ class WhatsAppService:
 
         except requests.exceptions.Timeout:
             CircuitBreaker.record_failure()
-            logger.error(f"MegaAPI timeout [{endpoint_type}] após {timeout}s")
-            return False, {"error": f"Timeout após {timeout}s"}
+            logger.error(f"MegaAPI timeout [{endpoint_type}] após {timeout[1]}s")
+            return False, {"error": f"Timeout após {timeout[1]}s"}
         except requests.exceptions.RequestException as e:
             CircuitBreaker.record_failure()
             logger.error(f"MegaAPI request exception [{endpoint_type}]: {str(e)}")
@@ -395,7 +533,7 @@ class WhatsAppService:
         }
 
         try:
-            response = requests.post(endpoint, json=payload, headers=headers, timeout=10)
+            response = cls._get_session().post(endpoint, json=payload, headers=headers, timeout=cls._timeout(10))
             if response.status_code in [200, 201]:
                 return True, response.json()
             else:
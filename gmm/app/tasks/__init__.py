@@ -1,9 +1,15 @@
-from app.tasks.whatsapp_tasks import enviar_whatsapp_task, limpar_estados_expirados, agregar_metricas_horarias
+from app.tasks.whatsapp_tasks import (
+    enviar_whatsapp_task, limpar_estados_expirados, agregar_metricas_horarias, consumir_fila_inbound,
+    despachar_fila_outbound, gravar_auditoria_estados
+)
 from app.tasks.system_tasks import lembretes_automaticos_task
 
 __all__ = [
     'enviar_whatsapp_task',
     'limpar_estados_expirados',
     'agregar_metricas_horarias',
+    'consumir_fila_inbound',
+    'despachar_fila_outbound',
+    'gravar_auditoria_estados',
     'lembretes_automaticos_task'
 ]
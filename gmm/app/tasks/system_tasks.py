@@ -4,6 +4,8 @@ from app.extensions import db
 from app.models.terceirizados_models import ChamadoExterno, HistoricoNotificacao
 from app.tasks.whatsapp_tasks import enviar_whatsapp_task
 
+MAX_ITENS_ALERTA = 15  # por seção da mensagem de anomalias
+
 @shared_task
 def lembretes_automaticos_task():
     """
@@ -87,9 +89,10 @@ def enviar_morning_briefing_task():
         Usuario.telefone != ''
     ).all()
     
-    for g in gerentes:
-        WhatsAppService.enviar_mensagem(g.telefone, resumo, prioridade=1)
-        
+    WhatsAppService.enviar_lote([
+        {'telefone': g.telefone, 'texto': resumo, 'prioridade': 1} for g in gerentes
+    ])
+
     return {"status": "success", "notified": len(gerentes)}
 
 @shared_task
@@ -116,44 +119,54 @@ def verificar_estoque_critico_task():
         Usuario.telefone != ''
     ).all()
 
-    for d in destinatarios:
-        WhatsAppService.enviar_mensagem(d.telefone, msg, prioridade=1)
+    WhatsAppService.enviar_lote([
+        {'telefone': d.telefone, 'texto': msg, 'prioridade': 1} for d in destinatarios if d.telefone
+    ])
 
     return {"status": "success", "items_alerted": len(itens)}
 
 @shared_task
 def detectar_anomalias_equipamentos_task():
-    """US-008: Alertas preditivos de equipamentos."""
-    from app.models.estoque_models import Equipamento, OrdemServico
+    """
+    US-008: Alertas preditivos de equipamentos.
+    Detecção em lote (AnomaliasService): sem manutenção, taxa de falhas fora
+    da curva na categoria e MTBF em queda.
+    """
     from app.models.models import Usuario
+    from app.services.anomalias_service import AnomaliasService
     from app.services.whatsapp_service import WhatsAppService
 
-    # RF-017: Equipamento sem manutenção há mais de 30 dias
-    limite = datetime.utcnow() - timedelta(days=30)
-    
-    anomalias = []
-    equipamentos = Equipamento.query.filter_by(ativo=True).all()
-
-    for eq in equipamentos:
-        ultima_os = OrdemServico.query.filter_by(equipamento_id=eq.id, status='concluida').order_by(OrdemServico.data_conclusao.desc()).first()
-        
-        if not ultima_os or ultima_os.data_conclusao < limite:
-            anomalias.append(eq)
-
+    resultado = AnomaliasService.detectar()
+    secoes = [
+        # RF-017: Equipamento sem manutenção há mais de 30 dias
+        ("Equipamentos sem manutenção recente (>30 dias)", resultado['sem_manutencao'],
+         lambda a: f"há {a['dias']} dias" if a['dias'] is not None else "nunca"),
+        ("Taxa de falhas fora da curva da categoria", resultado['taxa_falhas'],
+         lambda a: f"{a['corretivas']} corretivas, z={a['z']}"),
+        ("Intervalo entre falhas (MTBF) em queda", resultado['mtbf_em_queda'],
+         lambda a: f"MTBF {a['mtbf_dias']}d, último {a['ultimo_intervalo_dias']}d"),
+    ]
+    anomalias = {a['id'] for _, itens, _ in secoes for a in itens}
     if not anomalias:
         return {"status": "no_anomalies"}
 
-    msg = "🔍 *ANALISADOR PREDITIVO: ALERTAS*\n\nEquipamentos sem manutenção recente (>30 dias):\n\n"
-    for eq in anomalias:
-        msg += f"• *{eq.nome}* ({eq.unidade.nome})\n"
-    
+    msg = "🔍 *ANALISADOR PREDITIVO: ALERTAS*\n"
+    for titulo, itens, detalhe in secoes:
+        if not itens:
+            continue
+        msg += f"\n{titulo}:\n\n"
+        for a in itens[:MAX_ITENS_ALERTA]:
+            msg += f"• *{a['nome']}* ({a['unidade']}) - {detalhe(a)}\n"
+        if len(itens) > MAX_ITENS_ALERTA:
+            msg += f"• ... e mais {len(itens) - MAX_ITENS_ALERTA}\n"
+
     msg += "\nRecomenda-se agendar uma revisão preventiva."
 
     # Notifica gestores
     gestores = Usuario.query.filter(Usuario.tipo.in_(['admin', 'gerente'])).all()
-    for g in gestores:
-        if g.telefone:
-            WhatsAppService.enviar_mensagem(g.telefone, msg)
+    WhatsAppService.enviar_lote([
+        {'telefone': g.telefone, 'texto': msg} for g in gestores if g.telefone
+    ])
 
     return {"status": "success", "anomalies_found": len(anomalias)}
 
@@ -251,11 +264,23 @@ def executar_manutencoes_preventivas_task():
             Usuario.telefone.isnot(None)
         ).all()
 
-        for g in gestores:
-            WhatsAppService.enviar_mensagem(g.telefone, msg, prioridade=1)
+        WhatsAppService.enviar_lote([
+            {'telefone': g.telefone, 'texto': msg, 'prioridade': 1} for g in gestores
+        ])
 
     return {
         "status": "success",
         "oss_criadas": len(oss_criadas),
         "planos_executados": planos_executados
     }
+
+@shared_task
+def atualizar_kpi_diario_task():
+    """
+    Consolida o rollup kpi_diario a partir da marca d'água (dias fechados
+    ainda não processados e dias marcados como sujos).
+    """
+    from app.services.kpi_diario_service import KpiDiarioService
+
+    resultado = KpiDiarioService.atualizar()
+    return {"status": "success", **resultado}
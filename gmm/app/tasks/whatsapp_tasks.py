@@ -1,13 +1,19 @@
 from celery import shared_task
 from datetime import datetime, timedelta
 import json
+import time
 import hashlib
 from app.extensions import db
 from app.models.terceirizados_models import HistoricoNotificacao
-from app.models.whatsapp_models import EstadoConversa, MetricasWhatsApp, ConfiguracaoWhatsApp
+from app.models.whatsapp_models import MetricasWhatsApp, ConfiguracaoWhatsApp
 from app.services.whatsapp_service import WhatsAppService
 from app.services.roteamento_service import RoteamentoService
 from app.services.media_downloader_service import MediaDownloaderService
+from app.services.telefone_index import TelefoneIndex
+from app.services.fila_ingestao import FilaIngestao
+from app.services.fila_envio import FilaEnvio
+from app.services.rate_limiter import RateLimiter
+from app.services.estado_store import EstadoStore
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,7 +28,6 @@ def verificar_saude_whatsapp():
 def _processar_onetap_compra(remetente: str, texto: str) -> bool:
     """Detecta e processa One-Tap de aprovação/rejeição via WhatsApp. Retorna True se tratado."""
     import re
-    from app.models.models import Usuario
     from app.models.estoque_models import PedidoCompra, AprovacaoPedido
 
     m_apr = re.match(r'^aprovar_pedido_(\d+)$', texto.strip(), re.IGNORECASE)
@@ -36,10 +41,8 @@ def _processar_onetap_compra(remetente: str, texto: str) -> bool:
         WhatsAppService.enviar_mensagem(remetente, f"❌ Pedido #{pedido_id} não encontrado.")
         return True
 
-    tel_norm = WhatsAppService.normalizar_telefone(remetente)
-    usuario = Usuario.query.filter(
-        db.or_(Usuario.telefone == tel_norm, Usuario.telefone == remetente)
-    ).first()
+    # Autorização exige o telefone exato (o sufixo do índice admite colisões)
+    usuario = TelefoneIndex.buscar_usuario_exato(remetente)
     if not usuario or usuario.tipo not in ('admin', 'gerente', 'diretor'):
         WhatsAppService.enviar_mensagem(remetente, "❌ Sem permissão para aprovar pedidos.")
         return True
@@ -129,6 +132,9 @@ def processar_mensagem_inbound(remetente: str, texto: str, timestamp: float):
             elif resultado.get('resposta'):
                 WhatsAppService.enviar_mensagem(remetente, resultado['resposta'])
         
+        elif resultado.get('acao') == 'enviar_mensagem' and resultado.get('mensagem'):
+            WhatsAppService.enviar_mensagem(resultado.get('telefone', remetente), resultado['mensagem'])
+
         elif resultado.get('acao') == 'executar_funcao':
              # Em um cenário real, chamariamos a funcão dinamicamente o u via mapping
              # Ex: executar_funcao_sistema(resultado['funcao'], remetente, texto)
@@ -138,22 +144,79 @@ def processar_mensagem_inbound(remetente: str, texto: str, timestamp: float):
         elif resultado.get('acao') == 'encaminhar':
              # Simula encaminhamento
             WhatsAppService.enviar_mensagem(remetente, "Sua mensagem foi encaminhada para um atendente.")
-            
-            # Aqui notificariamos o admin/gerente (Ex: Email, ou msg no WhatsApp do Admin)
-            # destino = resultado['destino'] # gerente, etc
+
+            # Notifica os usuários do perfil configurado na regra (admin, gerente, comprador...)
+            if resultado.get('encaminhar_para'):
+                from app.routes.webhook import _encaminhar_para_perfil
+                _encaminhar_para_perfil(resultado['encaminhar_para'], remetente, texto)
             
     except Exception as e:
         logger.error(f"Erro ao processar inbound: {e}")
         WhatsAppService.enviar_mensagem(remetente, "❌ Erro ao processar sua mensagem. Tente novamente.")
 
+@shared_task
+def consumir_fila_inbound(lote: int = 50):
+    """
+    Drena a fila de ingestão do webhook (modo WHATSAPP_INGESTAO_ASSINCRONA).
+    Acionada a cada evento enfileirado e pelo beat, que também reivindica
+    entregas órfãs de workers interrompidos.
+    """
+    from app.routes.webhook import (
+        registrar_mensagem_inbound, processar_interativo_inbound, baixar_midia_inbound
+    )
+
+    processados = 0
+    for entrada_id, evento in FilaIngestao.ler_lote(quantidade=lote):
+        dados = evento['dados']
+        remetente = evento['remetente']
+        inicio = time.time()
+        FilaIngestao.registrar_latencia('fila', (inicio - evento['enfileirado_em']) * 1000)
+
+        try:
+            notif = registrar_mensagem_inbound(dados, remetente)
+            persistido = time.time()
+            FilaIngestao.registrar_latencia('persistencia', (persistido - inicio) * 1000)
+
+            tipo = dados['tipo']
+            megaapi_id = dados['msg_id'] or None
+            if notif is None and evento.get('reentrega') and not FilaIngestao.ja_roteado(megaapi_id):
+                # O worker anterior gravou a mensagem e morreu antes de rotear
+                notif = HistoricoNotificacao.query.filter_by(megaapi_id=megaapi_id).first()
+                logger.info(f"Evento {entrada_id} reentregue: roteando a mensagem já gravada")
+
+            if notif is None:
+                logger.info(f"Evento {entrada_id} descartado: megaapi_id já registrado no banco")
+            else:
+                if tipo == 'text':
+                    processar_mensagem_inbound(remetente, dados['texto'], dados.get('timestamp'))
+                elif tipo == 'interactive':
+                    processar_interativo_inbound(notif)
+                else:
+                    baixar_midia_inbound(notif, dados['url_midia'], tipo)
+                if megaapi_id:
+                    FilaIngestao.marcar_roteado(megaapi_id)
+            FilaIngestao.registrar_latencia('roteamento', (time.time() - persistido) * 1000)
+        except Exception as e:
+            # Evento com erro não volta para a fila (evita reprocessar mensagens envenenadas)
+            logger.error(f"Erro ao processar evento {entrada_id} da fila de ingestão: {e}", exc_info=True)
+            db.session.rollback()
+            FilaIngestao.incrementar('erros')
+
+        FilaIngestao.confirmar(entrada_id)
+        processados += 1
+
+    return {'processados': processados}
+
 @shared_task(bind=True, max_retries=3)
-def enviar_whatsapp_task(self, notificacao_id: int):
+def enviar_whatsapp_task(self, notificacao_id: int, token_reservado: bool = False):
     """
     Task assíncrona para envio de WhatsApp.
     - Busca notificação no banco
     - Chama WhatsAppService.enviar_mensagem()
     - Atualiza status e tentativas
     - Retry com backoff exponencial: 1min, 5min, 25min (baseado na fórmula do PRD)
+
+    token_reservado: disparada pelo despachante da FilaEnvio, que já consumiu o token.
     """
     notificacao = HistoricoNotificacao.query.get(notificacao_id)
     if not notificacao:
@@ -167,13 +230,14 @@ def enviar_whatsapp_task(self, notificacao_id: int):
         telefone=notificacao.destinatario,
         texto=notificacao.mensagem,
         prioridade=notificacao.prioridade,
-        notificacao_id=notificacao.id
+        notificacao_id=notificacao.id,
+        token_reservado=token_reservado
     )
 
     # Se foi enfileirado pelo Rate Limiter, a task atual termina com sucesso
-    # pois uma nova já foi agendada.
+    # pois ela já está na fila de despacho.
     if sucesso and isinstance(resposta, dict) and resposta.get('status') == 'enfileirado':
-        return {"status": "enfileirado", "notificacao_id": notificacao_id}
+        return {"status": "enfileirado", "notificacao_id": notificacao_id, "espera": resposta.get('espera')}
 
     notificacao.tentativas += 1
     notificacao.resposta_api = json.dumps(resposta) if isinstance(resposta, dict) else str(resposta)
@@ -188,19 +252,69 @@ def enviar_whatsapp_task(self, notificacao_id: int):
         if notificacao.tentativas < self.max_retries:
             delay = 60 * (5 ** (notificacao.tentativas - 1))
             db.session.commit()
-            raise self.retry(countdown=delay)
+            # O retry volta a passar pelo Rate Limiter
+            raise self.retry(countdown=delay, kwargs={})
         else:
             notificacao.status_envio = 'falhou'
             db.session.commit()
             return {"status": "failed", "error": resposta}
 
+@shared_task
+def despachar_fila_outbound():
+    """
+    Drena a FilaEnvio no ritmo exato do token bucket: retira na ordem
+    (prioridade, criado_em, justiça por destinatário), consome o token e dispara
+    enviar_whatsapp_task. Sem token, dorme só a espera informada pelo balde.
+    Acionada quando uma notificação entra na fila e pelo beat (rede de segurança),
+    que também devolve à fila o que um despachante interrompido deixou em voo.
+    """
+    token = FilaEnvio.adquirir_despachante()
+    if not token:
+        return {'status': 'em_execucao'}
+    FilaEnvio.recuperar_em_voo()
+
+    despachados = 0
+    esgotou_tempo = False
+    fim = time.monotonic() + FilaEnvio.DURACAO_DESPACHO
+    try:
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                esgotou_tempo = True
+                break
+            item = FilaEnvio.proximo()
+            if item is None:
+                break
+
+            notificacao_id, pontuacao, dados = item
+            permitido, _restantes, espera = RateLimiter.consumir(dados['prioridade'])
+            if not permitido:
+                FilaEnvio.devolver(notificacao_id, pontuacao)
+                time.sleep(min(espera, restante))
+                continue
+
+            enviar_whatsapp_task.apply_async(args=[notificacao_id], kwargs={'token_reservado': True})
+            FilaEnvio.registrar_despacho(notificacao_id, dados)
+            despachados += 1
+    finally:
+        FilaEnvio.liberar_despachante(token)
+
+    if esgotou_tempo:
+        despachar_fila_outbound.delay()
+    return {'despachados': despachados}
+
 @shared_task
 def limpar_estados_expirados():
-    """Limpa estados de conversa com mais de 24 horas de inatividade."""
-    limite = datetime.utcnow() - timedelta(hours=24)
-    removidos = EstadoConversa.query.filter(EstadoConversa.updated_at < limite).delete()
-    db.session.commit()
-    return {"removidos": removidos}
+    """
+    Limpa estados de conversa com mais de 24 horas de inatividade (backend SQL).
+    No Redis o TTL expira os estados; aqui só sai a auditoria além da retenção.
+    """
+    return {"removidos": EstadoStore.limpar_expirados()}
+
+@shared_task
+def gravar_auditoria_estados():
+    """Grava na tabela whatsapp_estados_conversa as mudanças de estado acumuladas no Redis."""
+    return {"gravados": EstadoStore.gravar_auditoria()}
 
 @shared_task
 def agregar_metricas_horarias():
@@ -0,0 +1,116 @@
+import time
+import logging
+import threading
+import redis
+from app.utils.redis_client import get_redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class CacheVersionado:
+    """
+    Valor derivado do banco, carregado uma vez por processo (worker web ou Celery).
+
+    A invalidação é local e imediata no processo que fez o commit; os demais
+    processos percebem a mudança por um contador de versão no Redis, checado no
+    máximo a cada INTERVALO_VERIFICACAO segundos. O TTL força uma recarga mesmo
+    que o Redis esteja indisponível.
+    """
+
+    INTERVALO_VERIFICACAO = 5  # segundos entre checagens da versão no Redis
+
+    def __init__(self, nome: str, carregar, ttl: int = 600):
+        self.nome = nome
+        self.chave_versao = f'gmm:cache:{nome}:versao'
+        self._carregar = carregar
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._valor = None
+        self._versao = None
+        self._carregado_em = 0.0
+        self._verificado_em = 0.0
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    def _versao_remota(self):
+        try:
+            versao = self._get_redis().get(self.chave_versao)
+            return int(versao) if versao else 0
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            return None
+
+    def obter(self):
+        """Retorna o valor em memória, recarregando apenas se invalidado/expirado."""
+        agora = time.monotonic()
+        valor = self._valor
+
+        if valor is not None and agora - self._carregado_em < self.ttl:
+            if agora - self._verificado_em < self.INTERVALO_VERIFICACAO:
+                return valor
+            versao = self._versao_remota()
+            self._verificado_em = agora
+            if versao is None or versao == self._versao:
+                return valor
+
+        with self._lock:
+            # Outro thread pode ter recarregado enquanto aguardávamos o lock
+            if self._valor is not None and self._valor is not valor:
+                return self._valor
+            versao = self._versao_remota()
+            self._valor = self._carregar()
+            self._versao = versao
+            self._carregado_em = self._verificado_em = time.monotonic()
+            logger.info(f"Cache '{self.nome}' carregado (versão {versao})")
+            return self._valor
+
+    def limpar_local(self):
+        """Descarta apenas a cópia deste processo."""
+        self._valor = None
+
+    def invalidar(self):
+        """Descarta a cópia local e incrementa a versão global (outros workers recarregam)."""
+        self._valor = None
+        try:
+            self._get_redis().incr(self.chave_versao)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning(f"Redis Unavailable: cache '{self.nome}' invalidado apenas localmente.")
+        except RuntimeError:
+            # Fora de app context (scripts de manutenção): basta a invalidação local
+            pass
+
+
+def invalidar_apos_commit(cache: CacheVersionado, modelo, campos=None):
+    """
+    Invalida `cache` quando um commit insere, exclui ou altera registros de `modelo`.
+    Se `campos` for informado, updates que não tocam nesses campos são ignorados.
+    """
+    def _marcar(mapper, connection, target):
+        sessao = inspect(target).session
+        if sessao is not None:
+            sessao.info.setdefault('caches_sujos', set()).add(cache)
+
+    def _ao_atualizar(mapper, connection, target):
+        if campos:
+            estado = inspect(target)
+            if not any(estado.attrs[c].history.has_changes() for c in campos):
+                return
+        _marcar(mapper, connection, target)
+
+    event.listen(modelo, 'after_insert', _marcar)
+    event.listen(modelo, 'after_delete', _marcar)
+    event.listen(modelo, 'after_update', _ao_atualizar)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_caches_sujos(session):
+    for cache in session.info.pop('caches_sujos', ()):
+        cache.invalidar()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_marcacoes(session):
+    session.info.pop('caches_sujos', None)
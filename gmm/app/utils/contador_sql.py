@@ -0,0 +1,412 @@
+import heapq
+import json
+import logging
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+import redis
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.extensions import db
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_SELO_HTML = (
+    '<div id="gmm-sql-contador" title="Queries SQL nesta requisição" style="position:fixed;left:8px;bottom:8px;'
+    'z-index:9999;padding:2px 8px;border-radius:4px;font:12px monospace;color:#fff;background:{cor};">'
+    'SQL: {total}</div>'
+)
+
+# Diretório do pacote `app`: o local de chamada de uma query é o primeiro frame do nosso código
+_RAIZ_APP = str(Path(__file__).resolve().parents[1])
+
+# Medição da requisição / task Celery em andamento (None fora delas)
+_medicao_atual = ContextVar('gmm_sql_medicao', default=None)
+
+
+class ContadorConsultas:
+    """
+    Conta as queries executadas pelo engine dentro de um bloco `with`
+    (usado nos testes de orçamento de queries das páginas).
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine or db.engine
+        self.total = 0
+        self.sqls = []
+
+    def _contar(self, conn, cursor, statement, parameters, context, executemany):
+        self.total += 1
+        self.sqls.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._contar)
+        return False
+
+
+def _local_chamada() -> str:
+    """Primeiro frame do pacote app fora deste módulo, como 'routes/os.py:123 (detalhes)'."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        arquivo = frame.f_code.co_filename
+        if arquivo.startswith(_RAIZ_APP) and arquivo != __file__:
+            relativo = arquivo[len(_RAIZ_APP) + 1:].replace('\\', '/')
+            return f"{relativo}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return '?'
+
+
+class MedicaoSQL:
+    """
+    Queries de uma requisição ou task: total, tempo de banco e as mais lentas.
+    Queries acima de `limite_lenta_ms` são logadas com o local da chamada.
+    """
+
+    MAX_LENTAS = 5
+
+    def __init__(self, nome, limite_lenta_ms=None):
+        self.nome = nome
+        self.limite_lenta_ms = limite_lenta_ms
+        self.consultas = 0
+        self.tempo_ms = 0.0
+        self.lentas = []  # heap (ms, sql, local) com as MAX_LENTAS mais lentas
+        self.inicio = time.perf_counter()
+
+    def registrar(self, statement, ms):
+        self.consultas += 1
+        self.tempo_ms += ms
+        local = None
+        if self.limite_lenta_ms is not None and ms >= self.limite_lenta_ms:
+            local = _local_chamada()
+            logger.warning(f"Query lenta ({ms:.1f} ms) em {local} [{self.nome}]: {' '.join(statement.split())[:500]}")
+        if len(self.lentas) < self.MAX_LENTAS:
+            heapq.heappush(self.lentas, (ms, statement, local))
+        elif ms > self.lentas[0][0]:
+            heapq.heapreplace(self.lentas, (ms, statement, local))
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.inicio) * 1000
+
+    def mais_lentas(self) -> list:
+        return sorted(self.lentas, reverse=True)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _iniciar_cronometro(conn, cursor, statement, parameters, context, executemany):
+    if _medicao_atual.get() is not None:
+        conn.info.setdefault('gmm_sql_inicio', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _registrar_consulta(conn, cursor, statement, parameters, context, executemany):
+    medicao = _medicao_atual.get()
+    inicios = conn.info.get('gmm_sql_inicio')
+    if medicao is not None and inicios:
+        medicao.registrar(statement, (time.perf_counter() - inicios.pop()) * 1000)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _descartar_cronometro(contexto):
+    # Query com erro não chega ao after_cursor_execute
+    conexao = contexto.connection
+    if conexao is not None and conexao.info.get('gmm_sql_inicio'):
+        conexao.info['gmm_sql_inicio'].pop()
+
+
+class AgregadorPerf:
+    """
+    Histogramas por endpoint (queries e tempo de banco por requisição/task)
+    para a página /admin/perf.
+
+    Cada processo acumula localmente e envia os incrementos ao Redis no máximo
+    a cada INTERVALO_ENVIO segundos, somando os dados de todos os workers. Sem
+    Redis, a página mostra só os números deste processo.
+    """
+
+    PREFIXO = 'gmm:perf'
+    INTERVALO_ENVIO = 10
+    TTL = 7 * 86400
+    # Limites superiores dos baldes (o último balde é "acima do maior limite")
+    LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100)
+    LIMITES_DB_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    _lock = threading.Lock()
+    _acumulado = {}  # endpoint -> estatísticas deste processo
+    _pendente = {}   # endpoint -> incrementos ainda não enviados ao Redis
+    _enviado_em = 0.0
+
+    @staticmethod
+    def _get_redis():
+        return get_redis()
+
+    @classmethod
+    def _vazio(cls) -> dict:
+        return {
+            'n': 0, 'consultas': 0, 'db_ms': 0.0, 'total_ms': 0.0,
+            'hist_consultas': [0] * (len(cls.LIMITES_CONSULTAS) + 1),
+            'hist_db': [0] * (len(cls.LIMITES_DB_MS) + 1),
+            'lentas': [],
+        }
+
+    @staticmethod
+    def _balde(limites, valor) -> int:
+        for i, limite in enumerate(limites):
+            if valor <= limite:
+                return i
+        return len(limites)
+
+    @classmethod
+    def _somar(cls, estatisticas, medicao, total_ms, balde_consultas, balde_db, lentas):
+        estatisticas['n'] += 1
+        estatisticas['consultas'] += medicao.consultas
+        estatisticas['db_ms'] += medicao.tempo_ms
+        estatisticas['total_ms'] += total_ms
+        estatisticas['hist_consultas'][balde_consultas] += 1
+        estatisticas['hist_db'][balde_db] += 1
+        # Uma entrada por statement, com o maior tempo visto
+        por_sql = {}
+        for ms, sql, local in sorted(estatisticas['lentas'] + lentas, reverse=True):
+            por_sql.setdefault(sql, (ms, sql, local))
+        estatisticas['lentas'] = list(por_sql.values())[:MedicaoSQL.MAX_LENTAS]
+
+    @classmethod
+    def registrar(cls, endpoint, medicao, total_ms):
+        balde_consultas = cls._balde(cls.LIMITES_CONSULTAS, medicao.consultas)
+        balde_db = cls._balde(cls.LIMITES_DB_MS, medicao.tempo_ms)
+        lentas = [(round(ms, 1), ' '.join(sql.split())[:500], local or '') for ms, sql, local in medicao.lentas]
+        with cls._lock:
+            for destino in (cls._acumulado, cls._pendente):
+                estatisticas = destino.get(endpoint)
+                if estatisticas is None:
+                    estatisticas = destino[endpoint] = cls._vazio()
+                cls._somar(estatisticas, medicao, total_ms, balde_consultas, balde_db, lentas)
+
+    @classmethod
+    def enviar(cls, forcar=False):
+        """Envia os incrementos pendentes ao Redis (requer app context)."""
+        agora = time.monotonic()
+        with cls._lock:
+            if not cls._pendente or (not forcar and agora - cls._enviado_em < cls.INTERVALO_ENVIO):
+                return
+            pendente, cls._pendente = cls._pendente, {}
+            cls._enviado_em = agora
+        try:
+            pipe = cls._get_redis().pipeline(transaction=False)
+            for endpoint, e in pendente.items():
+                chave = f'{cls.PREFIXO}:ep:{endpoint}'
+                pipe.sadd(f'{cls.PREFIXO}:endpoints', endpoint)
+                pipe.hincrby(chave, 'n', e['n'])
+                pipe.hincrby(chave, 'consultas', e['consultas'])
+                pipe.hincrbyfloat(chave, 'db_ms', round(e['db_ms'], 3))
+                pipe.hincrbyfloat(chave, 'total_ms', round(e['total_ms'], 3))
+                for i, qtd in enumerate(e['hist_consultas']):
+                    if qtd:
+                        pipe.hincrby(chave, f'c{i}', qtd)
+                for i, qtd in enumerate(e['hist_db']):
+                    if qtd:
+                        pipe.hincrby(chave, f'd{i}', qtd)
+                pipe.expire(chave, cls.TTL)
+                if e['lentas']:
+                    chave_lentas = f'{cls.PREFIXO}:lentas:{endpoint}'
+                    pipe.zadd(chave_lentas, {
+                        json.dumps({'sql': sql, 'local': local}, ensure_ascii=False): ms for ms, sql, local in e['lentas']
+                    }, gt=True)
+                    pipe.zremrangebyrank(chave_lentas, 0, -MedicaoSQL.MAX_LENTAS - 1)
+                    pipe.expire(chave_lentas, cls.TTL)
+            pipe.expire(f'{cls.PREFIXO}:endpoints', cls.TTL)
+            pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: métricas de SQL mantidas apenas neste processo.")
+
+    @classmethod
+    def _ler_redis(cls) -> dict:
+        cliente = cls._get_redis()
+        endpoints = sorted(e.decode() if isinstance(e, bytes) else e
+                           for e in cliente.smembers(f'{cls.PREFIXO}:endpoints'))
+        pipe = cliente.pipeline(transaction=False)
+        for endpoint in endpoints:
+            pipe.hgetall(f'{cls.PREFIXO}:ep:{endpoint}')
+            pipe.zrevrange(f'{cls.PREFIXO}:lentas:{endpoint}', 0, -1, withscores=True)
+        respostas = pipe.execute()
+
+        dados = {}
+        for endpoint, campos, lentas in zip(endpoints, respostas[::2], respostas[1::2]):
+            if not campos:
+                continue
+            campos = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in campos.items()}
+            e = cls._vazio()
+            e['n'] = int(campos.get('n', 0))
+            e['consultas'] = int(campos.get('consultas', 0))
+            e['db_ms'] = campos.get('db_ms', 0.0)
+            e['total_ms'] = campos.get('total_ms', 0.0)
+            e['hist_consultas'] = [int(campos.get(f'c{i}', 0)) for i in range(len(e['hist_consultas']))]
+            e['hist_db'] = [int(campos.get(f'd{i}', 0)) for i in range(len(e['hist_db']))]
+            for membro, ms in lentas:
+                item = json.loads(membro)
+                e['lentas'].append((round(ms, 1), item['sql'], item['local']))
+            dados[endpoint] = e
+        return dados
+
+    @staticmethod
+    def _percentil_hist(hist, limites, p):
+        """Limite superior do balde que contém o percentil p (None = acima do maior limite)."""
+        total = sum(hist)
+        if not total:
+            return 0
+        alvo, acumulado = p / 100 * total, 0
+        for i, qtd in enumerate(hist):
+            acumulado += qtd
+            if acumulado >= alvo:
+                return limites[i] if i < len(limites) else None
+        return None
+
+    @classmethod
+    def resumo(cls) -> dict:
+        """
+        Estatísticas por endpoint para a página /admin/perf, ordenadas pelo
+        tempo total de banco. 'origem' indica se os números são de todos os
+        workers ('redis') ou só deste processo ('local').
+        """
+        cls.enviar(forcar=True)
+        try:
+            dados, origem = cls._ler_redis(), 'redis'
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: /admin/perf com as métricas deste processo.")
+            with cls._lock:
+                dados = {k: {**v, 'lentas': list(v['lentas'])} for k, v in cls._acumulado.items()}
+            origem = 'local'
+
+        endpoints = []
+        for endpoint, e in dados.items():
+            n = e['n'] or 1
+            endpoints.append({
+                'endpoint': endpoint,
+                'n': e['n'],
+                'media_consultas': round(e['consultas'] / n, 1),
+                'media_db_ms': round(e['db_ms'] / n, 1),
+                'media_total_ms': round(e['total_ms'] / n, 1),
+                'db_total_ms': round(e['db_ms'], 1),
+                'p50_consultas': cls._percentil_hist(e['hist_consultas'], cls.LIMITES_CONSULTAS, 50),
+                'p95_consultas': cls._percentil_hist(e['hist_consultas'], cls.LIMITES_CONSULTAS, 95),
+                'p50_db_ms': cls._percentil_hist(e['hist_db'], cls.LIMITES_DB_MS, 50),
+                'p95_db_ms': cls._percentil_hist(e['hist_db'], cls.LIMITES_DB_MS, 95),
+                'hist_consultas': e['hist_consultas'],
+                'hist_db': e['hist_db'],
+                'lentas': e['lentas'],
+            })
+        endpoints.sort(key=lambda e: e['db_total_ms'], reverse=True)
+        return {
+            'origem': origem,
+            'endpoints': endpoints,
+            'limites_consultas': cls.LIMITES_CONSULTAS,
+            'limites_db_ms': cls.LIMITES_DB_MS,
+        }
+
+    @classmethod
+    def limpar(cls):
+        """Zera as métricas (deste processo e, se disponível, do Redis)."""
+        with cls._lock:
+            cls._acumulado, cls._pendente = {}, {}
+        try:
+            cliente = cls._get_redis()
+            chaves = list(cliente.scan_iter(match=f'{cls.PREFIXO}:*', count=500))
+            if chaves:
+                cliente.delete(*chaves)
+        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError):
+            logger.warning("Redis Unavailable: métricas de SQL zeradas apenas neste processo.")
+
+
+def _limite_lenta(config):
+    limite = config.get('SQL_LENTA_MS')
+    return float(limite) if limite not in (None, '') else None
+
+
+def registrar_contador_requisicao(app):
+    """
+    Instrumentação SQL por requisição (SQL_INSTRUMENTACAO, ligada por padrão):
+    mede queries e tempo de banco, loga as queries acima de SQL_LENTA_MS com o
+    local da chamada e alimenta os histogramas de /admin/perf.
+
+    Em modo debug ou com SQL_CONTADOR=true devolve também os headers
+    X-SQL-Queries e Server-Timing e, em páginas HTML no modo debug, mostra um
+    selo no canto da tela.
+    """
+    def _expor():
+        return app.debug or app.config.get('SQL_CONTADOR')
+
+    def _medir():
+        return app.config.get('SQL_INSTRUMENTACAO', True) or _expor()
+
+    @app.before_request
+    def _iniciar_contador_sql():
+        if _medir():
+            medicao = MedicaoSQL(request.endpoint or request.path, _limite_lenta(app.config))
+            g.sql_medicao = medicao
+            g.sql_medicao_token = _medicao_atual.set(medicao)
+
+    @app.after_request
+    def _reportar_contador_sql(response):
+        medicao = g.get('sql_medicao')
+        if medicao is None:
+            return response
+        total_ms = medicao.total_ms
+        if request.endpoint and request.endpoint != 'static':
+            AgregadorPerf.registrar(request.endpoint, medicao, total_ms)
+            AgregadorPerf.enviar()
+
+        total = medicao.consultas
+        logger.debug(f"{request.method} {request.path}: {total} queries SQL, {medicao.tempo_ms:.1f} ms")
+        if not _expor():
+            return response
+        response.headers['X-SQL-Queries'] = str(total)
+        response.headers['Server-Timing'] = (
+            f'db;dur={medicao.tempo_ms:.1f};desc="{total} queries", app;dur={total_ms:.1f}'
+        )
+        if app.debug and response.mimetype == 'text/html' and not response.direct_passthrough:
+            html = response.get_data(as_text=True)
+            if '</body>' in html:
+                selo = _SELO_HTML.format(total=total, cor='#198754' if total <= 15 else '#dc3545')
+                response.set_data(html.replace('</body>', selo + '</body>', 1))
+        return response
+
+    @app.teardown_request
+    def _encerrar_contador_sql(exc):
+        token = g.pop('sql_medicao_token', None)
+        if token is not None:
+            _medicao_atual.reset(token)
+
+
+def registrar_instrumentacao_celery(app):
+    """Mesma medição por task Celery (endpoint 'celery:<nome da task>')."""
+    from celery.signals import task_prerun, task_postrun
+
+    em_andamento = {}  # task_id -> (medicao, token)
+
+    @task_prerun.connect(weak=False)
+    def _iniciar_medicao_task(task_id=None, task=None, **kwargs):
+        if app.config.get('SQL_INSTRUMENTACAO', True):
+            medicao = MedicaoSQL(f'celery:{task.name}', _limite_lenta(app.config))
+            em_andamento[task_id] = (medicao, _medicao_atual.set(medicao))
+
+    @task_postrun.connect(weak=False)
+    def _encerrar_medicao_task(task_id=None, task=None, **kwargs):
+        item = em_andamento.pop(task_id, None)
+        if item is None:
+            return
+        medicao, token = item
+        try:
+            _medicao_atual.reset(token)
+        except ValueError:
+            _medicao_atual.set(None)  # postrun em outro contexto (pool de threads)
+        AgregadorPerf.registrar(medicao.nome, medicao, medicao.total_ms)
+        with app.app_context():
+            AgregadorPerf.enviar()
@@ -0,0 +1,43 @@
+import statistics
+
+
+def percentil(amostras_ordenadas, p):
+    """Percentil por posição (nearest-rank) de uma lista já ordenada."""
+    if not amostras_ordenadas:
+        return 0
+    indice = max(0, min(len(amostras_ordenadas) - 1, int(round(p / 100 * len(amostras_ordenadas))) - 1))
+    return round(amostras_ordenadas[indice], 1)
+
+
+def z_robustos(valores):
+    """
+    z-score robusto (Iglewicz-Hoaglin) de cada valor: 0,6745·(x − mediana)/MAD.
+    Mediana e MAD não são arrastadas pelo próprio outlier, ao contrário de
+    média e desvio padrão. Com MAD = 0 usa o desvio médio absoluto
+    (1,2533·MeanAD); se os valores forem todos iguais, tudo é 0.
+    """
+    if not valores:
+        return []
+    mediana = statistics.median(valores)
+    desvios = [abs(v - mediana) for v in valores]
+    mad = statistics.median(desvios)
+    if mad:
+        return [0.6745 * (v - mediana) / mad for v in valores]
+    media_desvios = sum(desvios) / len(desvios)
+    if not media_desvios:
+        return [0.0] * len(valores)
+    return [(v - mediana) / (1.253314 * media_desvios) for v in valores]
+
+
+def tendencia_relativa(valores):
+    """
+    Variação da reta de mínimos quadrados ao longo da série, relativa à média
+    (−0,5 = a tendência caiu metade da média do primeiro ao último ponto).
+    """
+    if len(valores) < 2:
+        return 0.0
+    media = sum(valores) / len(valores)
+    if not media:
+        return 0.0
+    inclinacao, _ = statistics.linear_regression(range(len(valores)), valores)
+    return inclinacao * (len(valores) - 1) / media
@@ -0,0 +1,35 @@
+import threading
+import redis
+from flask import current_app
+
+_lock = threading.Lock()
+_clientes = {}
+
+
+def get_redis() -> redis.Redis:
+    """
+    Cliente Redis compartilhado: um ConnectionPool por URL, por processo.
+
+    Substitui o redis.from_url() a cada chamada (que abria uma conexão nova
+    por operação). O ConnectionPool do redis-py detecta fork e recria as
+    conexões no processo filho (workers prefork do Celery).
+    """
+    config = current_app.config
+    url = config.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+
+    cliente = _clientes.get(url)
+    if cliente is None:
+        with _lock:
+            cliente = _clientes.get(url)
+            if cliente is None:
+                timeout = config.get('REDIS_SOCKET_TIMEOUT', 2)
+                pool = redis.ConnectionPool.from_url(
+                    url,
+                    max_connections=config.get('REDIS_MAX_CONNECTIONS', 50),
+                    socket_connect_timeout=timeout,
+                    socket_timeout=timeout,
+                    health_check_interval=30,
+                )
+                cliente = redis.Redis(connection_pool=pool)
+                _clientes[url] = cliente
+    return cliente
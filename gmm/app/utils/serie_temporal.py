@@ -0,0 +1,87 @@
+from array import array
+from datetime import date, timedelta
+
+RESOLUCOES = ('dia', 'semana', 'mes')
+
+# Pontos máximos por série pedidos via API (~2 anos por dia, ~5 por semana, 10 por mês)
+MAX_PONTOS = {'dia': 732, 'semana': 262, 'mes': 120}
+
+
+class EixoTemporal:
+    """
+    Eixo denso de `inicio` a `fim` (inclusive) na resolução pedida: um ponto por
+    dia, por semana (início na segunda-feira) ou por mês, sem buracos.
+    """
+
+    def __init__(self, inicio: date, fim: date, resolucao: str = 'dia'):
+        if resolucao not in RESOLUCOES:
+            raise ValueError(f"Resolução inválida: {resolucao!r} (use {', '.join(RESOLUCOES)})")
+        if fim < inicio:
+            raise ValueError(f"Período invertido: {inicio} > {fim}")
+        self.resolucao = resolucao
+        self.inicio = self.balde(inicio)
+        self.fim = self.balde(fim)
+        self.tamanho = self._posicao(self.fim) + 1
+
+    def balde(self, dia: date) -> date:
+        """Primeiro dia do intervalo (dia, semana ou mês) que contém `dia`."""
+        if self.resolucao == 'semana':
+            return dia - timedelta(days=dia.weekday())
+        if self.resolucao == 'mes':
+            return dia.replace(day=1)
+        return dia
+
+    def _posicao(self, balde: date) -> int:
+        if self.resolucao == 'mes':
+            return (balde.year - self.inicio.year) * 12 + balde.month - self.inicio.month
+        dias = (balde - self.inicio).days
+        return dias // 7 if self.resolucao == 'semana' else dias
+
+    def indice(self, dia: date):
+        """Posição de `dia` no eixo, ou None se estiver fora do intervalo."""
+        posicao = self._posicao(self.balde(dia))
+        return posicao if 0 <= posicao < self.tamanho else None
+
+    def datas(self) -> list:
+        if self.resolucao == 'mes':
+            meses = self.inicio.year * 12 + self.inicio.month - 1
+            return [date((meses + n) // 12, (meses + n) % 12 + 1, 1) for n in range(self.tamanho)]
+        passo = 7 if self.resolucao == 'semana' else 1
+        return [self.inicio + timedelta(days=n * passo) for n in range(self.tamanho)]
+
+    def rotulos(self) -> list:
+        formato = '%m/%Y' if self.resolucao == 'mes' else '%d/%m'
+        if self.resolucao == 'dia' and self.inicio.year != self.fim.year:
+            formato = '%d/%m/%y'
+        return [d.strftime(formato) for d in self.datas()]
+
+
+class SeriesTemporais:
+    """
+    Conjunto de séries numéricas alinhadas a um EixoTemporal, guardadas em
+    colunas `array('d')` pré-preenchidas com zero: dias sem movimento viram 0
+    em vez de sumirem do gráfico. Cada série é identificada por uma chave
+    qualquer (ex.: 'pecas' ou ('pecas', unidade_id)).
+    """
+
+    def __init__(self, eixo: EixoTemporal):
+        self.eixo = eixo
+        self._vazia = array('d', bytes(8 * eixo.tamanho))
+        self._colunas = {}
+
+    def coluna(self, chave) -> array:
+        coluna = self._colunas.get(chave)
+        if coluna is None:
+            coluna = self._colunas[chave] = array('d', self._vazia)
+        return coluna
+
+    def somar(self, chave, dia: date, valor) -> None:
+        indice = self.eixo.indice(dia)
+        if indice is not None and valor:
+            self.coluna(chave)[indice] += float(valor)
+
+    def chaves(self) -> list:
+        return list(self._colunas)
+
+    def lista(self, chave, casas: int = 2) -> list:
+        return [round(v, casas) for v in self._colunas.get(chave, self._vazia)]
@@ -0,0 +1,38 @@
+from sqlalchemy import Float
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class horas_entre(FunctionElement):
+    """
+    Duração em horas (float) entre duas colunas DateTime, calculada no banco.
+
+    `fim - inicio` não é portável: no Postgres vira interval, no SQLite subtrai
+    os textos das datas (só os anos). Uso: horas_entre(OS.data_abertura, OS.data_conclusao)
+    """
+    type = Float()
+    name = 'horas_entre'
+    inherit_cache = True
+
+
+def _operandos(elemento, compiler, **kw):
+    inicio, fim = elemento.clauses
+    return compiler.process(inicio, **kw), compiler.process(fim, **kw)
+
+
+@compiles(horas_entre)
+def _horas_entre_postgres(elemento, compiler, **kw):
+    inicio, fim = _operandos(elemento, compiler, **kw)
+    return f"(EXTRACT(EPOCH FROM ({fim} - {inicio})) / 3600.0)"
+
+
+@compiles(horas_entre, 'sqlite')
+def _horas_entre_sqlite(elemento, compiler, **kw):
+    inicio, fim = _operandos(elemento, compiler, **kw)
+    return f"((julianday({fim}) - julianday({inicio})) * 24.0)"
+
+
+@compiles(horas_entre, 'mysql')
+def _horas_entre_mysql(elemento, compiler, **kw):
+    inicio, fim = _operandos(elemento, compiler, **kw)
+    return f"(TIMESTAMPDIFF(SECOND, {inicio}, {fim}) / 3600.0)"
@@ -0,0 +1,13 @@
+import unicodedata
+
+
+def sem_acentos(texto) -> str:
+    """
+    Forma canônica para busca: minúsculas e sem acentos/cedilha
+    ("Manutenção Elétrica" -> "manutencao eletrica"). Aplicada tanto ao texto
+    indexado quanto aos termos pesquisados.
+    """
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
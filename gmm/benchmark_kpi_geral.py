@@ -0,0 +1,151 @@
+"""
+Benchmark de AnalyticsService.get_kpi_geral: versão anterior (6 consultas nas
+tabelas de origem) x versão atual (rollup kpi_diario + dia corrente ao vivo),
+sobre uma base semeada com 100k OS.
+
+Uso:
+    python benchmark_kpi_geral.py                 # SQLite temporário
+    BENCH_DATABASE_URL=postgresql://... python benchmark_kpi_geral.py
+    python benchmark_kpi_geral.py --os 20000 --repeticoes 10
+"""
+import os
+import random
+import argparse
+import tempfile
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from sqlalchemy import func, insert
+
+from app.extensions import db
+from app.models.estoque_models import OrdemServico, MovimentacaoEstoque, Estoque
+from app.models.terceirizados_models import ChamadoExterno
+from app.services.analytics_service import AnalyticsService
+from app.services.kpi_diario_service import KpiDiarioService
+
+
+def kpi_geral_legado(unidade_id=None, days=30):
+    """Implementação anterior (uma consulta por KPI), mantida só para comparação."""
+    start_date = datetime.utcnow() - timedelta(days=days)
+    os_filter = [OrdemServico.data_abertura >= start_date]
+    mov_filter = [MovimentacaoEstoque.data_movimentacao >= start_date, MovimentacaoEstoque.tipo_movimentacao == 'consumo']
+    chamado_filter = [ChamadoExterno.criado_em >= start_date]
+    if unidade_id:
+        os_filter.append(OrdemServico.unidade_id == unidade_id)
+        mov_filter.append(MovimentacaoEstoque.unidade_id == unidade_id)
+        chamado_filter.append(OrdemServico.unidade_id == unidade_id)
+
+    mttr = db.session.query(
+        func.avg(OrdemServico.data_conclusao - OrdemServico.data_abertura)
+    ).filter(OrdemServico.status == 'concluida', OrdemServico.data_conclusao.isnot(None), *os_filter).scalar()
+    mttr_hours = mttr.total_seconds() / 3600 if hasattr(mttr, 'total_seconds') else 0
+
+    custo_pecas = db.session.query(
+        func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
+    ).join(Estoque).filter(*mov_filter).scalar() or Decimal('0.00')
+    custo_servicos = db.session.query(
+        func.sum(ChamadoExterno.valor_final)
+    ).join(OrdemServico, ChamadoExterno.os_id == OrdemServico.id).filter(*chamado_filter).scalar() or Decimal('0.00')
+
+    total_os = OrdemServico.query.filter(*os_filter).count()
+    concluidas = OrdemServico.query.filter(OrdemServico.status == 'concluida', *os_filter).count()
+    backlog_critico = OrdemServico.query.filter(
+        OrdemServico.status == 'aberta',
+        OrdemServico.data_abertura <= datetime.utcnow() - timedelta(days=7),
+        *([OrdemServico.unidade_id == unidade_id] if unidade_id else [])
+    ).count()
+    return mttr_hours, custo_pecas, custo_servicos, total_os, concluidas, backlog_critico
+
+
+def semear(total_os: int):
+    random.seed(42)
+    agora = datetime.utcnow()
+    lote = []
+    for i in range(total_os):
+        abertura = agora - timedelta(days=random.uniform(0, 365))
+        concluida = random.random() < 0.7
+        lote.append({
+            'numero_os': f'B{i:07d}', 'tecnico_id': random.randint(1, 40), 'unidade_id': random.randint(1, 8),
+            'tipo_manutencao': random.choice(['preventiva', 'corretiva']), 'descricao_problema': 'bench',
+            'status': 'concluida' if concluida else random.choice(['aberta', 'em_andamento']),
+            'prazo_conclusao': abertura + timedelta(days=3), 'data_abertura': abertura,
+            'data_conclusao': abertura + timedelta(hours=random.uniform(1, 96)) if concluida else None,
+        })
+        if len(lote) == 5000:
+            db.session.execute(insert(OrdemServico), lote)
+            lote = []
+    if lote:
+        db.session.execute(insert(OrdemServico), lote)
+
+    db.session.execute(insert(Estoque), [
+        {'codigo': f'P{i}', 'nome': f'Peça {i}', 'unidade_medida': 'un', 'valor_unitario': random.uniform(1, 500)}
+        for i in range(500)
+    ])
+    db.session.execute(insert(MovimentacaoEstoque), [
+        {'estoque_id': random.randint(1, 500), 'tipo_movimentacao': 'consumo', 'quantidade': random.randint(1, 5),
+         'unidade_id': random.randint(1, 8), 'usuario_id': 1,
+         'data_movimentacao': agora - timedelta(days=random.uniform(0, 365))}
+        for _ in range(total_os // 2)
+    ])
+    db.session.execute(insert(ChamadoExterno), [
+        {'numero_chamado': f'BC{i:07d}', 'os_id': random.randint(1, total_os), 'terceirizado_id': 1,
+         'titulo': 'bench', 'descricao': 'bench', 'prazo_combinado': agora, 'criado_por': 1,
+         'valor_final': random.uniform(50, 5000), 'criado_em': agora - timedelta(days=random.uniform(0, 365))}
+        for i in range(total_os // 10)
+    ])
+    db.session.commit()
+
+
+def medir(funcao, repeticoes: int, **kwargs) -> float:
+    funcao(**kwargs)  # aquece cache de páginas/planos
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(**kwargs)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--os', type=int, default=100_000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    url = os.environ.get('BENCH_DATABASE_URL')
+    arquivo_tmp = None
+    if not url:
+        arquivo_tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        url = f'sqlite:///{arquivo_tmp.name}'
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(app)
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            print(f"Semeando {args.os} OS em {db.engine.dialect.name}...")
+            semear(args.os)
+            inicio = time.perf_counter()
+            carga = KpiDiarioService.atualizar()
+            print(f"Carga inicial do kpi_diario: {carga['linhas']} linhas em "
+                  f"{(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+            for rotulo, kwargs in (('todas as unidades', {}), ('unidade 3', {'unidade_id': 3}),
+                                   ('365 dias', {'days': 365})):
+                legado = medir(kpi_geral_legado, args.repeticoes, **kwargs)
+                atual = medir(AnalyticsService.get_kpi_geral, args.repeticoes, **kwargs)
+                print(f"[{rotulo}] legado: {legado:.1f} ms | rollup: {atual:.1f} ms | "
+                      f"{legado / atual:.2f}x")
+            db.drop_all()
+    finally:
+        if arquivo_tmp:
+            os.unlink(arquivo_tmp.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,16 +23,45 @@ class Config:
         SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'instance', 'gmm.db')
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Medição de queries/tempo de banco por requisição e task Celery (/admin/perf)
+    SQL_INSTRUMENTACAO = os.environ.get('SQL_INSTRUMENTACAO', 'true').lower() == 'true'
+    # Queries acima deste tempo (ms) vão para o log com o local da chamada
+    SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS') or 200)
+    # Headers X-SQL-Queries e Server-Timing fora do modo debug
+    SQL_CONTADOR = os.environ.get('SQL_CONTADOR', 'false').lower() == 'true'
     
     # Redis configuration
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or 'redis://localhost:6379/0'
+    # Pool compartilhado dos serviços (rate limit, circuit breaker, filas, caches)
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS') or 50)
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT') or 2)
     
     # WhatsApp (MegaAPI)
     MEGA_API_URL = os.environ.get('MEGA_API_URL') or 'https://apistart01.megaapi.com.br'
     MEGA_API_KEY = os.environ.get('MEGA_API_KEY')
     MEGA_API_TOKEN = os.environ.get('MEGA_API_TOKEN')
     MEGA_API_ID = os.environ.get('MEGA_API_ID')
+
+    # Cliente HTTP da MegaAPI (sessão keep-alive por processo)
+    WHATSAPP_HTTP_POOL_SIZE = int(os.environ.get('WHATSAPP_HTTP_POOL_SIZE') or 20)
+    WHATSAPP_HTTP_RETRIES = int(os.environ.get('WHATSAPP_HTTP_RETRIES') or 2)
+    WHATSAPP_HTTP_CONNECT_TIMEOUT = float(os.environ.get('WHATSAPP_HTTP_CONNECT_TIMEOUT') or 5)
+    WHATSAPP_HTTP_TIMEOUT = float(os.environ.get('WHATSAPP_HTTP_TIMEOUT') or 15)
+    WHATSAPP_LOTE_MAX_THREADS = int(os.environ.get('WHATSAPP_LOTE_MAX_THREADS') or 8)
+    # Orçamento (MB, por processo) do cache de mídia já codificada em base64
+    WHATSAPP_MIDIA_CACHE_MB = int(os.environ.get('WHATSAPP_MIDIA_CACHE_MB') or 64)
+
+    # Ingestão do webhook: se ativa, o webhook só enfileira (Redis Stream) e os workers roteiam
+    WHATSAPP_INGESTAO_ASSINCRONA = os.environ.get('WHATSAPP_INGESTAO_ASSINCRONA', 'false').lower() == 'true'
+    WHATSAPP_INGESTAO_MAX_PENDENTES = int(os.environ.get('WHATSAPP_INGESTAO_MAX_PENDENTES') or 5000)
+
+    # Estado das conversas do bot: 'redis' (hash com TTL de 24h) ou 'sql' (tabela whatsapp_estados_conversa)
+    ESTADO_CONVERSA_BACKEND = os.environ.get('ESTADO_CONVERSA_BACKEND') or 'redis'
+    # Com o backend Redis, copia cada mudança de estado para a tabela (write-behind, auditoria)
+    ESTADO_CONVERSA_AUDITORIA = os.environ.get('ESTADO_CONVERSA_AUDITORIA', 'true').lower() == 'true'
+    # Dias que as linhas de auditoria ficam na tabela (limpar_estados_expirados apaga as mais antigas)
+    ESTADO_CONVERSA_RETENCAO_DIAS = int(os.environ.get('ESTADO_CONVERSA_RETENCAO_DIAS') or 30)
     
     # Inteligência Artificial
     AI_PROVIDER = os.environ.get('AI_PROVIDER') or 'openai'  # 'openai' ou 'gemini'
@@ -83,4 +112,24 @@ class Config:
             'task': 'app.tasks.email_tasks.monitorar_email_task',
             'schedule': crontab(minute='*/10'), # A cada 10 minutos
         },
+        'drenar-fila-inbound-whatsapp': {
+            'task': 'app.tasks.whatsapp_tasks.consumir_fila_inbound',
+            'schedule': crontab(minute='*'), # Rede de segurança da ingestão assíncrona
+        },
+        'despachar-fila-outbound-whatsapp': {
+            'task': 'app.tasks.whatsapp_tasks.despachar_fila_outbound',
+            'schedule': crontab(minute='*'), # Rede de segurança do despacho outbound
+        },
+        'gravar-auditoria-estados-conversa': {
+            'task': 'app.tasks.whatsapp_tasks.gravar_auditoria_estados',
+            'schedule': crontab(minute='*'), # Write-behind do EstadoStore (Redis -> tabela)
+        },
+        'limpar-estados-conversa': {
+            'task': 'app.tasks.whatsapp_tasks.limpar_estados_expirados',
+            'schedule': crontab(hour=3, minute=30), # Estados expirados (SQL) / retenção da auditoria (Redis)
+        },
+        'atualizar-kpi-diario': {
+            'task': 'app.tasks.system_tasks.atualizar_kpi_diario_task',
+            'schedule': crontab(minute='*/10'), # Rollup incremental dos KPIs (dias fechados e sujos)
+        },
     }
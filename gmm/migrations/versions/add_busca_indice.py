@@ -0,0 +1,70 @@
+"""GMM v4.3 - Índice unificado da busca global (busca_indice + FTS5/pg_trgm)
+
+Revision ID: add_busca_indice
+Revises: add_kpi_diario
+Create Date: 2026-03-10
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_busca_indice'
+down_revision = 'add_kpi_diario'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS busca_fts USING fts5("
+    "texto, content='busca_indice', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_ai AFTER INSERT ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(rowid, texto) VALUES (new.id, new.texto); END",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_ad AFTER DELETE ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(busca_fts, rowid, texto) VALUES ('delete', old.id, old.texto); END",
+    "CREATE TRIGGER IF NOT EXISTS busca_indice_au AFTER UPDATE ON busca_indice BEGIN "
+    "INSERT INTO busca_fts(busca_fts, rowid, texto) VALUES ('delete', old.id, old.texto); "
+    "INSERT INTO busca_fts(rowid, texto) VALUES (new.id, new.texto); END",
+)
+
+
+def _sqlite_tem_fts_trigram(bind):
+    versao = bind.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(p) for p in versao.split('.')[:2]) < (3, 34):
+        return False
+    return bool(bind.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def upgrade():
+    # ── documentos pesquisáveis (um por OS/equipamento/peça/fornecedor/terceirizado/usuário) ──
+    op.create_table('busca_indice',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entidade', sa.String(length=20), nullable=False),
+        sa.Column('entidade_id', sa.Integer(), nullable=False),
+        sa.Column('titulo', sa.String(length=255), nullable=False),
+        sa.Column('subtitulo', sa.String(length=255), nullable=True),
+        sa.Column('texto', sa.Text(), nullable=False),
+        sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('busca_indice', schema=None) as batch_op:
+        batch_op.create_index('ix_busca_indice_entidade', ['entidade', 'entidade_id'], unique=True)
+
+    # ── índice textual do banco ─────────────────────────────────────────────
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite' and _sqlite_tem_fts_trigram(bind):
+        for comando in SQLITE_FTS:
+            op.execute(comando)
+    elif bind.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_busca_indice_texto_trgm ON busca_indice USING gin (texto gin_trgm_ops)")
+    # A carga inicial é feita por reindexar_busca.py
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS busca_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_busca_indice_texto_trgm")
+    with op.batch_alter_table('busca_indice', schema=None) as batch_op:
+        batch_op.drop_index('ix_busca_indice_entidade')
+    op.drop_table('busca_indice')
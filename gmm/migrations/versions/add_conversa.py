@@ -0,0 +1,41 @@
+"""GMM v4.4 - Resumo das conversas da central de chat (tabela conversa)
+
+Revision ID: add_conversa
+Revises: add_busca_indice
+Create Date: 2026-03-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_conversa'
+down_revision = 'add_busca_indice'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ── uma linha por telefone normalizado (mantida pelo ConversaService) ──
+    op.create_table('conversa',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('telefone', sa.String(length=20), nullable=False),
+        sa.Column('nome_contato', sa.String(length=150), nullable=True),
+        sa.Column('nome_origem', sa.String(length=20), nullable=True),
+        sa.Column('ultima_mensagem_id', sa.Integer(), nullable=True),
+        sa.Column('ultima_msg_em', sa.DateTime(), nullable=True),
+        sa.Column('ultima_direcao', sa.String(length=10), nullable=True),
+        sa.Column('ultima_preview', sa.String(length=120), nullable=True),
+        sa.Column('nao_lidas', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('telefone')
+    )
+    with op.batch_alter_table('conversa', schema=None) as batch_op:
+        batch_op.create_index('ix_conversa_ultima_msg_em', ['ultima_msg_em'], unique=False)
+    # A carga inicial é feita por reconstruir_conversas.py
+
+
+def downgrade():
+    with op.batch_alter_table('conversa', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversa_ultima_msg_em')
+    op.drop_table('conversa')
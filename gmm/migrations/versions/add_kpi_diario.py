@@ -0,0 +1,88 @@
+"""GMM v4.3 - Rollup diário de KPIs (kpi_diario) com marca d'água e dias sujos
+
+Revision ID: add_kpi_diario
+Revises: add_megaapi_id_unico
+Create Date: 2026-03-10
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_kpi_diario'
+down_revision = 'add_megaapi_id_unico'
+branch_labels = None
+depends_on = None
+
+INDICES_DATA = (
+    ('ordens_servico', 'data_abertura'),
+    ('movimentacoes_estoque', 'data_movimentacao'),
+    ('chamados_externos', 'criado_em'),
+    ('chamados_externos', 'data_conclusao'),
+    ('pedidos_compra', 'data_solicitacao'),
+)
+
+
+def upgrade():
+    # ── rollup por (dia, unidade) ──────────────────────────────────────────
+    op.create_table('kpi_diario',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('dia', sa.Date(), nullable=False),
+        sa.Column('unidade_id', sa.Integer(), nullable=True),
+        sa.Column('os_abertas', sa.Integer(), nullable=False),
+        sa.Column('os_concluidas', sa.Integer(), nullable=False),
+        sa.Column('mttr_horas_soma', sa.Float(), nullable=False),
+        sa.Column('mttr_qtd', sa.Integer(), nullable=False),
+        sa.Column('custo_pecas', sa.Numeric(precision=16, scale=4), nullable=False),
+        sa.Column('custo_servicos', sa.Numeric(precision=16, scale=4), nullable=False),
+        sa.Column('custo_servicos_concluidos', sa.Numeric(precision=16, scale=4), nullable=False),
+        sa.Column('compras_empenhado', sa.Numeric(precision=16, scale=4), nullable=False),
+        sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['unidade_id'], ['unidades.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('kpi_diario', schema=None) as batch_op:
+        batch_op.create_index('ix_kpi_diario_dia_unidade', ['dia', 'unidade_id'], unique=True)
+
+    # ── marca d'água ───────────────────────────────────────────────────────
+    op.create_table('kpi_diario_controle',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('processado_ate', sa.Date(), nullable=True),
+        sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # ── dias consolidados a recalcular ─────────────────────────────────────
+    op.create_table('kpi_diario_sujo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('dia', sa.Date(), nullable=False),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('kpi_diario_sujo', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_kpi_diario_sujo_dia'), ['dia'], unique=False)
+    # A carga inicial é feita pela primeira execução de atualizar_kpi_diario_task
+
+    # ── datas de evento: agregação ao vivo do dia corrente sem varrer as tabelas ──
+    for tabela, coluna in INDICES_DATA:
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.create_index(batch_op.f(f'ix_{tabela}_{coluna}'), [coluna], unique=False)
+
+    # ── backlog crítico (status = 'aberta' e abertura antiga) ───────────────
+    with op.batch_alter_table('ordens_servico', schema=None) as batch_op:
+        batch_op.create_index('ix_ordens_servico_status_abertura', ['status', 'data_abertura'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ordens_servico', schema=None) as batch_op:
+        batch_op.drop_index('ix_ordens_servico_status_abertura')
+    for tabela, coluna in INDICES_DATA:
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{tabela}_{coluna}'))
+
+    with op.batch_alter_table('kpi_diario_sujo', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_kpi_diario_sujo_dia'))
+    op.drop_table('kpi_diario_sujo')
+    op.drop_table('kpi_diario_controle')
+    with op.batch_alter_table('kpi_diario', schema=None) as batch_op:
+        batch_op.drop_index('ix_kpi_diario_dia_unidade')
+    op.drop_table('kpi_diario')
@@ -0,0 +1,45 @@
+"""GMM v4.2 - Índice único em historico_notificacoes.megaapi_id (dedup do webhook)
+
+Revision ID: add_megaapi_id_unico
+Revises: merge_multi_heads
+Create Date: 2026-03-10
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_megaapi_id_unico'
+down_revision = 'merge_multi_heads'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    # ── ids vazios viram NULL (NULL não colide em índice único) ────────────
+    conn.execute(sa.text("UPDATE historico_notificacoes SET megaapi_id = NULL WHERE megaapi_id = ''"))
+
+    # ── retries já gravados: mantém o id só na primeira ocorrência ─────────
+    # As linhas duplicadas são preservadas (histórico), apenas perdem o megaapi_id.
+    conn.execute(sa.text("""
+        UPDATE historico_notificacoes SET megaapi_id = NULL
+        WHERE megaapi_id IS NOT NULL
+          AND id NOT IN (
+              SELECT primeiro_id FROM (
+                  SELECT MIN(id) AS primeiro_id
+                  FROM historico_notificacoes
+                  WHERE megaapi_id IS NOT NULL
+                  GROUP BY megaapi_id
+              ) AS primeiros
+          )
+    """))
+
+    # ── índice único ───────────────────────────────────────────────────────
+    with op.batch_alter_table('historico_notificacoes', schema=None) as batch_op:
+        batch_op.create_index('ix_historico_notificacoes_megaapi_id', ['megaapi_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('historico_notificacoes', schema=None) as batch_op:
+        batch_op.drop_index('ix_historico_notificacoes_megaapi_id')
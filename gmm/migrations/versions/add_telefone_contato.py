@@ -0,0 +1,79 @@
+"""GMM v4.4 - Telefone normalizado do contato no histórico (paginação do chat)
+
+Revision ID: add_telefone_contato
+Revises: add_conversa
+Create Date: 2026-03-24
+
+"""
+import re
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'add_telefone_contato'
+down_revision = 'add_conversa'
+branch_labels = None
+depends_on = None
+
+LOTE = 1000
+
+# Data usada para registros anteriores à coluna criado_em (3a53dda54dd3) sem enviado_em:
+# ficam no começo do histórico, mas entram na paginação por (criado_em, id)
+CRIADO_EM_DESCONHECIDO = datetime(2000, 1, 1)
+
+
+def _normalizar(bruto):
+    """Mesma regra do WhatsAppService.normalizar_telefone (cópia fixa para a migração)."""
+    if not bruto or bruto == 'sistema':
+        return None
+    digitos = re.sub(r'\D', '', bruto)
+    if len(digitos) in (10, 11):
+        digitos = '55' + digitos
+    return digitos or None
+
+
+def upgrade():
+    with op.batch_alter_table('historico_notificacoes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('telefone_contato', sa.String(length=20), nullable=True))
+
+    # ── preenchimento em lotes por id (remetente no inbound, destinatário no outbound) ──
+    bind = op.get_bind()
+    historico = sa.table('historico_notificacoes',
+        sa.column('id', sa.Integer), sa.column('direcao', sa.String), sa.column('remetente', sa.String),
+        sa.column('destinatario', sa.String), sa.column('telefone_contato', sa.String),
+        sa.column('criado_em', sa.DateTime), sa.column('enviado_em', sa.DateTime))
+    ultimo_id = 0
+    while True:
+        linhas = bind.execute(
+            sa.select(historico.c.id, historico.c.direcao, historico.c.remetente, historico.c.destinatario)
+            .where(historico.c.id > ultimo_id).order_by(historico.c.id).limit(LOTE)
+        ).fetchall()
+        if not linhas:
+            break
+        valores = []
+        for linha in linhas:
+            telefone = _normalizar(linha.remetente if linha.direcao == 'inbound' else linha.destinatario)
+            if telefone:
+                valores.append({'alvo': linha.id, 'telefone': telefone[:20]})
+        if valores:
+            bind.execute(
+                historico.update().where(historico.c.id == sa.bindparam('alvo'))
+                .values(telefone_contato=sa.bindparam('telefone')),
+                valores)
+        ultimo_id = linhas[-1].id
+
+    # ── criado_em obrigatório para o cursor (criado_em, id) ──
+    bind.execute(historico.update().where(historico.c.criado_em.is_(None), historico.c.enviado_em.isnot(None))
+                 .values(criado_em=historico.c.enviado_em))
+    bind.execute(historico.update().where(historico.c.criado_em.is_(None))
+                 .values(criado_em=CRIADO_EM_DESCONHECIDO))
+
+    with op.batch_alter_table('historico_notificacoes', schema=None) as batch_op:
+        batch_op.create_index('ix_historico_telefone_contato_criado_em', ['telefone_contato', 'criado_em'],
+                              unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('historico_notificacoes', schema=None) as batch_op:
+        batch_op.drop_index('ix_historico_telefone_contato_criado_em')
+        batch_op.drop_column('telefone_contato')
@@ -0,0 +1,10 @@
+from app import create_app, db
+from app.services.conversa_service import ConversaService
+
+app = create_app()
+
+with app.app_context():
+    print("Reconstruindo o resumo das conversas da central de chat (conversa)...")
+    total = ConversaService.reconstruir()
+    db.session.commit()
+    print(f"Concluído: {total} conversas.")
@@ -0,0 +1,10 @@
+from app import create_app, db
+from app.services.busca_service import BuscaService
+
+app = create_app()
+
+with app.app_context():
+    print("Reconstruindo o índice da busca global (busca_indice)...")
+    total = BuscaService.reindexar()
+    db.session.commit()
+    print(f"Concluído: {total} documentos indexados.")
@@ -30,16 +30,19 @@ class TestWhatsAppOutbound(unittest.TestCase):
             state = CircuitBreaker.get_state()
             self.assertEqual(state, 'HALF_OPEN')
 
+    @patch('app.services.rate_limiter.RateLimiter.limite_por_minuto', return_value=60)
     @patch('app.services.rate_limiter.RateLimiter._get_redis')
-    def test_rate_limiter_buckets(self, mock_redis_func):
+    def test_rate_limiter_buckets(self, mock_redis_func, _limite):
         mock_redis = MagicMock()
         mock_redis_func.return_value = mock_redis
-        
-        # Limite atingido
-        mock_redis.get.return_value = b'60'
+        RateLimiter._script = None
+
+        # Balde vazio: script nega e informa a espera exata
+        mock_redis.register_script.return_value.return_value = [0, 0, 1500]
         can_send, rem = RateLimiter.check_limit()
         self.assertFalse(can_send)
         self.assertEqual(rem, 0)
+        self.assertEqual(RateLimiter.consumir(), (False, 0, 1.5))
 
 if __name__ == '__main__':
     unittest.main()
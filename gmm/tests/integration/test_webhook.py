@@ -60,5 +60,152 @@ class TestWebhook(unittest.TestCase):
         with patch('app.routes.webhook.current_app', self.app):
              self.assertFalse(validar_webhook(req))
 
+
+class TestWebhookIngestaoAssincrona(unittest.TestCase):
+    PAYLOAD = {
+        'event': 'messages.upsert',
+        'data': {
+            'key': {'remoteJid': '5527988010899@s.whatsapp.net', 'fromMe': False, 'id': 'ABC123'},
+            'message': {'conversation': 'Olá'},
+            'messageType': 'conversation',
+            'messageTimestamp': 1700000000,
+        },
+    }
+
+    def setUp(self):
+        from app.routes.webhook import bp
+        self.app = Flask(__name__)
+        self.app.config['WHATSAPP_INGESTAO_ASSINCRONA'] = True
+        self.app.register_blueprint(bp)
+        self.client = self.app.test_client()
+        self.patcher = patch('app.routes.webhook.DeduplicadorWebhook.ja_processado', return_value=False)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    @patch('app.routes.webhook.FilaIngestao.registrar_latencia')
+    @patch('app.routes.webhook.registrar_mensagem_inbound')
+    @patch('app.routes.webhook.FilaIngestao.publicar', return_value=(True, '1-0'))
+    def test_enfileira_e_responde_sem_gravar(self, mock_publicar, mock_registrar, _mock_latencia):
+        with patch('app.tasks.whatsapp_tasks.consumir_fila_inbound.delay') as mock_delay:
+            resp = self.client.post('/webhook/whatsapp', json=self.PAYLOAD)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['status'], 'queued')
+        dados, remetente, _ = mock_publicar.call_args[0]
+        self.assertEqual(dados['msg_id'], 'ABC123')
+        self.assertEqual(remetente, '5527988010899')
+        mock_registrar.assert_not_called()
+        mock_delay.assert_called_once()
+
+    @patch('app.routes.webhook._rotear_texto_sincrono')
+    @patch('app.routes.webhook.FilaIngestao.incrementar')
+    @patch('app.routes.webhook.registrar_mensagem_inbound')
+    @patch('app.routes.webhook.FilaIngestao.publicar', return_value=(False, 'fila_cheia'))
+    def test_fila_cheia_processa_sincrono(self, _mock_publicar, mock_registrar, mock_incrementar, mock_rotear):
+        resp = self.client.post('/webhook/whatsapp', json=self.PAYLOAD)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.get_json()['success'])
+        mock_registrar.assert_called_once()
+        mock_rotear.assert_called_once_with('5527988010899', 'Olá')
+        mock_incrementar.assert_called_once_with('fallback_sincrono')
+
+    @patch('app.routes.webhook.registrar_mensagem_inbound')
+    @patch('app.routes.webhook.FilaIngestao.publicar')
+    def test_retry_descartado_antes_de_gravar(self, mock_publicar, mock_registrar):
+        self.patcher.stop()
+        with patch('app.routes.webhook.DeduplicadorWebhook.ja_processado', return_value=True):
+            resp = self.client.post('/webhook/whatsapp', json=self.PAYLOAD)
+        self.patcher.start()
+
+        self.assertEqual(resp.get_json()['reason'], 'duplicate')
+        mock_publicar.assert_not_called()
+        mock_registrar.assert_not_called()
+
+
+
+class TestConsumoFilaIngestao(unittest.TestCase):
+    DADOS = {'tipo': 'text', 'msg_id': 'ABC123', 'texto': 'Olá', 'timestamp': 1700000000, 'push_name': 'Ana'}
+
+    def setUp(self):
+        from app.extensions import db
+        self.db = db
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.patchers = [
+            patch('app.services.fila_ingestao.FilaIngestao.registrar_latencia'),
+            patch('app.services.fila_ingestao.FilaIngestao.confirmar'),
+            patch('app.routes.webhook.DeduplicadorWebhook.registrar_duplicata_banco'),
+            patch('app.routes.webhook.vincular_notificacao_chamado'),
+            patch('app.routes.webhook.vincular_whatsapp_fornecedor'),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        self.db.session.remove()
+        self.db.drop_all()
+        self.ctx.pop()
+
+    def _consumir(self, reentrega, roteado=False):
+        from app.tasks.whatsapp_tasks import consumir_fila_inbound
+        evento = {'dados': self.DADOS, 'remetente': '5527988010899',
+                  'recebido_em': time.time(), 'enfileirado_em': time.time()}
+        if reentrega:
+            evento['reentrega'] = True
+        with patch('app.services.fila_ingestao.FilaIngestao.ler_lote', return_value=[('1-0', evento)]), \
+             patch('app.services.fila_ingestao.FilaIngestao.ja_roteado', return_value=roteado), \
+             patch('app.services.fila_ingestao.FilaIngestao.marcar_roteado') as marcar, \
+             patch('app.tasks.whatsapp_tasks.processar_mensagem_inbound') as rotear:
+            consumir_fila_inbound()
+        return rotear, marcar
+
+    def test_reentrega_de_mensagem_gravada_e_nao_roteada_e_roteada(self):
+        from app.models.terceirizados_models import HistoricoNotificacao
+        from app.routes.webhook import registrar_mensagem_inbound
+        registrar_mensagem_inbound(self.DADOS, '5527988010899')  # worker morreu logo após o commit
+
+        rotear, marcar = self._consumir(reentrega=True)
+        rotear.assert_called_once_with('5527988010899', 'Olá', 1700000000)
+        marcar.assert_called_once_with('ABC123')
+        self.assertEqual(HistoricoNotificacao.query.count(), 1)
+
+        rotear, _ = self._consumir(reentrega=True, roteado=True)
+        rotear.assert_not_called()
+
+    def test_retry_com_megaapi_id_gravado_continua_descartado(self):
+        from app.routes.webhook import registrar_mensagem_inbound
+        registrar_mensagem_inbound(self.DADOS, '5527988010899')
+
+        rotear, marcar = self._consumir(reentrega=False)
+        rotear.assert_not_called()
+        marcar.assert_not_called()
+
+    def test_primeira_entrega_marca_roteado(self):
+        rotear, marcar = self._consumir(reentrega=False)
+        rotear.assert_called_once()
+        marcar.assert_called_once_with('ABC123')
+
+    def test_ler_lote_sinaliza_reentregas(self):
+        from app.services.fila_ingestao import FilaIngestao
+
+        def entrada(entrada_id):
+            return (entrada_id, {b'evento': json.dumps({'dados': {}, 'remetente': 'x'}).encode()})
+
+        cliente = MagicMock()
+        cliente.xautoclaim.return_value = (b'0-0', [entrada(b'1-0')], [])
+        cliente.xreadgroup.return_value = [(b'stream', [entrada(b'2-0')])]
+        with patch.object(FilaIngestao, '_get_redis', return_value=cliente):
+            lote = FilaIngestao.ler_lote(quantidade=10)
+        self.assertEqual([(i, e.get('reentrega', False)) for i, e in lote], [('1-0', True), ('2-0', False)])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from app.extensions import db
+from app.models.estoque_models import OrdemServico, Estoque, MovimentacaoEstoque
+from app.models.terceirizados_models import ChamadoExterno
+from app.services.analytics_service import AnalyticsService
+from app.utils.sql_tempo import horas_entre
+
+
+class TestHorasEntre(unittest.TestCase):
+    def _sql(self, dialeto):
+        expr = select(horas_entre(OrdemServico.data_abertura, OrdemServico.data_conclusao))
+        return str(expr.compile(dialect=dialeto))
+
+    def test_sqlite_usa_julianday(self):
+        self.assertIn('julianday(ordens_servico.data_conclusao) - julianday(ordens_servico.data_abertura)',
+                      self._sql(sqlite.dialect()))
+
+    def test_postgres_usa_epoch_do_intervalo(self):
+        self.assertIn('EXTRACT(EPOCH FROM (ordens_servico.data_conclusao - ordens_servico.data_abertura))',
+                      self._sql(postgresql.dialect()))
+
+
+class TestKpiGeral(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.utcnow()
+        self.agora = agora
+
+        def os_(n, unidade, status, aberta_ha_dias, horas_reparo=None):
+            abertura = agora - timedelta(days=aberta_ha_dias)
+            return OrdemServico(
+                numero_os=f'OS-{n}', tecnico_id=1, unidade_id=unidade, tipo_manutencao='corretiva',
+                descricao_problema='x', status=status, prazo_conclusao=abertura + timedelta(days=2),
+                data_abertura=abertura,
+                data_conclusao=abertura + timedelta(hours=horas_reparo) if horas_reparo else None,
+            )
+
+        db.session.add_all([
+            os_(1, 1, 'concluida', 2, horas_reparo=4),
+            os_(2, 1, 'concluida', 3, horas_reparo=10),
+            os_(3, 1, 'aberta', 10),            # no período e crítica
+            os_(4, 2, 'concluida', 5, horas_reparo=1),
+            os_(5, 2, 'aberta', 60),            # fora do período, mas crítica
+            os_(6, 1, 'concluida', 45, horas_reparo=100),  # fora do período
+        ])
+        peca = Estoque(codigo='P1', nome='Rolamento', unidade_medida='un', valor_unitario=10)
+        db.session.add(peca)
+        db.session.flush()
+        db.session.add_all([
+            MovimentacaoEstoque(estoque_id=peca.id, tipo_movimentacao='consumo', quantidade=3, unidade_id=1,
+                                usuario_id=1, data_movimentacao=agora - timedelta(days=1)),
+            MovimentacaoEstoque(estoque_id=peca.id, tipo_movimentacao='consumo', quantidade=2, unidade_id=2,
+                                usuario_id=1, data_movimentacao=agora - timedelta(days=1)),
+            MovimentacaoEstoque(estoque_id=peca.id, tipo_movimentacao='entrada', quantidade=50, unidade_id=1,
+                                usuario_id=1, data_movimentacao=agora - timedelta(days=1)),
+        ])
+        db.session.add_all([
+            ChamadoExterno(numero_chamado='CH-1', os_id=1, terceirizado_id=1, titulo='t', descricao='d',
+                           prazo_combinado=agora, criado_por=1, valor_final=200, criado_em=agora),
+            ChamadoExterno(numero_chamado='CH-2', os_id=4, terceirizado_id=1, titulo='t', descricao='d',
+                           prazo_combinado=agora, criado_por=1, valor_final=50, criado_em=agora),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_kpis_todas_unidades(self):
+        kpis = AnalyticsService.get_kpi_geral(days=30)
+        self.assertEqual(kpis['mttr'], 5.0)  # (4 + 10 + 1) / 3
+        self.assertEqual(kpis['total_os'], 4)
+        self.assertEqual(kpis['taxa_conclusao'], 75.0)
+        self.assertEqual(kpis['backlog_critico'], 2)
+        self.assertEqual(kpis['custo_pecas'], 50.0)
+        self.assertEqual(kpis['custo_servicos'], 250.0)
+        self.assertEqual(kpis['custo_total'], 300.0)
+
+    def test_kpis_por_unidade(self):
+        kpis = AnalyticsService.get_kpi_geral(unidade_id=1, days=30)
+        self.assertEqual(kpis['mttr'], 7.0)
+        self.assertEqual(kpis['total_os'], 3)
+        self.assertEqual(kpis['backlog_critico'], 1)
+        self.assertEqual(kpis['custo_pecas'], 30.0)
+        self.assertEqual(kpis['custo_servicos'], 200.0)
+
+    def test_sem_dados(self):
+        kpis = AnalyticsService.get_kpi_geral(unidade_id=99, days=30)
+        self.assertEqual((kpis['mttr'], kpis['total_os'], kpis['taxa_conclusao'], kpis['custo_total']),
+                         (0, 0, 0, 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event, func
+from app.extensions import db
+from app.models.models import Usuario, RegistroPonto
+from app.models.estoque_models import OrdemServico, Estoque, MovimentacaoEstoque
+from app.services.analytics_service import AnalyticsService
+
+
+def _performance_tecnicos_legado(start_date, end_date, unidade_id=None):
+    """Implementação anterior (loop por técnico), usada como oráculo."""
+    tecnicos_query = Usuario.query.filter(Usuario.tipo == 'tecnico')
+    if unidade_id:
+        tecnicos_query = tecnicos_query.filter(Usuario.unidade_padrao_id == unidade_id)
+    result = []
+    for t in tecnicos_query.all():
+        registros = RegistroPonto.query.filter(
+            RegistroPonto.usuario_id == t.id,
+            RegistroPonto.data_hora_entrada >= start_date,
+            RegistroPonto.data_hora_entrada <= end_date,
+            RegistroPonto.data_hora_saida.isnot(None)
+        ).all()
+        total_horas_ponto = sum((r.data_hora_saida - r.data_hora_entrada).total_seconds() / 3600 for r in registros)
+        ordens = OrdemServico.query.filter(
+            OrdemServico.tecnico_id == t.id,
+            OrdemServico.status == 'concluida',
+            OrdemServico.data_conclusao >= start_date,
+            OrdemServico.data_conclusao <= end_date
+        ).all()
+        total_horas_os = sum((o.data_conclusao - o.data_abertura).total_seconds() / 3600
+                             for o in ordens if o.data_conclusao and o.data_abertura)
+        custo_pecas = db.session.query(
+            func.sum(MovimentacaoEstoque.quantidade * Estoque.valor_unitario)
+        ).join(Estoque).filter(
+            MovimentacaoEstoque.usuario_id == t.id,
+            MovimentacaoEstoque.tipo_movimentacao == 'consumo',
+            MovimentacaoEstoque.data_movimentacao >= start_date,
+            MovimentacaoEstoque.data_movimentacao <= end_date
+        ).scalar() or 0
+        ociosidade = 0
+        if total_horas_ponto > 0:
+            ociosidade = max(0, (total_horas_ponto - total_horas_os) / total_horas_ponto * 100)
+        result.append({
+            'tecnico_id': t.id,
+            'tecnico_nome': t.nome,
+            'horas_ponto': round(total_horas_ponto, 1),
+            'horas_os': round(total_horas_os, 1),
+            'ociosidade_percentual': round(ociosidade, 1),
+            'custo_pecas': float(custo_pecas),
+            'os_concluidas': len(ordens)
+        })
+    return result
+
+
+class TestPerformanceTecnicos(unittest.TestCase):
+    CAMPOS_HORAS = ('horas_ponto', 'horas_os', 'ociosidade_percentual')
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self._semear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _semear(self):
+        rnd = random.Random(7)
+        self.fim = datetime(2026, 3, 31, 23, 59)
+        self.inicio = datetime(2026, 3, 1)
+
+        for i in range(30):
+            tipo = 'tecnico' if i < 25 else 'admin'
+            db.session.add(Usuario(nome=f'Usuário {i}', username=f'u{i}', tipo=tipo, senha_hash='x',
+                                   unidade_padrao_id=1 + i % 3))
+        pecas = [Estoque(codigo=f'P{i}', nome=f'Peça {i}', unidade_medida='un', valor_unitario=rnd.randint(5, 300))
+                 for i in range(10)]
+        db.session.add_all(pecas)
+        db.session.flush()
+
+        def quando():
+            # Inclui datas fora do período para exercitar os filtros
+            return datetime(2026, 2, 20) + timedelta(minutes=rnd.randint(0, 50 * 24 * 60))
+
+        for n in range(600):
+            usuario_id = rnd.randint(1, 30)
+            entrada = quando()
+            db.session.add(RegistroPonto(
+                usuario_id=usuario_id, unidade_id=1, ip_origem_entrada='127.0.0.1', data_hora_entrada=entrada,
+                data_hora_saida=entrada + timedelta(minutes=rnd.randint(60, 600)) if rnd.random() < 0.9 else None,
+            ))
+            abertura = quando()
+            status = rnd.choice(['concluida', 'concluida', 'aberta'])
+            db.session.add(OrdemServico(
+                numero_os=f'OS-{n}', tecnico_id=usuario_id, unidade_id=1, tipo_manutencao='corretiva',
+                descricao_problema='x', status=status, prazo_conclusao=abertura, data_abertura=abertura,
+                data_conclusao=abertura + timedelta(minutes=rnd.randint(10, 3000)) if status == 'concluida' else None,
+            ))
+            db.session.add(MovimentacaoEstoque(
+                estoque_id=rnd.choice(pecas).id, tipo_movimentacao=rnd.choice(['consumo', 'entrada']),
+                quantidade=rnd.randint(1, 4), unidade_id=1, usuario_id=usuario_id, data_movimentacao=quando(),
+            ))
+        db.session.commit()
+
+    def _comparar(self, atual, legado):
+        self.assertEqual(len(atual), len(legado))
+        for novo, antigo in zip(atual, legado):
+            for campo in self.CAMPOS_HORAS:
+                # julianday x timedelta: diferença só no arredondamento da 1ª casa
+                self.assertAlmostEqual(novo[campo], antigo[campo], delta=0.1, msg=campo)
+            for campo in ('tecnico_id', 'tecnico_nome', 'custo_pecas', 'os_concluidas'):
+                self.assertEqual(novo[campo], antigo[campo], msg=campo)
+
+    def test_igual_a_implementacao_anterior(self):
+        self._comparar(AnalyticsService.get_performance_tecnicos(self.inicio, self.fim),
+                       _performance_tecnicos_legado(self.inicio, self.fim))
+
+    def test_igual_por_unidade(self):
+        self._comparar(AnalyticsService.get_performance_tecnicos(self.inicio, self.fim, unidade_id=2),
+                       _performance_tecnicos_legado(self.inicio, self.fim, unidade_id=2))
+
+    def test_numero_fixo_de_consultas(self):
+        consultas = []
+
+        def _contar(*_args, **_kwargs):
+            consultas.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            resultado = AnalyticsService.get_performance_tecnicos(self.inicio, self.fim)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+
+        self.assertEqual(len(resultado), 25)
+        self.assertEqual(len(consultas), 4)
+
+    def test_sem_tecnicos(self):
+        self.assertEqual(AnalyticsService.get_performance_tecnicos(self.inicio, self.fim, unidade_id=99), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
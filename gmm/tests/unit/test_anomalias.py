@@ -0,0 +1,119 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from app.extensions import db
+from app.models.models import Unidade
+from app.models.estoque_models import Equipamento, OrdemServico
+from app.services.anomalias_service import AnomaliasService
+from app.utils.contador_sql import ContadorConsultas
+from app.utils.estatisticas import z_robustos, tendencia_relativa
+
+
+class TestAnomaliasService(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.unidade = Unidade(nome='Centro', faixa_ip_permitida='*')
+        db.session.add(self.unidade)
+        db.session.flush()
+        self.agora = datetime.utcnow().replace(microsecond=0)
+        self.numero = 0
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _equipamento(self, nome, categoria='Compressor', manutencao_ha=5):
+        eq = Equipamento(nome=nome, categoria=categoria, unidade_id=self.unidade.id,
+                         created_at=self.agora - timedelta(days=800))
+        db.session.add(eq)
+        db.session.flush()
+        if manutencao_ha is not None:
+            self._os(eq, 'preventiva', self.agora - timedelta(days=manutencao_ha + 1), concluida_em_dias=1)
+        return eq
+
+    def _os(self, eq, tipo, abertura, concluida_em_dias=None):
+        self.numero += 1
+        db.session.add(OrdemServico(
+            numero_os=f'OS-{self.numero}', tecnico_id=1, unidade_id=self.unidade.id, equipamento_id=eq.id,
+            tipo_manutencao=tipo, descricao_problema='x', prazo_conclusao=abertura, data_abertura=abertura,
+            status='concluida' if concluida_em_dias is not None else 'aberta',
+            data_conclusao=abertura + timedelta(days=concluida_em_dias) if concluida_em_dias is not None else None,
+        ))
+
+    def _falhas(self, eq, dias_atras):
+        for dias in dias_atras:
+            self._os(eq, 'corretiva', self.agora - timedelta(days=dias))
+
+    def test_consultas_constantes(self):
+        def contar(n):
+            for i in range(n):
+                self._falhas(self._equipamento(f'EQ-{n}-{i}', categoria=f'C{i % 3}'), [200, 100, 20])
+            db.session.commit()
+            with ContadorConsultas(db.engine) as contador:
+                resultado = AnomaliasService.detectar(self.agora)
+            return contador.total, resultado['analisados']
+
+        poucos, analisados = contar(3)
+        muitos, analisados_total = contar(30)
+        self.assertEqual(poucos, muitos)
+        self.assertEqual(poucos, 2)
+        self.assertEqual((analisados, analisados_total), (3, 33))
+
+    def test_taxa_de_falhas_fora_da_curva_da_categoria(self):
+        for i, n in enumerate([1, 2, 2, 1, 3, 2, 1, 2]):
+            self._falhas(self._equipamento(f'Compressor {i}'), [30 * (k + 1) for k in range(n)])
+        ruim = self._equipamento('Compressor ruim')
+        self._falhas(ruim, [10 * (k + 1) for k in range(14)])
+        # Outra categoria, muito mais falhas por natureza: sem alerta dentro do próprio grupo
+        for i in range(6):
+            self._falhas(self._equipamento(f'Bomba {i}', categoria='Bomba'), [10 * (k + 1) for k in range(12 + i % 2)])
+        db.session.commit()
+
+        resultado = AnomaliasService.detectar(self.agora)
+        alerta, = resultado['taxa_falhas']
+        self.assertEqual(alerta['nome'], 'Compressor ruim')
+        self.assertEqual(alerta['corretivas'], 14)
+        self.assertGreaterEqual(alerta['z'], AnomaliasService.Z_LIMITE)
+
+    def test_mtbf_em_queda(self):
+        piorando = self._equipamento('Esteira')
+        self._falhas(piorando, [300, 180, 100, 50, 25, 10])
+        estavel = self._equipamento('Prensa')
+        self._falhas(estavel, [300, 240, 180, 120, 60, 5])
+        db.session.commit()
+
+        alerta, = AnomaliasService.detectar(self.agora)['mtbf_em_queda']
+        self.assertEqual(alerta['nome'], 'Esteira')
+        self.assertEqual(alerta['ultimo_intervalo_dias'], 15.0)
+        self.assertLessEqual(alerta['tendencia'], AnomaliasService.TENDENCIA_LIMITE)
+
+    def test_sem_manutencao(self):
+        self._equipamento('Em dia', manutencao_ha=5)
+        self._equipamento('Atrasado', manutencao_ha=45)
+        self._equipamento('Nunca', manutencao_ha=None)
+        inativo = self._equipamento('Inativo', manutencao_ha=None)
+        inativo.ativo = False
+        db.session.commit()
+
+        resultado = AnomaliasService.detectar(self.agora)
+        self.assertEqual([(a['nome'], a['dias']) for a in resultado['sem_manutencao']],
+                         [('Nunca', None), ('Atrasado', 45)])
+
+    def test_estatisticas(self):
+        self.assertEqual(z_robustos([2, 2, 2]), [0.0, 0.0, 0.0])
+        z = z_robustos([1, 2, 2, 3, 2, 40])
+        self.assertGreater(z[-1], 3.5)
+        self.assertLess(max(z[:-1]), 3.5)
+        self.assertAlmostEqual(tendencia_relativa([40, 30, 20, 10]), -1.2)
+        self.assertEqual(tendencia_relativa([5]), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
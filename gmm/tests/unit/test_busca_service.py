@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from flask import Flask
+from sqlalchemy import event
+from app.extensions import db
+from app.models.busca_models import BuscaIndice
+from app.models.models import Unidade, Usuario
+from app.models.estoque_models import OrdemServico, Equipamento, Estoque, Fornecedor
+from app.services.busca_service import BuscaService
+
+
+class TestBuscaGlobal(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        unidade = Unidade(nome='Matriz', faixa_ip_permitida='*')
+        db.session.add(unidade)
+        db.session.flush()
+        self.tecnico = Usuario(nome='João Técnico', username='joao', senha_hash='x', tipo='tecnico')
+        self.compressor = Equipamento(nome='Compressor Atlas', categoria='Climatização', unidade_id=unidade.id)
+        db.session.add_all([self.tecnico, self.compressor])
+        db.session.flush()
+        for n in range(8):
+            db.session.add(OrdemServico(
+                numero_os=f'OS-{n}', tecnico_id=self.tecnico.id, unidade_id=unidade.id,
+                equipamento_id=self.compressor.id, tipo_manutencao='corretiva', prazo_conclusao=datetime.utcnow(),
+                descricao_problema=f'Manutenção elétrica no quadro {n}'))
+        db.session.add(Estoque(codigo='CR-10', nome='Correia elétrica', unidade_medida='un', quantidade_atual=7))
+        db.session.add(Fornecedor(nome='Elétrica Paulista', email='contato@eletrica.com'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _por_entidade(self, q):
+        resultado = {}
+        for r in BuscaService.buscar(q):
+            resultado.setdefault(r['entidade'], []).append(r)
+        return resultado
+
+    def test_busca_ignora_acentos(self):
+        com_acento = self._por_entidade('manutenção')
+        sem_acento = self._por_entidade('MANUTENCAO')
+        self.assertEqual(com_acento, sem_acento)
+        self.assertEqual(len(com_acento['os']), 5)  # limitado por categoria
+
+    def test_uma_consulta_para_todas_as_categorias(self):
+        consultas = []
+
+        def _contar(*_args, **_kwargs):
+            consultas.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            resultado = self._por_entidade('eletric')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(sorted(resultado), ['fornecedor', 'os', 'peca'])
+        self.assertEqual(len(resultado['os']), BuscaService.LIMITES['os'])
+        self.assertEqual(resultado['peca'][0]['saldo'], 7)
+        self.assertEqual(resultado['os'][0]['titulo'], 'OS #OS-0 - Compressor Atlas')
+
+    def test_indice_acompanha_insercao_alteracao_e_exclusao(self):
+        fornecedor = Fornecedor.query.one()
+        fornecedor.nome = 'Hidráulica Central'
+        db.session.commit()
+        self.assertNotIn('fornecedor', self._por_entidade('paulista'))
+        self.assertEqual(self._por_entidade('hidraulica')['fornecedor'][0]['titulo'], 'Hidráulica Central')
+
+        db.session.delete(fornecedor)
+        db.session.commit()
+        self.assertEqual(self._por_entidade('hidraulica'), {})
+        self.assertEqual(BuscaIndice.query.filter_by(entidade='fornecedor').count(), 0)
+
+    def test_alteracao_irrelevante_nao_reescreve_documento(self):
+        documento = BuscaIndice.query.filter_by(entidade='peca').one()
+        Estoque.query.one().quantidade_atual = 3
+        db.session.commit()
+        self.assertEqual(BuscaIndice.query.filter_by(entidade='peca').one().id, documento.id)
+        self.assertEqual(self._por_entidade('correia')['peca'][0]['saldo'], 3)
+
+    def test_renomear_equipamento_e_unidade_reescreve_documentos_dependentes(self):
+        ids = [d.id for d in BuscaIndice.query.filter_by(entidade='os').order_by(BuscaIndice.id)]
+        self.compressor.nome = 'Chiller York'
+        Unidade.query.one().nome = 'Filial Norte'
+        db.session.commit()
+
+        self.assertNotIn('os', self._por_entidade('atlas'))
+        resultado = self._por_entidade('york')
+        self.assertEqual(len(resultado['os']), BuscaService.LIMITES['os'])
+        self.assertEqual(resultado['os'][0]['titulo'], 'OS #OS-0 - Chiller York')
+        self.assertEqual(resultado['equipamento'][0]['subtitulo'],
+                         'Categoria: Climatização | Unidade: Filial Norte')
+        self.assertEqual([d.id for d in BuscaIndice.query.filter_by(entidade='os').order_by(BuscaIndice.id)], ids)
+
+    def test_numero_traz_a_os_pelo_id(self):
+        os_ = OrdemServico.query.filter_by(numero_os='OS-6').one()
+        resultado = BuscaService.buscar(str(os_.id))
+        self.assertEqual(resultado[0]['entidade'], 'os')
+        self.assertEqual(resultado[0]['entidade_id'], os_.id)
+
+    def test_termos_curtos_e_banco_sem_fts(self):
+        self.assertEqual(self._por_entidade('cr')['peca'][0]['titulo'], 'Correia elétrica (CR-10)')
+        with patch.object(BuscaService, '_modo', return_value='like'):
+            self.assertEqual(self._por_entidade('quadro 3')['os'][0]['titulo'], 'OS #OS-3 - Compressor Atlas')
+            self.assertEqual(len(self._por_entidade('manutencao')['os']), 5)
+
+    def test_reindexar_reconstroi_o_indice(self):
+        BuscaIndice.query.delete()
+        db.session.commit()
+        self.assertEqual(BuscaService.reindexar(), 12)
+        db.session.commit()
+        self.assertEqual(self._por_entidade('atlas')['equipamento'][0]['titulo'], 'Compressor Atlas')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+import redis
+from flask import Flask
+from app.extensions import db
+from app.models.terceirizados_models import HistoricoNotificacao
+from app.services.conversa_service import ConversaService
+from app.services.chat_eventos_service import ChatEventosService
+
+
+class TestChatEventos(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.redis = MagicMock()
+        self.patcher = patch.object(ChatEventosService, '_get_redis', return_value=self.redis)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _publicados(self):
+        return [json.loads(c.args[1]) for c in self.redis.publish.call_args_list]
+
+    def _inbound(self, telefone='27988010899'):
+        msg = HistoricoNotificacao(tipo='resposta_auto', direcao='inbound', remetente=telefone,
+                                   destinatario='sistema', mensagem='oi', tipo_conteudo='text',
+                                   status_leitura='nao_lida')
+        db.session.add(msg)
+        return msg
+
+    def test_publica_so_depois_do_commit(self):
+        self._inbound()
+        db.session.flush()
+        self.assertEqual(self._publicados(), [])
+        db.session.rollback()
+        self.assertEqual(self._publicados(), [])
+
+        msg = self._inbound()
+        db.session.commit()
+        evento, = self._publicados()
+        self.assertEqual(evento['tipo'], 'mensagem')
+        self.assertEqual(evento['id'], msg.id)
+        self.assertEqual(evento['telefone'], '5527988010899')
+        self.assertEqual(self.redis.publish.call_args.args[0], ChatEventosService.CANAL)
+
+    def test_status_exclusao_e_leitura(self):
+        msg = self._inbound()
+        db.session.commit()
+        self.redis.reset_mock()
+
+        msg.status_envio = 'lido'
+        db.session.commit()
+        msg.excluido_em = datetime.utcnow()
+        db.session.commit()
+        msg.tentativas = 3  # campo sem interesse para as telas
+        db.session.commit()
+        ConversaService.marcar_lida('5527988010899')
+        db.session.commit()
+
+        eventos = self._publicados()
+        self.assertEqual([e['tipo'] for e in eventos], ['status', 'atualizada', 'leitura'])
+        self.assertEqual(eventos[0]['status'], 'lido')
+        self.assertTrue(eventos[1]['excluido'])
+        self.assertEqual(eventos[2]['telefone'], '5527988010899')
+
+    def test_redis_fora_nao_quebra_commit(self):
+        self.redis.publish.side_effect = redis.exceptions.ConnectionError
+        self._inbound()
+        db.session.commit()
+        self.assertEqual(HistoricoNotificacao.query.count(), 1)
+
+    def test_stream_filtra_e_mantem_conexao(self):
+        with patch.object(ChatEventosService, '_garantir_ouvinte'), \
+                patch.object(ChatEventosService, 'HEARTBEAT', 0.01), \
+                patch.object(ChatEventosService, '_filas', set()):
+            stream = ChatEventosService.stream(lambda evento: evento.get('chamado_id'))
+            self.assertTrue(next(stream).startswith('retry:'))
+
+            ChatEventosService._distribuir(json.dumps({'tipo': 'mensagem', 'chamado_id': None}))
+            ChatEventosService._distribuir(json.dumps({'tipo': 'status', 'chamado_id': 7}))
+            self.assertEqual(next(stream), 'event: status\ndata: {"tipo": "status", "chamado_id": 7}\n\n')
+            self.assertEqual(next(stream), ': ping\n\n')
+
+            stream.close()
+            self.assertEqual(ChatEventosService._filas, set())
+
+    def test_stream_sem_redis_avisa_e_encerra(self):
+        self.redis.ping.side_effect = redis.exceptions.ConnectionError
+        self.assertEqual(list(ChatEventosService.stream()), ['event: indisponivel\ndata: {}\n\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
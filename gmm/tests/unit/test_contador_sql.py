@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+import redis
+from flask import Flask
+from app.extensions import db
+from app.models.models import Unidade, Usuario
+from app.services.perfis_carga import PerfisCarga
+from app.utils.contador_sql import AgregadorPerf, MedicaoSQL, _medicao_atual, registrar_contador_requisicao
+
+
+class TestInstrumentacaoSQL(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        registrar_contador_requisicao(self.app)
+
+        @self.app.route('/pagina')
+        def pagina():
+            Unidade.query.count()
+            Usuario.query.count()
+            return 'ok'
+
+        @self.app.route('/equipamento')
+        def equipamento():
+            PerfisCarga.equipamento_dossie(1)
+            return 'ok'
+
+        with self.app.app_context():
+            db.create_all()
+
+        AgregadorPerf._acumulado, AgregadorPerf._pendente = {}, {}
+        self.sem_redis = patch.object(AgregadorPerf, '_get_redis', side_effect=redis.exceptions.ConnectionError)
+        self.sem_redis.start()
+
+    def tearDown(self):
+        self.sem_redis.stop()
+        AgregadorPerf._acumulado, AgregadorPerf._pendente = {}, {}
+
+    def test_server_timing_com_tempo_de_banco(self):
+        self.app.config['SQL_CONTADOR'] = True
+        resposta = self.app.test_client().get('/pagina')
+        self.assertEqual(resposta.headers['X-SQL-Queries'], '2')
+        self.assertRegex(resposta.headers['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+$')
+
+    def test_query_lenta_logada_com_local_da_chamada(self):
+        self.app.config['SQL_LENTA_MS'] = 0
+        with self.assertLogs('app.utils.contador_sql', level='WARNING') as logs:
+            self.assertEqual(self.app.test_client().get('/equipamento').status_code, 404)
+        self.assertTrue(any('services/perfis_carga.py:' in linha and '(equipamento_dossie)' in linha
+                            for linha in logs.output))
+
+    def test_sem_log_abaixo_do_limite(self):
+        self.app.config['SQL_LENTA_MS'] = 60000
+        with patch('app.utils.contador_sql.logger.warning') as aviso:
+            self.app.test_client().get('/pagina')
+        self.assertFalse(any('Query lenta' in str(c) for c in aviso.call_args_list))
+
+    def test_histograma_por_endpoint_sem_redis(self):
+        cliente = self.app.test_client()
+        for _ in range(3):
+            cliente.get('/pagina')
+        cliente.get('/equipamento')
+
+        with self.app.app_context():
+            resumo = AgregadorPerf.resumo()
+        self.assertEqual(resumo['origem'], 'local')
+        por_endpoint = {e['endpoint']: e for e in resumo['endpoints']}
+        pagina = por_endpoint['pagina']
+        self.assertEqual(pagina['n'], 3)
+        self.assertEqual(pagina['media_consultas'], 2)
+        self.assertEqual(pagina['p95_consultas'], 2)
+        self.assertEqual(sum(pagina['hist_consultas']), 3)
+        self.assertEqual(sum(pagina['hist_db']), 3)
+        self.assertEqual(len(pagina['lentas']), 2)
+        self.assertEqual(por_endpoint['equipamento']['n'], 1)
+
+    def test_desligada_nao_mede(self):
+        self.app.config['SQL_INSTRUMENTACAO'] = False
+        self.app.test_client().get('/pagina')
+        self.assertEqual(AgregadorPerf._acumulado, {})
+
+
+class TestMedicaoSQL(unittest.TestCase):
+    def test_guarda_so_as_mais_lentas(self):
+        medicao = MedicaoSQL('task')
+        for ms in range(10):
+            medicao.registrar(f'SELECT {ms}', float(ms))
+        self.assertEqual(medicao.consultas, 10)
+        self.assertEqual(medicao.tempo_ms, 45.0)
+        self.assertEqual([ms for ms, _sql, _local in medicao.mais_lentas()], [9.0, 8.0, 7.0, 6.0, 5.0])
+
+    def test_mede_so_enquanto_ativa(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        with app.app_context():
+            self.assertIsNone(_medicao_atual.get())
+            medicao = MedicaoSQL('script')
+            token = _medicao_atual.set(medicao)
+            try:
+                db.create_all()
+                Unidade.query.count()
+            finally:
+                _medicao_atual.reset(token)
+            total = medicao.consultas
+            Unidade.query.count()
+            db.session.remove()
+        self.assertGreaterEqual(total, 1)
+        self.assertEqual(medicao.consultas, total)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+import redis
+from flask import Flask
+from app.extensions import db
+from app.models.models import Unidade, Usuario
+from app.models.estoque_models import OrdemServico, Estoque, MovimentacaoEstoque, PedidoCompra
+from app.services.contadores_pendencias import ContadoresPendencias
+from app.utils.contador_sql import ContadorConsultas
+
+
+class _RedisMemoria:
+    """get/set mínimos para simular o snapshot compartilhado entre workers."""
+
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor
+
+
+class TestContadoresPendencias(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        # Sem Redis nos testes: versão remota e snapshot indisponíveis
+        self.patchers = [
+            patch.object(ContadoresPendencias._cache, '_versao_remota', return_value=None),
+            patch.object(ContadoresPendencias, '_get_redis', side_effect=redis.exceptions.ConnectionError),
+        ]
+        for p in self.patchers:
+            p.start()
+        ContadoresPendencias._cache.limpar_local()
+
+        unidades = [Unidade(nome=f'U{i}', faixa_ip_permitida='*') for i in range(2)]
+        usuario = Usuario(nome='Admin', username='adm', senha_hash='x', tipo='admin')
+        db.session.add_all(unidades + [usuario])
+        db.session.flush()
+        self.unidade_ids = [u.id for u in unidades]
+        self.usuario_id = usuario.id
+
+        self.peca = Estoque(codigo='P1', nome='Correia', unidade_medida='un', quantidade_atual=10, quantidade_minima=5)
+        critica = Estoque(codigo='P2', nome='Filtro', unidade_medida='un', quantidade_atual=1, quantidade_minima=5)
+        db.session.add_all([self.peca, critica])
+        db.session.flush()
+
+        for status in ('solicitado', 'solicitado', 'aguardando_diretoria', 'aprovado', 'concluido'):
+            db.session.add(PedidoCompra(estoque_id=self.peca.id, quantidade=1, status=status,
+                                        solicitante_id=self.usuario_id))
+        for n, (unidade_id, status) in enumerate([(self.unidade_ids[0], 'aberta'), (self.unidade_ids[0], 'aberta'),
+                                                  (self.unidade_ids[1], 'aberta'), (self.unidade_ids[1], 'concluida')]):
+            db.session.add(OrdemServico(numero_os=f'OS-{n}', tecnico_id=self.usuario_id, unidade_id=unidade_id,
+                                        tipo_manutencao='corretiva', descricao_problema='x', status=status,
+                                        prazo_conclusao=datetime.utcnow()))
+        db.session.commit()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        ContadoresPendencias._cache.limpar_local()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_contadores_por_perfil(self):
+        self.assertEqual(ContadoresPendencias.pedidos_para_aprovar('gerente'), 2)
+        self.assertEqual(ContadoresPendencias.pedidos_para_aprovar('diretor'), 3)
+        self.assertEqual(ContadoresPendencias.fila_compras(), 1)
+        self.assertEqual(ContadoresPendencias.os_abertas(), 3)
+        self.assertEqual(ContadoresPendencias.os_abertas(self.unidade_ids[1]), 1)
+        self.assertEqual(ContadoresPendencias.os_abertas(999), 0)
+        self.assertEqual(ContadoresPendencias.itens_ruptura(), 1)
+        self.assertEqual(ContadoresPendencias.sidebar(SimpleNamespace(tipo='admin')), 3)
+        self.assertEqual(ContadoresPendencias.sidebar(SimpleNamespace(tipo='tecnico')), 0)
+
+    def test_leituras_seguintes_sem_sql(self):
+        ContadoresPendencias.obter()
+        with ContadorConsultas(db.engine) as contador:
+            for tipo in ('admin', 'gerente', 'diretor'):
+                ContadoresPendencias.sidebar(SimpleNamespace(tipo=tipo))
+            ContadoresPendencias.os_abertas(self.unidade_ids[0])
+            ContadoresPendencias.itens_ruptura()
+        self.assertEqual(contador.total, 0)
+
+    def test_mudanca_de_status_invalida(self):
+        self.assertEqual(ContadoresPendencias.fila_compras(), 1)
+        pedido = PedidoCompra.query.filter_by(status='solicitado').first()
+        pedido.status = 'aprovado'
+        db.session.commit()
+        self.assertEqual(ContadoresPendencias.fila_compras(), 2)
+        self.assertEqual(ContadoresPendencias.pedidos_para_aprovar('gerente'), 1)
+
+        os_ = OrdemServico.query.filter_by(status='aberta').first()
+        os_.status = 'concluida'
+        db.session.commit()
+        self.assertEqual(ContadoresPendencias.os_abertas(), 2)
+
+    def test_movimentacao_atualiza_ruptura(self):
+        self.assertEqual(ContadoresPendencias.itens_ruptura(), 1)
+        db.session.add(MovimentacaoEstoque(estoque_id=self.peca.id, tipo_movimentacao='consumo', quantidade=6,
+                                           unidade_id=self.unidade_ids[0], usuario_id=self.usuario_id))
+        db.session.commit()
+        self.assertEqual(ContadoresPendencias.itens_ruptura(), 2)
+
+    def test_snapshot_compartilhado_entre_workers(self):
+        memoria = _RedisMemoria()
+        with patch.object(ContadoresPendencias, '_get_redis', return_value=memoria):
+            ContadoresPendencias.obter()
+            self.assertEqual(list(memoria.dados), ['gmm:pendencias:v0'])
+
+            ContadoresPendencias._cache.limpar_local()  # outro worker, cache local vazio
+            with ContadorConsultas(db.engine) as contador:
+                self.assertEqual(ContadoresPendencias.os_abertas(self.unidade_ids[0]), 2)
+            self.assertEqual(contador.total, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import redis
+from flask import Flask
+from app.services.controle_envio import ControleEnvio
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.rate_limiter import RateLimiter
+from app.services.whatsapp_service import WhatsAppService
+from app.utils import redis_client
+
+
+class TestControleEnvio(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.script = MagicMock()
+        self.redis.register_script.return_value = self.script
+        ControleEnvio._script = None
+        ControleEnvio._script_cliente = None
+        self.patchers = [
+            patch.object(CircuitBreaker, '_get_redis', return_value=self.redis),
+            patch.object(RateLimiter, 'limite_por_minuto', return_value=60),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_circuito_limpo_permitido(self):
+        self.script.return_value = [b'CLOSED', 1, 9, 0, 0]
+        decisao = ControleEnvio.autorizar()
+        self.assertEqual(decisao, {'estado': 'CLOSED', 'permitido': True, 'restantes': 9, 'espera': 0.0,
+                                   'limpo': True})
+        # Uma única chamada ao script por checagem
+        self.assertEqual(self.script.call_count, 1)
+
+    def test_circuito_com_falhas_nao_esta_limpo(self):
+        self.script.return_value = [b'CLOSED', 1, 5, 2, 0]
+        self.assertFalse(ControleEnvio.autorizar()['limpo'])
+
+    def test_limite_atingido_informa_espera(self):
+        self.script.return_value = [b'CLOSED', 0, 0, 0, 2350]
+        decisao = ControleEnvio.autorizar()
+        self.assertFalse(decisao['permitido'])
+        self.assertEqual(decisao['espera'], 2.35)
+
+    def test_ignorar_limite_repassado_ao_script(self):
+        self.script.return_value = [b'HALF_OPEN', 1, 0, 3, 0]
+        ControleEnvio.autorizar(ignorar_limite=True)
+        self.assertEqual(self.script.call_args.kwargs['args'][-1], 1)
+
+    def test_urgente_ignora_limite(self):
+        self.script.return_value = [b'CLOSED', 1, 0, 0, 0]
+        ControleEnvio.autorizar(prioridade=2)
+        self.assertEqual(self.script.call_args.kwargs['args'][-1], 1)
+
+    def test_script_registrado_uma_vez(self):
+        self.script.return_value = [b'CLOSED', 1, 9, 0, 0]
+        ControleEnvio.autorizar()
+        ControleEnvio.autorizar()
+        self.redis.register_script.assert_called_once()
+
+    def test_redis_indisponivel_libera_envio(self):
+        self.script.side_effect = redis.exceptions.ConnectionError()
+        decisao = ControleEnvio.autorizar()
+        self.assertTrue(decisao['permitido'])
+        self.assertEqual(decisao['estado'], 'CLOSED')
+
+
+class TestEnvioUmRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    @patch.object(CircuitBreaker, 'record_success')
+    @patch.object(WhatsAppService, '_get_session')
+    @patch.object(WhatsAppService, '_get_credentials', return_value=('https://api', 'KEY', 'INST'))
+    @patch.object(ControleEnvio, 'autorizar')
+    def test_sucesso_com_circuito_limpo_nao_grava_no_redis(self, mock_autorizar, _cred, mock_sessao, mock_sucesso):
+        mock_autorizar.return_value = {'estado': 'CLOSED', 'permitido': True, 'restantes': 10, 'limpo': True}
+        resposta = MagicMock(status_code=200)
+        resposta.json.return_value = {'ok': True}
+        mock_sessao.return_value.post.return_value = resposta
+
+        ok, _ = WhatsAppService.enviar_mensagem('5511999999999', 'Olá')
+
+        self.assertTrue(ok)
+        mock_autorizar.assert_called_once_with(prioridade=0, token_reservado=False)
+        mock_sucesso.assert_not_called()
+
+    @patch.object(CircuitBreaker, 'record_success')
+    @patch.object(WhatsAppService, '_get_session')
+    @patch.object(WhatsAppService, '_get_credentials', return_value=('https://api', 'KEY', 'INST'))
+    @patch.object(ControleEnvio, 'autorizar')
+    def test_sucesso_em_half_open_fecha_circuito(self, mock_autorizar, _cred, mock_sessao, mock_sucesso):
+        mock_autorizar.return_value = {'estado': 'HALF_OPEN', 'permitido': True, 'restantes': 10, 'limpo': False}
+        resposta = MagicMock(status_code=200)
+        resposta.json.return_value = {'ok': True}
+        mock_sessao.return_value.post.return_value = resposta
+
+        WhatsAppService.enviar_mensagem('5511999999999', 'Olá')
+
+        mock_sucesso.assert_called_once()
+
+
+class TestFaixasRateLimiter(unittest.TestCase):
+    @patch.object(RateLimiter, 'limite_por_minuto', return_value=60)
+    def test_parametros_por_faixa(self, _limite):
+        taxa, capacidade, reserva_normal, ignorar = RateLimiter.parametros(0)
+        self.assertEqual((taxa, capacidade, ignorar), (1.0, 10.0, 0))
+        self.assertEqual(reserva_normal, 2.5)
+        self.assertEqual(RateLimiter.parametros(1)[2], 0.0)
+        self.assertEqual(RateLimiter.parametros(2)[3], 1)
+
+    @patch.object(RateLimiter, 'limite_por_minuto', return_value=6)
+    def test_reserva_nao_bloqueia_balde_pequeno(self, _limite):
+        _taxa, capacidade, reserva, _ignorar = RateLimiter.parametros(0)
+        self.assertEqual(capacidade, 1.0)
+        self.assertEqual(reserva, 0.0)
+
+    def test_countdown_arredondado_para_cima(self):
+        self.assertEqual(RateLimiter.espera_para_countdown(2.31), 2.4)
+        self.assertEqual(RateLimiter.espera_para_countdown(0), 0.1)
+
+    @patch.object(WhatsAppService, '_enfileirar_despacho')
+    @patch.object(ControleEnvio, 'autorizar')
+    def test_limitado_vai_para_fila_de_despacho(self, mock_autorizar, mock_enfileirar):
+        mock_autorizar.return_value = {'estado': 'CLOSED', 'permitido': False, 'restantes': 0, 'espera': 3.2,
+                                       'limpo': True}
+        app = Flask(__name__)
+        with app.app_context():
+            ok, resposta = WhatsAppService.enviar_mensagem('5511999999999', 'Olá', prioridade=1, notificacao_id=7)
+
+        self.assertTrue(ok)
+        self.assertEqual(resposta, {'status': 'enfileirado', 'espera': 3.2})
+        mock_autorizar.assert_called_once_with(prioridade=1, token_reservado=False)
+        mock_enfileirar.assert_called_once_with(7, 3.2)
+
+
+class TestRedisClient(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['CELERY_BROKER_URL'] = 'redis://localhost:6379/15'
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        redis_client._clientes.clear()
+
+    def tearDown(self):
+        redis_client._clientes.clear()
+        self.ctx.pop()
+
+    def test_cliente_reutilizado(self):
+        # Criar o pool não abre conexão; o mesmo cliente é devolvido em chamadas seguidas
+        self.assertIs(redis_client.get_redis(), redis_client.get_redis())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from app.extensions import db
+from app.models.terceirizados_models import Terceirizado, HistoricoNotificacao
+from app.models.whatsapp_models import Conversa
+from app.services.conversa_service import ConversaService
+from app.utils.contador_sql import ContadorConsultas
+
+
+class TestConversaService(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.agora = datetime.utcnow()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _inbound(self, telefone, texto='oi', minutos=0, push_name=None, tipo_conteudo='text'):
+        msg = HistoricoNotificacao(tipo='resposta_auto', direcao='inbound', remetente=telefone,
+                                   destinatario='sistema', mensagem=texto, tipo_conteudo=tipo_conteudo,
+                                   status_leitura='nao_lida', caption=push_name,
+                                   criado_em=self.agora + timedelta(minutes=minutos))
+        db.session.add(msg)
+        return msg
+
+    def _outbound(self, telefone, texto='resposta', minutos=0):
+        msg = HistoricoNotificacao(tipo='resposta_manual', direcao='outbound', remetente='sistema',
+                                   destinatario=telefone, mensagem=texto, tipo_conteudo='text',
+                                   criado_em=self.agora + timedelta(minutes=minutos))
+        db.session.add(msg)
+        return msg
+
+    def _conversa(self, telefone='5527988010899'):
+        return Conversa.query.filter_by(telefone=telefone).one()
+
+    def test_resumo_mantido_a_cada_mensagem(self):
+        db.session.add(Terceirizado(nome='Prestador', telefone='5527988010899'))
+        self._inbound('5527988010899', 'primeira', minutos=0)
+        self._inbound('27988010899', 'segunda', minutos=1)  # sem DDI: mesma conversa
+        self._outbound('5527988010899', 'x' * 80, minutos=2)
+        db.session.commit()
+
+        conversa = self._conversa()
+        self.assertEqual(Conversa.query.count(), 1)
+        self.assertEqual(conversa.nome_contato, 'Prestador')
+        self.assertEqual(conversa.nome_origem, 'terceirizado')
+        self.assertEqual(conversa.nao_lidas, 2)
+        self.assertEqual(conversa.ultima_direcao, 'outbound')
+        self.assertEqual(conversa.ultima_preview, '↗ ' + 'x' * 50 + '...')
+
+    def test_mensagem_fora_de_ordem_nao_troca_previa(self):
+        self._inbound('5527988010899', 'recente', minutos=10)
+        db.session.commit()
+        self._inbound('5527988010899', 'antiga', minutos=0)
+        db.session.commit()
+        conversa = self._conversa()
+        self.assertEqual(conversa.ultima_preview, 'recente')
+        self.assertEqual(conversa.nao_lidas, 2)
+
+    def test_push_name_para_contato_nao_cadastrado(self):
+        self._inbound('5511911112222', push_name='João')
+        self._inbound('5511911112222', 'foto', tipo_conteudo='image', push_name='legenda da foto', minutos=1)
+        db.session.commit()
+        conversa = self._conversa('5511911112222')
+        self.assertEqual(conversa.nome_contato, 'João')
+        self.assertEqual(conversa.ultima_preview, '📷 Imagem')
+
+        # Cadastro posterior passa a valer no lugar do pushName
+        db.session.add(Terceirizado(nome='João Elétrica', telefone='5511911112222'))
+        db.session.commit()
+        self.assertEqual(self._conversa('5511911112222').nome_contato, 'João Elétrica')
+
+    def test_exclusao_e_leitura_recalculam(self):
+        self._inbound('5527988010899', 'primeira', minutos=0)
+        ultima = self._inbound('5527988010899', 'segunda', minutos=1)
+        db.session.commit()
+
+        ultima.excluido_em = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(self._conversa().ultima_preview, 'primeira')
+
+        ConversaService.marcar_lida('5527988010899')
+        db.session.commit()
+        self.assertEqual(self._conversa().nao_lidas, 0)
+        self.assertEqual(HistoricoNotificacao.query.filter_by(status_leitura='nao_lida').count(), 0)
+
+    def test_rollback_desfaz_resumo(self):
+        self._inbound('5527988010899')
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(Conversa.query.count(), 0)
+
+    def test_listagem_em_uma_consulta(self):
+        for n in range(30):
+            self._inbound(f'55119{n:08d}', minutos=n)
+        db.session.commit()
+        self._inbound('5511900000000', 'de novo', minutos=60)
+        db.session.commit()
+        ConversaService.marcar_lida('5511900000001')
+        db.session.commit()
+
+        with ContadorConsultas(db.engine) as contador:
+            todas = ConversaService.listar()
+            nao_lidas = ConversaService.listar('nao_lidas')
+        self.assertEqual(contador.total, 2)
+        self.assertEqual(len(todas), 30)
+        self.assertEqual(todas[0].telefone, '5511900000000')
+        self.assertEqual(todas[0].nao_lidas, 2)
+        self.assertEqual(len(nao_lidas), 29)
+
+    def test_reconstruir_igual_ao_incremental(self):
+        db.session.add(Terceirizado(nome='Prestador', telefone='5527988010899'))
+        self._inbound('27988010899', 'a', minutos=0)
+        self._outbound('5527988010899', 'b', minutos=1)
+        self._inbound('5511911112222', 'c', minutos=2, push_name='Maria')
+        db.session.commit()
+        campos = ('telefone', 'nome_contato', 'nome_origem', 'ultima_mensagem_id', 'ultima_preview', 'nao_lidas')
+        incremental = sorted(tuple(getattr(c, f) for f in campos) for c in Conversa.query.all())
+
+        self.assertEqual(ConversaService.reconstruir(), 2)
+        db.session.commit()
+        db.session.expire_all()
+        reconstruido = sorted(tuple(getattr(c, f) for f in campos) for c in Conversa.query.all())
+        self.assertEqual(reconstruido, incremental)
+
+    def test_telefone_contato_preenchido_no_insert(self):
+        entrada = self._inbound('27988010899')
+        saida = self._outbound('(27) 98801-0899', minutos=1)
+        db.session.commit()
+        self.assertEqual(entrada.telefone_contato, '5527988010899')
+        self.assertEqual(saida.telefone_contato, '5527988010899')
+
+    def test_paginacao_por_cursor(self):
+        for n in range(120):
+            self._inbound('5527988010899', f'm{n}', minutos=n // 2)  # pares com o mesmo criado_em
+        self._inbound('5511911112222', 'outra conversa')
+        excluida = self._inbound('27988010899', 'apagada', minutos=30)
+        db.session.commit()
+        excluida.excluido_em = datetime.utcnow()
+        db.session.commit()
+
+        recentes, tem_anteriores = ConversaService.mensagens('27988010899')
+        self.assertTrue(tem_anteriores)
+        self.assertEqual([m.mensagem for m in recentes], [f'm{n}' for n in range(70, 120)])
+
+        vistas = [m.mensagem for m in recentes]
+        cursor = ConversaService.cursor(recentes[0])
+        while cursor:
+            with ContadorConsultas(db.engine) as contador:
+                pagina, tem_anteriores = ConversaService.mensagens('5527988010899', antes=cursor)
+            self.assertEqual(contador.total, 1)
+            vistas = [m.mensagem for m in pagina] + vistas
+            cursor = ConversaService.cursor(pagina[0]) if tem_anteriores else None
+        self.assertEqual(vistas, [f'm{n}' for n in range(120)])
+
+        novas, _ = ConversaService.mensagens('5527988010899', depois=ConversaService.cursor(recentes[-1]))
+        self.assertEqual(novas, [])
+        self._outbound('5527988010899', 'nova', minutos=59)
+        db.session.commit()
+        novas, _ = ConversaService.mensagens('5527988010899', depois=ConversaService.cursor(recentes[-1]))
+        self.assertEqual([m.mensagem for m in novas], ['nova'])
+
+        with self.assertRaises(ValueError):
+            ConversaService.mensagens('5527988010899', antes='ontem')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import random
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+import redis
+from flask import Flask
+from sqlalchemy import event
+from app.extensions import db
+from app.models.estoque_models import Estoque, MovimentacaoEstoque
+from app.services.estoque_service import EstoqueService
+
+
+def _curva_abc_legado(filtros=()):
+    """Implementação anterior (consulta por item + Decimal), usada como oráculo."""
+    from sqlalchemy import func
+    consumo = db.session.query(
+        MovimentacaoEstoque.estoque_id, func.sum(MovimentacaoEstoque.quantidade)
+    ).filter(MovimentacaoEstoque.tipo_movimentacao == 'consumo', *filtros).group_by(MovimentacaoEstoque.estoque_id).all()
+    dados, total = [], Decimal('0.00')
+    for estoque_id, qtd in consumo:
+        item = db.session.get(Estoque, estoque_id)
+        if item and item.valor_unitario:
+            dados.append({'id': item.id, 'valor_consumo': qtd * item.valor_unitario})
+            total += qtd * item.valor_unitario
+    dados.sort(key=lambda x: x['valor_consumo'], reverse=True)
+    acumulado = Decimal('0.00')
+    for d in dados:
+        acumulado += d['valor_consumo']
+        pct = acumulado / total * 100
+        d['classe'] = 'A' if pct <= 80 else ('B' if pct <= 95 else 'C')
+    return [(d['id'], float(d['valor_consumo']), d['classe']) for d in dados], float(total)
+
+
+class TestCurvaAbc(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        rnd = random.Random(11)
+        self.agora = datetime.utcnow()
+        itens = [Estoque(codigo=f'P{i}', nome=f'Peça {i}', unidade_medida='un',
+                         valor_unitario=0 if i == 0 else rnd.randint(1, 400)) for i in range(60)]
+        db.session.add_all(itens)
+        db.session.flush()
+        for _ in range(1500):
+            db.session.add(MovimentacaoEstoque(
+                estoque_id=rnd.choice(itens).id, tipo_movimentacao=rnd.choice(['consumo', 'consumo', 'entrada']),
+                quantidade=rnd.randint(1, 9), unidade_id=rnd.randint(1, 3), usuario_id=1,
+                data_movimentacao=self.agora - timedelta(days=rnd.randint(0, 200))))
+        db.session.commit()
+
+        # Sem Redis: cada teste exercita a consulta
+        self.redis = MagicMock()
+        self.redis.get.side_effect = redis.exceptions.ConnectionError()
+        self.redis.setex.side_effect = redis.exceptions.ConnectionError()
+        self.patcher = patch.object(EstoqueService, '_get_redis', return_value=self.redis)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _resumo(self, dados, total):
+        return [(d['id'], round(d['valor_consumo'], 2), d['classe']) for d in dados], round(total, 2)
+
+    def _comparar(self, dados_total, legado):
+        atual, total = self._resumo(*dados_total)
+        esperado, total_esperado = legado
+        self.assertEqual(total, round(total_esperado, 2))
+        self.assertEqual(atual, [(i, round(v, 2), c) for i, v, c in esperado])
+
+    def test_igual_a_implementacao_anterior(self):
+        self._comparar(EstoqueService.gerar_curva_abc(), _curva_abc_legado())
+
+    def test_por_unidade_e_janela(self):
+        inicio = self.agora - timedelta(days=30)
+        self._comparar(
+            EstoqueService.gerar_curva_abc(unidade_id=2, inicio=inicio),
+            _curva_abc_legado([MovimentacaoEstoque.unidade_id == 2, MovimentacaoEstoque.data_movimentacao >= inicio]))
+
+    def test_fallback_sem_window_functions(self):
+        com_janela = EstoqueService.gerar_curva_abc(unidade_id=1)
+        with patch.object(EstoqueService, '_janela_disponivel', return_value=False):
+            sem_janela = EstoqueService.gerar_curva_abc(unidade_id=1)
+        self.assertEqual(self._resumo(*sem_janela), self._resumo(*com_janela))
+
+    def test_uma_unica_consulta(self):
+        consultas = []
+
+        def _contar(*_args, **_kwargs):
+            consultas.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            dados, _total = EstoqueService.gerar_curva_abc()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+        self.assertGreater(len(dados), 50)
+        self.assertEqual(len(consultas), 1)
+
+    def test_cache_do_dia(self):
+        cache = {}
+        self.redis.get.side_effect = cache.get
+        self.redis.setex.side_effect = lambda chave, ttl, valor: cache.__setitem__(chave, valor)
+
+        primeiro = EstoqueService.gerar_curva_abc(unidade_id=3)
+        self.assertEqual(len(cache), 1)
+        chave = next(iter(cache))
+        self.assertIn(datetime.utcnow().date().isoformat(), chave)
+        self.assertLessEqual(self.redis.setex.call_args[0][1], 24 * 3600)
+
+        with patch.object(EstoqueService, '_consultar_curva_abc') as consultar:
+            segundo = EstoqueService.gerar_curva_abc(unidade_id=3)
+        consultar.assert_not_called()
+        self.assertEqual(segundo, (json.loads(cache[chave])['itens'], primeiro[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
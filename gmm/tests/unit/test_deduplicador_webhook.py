@@ -0,0 +1,93 @@
+import unittest
+from collections import OrderedDict
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from app.extensions import db
+from app.models.terceirizados_models import HistoricoNotificacao
+from app.services.deduplicador_webhook import DeduplicadorWebhook
+from app.routes.webhook import registrar_mensagem_inbound
+
+
+class TestDeduplicadorWebhook(unittest.TestCase):
+    def setUp(self):
+        DeduplicadorWebhook._lru = OrderedDict()
+        DeduplicadorWebhook._contadores = dict.fromkeys(DeduplicadorWebhook._contadores, 0)
+        self.redis = MagicMock()
+        self.patcher = patch.object(DeduplicadorWebhook, '_get_redis', return_value=self.redis)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_primeira_vez_reserva_no_redis(self):
+        self.redis.set.return_value = True
+        self.assertFalse(DeduplicadorWebhook.ja_processado('MSG1'))
+        self.redis.set.assert_called_once_with('whatsapp:dedup:MSG1', 1, nx=True, ex=DeduplicadorWebhook.TTL)
+        self.assertEqual(DeduplicadorWebhook._contadores['miss'], 1)
+
+    def test_retry_barrado_pelo_lru_sem_redis(self):
+        self.redis.set.return_value = True
+        DeduplicadorWebhook.ja_processado('MSG1')
+        self.redis.set.reset_mock()
+
+        self.assertTrue(DeduplicadorWebhook.ja_processado('MSG1'))
+        self.redis.set.assert_not_called()
+        self.assertEqual(DeduplicadorWebhook._contadores['hit_lru'], 1)
+
+    def test_retry_de_outro_worker_barrado_pelo_redis(self):
+        self.redis.set.return_value = None  # SET NX falhou: chave já existe
+        self.assertTrue(DeduplicadorWebhook.ja_processado('MSG2'))
+        self.assertEqual(DeduplicadorWebhook._contadores['hit_redis'], 1)
+
+    def test_lru_limitado(self):
+        self.redis.set.return_value = True
+        with patch.object(DeduplicadorWebhook, 'CAPACIDADE_LRU', 2):
+            for msg_id in ('A', 'B', 'C'):
+                DeduplicadorWebhook.ja_processado(msg_id)
+        self.assertEqual(list(DeduplicadorWebhook._lru), ['B', 'C'])
+
+    def test_liberar_permite_novo_processamento(self):
+        self.redis.set.return_value = True
+        DeduplicadorWebhook.ja_processado('MSG3')
+        DeduplicadorWebhook.liberar('MSG3')
+        self.redis.delete.assert_called_once_with('whatsapp:dedup:MSG3')
+        self.assertFalse(DeduplicadorWebhook.ja_processado('MSG3'))
+
+    def test_sem_msg_id_nao_deduplica(self):
+        self.assertFalse(DeduplicadorWebhook.ja_processado(''))
+        self.redis.set.assert_not_called()
+
+
+class TestIndiceUnicoMegaapiId(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _dados(self, msg_id):
+        return {'tipo': 'interactive', 'msg_id': msg_id, 'interactive_id': 'aprovar_1',
+                'interactive_title': 'Aprovar'}
+
+    @patch.object(DeduplicadorWebhook, '_contar')
+    def test_duplicata_no_banco_retorna_none(self, mock_contar):
+        self.assertIsNotNone(registrar_mensagem_inbound(self._dados('MSG9'), '5511999990000'))
+        self.assertIsNone(registrar_mensagem_inbound(self._dados('MSG9'), '5511999990000'))
+        mock_contar.assert_called_once_with('hit_banco')
+        self.assertEqual(HistoricoNotificacao.query.count(), 1)
+
+    def test_msg_id_vazio_nao_colide(self):
+        registrar_mensagem_inbound(self._dados(''), '5511999990000')
+        registrar_mensagem_inbound(self._dados(''), '5511999990000')
+        self.assertEqual(HistoricoNotificacao.query.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
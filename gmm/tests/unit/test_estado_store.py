@@ -0,0 +1,177 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import redis
+from flask import Flask
+from app.extensions import db
+from app.models.whatsapp_models import EstadoConversa
+from app.services.estado_service import EstadoService
+from app.services.estado_store import EstadoStore
+from app.utils.contador_sql import ContadorConsultas
+
+
+class _RedisMemoria:
+    """Hashes, listas e pipeline mínimos para o EstadoStore."""
+
+    def __init__(self):
+        self.dados = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return _Pipeline(self)
+
+    def hgetall(self, chave):
+        return {k.encode(): v.encode() for k, v in self.dados.get(chave, {}).items()}
+
+    def delete(self, chave):
+        self.dados.pop(chave, None)
+
+    def hset(self, chave, mapping):
+        self.dados.setdefault(chave, {}).update(mapping)
+
+    def expire(self, chave, ttl):
+        self.ttls[chave] = ttl
+
+    def rpush(self, chave, valor):
+        self.dados.setdefault(chave, []).append(valor.encode())
+
+    def lrange(self, chave, inicio, fim):
+        return self.dados.get(chave, [])[inicio:fim + 1]
+
+    def ltrim(self, chave, inicio, fim):
+        self.dados[chave] = self.dados.get(chave, [])[inicio:]
+
+
+class _Pipeline:
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self.comandos = []
+
+    def __getattr__(self, nome):
+        return lambda *args, **kwargs: self.comandos.append((nome, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.cliente, nome)(*args, **kwargs) for nome, args, kwargs in self.comandos]
+
+
+class TestEstadoStore(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.redis = _RedisMemoria()
+        self.patcher = patch.object(EstadoStore, '_get_redis', return_value=self.redis)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _estado(self, telefone='5527988010899', estado_atual='menu_usuario', **contexto):
+        estado = EstadoConversa(telefone=telefone, estado_atual=estado_atual, usuario_tipo='terceirizado',
+                                usuario_id=7, chamado_id=None)
+        estado.set_contexto(contexto or {'fluxo': 'menu_usuario'})
+        return estado
+
+    def test_redis_sem_sql_no_caminho_quente(self):
+        with ContadorConsultas(db.engine) as contador:
+            EstadoStore.salvar(self._estado(etapa='aguardando_codigo', fluxo='solicitar_peca'))
+            db.session.commit()
+            estado = EstadoStore.obter('5527988010899')
+            estado.estado_atual = 'solicitacao_peca_quantidade'
+            EstadoStore.salvar(estado)
+            db.session.commit()
+            estado = EstadoStore.obter('5527988010899')
+        self.assertEqual(contador.total, 0)
+
+        self.assertEqual(estado.estado_atual, 'solicitacao_peca_quantidade')
+        self.assertEqual(estado.get_contexto(), {'etapa': 'aguardando_codigo', 'fluxo': 'solicitar_peca'})
+        self.assertEqual((estado.usuario_id, estado.chamado_id), (7, None))
+        self.assertEqual(self.redis.ttls['gmm:estado:5527988010899'], EstadoStore.TTL)
+        self.assertIsNone(EstadoStore.obter('5511911112222'))
+
+    def test_auditoria_write_behind(self):
+        EstadoStore.salvar(self._estado())
+        EstadoStore.remover('5527988010899')
+        db.session.commit()
+        self.assertIsNone(EstadoStore.obter('5527988010899'))
+        self.assertEqual(EstadoConversa.query.count(), 0)
+
+        self.assertEqual(EstadoStore.gravar_auditoria(), 2)
+        self.assertEqual(EstadoStore.gravar_auditoria(), 0)
+        linhas = EstadoConversa.query.order_by(EstadoConversa.id).all()
+        self.assertEqual([l.estado_atual for l in linhas], ['menu_usuario', EstadoStore.ENCERRADO])
+        self.assertEqual(linhas[0].get_contexto(), {'fluxo': 'menu_usuario'})
+
+        # A tabela de auditoria também serve de leitura no backend SQL
+        self.app.config['ESTADO_CONVERSA_BACKEND'] = 'sql'
+        self.assertIsNone(EstadoStore.obter('5527988010899'))
+
+    def test_grava_no_redis_so_apos_commit(self):
+        EstadoStore.salvar(self._estado())
+        # Pendente: visível na própria sessão, ainda fora do Redis
+        self.assertEqual(EstadoStore.obter('5527988010899').estado_atual, 'menu_usuario')
+        self.assertEqual(self.redis.dados, {})
+        db.session.rollback()
+        self.assertIsNone(EstadoStore.obter('5527988010899'))
+        self.assertEqual(self.redis.dados, {})
+
+        EstadoStore.salvar(self._estado())
+        db.session.commit()
+        EstadoStore.remover('5527988010899')
+        self.assertIsNone(EstadoStore.obter('5527988010899'))
+        db.session.rollback()
+        self.assertEqual(EstadoStore.obter('5527988010899').estado_atual, 'menu_usuario')
+
+    def test_retencao_da_auditoria(self):
+        antigo = self._estado('5511911112222')
+        antigo.updated_at = datetime.utcnow() - timedelta(days=EstadoStore._retencao_dias() + 1)
+        recente = self._estado()
+        recente.updated_at = datetime.utcnow() - timedelta(days=2)
+        db.session.add_all([antigo, recente])
+        db.session.commit()
+
+        self.assertEqual(EstadoStore.limpar_expirados(), 1)
+        self.assertEqual([e.telefone for e in EstadoConversa.query.all()], ['5527988010899'])
+
+    def test_sem_redis_usa_a_tabela(self):
+        with patch.object(EstadoStore, '_get_redis', side_effect=redis.exceptions.ConnectionError):
+            EstadoStore.salvar(self._estado())
+            db.session.commit()
+            self.assertEqual(EstadoStore.obter('5527988010899').estado_atual, 'menu_usuario')
+            EstadoStore.remover('5527988010899')
+            db.session.commit()
+            self.assertIsNone(EstadoStore.obter('5527988010899'))
+
+    def test_backend_sql_expira_em_24h(self):
+        self.app.config['ESTADO_CONVERSA_BACKEND'] = 'sql'
+        EstadoStore.salvar(self._estado())
+        antigo = self._estado('5511911112222')
+        EstadoStore.salvar(antigo)
+        antigo.updated_at = datetime.utcnow() - timedelta(hours=25)
+        db.session.commit()
+
+        self.assertIsNotNone(EstadoStore.obter('5527988010899'))
+        self.assertIsNone(EstadoStore.obter('5511911112222'))
+        self.assertEqual(EstadoStore.limpar_expirados(), 1)
+
+        self.app.config['ESTADO_CONVERSA_BACKEND'] = 'redis'
+        self.assertEqual(EstadoStore.limpar_expirados(), 0)  # auditoria dentro da retenção
+
+    def test_criar_ou_atualizar_estado(self):
+        EstadoService.criar_ou_atualizar_estado('5527988010899', {'fluxo': 'contexto_equipamento',
+                                                                  'equipamento_id': 3})
+        EstadoService.criar_ou_atualizar_estado('5527988010899', {'equipamento_id': 4})
+        estado = EstadoStore.obter('5527988010899')
+        self.assertEqual(estado.get_contexto(), {'fluxo': 'contexto_equipamento', 'equipamento_id': 4})
+        self.assertEqual(estado.estado_atual, 'inicio')
+
+
+if __name__ == '__main__':
+    unittest.main()
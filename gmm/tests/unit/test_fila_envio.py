@@ -0,0 +1,149 @@
+import json
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from app.services.fila_envio import FilaEnvio
+from app.services.rate_limiter import RateLimiter
+from app.tasks import whatsapp_tasks
+from app.tasks.whatsapp_tasks import despachar_fila_outbound
+
+
+class TestFilaEnvio(unittest.TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.patchers = [
+            patch.object(FilaEnvio, '_get_redis', return_value=self.redis),
+            patch.object(RateLimiter, 'limite_por_minuto', return_value=60),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_faixas_ordenam_por_prioridade(self):
+        self.assertLess(FilaEnvio._faixa(2), FilaEnvio._faixa(1))
+        self.assertLess(FilaEnvio._faixa(1), FilaEnvio._faixa(0))
+        self.assertEqual(FilaEnvio._faixa(5), FilaEnvio._faixa(2))
+
+    def test_enfileirar_usa_criado_em_utc_e_intervalo_do_balde(self):
+        notif = SimpleNamespace(id=42, prioridade=1, destinatario='5511999990000',
+                                criado_em=datetime(2026, 1, 1, 12, 0, 0))
+        self.assertTrue(FilaEnvio.enfileirar(notif))
+
+        args = self.redis.eval.call_args.args
+        self.assertEqual(args[1:5], (3, FilaEnvio.CHAVE_FILA, FilaEnvio.CHAVE_DADOS, FilaEnvio.CHAVE_TEMPO_VIRTUAL))
+        notificacao_id, destinatario, criado_em, intervalo, faixa, dados = args[5:]
+        self.assertEqual((notificacao_id, destinatario), (42, '5511999990000'))
+        self.assertEqual(criado_em, 1767268800.0)
+        self.assertEqual(intervalo, 1.0)  # 60 msg/min
+        self.assertEqual(faixa, FilaEnvio._faixa(1))
+        self.assertEqual(json.loads(dados)['prioridade'], 1)
+
+    def test_proximo_move_para_em_voo_e_decodifica_membro(self):
+        self.redis.eval.return_value = [b'42', b'10000000005']
+        self.redis.hget.return_value = json.dumps({'prioridade': 1, 'enfileirado_em': 100.0})
+        self.assertEqual(FilaEnvio.proximo(), (42, 1e10 + 5, {'prioridade': 1, 'enfileirado_em': 100.0}))
+        args = self.redis.eval.call_args.args
+        self.assertEqual(args[:5], (FilaEnvio._LUA_RETIRAR, 3, FilaEnvio.CHAVE_FILA, FilaEnvio.CHAVE_EM_VOO,
+                                    FilaEnvio.CHAVE_EM_VOO_PONTUACAO))
+
+    def test_fila_vazia(self):
+        self.redis.eval.return_value = None
+        self.assertIsNone(FilaEnvio.proximo())
+
+    def test_devolver_e_despacho_tiram_do_em_voo(self):
+        pipe = self.redis.pipeline.return_value
+        FilaEnvio.devolver(42, 10.0)
+        pipe.zadd.assert_called_once_with(FilaEnvio.CHAVE_FILA, {'42': 10.0})
+        pipe.zrem.assert_called_once_with(FilaEnvio.CHAVE_EM_VOO, '42')
+
+        pipe.reset_mock()
+        FilaEnvio.registrar_despacho(42, {'prioridade': 0, 'enfileirado_em': 100.0})
+        pipe.zrem.assert_called_once_with(FilaEnvio.CHAVE_EM_VOO, '42')
+        pipe.hdel.assert_any_call(FilaEnvio.CHAVE_EM_VOO_PONTUACAO, '42')
+        pipe.execute.assert_called_once()
+
+    @patch('app.services.fila_envio.time.time', return_value=1000.0)
+    def test_recupera_em_voo_mais_antigos_que_o_lock(self, _time):
+        self.redis.eval.return_value = 2
+        self.assertEqual(FilaEnvio.recuperar_em_voo(), 2)
+        args = self.redis.eval.call_args.args
+        self.assertEqual(args[0], FilaEnvio._LUA_RECUPERAR)
+        self.assertEqual(args[-1], 1000.0 - FilaEnvio.TTL_LOCK)
+
+
+class TestDespacharFilaOutbound(unittest.TestCase):
+    def setUp(self):
+        self.patchers = [
+            patch.object(FilaEnvio, 'adquirir_despachante', return_value='tok'),
+            patch.object(FilaEnvio, 'liberar_despachante'),
+            patch.object(FilaEnvio, 'registrar_despacho'),
+            patch.object(FilaEnvio, 'devolver'),
+            patch.object(FilaEnvio, 'recuperar_em_voo'),
+            patch.object(whatsapp_tasks.time, 'sleep'),
+            patch.object(whatsapp_tasks.enviar_whatsapp_task, 'apply_async'),
+        ]
+        (_, self.liberar, self.registrar, self.devolver, self.recuperar,
+         self.sleep, self.apply_async) = [p.start() for p in self.patchers]
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_dorme_a_espera_exata_e_despacha_com_token(self):
+        fila = [(1, 10.0, {'prioridade': 0}), (1, 10.0, {'prioridade': 0}), None]
+        with patch.object(FilaEnvio, 'proximo', side_effect=fila), \
+                patch.object(RateLimiter, 'consumir', side_effect=[(False, 0, 0.7), (True, 0, 0.0)]):
+            resultado = despachar_fila_outbound()
+
+        self.assertEqual(resultado, {'despachados': 1})
+        self.devolver.assert_called_once_with(1, 10.0)
+        self.sleep.assert_called_once_with(0.7)
+        self.apply_async.assert_called_once_with(args=[1], kwargs={'token_reservado': True})
+        self.liberar.assert_called_once_with('tok')
+        self.recuperar.assert_called_once_with()
+
+    def test_falha_no_apply_async_deixa_o_item_em_voo(self):
+        self.apply_async.side_effect = ConnectionError('broker')
+        with patch.object(FilaEnvio, 'proximo', return_value=(1, 10.0, {'prioridade': 0})), \
+                patch.object(RateLimiter, 'consumir', return_value=(True, 0, 0.0)):
+            with self.assertRaises(ConnectionError):
+                despachar_fila_outbound()
+        # Sem confirmação: o próximo despacho o devolve à fila (recuperar_em_voo)
+        self.registrar.assert_not_called()
+        self.liberar.assert_called_once_with('tok')
+
+    def test_um_despachante_por_vez(self):
+        with patch.object(FilaEnvio, 'adquirir_despachante', return_value=None):
+            self.assertEqual(despachar_fila_outbound(), {'status': 'em_execucao'})
+        self.apply_async.assert_not_called()
+        self.recuperar.assert_not_called()
+
+
+class TestEnfileirarDespacho(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    @patch('app.tasks.whatsapp_tasks.despachar_fila_outbound')
+    @patch('app.tasks.whatsapp_tasks.enviar_whatsapp_task')
+    @patch.object(FilaEnvio, 'enfileirar', return_value=False)
+    @patch('app.extensions.db.session')
+    def test_sem_redis_reagenda_pela_espera(self, mock_session, _enfileirar, mock_task, mock_despachar):
+        from app.services.whatsapp_service import WhatsAppService
+        mock_session.get.return_value = MagicMock()
+        WhatsAppService._enfileirar_despacho(7, 2.5)
+        mock_task.apply_async.assert_called_once_with(args=[7], countdown=2.5)
+        mock_despachar.delay.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
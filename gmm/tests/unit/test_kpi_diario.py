@@ -0,0 +1,166 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event
+from app.extensions import db
+from app.models.analytics_models import KpiDiario, KpiDiarioSujo
+from app.models.estoque_models import OrdemServico, Estoque, MovimentacaoEstoque, PedidoCompra
+from app.models.terceirizados_models import ChamadoExterno
+from app.services.analytics_service import AnalyticsService
+from app.services.kpi_diario_service import KpiDiarioService
+
+
+class TestKpiDiario(unittest.TestCase):
+    UNIDADES = 3
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self._semear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _semear(self):
+        rnd = random.Random(3)
+        agora = datetime.utcnow()
+
+        def quando():
+            return agora - timedelta(minutes=rnd.randint(0, 40 * 24 * 60))
+
+        pecas = [Estoque(codigo=f'P{i}', nome=f'Peça {i}', unidade_medida='un', valor_unitario=rnd.randint(5, 90))
+                 for i in range(5)]
+        db.session.add_all(pecas)
+        db.session.flush()
+        for n in range(300):
+            unidade = 1 + n % self.UNIDADES
+            abertura = quando()
+            status = rnd.choice(['concluida', 'concluida', 'aberta', 'em_andamento'])
+            os_ = OrdemServico(
+                numero_os=f'OS-{n}', tecnico_id=1, unidade_id=unidade, tipo_manutencao='corretiva',
+                descricao_problema='x', status=status, prazo_conclusao=abertura, data_abertura=abertura,
+                data_conclusao=abertura + timedelta(minutes=rnd.randint(30, 3000)) if status == 'concluida' else None,
+            )
+            db.session.add(os_)
+            db.session.flush()
+            db.session.add(MovimentacaoEstoque(
+                estoque_id=rnd.choice(pecas).id, tipo_movimentacao=rnd.choice(['consumo', 'entrada']),
+                quantidade=rnd.randint(1, 4), unidade_id=unidade, usuario_id=1, data_movimentacao=quando(),
+            ))
+            if n % 4 == 0:
+                criado = quando()
+                concluido = rnd.random() < 0.5
+                db.session.add(ChamadoExterno(
+                    numero_chamado=f'CH-{n}', os_id=os_.id, terceirizado_id=1, titulo='t', descricao='d',
+                    prazo_combinado=criado, criado_por=1, valor_final=rnd.randint(50, 900), criado_em=criado,
+                    status='concluido' if concluido else 'aguardando',
+                    data_conclusao=criado + timedelta(hours=rnd.randint(1, 72)) if concluido else None,
+                ))
+            if n % 3 == 0:
+                solicitado = quando()
+                status = rnd.choice(['pendente', 'aprovado', 'faturado', 'recebido'])
+                db.session.add(PedidoCompra(
+                    quantidade=1, status=status, unidade_destino_id=unidade, data_solicitacao=solicitado,
+                    valor_total_estimado=rnd.randint(100, 5000),
+                ))
+        db.session.commit()
+
+    def _compras(self, dias):
+        totais = KpiDiarioService.totais((datetime.utcnow() - timedelta(days=dias)).date(), fontes=('compras',))
+        return {k: round(v, 4) for k, v in totais.items()}
+
+    def test_rollup_igual_ao_calculo_ao_vivo(self):
+        antes = [AnalyticsService.get_kpi_geral(days=30), AnalyticsService.get_kpi_geral(unidade_id=2, days=30),
+                 AnalyticsService.get_cost_evolution(days=30), self._compras(30)]
+
+        resultado = KpiDiarioService.atualizar()
+        self.assertEqual(KpiDiarioService.processado_ate(), datetime.utcnow().date() - timedelta(days=1))
+        self.assertGreater(resultado['linhas'], 0)
+        self.assertLessEqual(KpiDiario.query.count(), 41 * self.UNIDADES)
+
+        depois = [AnalyticsService.get_kpi_geral(days=30), AnalyticsService.get_kpi_geral(unidade_id=2, days=30),
+                  AnalyticsService.get_cost_evolution(days=30), self._compras(30)]
+        self.assertEqual(depois, antes)
+
+    def test_empenhado_igual_a_soma_dos_pedidos(self):
+        pedidos = PedidoCompra.query.filter(PedidoCompra.status.in_(['aprovado', 'faturado', 'recebido'])).all()
+
+        KpiDiarioService.atualizar()
+        self.assertEqual(self._compras(60)['compras_empenhado'], sum(p.valor_total_estimado for p in pedidos))
+
+    def test_alteracao_em_dia_consolidado_marca_e_recalcula(self):
+        KpiDiarioService.atualizar()
+        os_ = OrdemServico.query.filter(
+            OrdemServico.status == 'aberta',
+            OrdemServico.data_abertura < datetime.utcnow() - timedelta(days=3)
+        ).first()
+        os_.status = 'concluida'
+        os_.data_conclusao = os_.data_abertura + timedelta(hours=5)
+        db.session.commit()
+        self.assertEqual([s.dia for s in KpiDiarioSujo.query.all()], [os_.data_abertura.date()])
+
+        KpiDiarioService.atualizar()
+        self.assertEqual(KpiDiarioSujo.query.count(), 0)
+        inicio = datetime.combine(os_.data_abertura.date(), datetime.min.time())
+        ao_vivo = KpiDiarioService.agregar(inicio, inicio + timedelta(days=1), unidade_id=os_.unidade_id,
+                                           fontes=('os',))[0]
+        registro = KpiDiario.query.filter_by(dia=os_.data_abertura.date(), unidade_id=os_.unidade_id).one()
+        self.assertEqual(registro.os_concluidas, ao_vivo['os_concluidas'])
+        self.assertAlmostEqual(registro.mttr_horas_soma, ao_vivo['mttr_horas_soma'], places=4)
+
+    def test_dia_corrente_nao_gera_marca(self):
+        marcas = KpiDiarioSujo.query.count()  # a carga semeada tem datas passadas
+        db.session.add(OrdemServico(numero_os='OS-hoje', tecnico_id=1, unidade_id=1, tipo_manutencao='corretiva',
+                                    descricao_problema='x', prazo_conclusao=datetime.utcnow()))
+        db.session.commit()
+        self.assertEqual(KpiDiarioSujo.query.count(), marcas)
+
+    def test_atualizacao_incremental(self):
+        hoje = datetime.utcnow().date()
+        KpiDiarioService.atualizar(hoje=hoje)
+        # Dia seguinte: só o novo dia fechado é recalculado
+        resultado = KpiDiarioService.atualizar(hoje=hoje + timedelta(days=1))
+        self.assertEqual(resultado['dias'], 1)
+        self.assertEqual(KpiDiarioService.processado_ate(), hoje)
+
+    def test_leitura_do_historico_em_consultas_fixas(self):
+        KpiDiarioService.atualizar()
+        consultas = []
+
+        def _contar(*_args, **_kwargs):
+            consultas.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            AnalyticsService.get_kpi_geral(days=365)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+        # marca d'água + rollup + 3 fontes ao vivo (só o dia corrente) + backlog
+        self.assertEqual(len(consultas), 6)
+
+
+    def test_api_budget_valida_mes_e_ano(self):
+        from app.extensions import login_manager
+        from app.routes import analytics
+        self.app.config['LOGIN_DISABLED'] = True
+        login_manager.init_app(self.app)
+        self.app.register_blueprint(analytics.bp)
+        cliente = self.app.test_client()
+
+        def status(consulta):
+            return cliente.get(f'/analytics/api/compras/budget?{consulta}').status_code
+
+        for consulta in ('ano=2026&mes=0', 'ano=2026&mes=13', 'ano=0&mes=5', 'ano=99999&mes=5'):
+            self.assertEqual(status(consulta), 400, consulta)
+        self.assertEqual(status('ano=2026&mes=12'), 200)
+        self.assertEqual(status('ano=2026&mes=1'), 200)
+
+if __name__ == '__main__':
+    unittest.main()
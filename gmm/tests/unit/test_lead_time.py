@@ -0,0 +1,154 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+import redis
+from flask import Flask
+from app.extensions import db
+from app.models.models import Unidade, Usuario
+from app.models.estoque_models import PedidoCompra, AprovacaoPedido, Fornecedor, Estoque
+from app.services.lead_time_service import LeadTimeService
+from app.utils.contador_sql import ContadorConsultas
+
+
+class TestLeadTimeService(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.patchers = [
+            patch.object(LeadTimeService, '_get_redis', side_effect=redis.exceptions.ConnectionError),
+            patch.object(LeadTimeService._cache, '_versao_remota', return_value=None),
+            patch.object(LeadTimeService._cache, '_get_redis', side_effect=redis.exceptions.ConnectionError),
+        ]
+        for p in self.patchers:
+            p.start()
+        LeadTimeService._cache.limpar_local()
+
+        self.unidades = [Unidade(nome=f'U{i}', faixa_ip_permitida='*') for i in range(2)]
+        self.fornecedores = [Fornecedor(nome=f'F{i}', email=f'f{i}@x.com') for i in range(2)]
+        self.usuario = Usuario(nome='Diretor', username='dir', senha_hash='x', tipo='diretor')
+        self.peca = Estoque(codigo='P1', nome='Correia', unidade_medida='un')
+        db.session.add_all(self.unidades + self.fornecedores + [self.usuario, self.peca])
+        db.session.flush()
+        self.base = datetime.utcnow().replace(microsecond=0) - timedelta(days=10)
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        LeadTimeService._cache.limpar_local()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _pedido(self, horas_aprovacao, horas_recebimento, tier=1, fornecedor=0, unidade=0, status='recebido',
+                solicitado_em=None):
+        solicitado_em = solicitado_em or self.base
+        pedido = PedidoCompra(
+            estoque_id=self.peca.id, quantidade=1, status=status, tier_aprovacao=tier,
+            fornecedor_id=self.fornecedores[fornecedor].id, unidade_destino_id=self.unidades[unidade].id,
+            solicitante_id=self.usuario.id, data_solicitacao=solicitado_em,
+            data_recebimento=solicitado_em + timedelta(hours=horas_recebimento) if horas_recebimento else None,
+        )
+        db.session.add(pedido)
+        db.session.flush()
+        if horas_aprovacao is not None:
+            # Segunda aprovação (dual-approval) não altera o lead time
+            for extra in (horas_aprovacao + 5, horas_aprovacao):
+                db.session.add(AprovacaoPedido(pedido_id=pedido.id, aprovador_id=self.usuario.id, acao='aprovado',
+                                               created_at=solicitado_em + timedelta(hours=extra)))
+        return pedido
+
+    def test_percentis_e_media_por_etapa(self):
+        for horas in range(1, 11):
+            self._pedido(horas, horas * 10)
+        db.session.commit()
+
+        geral = LeadTimeService.calcular(30)['geral']
+        self.assertEqual(geral['total_pedidos'], 10)
+        self.assertEqual(geral['aprovacao'], {'qtd': 10, 'media': 5.5, 'p50': 5.0, 'p90': 9.0, 'p99': 10.0})
+        self.assertEqual(geral['recebimento']['media'], 55.0)
+        self.assertEqual(geral['recebimento']['p90'], 90.0)
+
+    def test_quebra_por_tier_fornecedor_e_unidade(self):
+        self._pedido(2, 20, tier=1, fornecedor=0, unidade=0)
+        self._pedido(4, 40, tier=1, fornecedor=1, unidade=0)
+        self._pedido(30, None, tier=3, fornecedor=1, unidade=1, status='faturado')
+        self._pedido(None, 50, tier=None, fornecedor=1, unidade=1)
+        self._pedido(1, 1, status='aprovado')  # não finalizado
+        self._pedido(1, 1, solicitado_em=self.base - timedelta(days=60))  # fora da janela
+        db.session.commit()
+
+        resultado = LeadTimeService.calcular(30)
+        self.assertEqual(resultado['geral']['total_pedidos'], 4)
+
+        por_tier = {g['nome']: g for g in resultado['por_tier']}
+        self.assertEqual(por_tier['Tier 1']['aprovacao']['media'], 3.0)
+        self.assertEqual(por_tier['Tier 3']['recebimento']['qtd'], 0)
+        self.assertEqual(por_tier['Sem tier']['aprovacao']['qtd'], 0)
+
+        por_fornecedor = {g['nome']: g for g in resultado['por_fornecedor']}
+        self.assertEqual(por_fornecedor['F1']['total_pedidos'], 3)
+        self.assertEqual(por_fornecedor['F0']['recebimento']['p50'], 20.0)
+
+        por_unidade = {g['id']: g for g in resultado['por_unidade']}
+        self.assertEqual(por_unidade[self.unidades[1].id]['recebimento']['media'], 50.0)
+
+        so_unidade = LeadTimeService.calcular(30, unidade_id=self.unidades[0].id)
+        self.assertEqual(so_unidade['geral']['total_pedidos'], 2)
+
+    def test_uma_consulta_independente_do_numero_de_pedidos(self):
+        for n in (3, 30):
+            for horas in range(n):
+                self._pedido(horas, horas + 24, tier=horas % 3 + 1, fornecedor=horas % 2, unidade=horas % 2)
+            db.session.commit()
+            with ContadorConsultas(db.engine) as contador:
+                LeadTimeService.calcular(30)
+            self.assertEqual(contador.total, 1)
+
+    def test_snapshot_por_versao_dia_e_janela(self):
+        self._pedido(2, 20)
+        db.session.commit()
+
+        cliente = MagicMock()
+        cliente.get.return_value = None
+        with patch.object(LeadTimeService, '_get_redis', return_value=cliente):
+            resultado = LeadTimeService.calcular(30)
+            chave, ttl, valor = cliente.setex.call_args[0]
+            self.assertEqual(chave, f"gmm:leadtime:v0:{datetime.utcnow().date().isoformat()}:30:todas")
+            self.assertLessEqual(ttl, 86400)
+
+            LeadTimeService._cache.limpar_local()  # outro worker, cache local vazio
+            cliente.get.side_effect = {chave: valor}.get
+            with ContadorConsultas(db.engine) as contador:
+                self.assertEqual(LeadTimeService.calcular(30), json.loads(json.dumps(resultado)))
+            self.assertEqual(contador.total, 0)
+
+    def test_recebimento_e_aprovacao_invalidam_o_cache(self):
+        pedido = self._pedido(None, None, status='aprovado')
+        db.session.commit()
+        self.assertEqual(LeadTimeService.calcular(30)['geral']['total_pedidos'], 0)
+
+        pedido.status = 'recebido'
+        pedido.data_recebimento = self.base + timedelta(hours=30)
+        db.session.commit()
+        self.assertEqual(LeadTimeService.calcular(30)['geral']['recebimento']['qtd'], 1)
+
+        db.session.add(AprovacaoPedido(pedido_id=pedido.id, aprovador_id=self.usuario.id, acao='aprovado',
+                                       created_at=self.base + timedelta(hours=4)))
+        db.session.commit()
+        self.assertEqual(LeadTimeService.calcular(30)['geral']['aprovacao']['media'], 4.0)
+
+        # Alteração que não muda o lead time mantém o cache
+        self.peca.nome = 'Correia dentada'
+        db.session.commit()
+        with ContadorConsultas(db.engine) as contador:
+            LeadTimeService.calcular(30)
+        self.assertEqual(contador.total, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import json
+import base64
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import patch
+import requests
+from flask import Flask
+from app.services.midia_base64 import CorpoMidiaBase64, CacheMidiaBase64
+
+
+class TestCorpoMidiaBase64(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.caminho = os.path.join(self.dir.name, 'relatorio.pdf')
+        with open(self.caminho, 'wb') as f:
+            f.write(os.urandom(100_003))  # não múltiplo de 3: exercita o padding final
+        self.campos = {'to': '5511999999999@s.whatsapp.net', 'fileName': 'relatório "final".pdf',
+                       'type': 'document', 'caption': 'OS #12\nsegue', 'mimeType': 'application/pdf'}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _esperado(self):
+        with open(self.caminho, 'rb') as f:
+            dados = base64.b64encode(f.read()).decode()
+        return {'messageData': dict(self.campos, base64=f'data:application/pdf;base64,{dados}')}
+
+    def test_corpo_equivale_ao_json_completo(self):
+        corpo = CorpoMidiaBase64(self.campos, 'application/pdf', self.caminho)
+        bruto = corpo.read()
+        self.assertEqual(len(bruto), len(corpo))
+        self.assertEqual(json.loads(bruto), self._esperado())
+
+    def test_texto_do_usuario_nao_interfere_no_corpo(self):
+        self.campos.update(caption='legenda com __gmm_base64__ e "base64": "x"', fileName='__gmm_base64__.pdf')
+        corpo = CorpoMidiaBase64(self.campos, 'application/pdf', self.caminho)
+        self.assertEqual(json.loads(corpo.read()), self._esperado())
+
+        vazio = CorpoMidiaBase64({}, 'image/png', self.caminho)
+        self.assertEqual(list(json.loads(vazio.read())['messageData']), ['base64'])
+
+    def test_leitura_em_pedacos_e_retorno_ao_inicio(self):
+        corpo = CorpoMidiaBase64(self.campos, 'application/pdf', self.caminho)
+        pedacos = b''.join(iter(lambda: corpo.read(777), b''))
+        self.assertEqual(corpo.tell(), len(corpo))
+
+        corpo.seek(0)  # retry do urllib3
+        self.assertEqual(corpo.read(), pedacos)
+        self.assertEqual(json.loads(pedacos), self._esperado())
+
+    def test_pre_codificado(self):
+        codificado = CacheMidiaBase64._codificar(self.caminho, os.path.getsize(self.caminho))
+        corpo = CorpoMidiaBase64(self.campos, 'application/pdf', self.caminho, pre_codificado=codificado)
+        self.assertEqual(json.loads(b''.join(corpo)), self._esperado())
+
+    def test_requests_envia_com_content_length(self):
+        corpo = CorpoMidiaBase64(self.campos, 'application/pdf', self.caminho)
+        preparado = requests.Request('POST', 'http://megaapi.local/x', data=corpo).prepare()
+        self.assertEqual(preparado.headers['Content-Length'], str(len(corpo)))
+        self.assertNotIn('Transfer-Encoding', preparado.headers)
+
+    def test_memoria_nao_cresce_com_o_arquivo(self):
+        grande = os.path.join(self.dir.name, 'video.mp4')
+        with open(grande, 'wb') as f:
+            f.write(os.urandom(8 * 1024 * 1024))
+
+        corpo = CorpoMidiaBase64(self.campos, 'video/mp4', grande)
+        tracemalloc.start()
+        try:
+            while corpo.read(8192):
+                pass
+            _atual, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(pico, 1024 * 1024)
+
+
+class TestCacheMidiaBase64(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['WHATSAPP_MIDIA_CACHE_MB'] = 1
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        CacheMidiaBase64.limpar()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        CacheMidiaBase64.limpar()
+        self.dir.cleanup()
+        self.ctx.pop()
+
+    def _arquivo(self, nome, tamanho):
+        caminho = os.path.join(self.dir.name, nome)
+        with open(caminho, 'wb') as f:
+            f.write(os.urandom(tamanho))
+        return caminho
+
+    def test_codifica_uma_vez_por_arquivo(self):
+        caminho = self._arquivo('foto.jpg', 30_000)
+        with patch.object(CacheMidiaBase64, '_codificar', wraps=CacheMidiaBase64._codificar) as codificar:
+            primeiro = CacheMidiaBase64.obter(caminho)
+            segundo = CacheMidiaBase64.obter(caminho)
+        self.assertIs(primeiro, segundo)
+        codificar.assert_called_once()
+
+    def test_arquivo_alterado_e_recodificado(self):
+        caminho = self._arquivo('foto.jpg', 30_000)
+        antes = CacheMidiaBase64.obter(caminho)
+        with open(caminho, 'wb') as f:
+            f.write(os.urandom(30_001))
+        self.assertNotEqual(bytes(CacheMidiaBase64.obter(caminho)), bytes(antes))
+
+    def test_arquivo_grande_nao_entra_no_cache(self):
+        self.assertIsNone(CacheMidiaBase64.obter(self._arquivo('video.mp4', 300_000)))
+
+    def test_orcamento_respeitado(self):
+        for i in range(6):
+            CacheMidiaBase64.obter(self._arquivo(f'f{i}.jpg', 150_000))
+        self.assertLessEqual(CacheMidiaBase64._bytes_total, 1024 * 1024)
+        self.assertEqual(len(CacheMidiaBase64._itens), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
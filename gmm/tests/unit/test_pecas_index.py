@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import redis
+from flask import Flask
+from sqlalchemy import event
+from app.extensions import db
+from app.models.estoque_models import Estoque, EstoqueSaldo, MovimentacaoEstoque
+from app.services.pecas_index import PecasIndex
+
+
+class TestPecasIndex(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        # Sem Redis nos testes
+        self.patcher = patch.object(PecasIndex, '_get_redis', side_effect=redis.exceptions.ConnectionError)
+        self.patcher.start()
+        PecasIndex.limpar_local()
+
+        self.rolamento = Estoque(codigo='ROL-6204', nome='Rolamento 6204', unidade_medida='un', quantidade_atual=7)
+        self.correia = Estoque(codigo='COR-A42', nome='Correia em V A42', unidade_medida='un', quantidade_atual=2)
+        self.cabo = Estoque(codigo='CAB-10', nome='Cabo elétrico 10mm', unidade_medida='m', quantidade_atual=100)
+        db.session.add_all([self.rolamento, self.correia, self.cabo])
+        db.session.flush()
+        db.session.add_all([
+            EstoqueSaldo(estoque_id=self.rolamento.id, unidade_id=1, quantidade=5),
+            EstoqueSaldo(estoque_id=self.rolamento.id, unidade_id=2, quantidade=2),
+            EstoqueSaldo(estoque_id=self.cabo.id, unidade_id=2, quantidade=100),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        self.patcher.stop()
+        PecasIndex.limpar_local()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _consultas(self, funcao):
+        consultas = []
+
+        def _contar(*_args, **_kwargs):
+            consultas.append(1)
+
+        event.listen(db.engine, 'before_cursor_execute', _contar)
+        try:
+            resultado = funcao()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _contar)
+        return resultado, len(consultas)
+
+    def test_busca_por_nome_e_codigo_sem_acentos(self):
+        self.assertEqual([p['id'] for p in PecasIndex.buscar('eletrico')], [self.cabo.id])
+        self.assertEqual([p['id'] for p in PecasIndex.buscar('rol-62')], [self.rolamento.id])
+        self.assertEqual([p['id'] for p in PecasIndex.buscar('v a4')], [self.correia.id])
+        self.assertEqual(PecasIndex.buscar('inexistente'), [])
+
+    def test_saldo_por_unidade(self):
+        peca = PecasIndex.buscar('rolamento', unidade_id=2)[0]
+        self.assertEqual(peca['saldo'], 7.0)
+        self.assertEqual(peca['saldos'], {1: 5.0, 2: 2.0})
+        self.assertEqual(peca['saldo_unidade'], 2.0)
+        self.assertEqual(PecasIndex.buscar('correia', unidade_id=2)[0]['saldo_unidade'], 0.0)
+
+    def test_ranking_prioriza_codigo_e_prefixo(self):
+        db.session.add_all([
+            Estoque(codigo='X-1', nome='Suporte do cabo', unidade_medida='un'),
+            Estoque(codigo='CABO', nome='Abraçadeira', unidade_medida='un'),
+        ])
+        db.session.commit()
+        self.assertEqual([p['nome'] for p in PecasIndex.buscar('cabo')],
+                         ['Abraçadeira', 'Cabo elétrico 10mm', 'Suporte do cabo'])
+
+    def test_busca_sem_sql_apos_carga(self):
+        PecasIndex.buscar('rolamento')
+        _resultado, consultas = self._consultas(lambda: (PecasIndex.buscar('cor'), PecasIndex.buscar('ca')))
+        self.assertEqual(consultas, 0)
+
+    def test_alteracoes_relidas_incrementalmente(self):
+        PecasIndex.buscar('rolamento')
+        db.session.add(MovimentacaoEstoque(estoque_id=self.rolamento.id, tipo_movimentacao='consumo',
+                                           quantidade=1, unidade_id=1, usuario_id=1))
+        saldo = EstoqueSaldo.query.filter_by(estoque_id=self.rolamento.id, unidade_id=1).one()
+        saldo.quantidade = 4
+        self.correia.nome = 'Correia dentada'
+        db.session.commit()
+
+        with patch.object(PecasIndex, '_carregar') as mock_carregar:
+            peca, consultas = self._consultas(lambda: PecasIndex.buscar('rolamento', unidade_id=1)[0])
+            mock_carregar.assert_not_called()
+        self.assertEqual(consultas, 2)  # peças + saldos, só dos ids alterados
+        self.assertEqual((peca['saldo'], peca['saldo_unidade']), (6.0, 4.0))
+        self.assertEqual(PecasIndex.buscar('v a42'), [])
+        self.assertEqual(PecasIndex.buscar('dentada')[0]['id'], self.correia.id)
+
+        db.session.delete(self.correia)
+        db.session.commit()
+        self.assertEqual(PecasIndex.buscar('dentada'), [])
+
+    def test_alteracoes_de_outros_workers_pelo_log_do_redis(self):
+        PecasIndex.buscar('rolamento')
+        PecasIndex._versao = 3
+        PecasIndex._verificado_em = 0.0
+        cliente = MagicMock()
+        cliente.get.return_value = b'5'
+        cliente.zrangebyscore.return_value = [str(self.cabo.id).encode()]
+        db.session.execute(Estoque.__table__.update().where(Estoque.id == self.cabo.id).values(nome='Cabo PP'))
+
+        with patch.object(PecasIndex, '_get_redis', return_value=cliente):
+            self.assertEqual(PecasIndex.buscar('cabo pp')[0]['id'], self.cabo.id)
+        cliente.zrangebyscore.assert_called_once_with(PecasIndex.CHAVE_ALTERACOES, '(3', 5)
+        self.assertEqual(PecasIndex._versao, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+from datetime import datetime, timedelta
+import importlib
+from flask import Flask, g
+from app.extensions import db, login_manager
+from app.models.models import Unidade, Usuario
+from app.models.estoque_models import (
+    OrdemServico, Equipamento, Estoque, MovimentacaoEstoque, PedidoCompra, SolicitacaoTransferencia,
+    CatalogoFornecedor, ComunicacaoFornecedor, CotacaoCompra, Fornecedor
+)
+from app.models.terceirizados_models import Terceirizado, ChamadoExterno
+from app.services.perfis_carga import PerfisCarga
+from app.utils.contador_sql import ContadorConsultas, registrar_contador_requisicao
+
+
+# Rotas cujos templates base.html referencia (url_for) e as três páginas medidas
+BLUEPRINTS = ('auth', 'ponto', 'admin', 'os', 'terceirizados', 'analytics', 'whatsapp', 'webhook',
+              'admin_whatsapp', 'equipamentos', 'search', 'notifications', 'compras', 'estoque', 'manutencao')
+
+
+class TestPerfisCarga(unittest.TestCase):
+    # Orçamento de queries por página renderizada (usuário logado + dados da página + template)
+    ORCAMENTO = {'os_detalhe': 8, 'equipamento_dossie': 4, 'pedido_detalhe': 7}
+
+    def setUp(self):
+        # Templates reais (app/templates) e as rotas reais, com login
+        self.app = Flask('app')
+        self.app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', SECRET_KEY='teste', WTF_CSRF_ENABLED=False)
+        db.init_app(self.app)
+        login_manager.init_app(self.app)
+        login_manager.user_loader(lambda user_id: db.session.get(Usuario, int(user_id)))
+        self.app.context_processor(lambda: {'hoje': datetime.utcnow(), 'sidebar_pendencias': 0})
+        for nome in BLUEPRINTS:
+            self.app.register_blueprint(importlib.import_module(f'app.routes.{nome}').bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.agora = datetime.utcnow()
+        unidades = [Unidade(nome=f'U{i}', faixa_ip_permitida='*') for i in range(2)]
+        db.session.add_all(unidades)
+        db.session.flush()
+        usuario = Usuario(nome='Técnico', username='tec', senha_hash='x', tipo='admin')
+        equipamento = Equipamento(nome='Compressor', categoria='Ar', unidade_id=unidades[0].id)
+        fornecedor = Fornecedor(nome='Fornecedor', email='f@x.com')
+        db.session.add_all([usuario, equipamento, fornecedor])
+        db.session.flush()
+        os_ = OrdemServico(numero_os='OS-1', tecnico_id=usuario.id, unidade_id=unidades[0].id,
+                           equipamento_id=equipamento.id, tipo_manutencao='corretiva',
+                           descricao_problema='x', prazo_conclusao=self.agora, data_abertura=self.agora)
+        db.session.add(os_)
+        db.session.flush()
+        self.unidade_ids = [u.id for u in unidades]
+        self.usuario_id, self.equipamento_id, self.fornecedor_id, self.os_id = (
+            usuario.id, equipamento.id, fornecedor.id, os_.id)
+        self.pedido_id = None
+        self._semear(3)
+
+        self.cliente = self.app.test_client()
+        with self.cliente.session_transaction() as sessao:
+            sessao['_user_id'] = str(self.usuario_id)
+            sessao['_fresh'] = True
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _semear(self, n):
+        """Acrescenta `n` linhas de cada coleção que as páginas listam."""
+        base = Estoque.query.count() // 2
+        local, outra = self.unidade_ids
+        for i in range(base, base + n):
+            # Relacionados distintos por linha: o identity map não mascara lazy loads
+            peca = Estoque(codigo=f'P{i}', nome=f'Peça {i}', unidade_medida='un', valor_unitario=3)
+            peca_pedida = Estoque(codigo=f'Q{i}', nome=f'Peça pedida {i}', unidade_medida='un')
+            terceirizado = Terceirizado(nome=f'Prestador {i}', telefone=f'55119000000{i:02d}', ativo=False)
+            os_extra = OrdemServico(numero_os=f'OS-X{i}', tecnico_id=self.usuario_id, unidade_id=local,
+                                    equipamento_id=self.equipamento_id, tipo_manutencao='corretiva',
+                                    descricao_problema='x', prazo_conclusao=datetime.utcnow(),
+                                    data_abertura=self.agora - timedelta(days=3 * (i + 1)))
+            db.session.add_all([peca, peca_pedida, terceirizado, os_extra])
+            db.session.flush()
+            if self.pedido_id is None:
+                pedido = PedidoCompra(estoque_id=peca.id, quantidade=1, status='aprovado',
+                                      fornecedor_id=self.fornecedor_id, solicitante_id=self.usuario_id,
+                                      aprovador_id=self.usuario_id, unidade_destino_id=local)
+                db.session.add(pedido)
+                db.session.flush()
+                self.pedido_id, self.peca_cotada_id = pedido.id, peca.id
+            db.session.add_all([
+                MovimentacaoEstoque(os_id=self.os_id, estoque_id=peca.id, tipo_movimentacao='consumo', quantidade=1,
+                                    unidade_id=local, usuario_id=self.usuario_id),
+                MovimentacaoEstoque(os_id=os_extra.id, estoque_id=peca.id, tipo_movimentacao='consumo', quantidade=2,
+                                    unidade_id=local, usuario_id=self.usuario_id),
+                ChamadoExterno(numero_chamado=f'CH-{i}', os_id=self.os_id, terceirizado_id=terceirizado.id,
+                               titulo='t', descricao='d', prazo_combinado=datetime.utcnow(), criado_por=self.usuario_id),
+                PedidoCompra(estoque_id=peca_pedida.id, quantidade=1, status='pendente', os_id=self.os_id,
+                             solicitante_id=self.usuario_id),
+                SolicitacaoTransferencia(estoque_id=peca_pedida.id, unidade_origem_id=outra, unidade_destino_id=local,
+                                         quantidade=1, os_id=self.os_id, solicitante_id=self.usuario_id),
+                CatalogoFornecedor(estoque_id=self.peca_cotada_id, fornecedor_id=self.fornecedor_id, preco_atual=10 + i),
+                CotacaoCompra(pedido_id=self.pedido_id, fornecedor_nome=f'F{i}', valor_total=100 + i),
+                ComunicacaoFornecedor(pedido_compra_id=self.pedido_id, fornecedor_id=self.fornecedor_id,
+                                      tipo_comunicacao='email', direcao='enviado', mensagem='m'),
+            ])
+        db.session.commit()
+
+    def _consultas(self, url):
+        db.session.remove()  # sessão nova, como numa requisição
+        g.pop('_login_user', None)  # o contexto da app do teste é reaproveitado pela requisição
+        with ContadorConsultas() as contador:
+            resposta = self.cliente.get(url)
+        self.assertEqual(resposta.status_code, 200, resposta.get_data(as_text=True)[:500])
+        return contador.total
+
+    def _verificar_orcamento(self, pagina, url):
+        antes = self._consultas(url())
+        self._semear(10)
+        depois = self._consultas(url())
+        self.assertLessEqual(antes, self.ORCAMENTO[pagina])
+        self.assertEqual(depois, antes)  # não cresce com o número de linhas
+
+    def test_orcamento_os_detalhe(self):
+        self._verificar_orcamento('os_detalhe', lambda: f'/os/{self.os_id}')
+
+    def test_orcamento_equipamento_dossie(self):
+        self._verificar_orcamento('equipamento_dossie', lambda: f'/equipamentos/{self.equipamento_id}')
+
+    def test_orcamento_pedido_detalhe(self):
+        self._verificar_orcamento('pedido_detalhe', lambda: f'/compras/{self.pedido_id}')
+
+    def test_kpis_do_dossie(self):
+        kpis = PerfisCarga.equipamento_dossie(self.equipamento_id)['kpis']
+        self.assertEqual(kpis['qtd_os'], 4)
+        self.assertEqual(kpis['custo_total'], 27)  # 3 peças x (1 + 2) un x R$ 3
+        self.assertEqual(kpis['mtbf'], '3 dias')
+
+
+class TestContadorRequisicao(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        registrar_contador_requisicao(self.app)
+
+        @self.app.route('/pagina')
+        def pagina():
+            Unidade.query.count()
+            Usuario.query.count()
+            return '<html><body>ok</body></html>'
+
+        with self.app.app_context():
+            db.create_all()
+
+    def test_header_com_total_de_queries(self):
+        self.app.config['SQL_CONTADOR'] = True
+        resposta = self.app.test_client().get('/pagina')
+        self.assertEqual(resposta.headers['X-SQL-Queries'], '2')
+        self.assertNotIn('gmm-sql-contador', resposta.get_data(as_text=True))
+
+    def test_selo_na_pagina_em_modo_debug(self):
+        self.app.debug = True
+        html = self.app.test_client().get('/pagina').get_data(as_text=True)
+        self.assertIn('SQL: 2</div></body>', html)
+
+    def test_desligado_por_padrao(self):
+        self.assertNotIn('X-SQL-Queries', self.app.test_client().get('/pagina').headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import patch
+from flask import Flask
+from app.extensions import db
+from app.models.whatsapp_models import RegrasAutomacao
+from app.services.regras_matcher import AhoCorasick, RegrasMatcher
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_padroes_sobrepostos(self):
+        ac = AhoCorasick([('HE', 1), ('SHE', 2), ('HIS', 3), ('HERS', 4)])
+        self.assertEqual(ac.buscar('USHERS'), {1, 2, 4})
+        self.assertEqual(ac.buscar('AHISHE'), {1, 2, 3})
+        self.assertEqual(ac.buscar('XYZ'), set())
+
+    def test_frases_com_espaco(self):
+        ac = AhoCorasick([('ORDEM DE SERVICO', 'os'), ('SERVICO', 's')])
+        self.assertEqual(ac.buscar('QUERO ABRIR ORDEM DE SERVICO'), {'os', 's'})
+
+
+class TestRegrasMatcher(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        # Sem Redis nos testes: versão remota indisponível
+        self.patchers = [
+            patch.object(RegrasMatcher._cache, '_versao_remota', return_value=None),
+            patch.object(RegrasMatcher._cache, '_get_redis'),
+        ]
+        for p in self.patchers:
+            p.start()
+        RegrasMatcher._cache.limpar_local()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        RegrasMatcher._cache.limpar_local()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _regra(self, palavra, tipo='contem', prioridade=0, **kwargs):
+        regra = RegrasAutomacao(palavra_chave=palavra, tipo_correspondencia=tipo,
+                                acao='responder', resposta_texto=palavra,
+                                prioridade=prioridade, **kwargs)
+        db.session.add(regra)
+        return regra
+
+    def test_ordem_de_prioridade_e_tipos(self):
+        self._regra('estoque', 'contem', prioridade=1)
+        self._regra('MENU', 'exato', prioridade=5)
+        self._regra(r'^os\s*\d+', 'regex', prioridade=3)
+        self._regra('([', 'regex', prioridade=9)  # regex inválida é ignorada
+        db.session.commit()
+
+        nomes = [r.palavra_chave for r in RegrasMatcher.correspondentes('OS 12 sem estoque', 'usuarios')]
+        self.assertEqual(nomes, [r'^os\s*\d+', 'estoque'])
+        self.assertEqual([r.palavra_chave for r in RegrasMatcher.correspondentes(' menu ', 'usuarios')], ['MENU'])
+        self.assertEqual(RegrasMatcher.correspondentes('menu principal', 'usuarios'), [])
+
+    def test_filtra_por_publico_e_ativo(self):
+        self._regra('orcamento', para_desconhecidos=False)
+        self._regra('orcamento urgente', ativo=False)
+        db.session.commit()
+
+        self.assertEqual(RegrasMatcher.correspondentes('orcamento urgente', 'desconhecidos'), [])
+        self.assertEqual(len(RegrasMatcher.correspondentes('orcamento urgente', 'terceirizados')), 1)
+
+    def test_sem_sql_apos_carga_e_recompila_no_commit(self):
+        regra = self._regra('ajuda')
+        db.session.commit()
+        self.assertEqual(len(RegrasMatcher.correspondentes('preciso de ajuda', 'usuarios')), 1)
+
+        with patch.object(RegrasMatcher, '_compilar') as mock_compilar:
+            RegrasMatcher.correspondentes('ajuda', 'usuarios')
+            mock_compilar.assert_not_called()
+
+        regra.ativo = False
+        db.session.commit()
+        self.assertEqual(RegrasMatcher.correspondentes('preciso de ajuda', 'usuarios'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from datetime import date, datetime, timedelta
+from flask import Flask
+from app.extensions import db
+from app.models.estoque_models import Estoque, MovimentacaoEstoque
+from app.services.analytics_service import AnalyticsService
+from app.services.kpi_diario_service import KpiDiarioService
+from app.utils.serie_temporal import EixoTemporal, SeriesTemporais
+
+
+class TestEixoTemporal(unittest.TestCase):
+    def test_eixo_diario_inclusivo(self):
+        eixo = EixoTemporal(date(2026, 2, 27), date(2026, 3, 2))
+        self.assertEqual(eixo.tamanho, 4)
+        self.assertEqual(eixo.rotulos(), ['27/02', '28/02', '01/03', '02/03'])
+        self.assertIsNone(eixo.indice(date(2026, 3, 3)))
+
+    def test_eixo_semanal_comeca_na_segunda(self):
+        eixo = EixoTemporal(date(2026, 3, 4), date(2026, 3, 16), 'semana')  # quarta a segunda
+        self.assertEqual(eixo.datas(), [date(2026, 3, 2), date(2026, 3, 9), date(2026, 3, 16)])
+        self.assertEqual(eixo.indice(date(2026, 3, 8)), 0)
+        self.assertEqual(eixo.indice(date(2026, 3, 9)), 1)
+
+    def test_eixo_mensal_atravessa_o_ano(self):
+        eixo = EixoTemporal(date(2025, 11, 20), date(2026, 2, 3), 'mes')
+        self.assertEqual(eixo.rotulos(), ['11/2025', '12/2025', '01/2026', '02/2026'])
+        self.assertEqual(eixo.indice(date(2026, 1, 31)), 2)
+
+    def test_resolucao_invalida(self):
+        with self.assertRaises(ValueError):
+            EixoTemporal(date(2026, 1, 1), date(2026, 1, 2), 'hora')
+
+    def test_periodo_invertido(self):
+        with self.assertRaises(ValueError):
+            EixoTemporal(date(2026, 5, 1), date(2026, 1, 1))
+
+    def test_series_preenchem_lacunas_com_zero(self):
+        series = SeriesTemporais(EixoTemporal(date(2026, 3, 1), date(2026, 3, 5)))
+        series.somar('pecas', date(2026, 3, 2), 10)
+        series.somar('pecas', date(2026, 3, 2), 2.5)
+        series.somar('pecas', date(2026, 4, 1), 99)  # fora do eixo: ignorado
+        self.assertEqual(series.lista('pecas'), [0, 12.5, 0, 0, 0])
+        self.assertEqual(series.lista('servicos'), [0, 0, 0, 0, 0])
+
+
+class TestEvolucaoCustos(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.utcnow()
+        peca = Estoque(codigo='P1', nome='Correia', unidade_medida='un', valor_unitario=10)
+        db.session.add(peca)
+        db.session.flush()
+        for dias_atras, unidade, quantidade in ((1, 1, 2), (1, 2, 1), (5, 1, 3), (40, 2, 4), (400, 1, 1)):
+            db.session.add(MovimentacaoEstoque(
+                estoque_id=peca.id, tipo_movimentacao='consumo', quantidade=quantidade, unidade_id=unidade,
+                usuario_id=1, data_movimentacao=agora - timedelta(days=dias_atras)))
+        db.session.commit()
+        KpiDiarioService.atualizar()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_eixo_denso_por_dia(self):
+        dados = AnalyticsService.get_cost_evolution(days=30)
+        self.assertEqual(len(dados['labels']), 31)
+        self.assertEqual(len(dados['pecas']), 31)
+        self.assertEqual(dados['pecas'].count(0), 29)
+        self.assertEqual(dados['pecas'][-2], 30.0)
+        self.assertEqual(sum(dados['servicos']), 0)
+
+    def test_resolucao_mensal_em_dois_anos(self):
+        dados = AnalyticsService.get_cost_evolution(days=730, resolucao='mes')
+        self.assertIn(len(dados['labels']), (24, 25))
+        self.assertEqual(sum(dados['pecas']), 110.0)
+
+    def test_series_por_unidade_somam_o_total(self):
+        dados = AnalyticsService.get_cost_evolution(days=60, resolucao='semana', por_unidade=True)
+        self.assertEqual([u['unidade_id'] for u in dados['unidades']], [1, 2])
+        soma = [a + b for a, b in zip(dados['unidades'][0]['pecas'], dados['unidades'][1]['pecas'])]
+        self.assertEqual(soma, dados['pecas'])
+
+    def test_api_valida_o_periodo(self):
+        from app.extensions import login_manager
+        from app.routes import analytics
+        self.app.config['LOGIN_DISABLED'] = True
+        login_manager.init_app(self.app)
+        self.app.register_blueprint(analytics.bp)
+        cliente = self.app.test_client()
+
+        def status(consulta):
+            return cliente.get(f'/analytics/api/charts/custos?{consulta}').status_code
+
+        self.assertEqual(status('inicio=0001-01-01&fim=9998-12-31'), 400)
+        self.assertEqual(status('inicio=2026-05-01&fim=2026-01-01'), 400)
+        self.assertEqual(status('days=100000000000'), 400)
+        self.assertEqual(status('days=800'), 400)
+        self.assertEqual(status('days=800&resolucao=semana'), 200)
+        self.assertEqual(status('inicio=2020-01-01&fim=2029-12-31&resolucao=mes'), 200)
+        dados = cliente.get('/analytics/api/charts/custos?inicio=2026-01-01&fim=2026-05-01').get_json()
+        self.assertEqual(len(dados['labels']), 121)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from unittest.mock import patch
+from flask import Flask
+from app.extensions import db
+from app.models.models import Usuario
+from app.models.terceirizados_models import Terceirizado
+from app.services.telefone_index import TelefoneIndex
+
+
+class TestTelefoneIndex(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        # Sem Redis nos testes: versão remota indisponível
+        self.patcher = patch.object(TelefoneIndex._cache, '_versao_remota', return_value=None)
+        self.patcher.start()
+        TelefoneIndex._cache.limpar_local()
+
+    def tearDown(self):
+        self.patcher.stop()
+        TelefoneIndex._cache.limpar_local()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_chave_ignora_formatacao(self):
+        self.assertEqual(TelefoneIndex.chave('+55 (11) 99988-7766'), '99887766')
+        self.assertEqual(TelefoneIndex.chave('5511999887766'), '99887766')
+        self.assertIsNone(TelefoneIndex.chave('1234'))
+
+    def test_resolver_sem_sql_apos_carga(self):
+        t = Terceirizado(nome='Prestador', telefone='(27) 98801-0899')
+        db.session.add(t)
+        db.session.commit()
+
+        self.assertEqual(TelefoneIndex.resolver('5527988010899')['terceirizado'], t.id)
+
+        with patch.object(TelefoneIndex, '_carregar') as mock_carregar:
+            TelefoneIndex.resolver('5527988010899')
+            TelefoneIndex.resolver('5511900000000')
+            mock_carregar.assert_not_called()
+
+    def test_inativos_nao_sao_indexados(self):
+        db.session.add(Usuario(nome='Ex', username='ex', senha_hash='x', tipo='comum',
+                               telefone='5511911112222', ativo=False))
+        db.session.commit()
+        self.assertIsNone(TelefoneIndex.resolver('5511911112222')['usuario'])
+
+    def test_commit_invalida_indice(self):
+        u = Usuario(nome='Gerente', username='ger', senha_hash='x', tipo='gerente',
+                    telefone='5511911112222')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(TelefoneIndex.buscar_usuario('11911112222').id, u.id)
+
+        with patch.object(TelefoneIndex._cache, '_get_redis'):
+            u.telefone = '5511933334444'
+            db.session.commit()
+
+        self.assertIsNone(TelefoneIndex.resolver('5511911112222')['usuario'])
+        self.assertEqual(TelefoneIndex.resolver('5511933334444')['usuario'], u.id)
+
+    def test_alteracao_irrelevante_nao_invalida(self):
+        u = Usuario(nome='Tec', username='tec', senha_hash='x', tipo='tecnico',
+                    telefone='5511955556666')
+        db.session.add(u)
+        db.session.commit()
+        TelefoneIndex.resolver('5511955556666')
+
+        with patch.object(TelefoneIndex._cache, 'invalidar') as mock_invalidar:
+            u.nome = 'Técnico'
+            db.session.commit()
+            mock_invalidar.assert_not_called()
+
+    def test_autorizacao_exige_telefone_exato(self):
+        from app.models.estoque_models import PedidoCompra
+        from app.tasks.whatsapp_tasks import _processar_onetap_compra, WhatsAppService
+
+        # Mesmo sufixo de 8 dígitos, DDDs diferentes; o de menor id é o comum
+        comum = Usuario(nome='Comum', username='com', senha_hash='x', tipo='comum', telefone='5521911112222')
+        admin = Usuario(nome='Admin', username='adm', senha_hash='x', tipo='admin', telefone='(11) 91111-2222')
+        pedido = PedidoCompra(quantidade=1, status='solicitado', descricao_livre='Correia')
+        db.session.add_all([comum, admin, pedido])
+        db.session.commit()
+
+        self.assertEqual(TelefoneIndex.buscar_usuario_exato('11911112222').id, admin.id)
+        self.assertEqual(TelefoneIndex.buscar_usuario_exato('5521911112222').id, comum.id)
+        self.assertIsNone(TelefoneIndex.buscar_usuario_exato('5531911112222'))
+
+        with patch.object(WhatsAppService, 'enviar_mensagem') as enviar:
+            _processar_onetap_compra('5531911112222', f'rejeitar_pedido_{pedido.id}')
+            self.assertIn('Sem permissão', enviar.call_args.args[1])
+            self.assertEqual(pedido.status, 'solicitado')
+
+            _processar_onetap_compra('5511911112222', f'rejeitar_pedido_{pedido.id}')
+            self.assertEqual(pedido.status, 'recusado')
+
+    def test_autorizacao_ambigua_recusa(self):
+        for n in range(2):
+            db.session.add(Usuario(nome=f'Dir {n}', username=f'dir{n}', senha_hash='x', tipo='diretor',
+                                   telefone='5511911112222'))
+        db.session.commit()
+        self.assertIsNone(TelefoneIndex.buscar_usuario_exato('5511911112222'))
+
+
+    def test_resposta_de_fornecedor_exige_telefone_exato(self):
+        from app.models.estoque_models import Fornecedor, PedidoCompra, ComunicacaoFornecedor
+        from app.routes.webhook import vincular_whatsapp_fornecedor
+
+        # Mesmo sufixo, DDDs diferentes; o de menor id é o que não respondeu
+        outro = Fornecedor(nome='Rio Peças', email='rio@x.com', whatsapp='5521933334444')
+        certo = Fornecedor(nome='SP Peças', email='sp@x.com', telefone='(11) 93333-4444')
+        db.session.add_all([outro, certo])
+        db.session.flush()
+        for fornecedor in (outro, certo):
+            pedido = PedidoCompra(quantidade=1, status='aprovado', descricao_livre='Correia',
+                                  fornecedor_id=fornecedor.id)
+            db.session.add(pedido)
+            db.session.flush()
+            db.session.add(ComunicacaoFornecedor(pedido_compra_id=pedido.id, fornecedor_id=fornecedor.id,
+                                                 tipo_comunicacao='whatsapp', direcao='enviado', status='enviado'))
+        db.session.commit()
+
+        self.assertEqual(TelefoneIndex.buscar_fornecedor_exato('5511933334444').id, certo.id)
+        self.assertIsNone(TelefoneIndex.buscar_fornecedor_exato('5531933334444'))
+
+        vincular_whatsapp_fornecedor('5511933334444', 'Entrega amanhã')
+        respondidas = ComunicacaoFornecedor.query.filter_by(direcao='enviado', status='respondido').all()
+        self.assertEqual([c.fornecedor_id for c in respondidas], [certo.id])
+
+        vincular_whatsapp_fornecedor('5531933334444', 'Quem fala?')
+        self.assertEqual(ComunicacaoFornecedor.query.filter_by(direcao='recebido').count(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,5 +27,65 @@ class TestWhatsAppService(unittest.TestCase):
         self.assertFalse(status)
         self.assertIn("OPEN", msg)
 
+
+class TestWhatsAppHttpClient(unittest.TestCase):
+    def setUp(self):
+        from flask import Flask
+        self.app = Flask(__name__)
+        self.app.config.update(MEGA_API_URL='https://api.teste', MEGA_API_KEY='inst', MEGA_API_TOKEN='tok')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        WhatsAppService._session = None
+        WhatsAppService._credenciais = None
+
+    def tearDown(self):
+        WhatsAppService._session = None
+        WhatsAppService._credenciais = None
+        self.ctx.pop()
+
+    def test_sessao_reutilizada_e_recriada_apos_fork(self):
+        sessao = WhatsAppService._get_session()
+        self.assertIs(WhatsAppService._get_session(), sessao)
+        self.assertEqual(sessao.get_adapter('https://api.teste').max_retries.read, 0)
+
+        with patch('app.services.whatsapp_service.os.getpid', return_value=-1):
+            self.assertIsNot(WhatsAppService._get_session(), sessao)
+
+    def test_credenciais_lidas_uma_vez(self):
+        self.assertEqual(WhatsAppService._get_credentials(), ('https://api.teste', 'inst', 'tok'))
+        self.app.config['MEGA_API_KEY'] = 'outra'
+        self.assertEqual(WhatsAppService._get_credentials()[1], 'inst')
+
+    @patch('app.services.whatsapp_service.ControleEnvio')
+    @patch('app.services.whatsapp_service.CircuitBreaker')
+    def test_envio_usa_sessao_compartilhada(self, mock_cb, mock_controle):
+        mock_controle.autorizar.return_value = {'estado': 'CLOSED', 'permitido': True, 'restantes': 10, 'limpo': True}
+        resposta = MagicMock(status_code=200)
+        resposta.json.return_value = {'ok': True}
+
+        with patch.object(WhatsAppService, '_get_session') as mock_sessao:
+            mock_sessao.return_value.post.return_value = resposta
+            sucesso, _ = WhatsAppService.enviar_mensagem('5511999999999', 'oi')
+
+        self.assertTrue(sucesso)
+        _, kwargs = mock_sessao.return_value.post.call_args
+        self.assertEqual(kwargs['timeout'], (5, 15))
+
+    def test_enviar_lote_preserva_ordem(self):
+        def _fake(telefone, texto, prioridade=0):
+            if telefone == 'erro':
+                raise RuntimeError('falhou')
+            return True, {'para': telefone}
+
+        with patch.object(WhatsAppService, 'enviar_mensagem', side_effect=_fake):
+            resultados = WhatsAppService.enviar_lote([
+                {'telefone': str(i), 'texto': 'x'} for i in range(20)
+            ] + [{'telefone': 'erro', 'texto': 'x'}])
+
+        self.assertEqual([r[1].get('para') for r in resultados[:20]], [str(i) for i in range(20)])
+        self.assertEqual(resultados[-1][0], False)
+        self.assertEqual(WhatsAppService.enviar_lote([]), [])
+
+
 if __name__ == '__main__':
     unittest.main()